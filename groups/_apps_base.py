@@ -1,6 +1,6 @@
 import importlib
 
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
 from django.contrib import admin
 
 
@@ -67,7 +67,13 @@ class AdminRegisteringAppConfig(AppConfig):
         pass
 
     def _register_admin_classes(self):
-        """Register each <model>:<admin_class> pair in self.admin_classes."""
+        """
+        Register each <model>:<admin_class> pair in self.admin_classes.
+
+        Nothing is registered, or imported, if the admin isn't installed.
+        """
+        if not apps.is_installed('django.contrib.admin'):
+            return
         self.update_admin_classes(self.admin_classes)
         for model, admin_class in self.admin_classes.items():
             admin.site.register(
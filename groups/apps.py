@@ -12,8 +12,58 @@ class GroupsConfig(AdminRegisteringAppConfig):
     * `new_comment_subject` and `new_discussion_subject` - subjects for notification
       emails.  Each one will be formatted with the `{discussion}` a comment is on or the
       `{group}` a discussion belongs to, respectively.
+    * `deliver_notifications_on_commit` - whether notification emails are sent by the
+      process that queued them as soon as its transaction commits.  Turn this off to
+      leave all sending to the `send_notifications` command.
+    * `outbox_lease_seconds` and `outbox_max_attempts` - how long a worker may spend
+      on a claimed notification before another can take it over, and how many times
+      a notification is tried before it's given up on.
+    * `notification_concurrency` - how many connections to the mail server are used at
+      once when sending one notification's emails.
+    * `max_reply_depth` and `thread_page_depth` - how deeply replies can nest (a
+      reply to a comment at the deepest level becomes its sibling), and how many
+      levels of a thread are shown on one page; deeper replies are loaded on their
+      own page (see `groups.threads`).
+    * `max_mentions_per_comment` - how many `@username` mentions in a comment are
+      notified; any more are ignored (see `groups.mentions`).
+    * `revision_snapshot_interval` - how often an edited comment's revision history
+      keeps the whole body rather than a diff; rebuilding an old version reads at
+      most this many revisions (see `groups.revisions`).
+    * `reaction_kinds` - the reactions people can give comments.
+    * `reaction_flush_seconds` and `reaction_max_pending` - how long changes to
+      reaction counts wait in a process's buffer, and how many it holds, before
+      they're saved (see `groups.reactions`).
     * `group_admin_class_path` and `discussion_admin_class_path` - these allow a project
       to override the admin behaviour of `incuna-groups`.
+    * `archive_after_days` and `archive_deleted_after_days` - the defaults for the
+      `archive_comments` command, which moves comments older than the first (if set)
+      or soft-deleted longer ago than the second into the archive table.
+    * `event_broker_class_path` and `event_stream_seconds` - the broker that carries new
+      comments to `views.discussions.DiscussionEvents` (see `groups.events`), and how
+      long each of its streams holds a worker before the browser has to reconnect.
+    * `read_marker_flush_seconds` and `read_marker_max_pending` - how long read markers
+      wait in a process's buffer, and how many it holds, before they're saved (see
+      `groups.read_markers`).
+    * `attachment_thumbnail_size` and `attachment_preview_size` - the largest width or
+      height, in pixels, of the thumbnails and previews made of image attachments by
+      the `process_attachments` command (see `groups.attachments`).
+    * `orphaned_attachment_hours` - how old an attachment that isn't on a comment, a
+      stored file that no attachment refers to, or an unfinished upload must be before
+      the `delete_orphaned_attachments` command deletes it.
+    * `upload_staging_directory`, `upload_max_bytes` and `upload_max_chunk_bytes` -
+      where the chunks of resumable uploads are kept until they're finished (a
+      directory in the system's temporary directory if None), the largest file that
+      can be uploaded that way, and the largest chunk of it one request can send (see
+      `groups.uploads`).
+    * `subscribe_button_cache_seconds` - how long the rendered HTML of each subscribe
+      button is kept in the default cache.
+    * `comment_rate_limits` and `rate_limit_cache` - how many comments can be posted,
+      as {scope: (comments, per seconds)} for the scopes `user`, `discussion` and
+      `reply_token` (None for no limit), and the cache that counts them (see
+      `groups.ratelimits`).
+    * `replica_databases` and `replica_pin_seconds` - the database aliases that
+      `groups.routers.ReplicaRouter` sends reads to, and how long a user's reads go to
+      the primary database after they post, subscribe or delete something.
     """
     name = 'groups'
 
@@ -22,9 +72,56 @@ class GroupsConfig(AdminRegisteringAppConfig):
     new_comment_subject = 'New comment on {discussion}'
     new_discussion_subject = 'New discussion in {group}'
 
+    archive_after_days = None
+    archive_deleted_after_days = 30
+
+    deliver_notifications_on_commit = True
+    outbox_lease_seconds = 300
+    outbox_max_attempts = 5
+    notification_concurrency = 4
+    max_mentions_per_comment = 50
+
+    max_reply_depth = 20
+    thread_page_depth = 6
+    revision_snapshot_interval = 10
+
+    reaction_kinds = ('like', 'love', 'laugh', 'thanks')
+    reaction_flush_seconds = 10
+    reaction_max_pending = 500
+
+    event_broker_class_path = 'groups.events.LocalBroker'
+    event_stream_seconds = 30
+
+    read_marker_flush_seconds = 10
+    read_marker_max_pending = 500
+
+    attachment_thumbnail_size = 200
+    attachment_preview_size = 1024
+    orphaned_attachment_hours = 24
+    upload_staging_directory = None
+    upload_max_bytes = 1024 * 1024 * 1024
+    upload_max_chunk_bytes = 16 * 1024 * 1024
+
+    subscribe_button_cache_seconds = 24 * 60 * 60
+
+    comment_rate_limits = {
+        'user': (10, 60),
+        'discussion': (60, 60),
+        'reply_token': (5, 60),
+    }
+    rate_limit_cache = 'default'
+
+    replica_databases = ()
+    replica_pin_seconds = 10
+
     group_admin_class_path = 'groups.admin.GroupAdmin'
     discussion_admin_class_path = 'groups.admin.DiscussionAdmin'
 
+    def ready(self):
+        super(GroupsConfig, self).ready()
+        from .comment_types import registry
+        registry.autodiscover()
+
     def update_admin_classes(self, admin_classes):
         super(GroupsConfig, self).update_admin_classes(admin_classes)
         admin_classes.update({
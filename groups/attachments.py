@@ -0,0 +1,302 @@
+"""
+Work out attachments' metadata and make image thumbnails, away from the request path.
+
+Uploading a file only saves it.  The `process_attachments` command (run it from
+cron, or after a deploy to backfill) then records each new attachment's size and
+MIME type and, for images, its dimensions and two scaled-down JPEG copies: a
+`thumbnail` and a larger `preview`, no bigger than `attachment_thumbnail_size` and
+`attachment_preview_size` pixels on a side.  Templates and the API only read those
+columns, so displaying an attachment never opens its file.
+
+Images are only handled when Pillow is installed (`pip install incuna-groups[images]`);
+otherwise every attachment just gets its size and MIME type.
+
+Decoding and resizing images is slow and CPU bound, so `process_pending()` can spread
+it across a pool of processes.  The workers only touch file storage.  The parent
+reads the work from the database and saves the results, since database connections
+can't be shared with forked processes.
+
+`delete_orphans()` (the `delete_orphaned_attachments` command) cleans up after
+uploads that never made it onto a comment: `AttachedFile` rows with no comment, and
+stored files under the attachments' upload directories that no row refers to.  Both
+are only deleted once they're older than a grace period, so uploads still in
+progress are left alone.
+"""
+import datetime
+import logging
+import mimetypes
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils import six, timezone
+
+from . import models
+
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES = ('thumbnail', 'preview')
+
+
+def get_image_module():
+    """Return `PIL.Image`, or None if Pillow isn't installed."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def guess_mime_type(name):
+    mime_type, _ = mimetypes.guess_type(name)
+    return mime_type or 'application/octet-stream'
+
+
+def make_derivative(image, size):
+    """Return `image` shrunk to fit in a `size` pixel square, as JPEG data."""
+    copy = image.convert('RGB')
+    copy.thumbnail((size, size), get_image_module().LANCZOS)
+    output = six.BytesIO()
+    copy.save(output, 'JPEG', quality=85)
+    return output.getvalue()
+
+
+def derivative_name(pk, kind):
+    upload_to = models.AttachedFile._meta.get_field(kind).upload_to
+    return os.path.join(upload_to, '{}-{}.jpg'.format(pk, kind))
+
+
+def derive(pk, name):
+    """
+    Inspect the stored file `name` belonging to the attachment `pk`.
+
+    Return a dict of the attachment's new field values, or None if the file is
+    missing.  This runs in the pool's workers, so it mustn't use the database.
+    """
+    config = apps.get_app_config('groups')
+    storage = models.AttachedFile._meta.get_field('file').storage
+    if not storage.exists(name):
+        logger.warning('The file of attachment %s (%s) is missing.', pk, name)
+        return None
+    values = {'size': storage.size(name), 'mime_type': guess_mime_type(name)}
+
+    Image = get_image_module()
+    if Image is None or not values['mime_type'].startswith('image/'):
+        return values
+
+    sizes = {
+        'thumbnail': config.attachment_thumbnail_size,
+        'preview': config.attachment_preview_size,
+    }
+    try:
+        with storage.open(name) as source:
+            image = Image.open(source)
+            image.load()
+        values['width'], values['height'] = image.size
+        for kind in DERIVATIVES:
+            derived = derivative_name(pk, kind)
+            if storage.exists(derived):
+                storage.delete(derived)
+            content = ContentFile(make_derivative(image, sizes[kind]))
+            values[kind] = storage.save(derived, content)
+    except Exception:
+        # Pillow raises all sorts for corrupt or unsupported images.  Keep the
+        # metadata we do have rather than retrying the file forever.
+        logger.exception('Could not make thumbnails for attachment %s (%s).', pk, name)
+    return values
+
+
+def _derive(args):
+    return args[0], derive(*args)
+
+
+def process_pending(batch_size=100, processes=1, reprocess=False):
+    """
+    Fill in the metadata of attachments that don't have it yet, or of all of them.
+
+    Attachments are read `batch_size` at a time, in pk order.  With `processes` > 1
+    their files are handled by a pool of that many worker processes.  Return how
+    many attachments were processed.
+    """
+    attachments = models.AttachedFile.objects.order_by('pk')
+    if not reprocess:
+        attachments = attachments.filter(date_processed__isnull=True)
+
+    pool = None
+    if processes > 1:
+        # Imported here, as multiprocessing is slow to import.
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+    mapper = pool.imap_unordered if pool else six.moves.map
+    count = 0
+    last_pk = 0
+    try:
+        while True:
+            batch = list(
+                attachments.filter(pk__gt=last_pk).values_list('pk', 'file')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            for pk, values in mapper(_derive, batch):
+                models.AttachedFile.objects.filter(pk=pk).update(
+                    date_processed=timezone.now(),
+                    **(values or {})
+                )
+                count += 1
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return count
+
+
+class Throttle(object):
+    """Slow a loop down to at most `rate` operations a second (no limit if None)."""
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.started = time.time()
+        self.done = 0
+
+    def wait(self, count):
+        """Note that `count` more operations were done, then sleep if they were early."""
+        if not self.rate:
+            return
+        self.done += count
+        delay = self.started + self.done / float(self.rate) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def get_modified_time(storage, name):
+    # Django 1.8 storages only have `modified_time`, which Django 2.0 removes, and
+    # it returns a naive local time.
+    get = getattr(storage, 'get_modified_time', None) or storage.modified_time
+    modified = get(name)
+    if settings.USE_TZ and timezone.is_naive(modified):
+        modified = timezone.make_aware(modified)
+    return modified
+
+
+def walk(storage, path):
+    """Yield the name of every file under `path` in `storage`, one directory at a time."""
+    dirs, files = storage.listdir(path)
+    for name in files:
+        yield os.path.join(path, name)
+    for directory in dirs:
+        for name in walk(storage, os.path.join(path, directory)):
+            yield name
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def delete_unattached(cutoff, batch_size=500, dry_run=False, throttle=None):
+    """
+    Delete attachments created before `cutoff` that aren't attached to a comment.
+
+    Rows are deleted a batch at a time, then their files.  A file left behind by a
+    failure is picked up by `delete_unreferenced()` next time.  Return how many
+    attachments were (or, with `dry_run`, would have been) deleted.
+    """
+    throttle = throttle or Throttle()
+    file_fields = ('file',) + DERIVATIVES
+    storage = models.AttachedFile._meta.get_field('file').storage
+    attachments = models.AttachedFile.objects.filter(
+        attached_to__isnull=True,
+        date_created__lt=cutoff,
+    ).order_by('pk')
+    count = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            batch = attachments.filter(pk__gt=last_pk)
+            if not dry_run:
+                batch = batch.select_for_update()
+            batch = list(batch.values_list('pk', *file_fields)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            if not dry_run:
+                models.AttachedFile.objects.filter(
+                    pk__in=[row[0] for row in batch],
+                ).delete()
+
+        count += len(batch)
+        if dry_run:
+            continue
+        for row in batch:
+            for name in row[1:]:
+                if name and storage.exists(name):
+                    storage.delete(name)
+        throttle.wait(len(batch))
+    return count
+
+
+def delete_unreferenced(cutoff, batch_size=500, dry_run=False, throttle=None):
+    """
+    Delete stored files, last modified before `cutoff`, that no attachment refers to.
+
+    The attachments' upload directories are listed one directory at a time and
+    checked against the database `batch_size` names at a time.  Return how many
+    files were (or, with `dry_run`, would have been) deleted.
+    """
+    throttle = throttle or Throttle()
+    file_fields = ('file',) + DERIVATIVES
+    meta = models.AttachedFile._meta
+    storage = meta.get_field('file').storage
+    directories = sorted({meta.get_field(field).upload_to for field in file_fields})
+
+    count = 0
+    for directory in directories:
+        if not storage.exists(directory):
+            continue
+        for names in chunked(walk(storage, directory), batch_size):
+            query = Q()
+            for field in file_fields:
+                query |= Q(**{field + '__in': names})
+            rows = models.AttachedFile.objects.filter(query).values_list(*file_fields)
+            referenced = set()
+            for row in rows:
+                referenced.update(row)
+
+            orphans = [
+                name for name in names
+                if name not in referenced and get_modified_time(storage, name) < cutoff
+            ]
+            count += len(orphans)
+            if dry_run:
+                continue
+            for name in orphans:
+                storage.delete(name)
+            throttle.wait(len(orphans))
+    return count
+
+
+def delete_orphans(hours=None, batch_size=500, dry_run=False, rate=None):
+    """
+    Delete unattached attachments and unreferenced files more than `hours` old.
+
+    `hours` defaults to `GroupsConfig.orphaned_attachment_hours`, and `rate` limits
+    deletions to that many a second, to spare a busy storage backend.  Return the
+    number of attachments and of files deleted.
+    """
+    if hours is None:
+        hours = apps.get_app_config('groups').orphaned_attachment_hours
+    cutoff = timezone.now() - datetime.timedelta(hours=hours)
+    throttle = Throttle(rate)
+    kwargs = {'batch_size': batch_size, 'dry_run': dry_run, 'throttle': throttle}
+    return delete_unattached(cutoff, **kwargs), delete_unreferenced(cutoff, **kwargs)
@@ -0,0 +1,428 @@
+"""
+Benchmarks for the parts of `groups` that slow down as a forum grows.
+
+`generate()` fills the database with a synthetic forum using bulk inserts, so that
+millions of comments take minutes rather than hours.  `run()` then times each of
+the `SCENARIOS` against whatever is in the database and returns a report that can
+be dumped to JSON and compared between runs.  The `benchmark_groups` management
+command does both.
+
+Run benchmarks against a database you can throw away: generated data is never
+removed.  Scenarios that write do so inside a transaction that is rolled back.
+Views must respond with the status their scenario expects, or the run stops with a
+`BenchmarkError`, so that error pages are never timed as if they were the real thing.
+"""
+import datetime
+import math
+import platform
+import random
+import sys
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db import connection, connections, transaction
+from django.test import override_settings, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import models, outbox
+from .views.comments import CommentPostByEmail
+from .views.discussions import DiscussionThread
+from .views.groups import GroupDetail
+
+
+def chunks(items, size):
+    """Split a list into lists of at most `size` items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def generate(groups=10, discussions=100, comments=1000, attachments=0, users=100,
+             watchers=10, days=365, batch_size=1000, seed=None):
+    """
+    Add a synthetic forum to the database and return what was created.
+
+    Each of the `groups` groups has `watchers` watchers, picked from `users` people.
+    Between them they start `discussions` discussions (each subscribed to by its
+    creator), spread evenly across the groups, and post `comments` text comments,
+    spread randomly across those discussions over the last `days` days.  Every so
+    often a comment gets an attachment, `attachments` in all; only their rows are
+    written, not files.  Everything is inserted `batch_size` rows at a time.
+    """
+    rng = random.Random(seed)
+    prefix = 'benchmark-{}'.format(uuid.uuid4().hex[:8])
+    User = get_user_model()
+
+    def create(model, objects, **lookup):
+        """Bulk-create `objects` and return their pks, which SQLite doesn't give back."""
+        for batch in chunks(objects, batch_size):
+            model.objects.bulk_create(batch)
+        return list(model.objects.filter(**lookup).order_by('pk').values_list(
+            'pk',
+            flat=True,
+        ))
+
+    user_ids = create(
+        User,
+        [
+            User(**{
+                User.USERNAME_FIELD: '{}-user-{}'.format(prefix, n),
+                'email': '{}-user-{}@example.com'.format(prefix, n),
+                'password': '!',
+            })
+            for n in range(users)
+        ],
+        **{User.USERNAME_FIELD + '__startswith': prefix}
+    )
+    group_ids = create(
+        models.Group,
+        [models.Group(name='{} group {}'.format(prefix, n)) for n in range(groups)],
+        name__startswith=prefix,
+    )
+    watching = models.Group.watchers.through
+    watchers = min(watchers, len(user_ids))
+    for batch in chunks(group_ids, max(batch_size // max(watchers, 1), 1)):
+        watching.objects.bulk_create([
+            watching(group_id=group_id, user_id=user_id)
+            for group_id in batch
+            for user_id in rng.sample(user_ids, watchers)
+        ])
+
+    now = timezone.now()
+    starts = [
+        (group_ids[n % len(group_ids)], rng.choice(user_ids))
+        for n in range(discussions)
+    ]
+    discussion_ids = create(
+        models.Discussion,
+        [
+            models.Discussion(
+                name='{} discussion {}'.format(prefix, n),
+                group_id=group_id,
+                creator_id=creator_id,
+                date_created=now - datetime.timedelta(days=days),
+            )
+            for n, (group_id, creator_id) in enumerate(starts)
+        ],
+        name__startswith=prefix,
+    )
+    subscribing = models.Discussion.subscribers.through
+    subscriptions = [
+        subscribing(discussion_id=discussion_id, user_id=creator_id)
+        for discussion_id, (_, creator_id) in zip(discussion_ids, starts)
+    ]
+    for batch in chunks(subscriptions, batch_size):
+        subscribing.objects.bulk_create(batch)
+
+    attach_every = comments // attachments if attachments else 0
+    attached = 0
+    for start in range(0, comments, batch_size):
+        new_comments = []
+        new_attachments = []
+        for n in range(start, min(start + batch_size, comments)):
+            age = datetime.timedelta(seconds=rng.randint(0, days * 86400))
+            comment = models.TextComment(
+                discussion_id=rng.choice(discussion_ids),
+                user_id=rng.choice(user_ids),
+                date_created=now - age,
+                body='{} comment {}'.format(prefix, n),
+            )
+            new_comments.append(comment)
+            if attach_every and n % attach_every == 0 and attached < attachments:
+                attached += 1
+                new_attachments.append((comment, models.AttachedFile(
+                    user_id=comment.user_id,
+                    file='groups/attachments/{}-{}.txt'.format(prefix, n),
+                )))
+        models.BaseComment.objects.bulk_create_comments(new_comments, new_attachments)
+
+    return OrderedDict([
+        ('prefix', prefix),
+        ('users', len(user_ids)),
+        ('groups', len(group_ids)),
+        ('discussions', len(discussion_ids)),
+        ('comments', comments),
+        ('attachments', attached),
+        ('watchers', len(group_ids) * watchers),
+    ])
+
+
+class BenchmarkError(Exception):
+    """A scenario didn't do what it was meant to, so its timings mean nothing."""
+
+
+class Sample(object):
+    """The ids of the users, groups and discussions that scenarios pick targets from."""
+    def __init__(self, rng):
+        self.rng = rng
+        self.user_ids = list(get_user_model().objects.values_list('pk', flat=True))
+        self.group_ids = list(models.Group.objects.values_list('pk', flat=True))
+        self.discussion_ids = list(
+            models.Discussion.objects.filter(comments__isnull=False)
+            .distinct()
+            .values_list('pk', flat=True)
+        )
+
+    def user(self):
+        return get_user_model().objects.get(pk=self.rng.choice(self.user_ids))
+
+    def group(self):
+        return models.Group.objects.get(pk=self.rng.choice(self.group_ids))
+
+    def discussion(self):
+        return models.Discussion.objects.get(pk=self.rng.choice(self.discussion_ids))
+
+    def comment(self):
+        """Return the latest comment on a random discussion."""
+        discussion = self.rng.choice(self.discussion_ids)
+        return models.BaseComment.objects.filter(discussion_id=discussion).latest('pk')
+
+
+class Scenario(object):
+    """
+    Something to time.
+
+    `prepare()` runs untimed before each iteration and returns the arguments for
+    `run()`, which is what gets timed.  If `writes` is set, each iteration is rolled
+    back afterwards.  Scenarios that call a view pass its response to `check()`,
+    which raises `BenchmarkError` unless it has the `expected_status`.
+    """
+    writes = False
+    expected_status = 200
+    request_factory = RequestFactory()
+
+    def __init__(self, sample):
+        self.sample = sample
+
+    def get_request(self, user, path='/', method='get', **kwargs):
+        request = getattr(self.request_factory, method)(path, **kwargs)
+        request.user = user
+        return request
+
+    def check(self, response):
+        if response.status_code != self.expected_status:
+            raise BenchmarkError('{} got a {} response, not {}.'.format(
+                type(self).__name__,
+                response.status_code,
+                self.expected_status,
+            ))
+        return response
+
+    def prepare(self):
+        return ()
+
+    def run(self, *args):
+        raise NotImplementedError
+
+
+class GroupDetailScenario(Scenario):
+    """Render the first page of a group's discussions."""
+    view = staticmethod(GroupDetail.as_view())
+
+    def prepare(self):
+        return self.sample.group(), self.sample.user()
+
+    def run(self, group, user):
+        self.check(self.view(self.get_request(user), pk=group.pk)).render()
+
+
+class DiscussionThreadScenario(Scenario):
+    """Render a discussion with all of its comments."""
+    view = staticmethod(DiscussionThread.as_view())
+
+    def prepare(self):
+        return self.sample.discussion(), self.sample.user()
+
+    def run(self, discussion, user):
+        self.check(self.view(self.get_request(user), pk=discussion.pk)).render()
+
+
+class CommentRecipientsScenario(Scenario):
+    """Work out who to email about a comment."""
+    def prepare(self):
+        return self.sample.comment(),
+
+    def run(self, comment):
+        list(outbox.comment_recipients(comment))
+
+
+class EmailSubscribersScenario(Scenario):
+    """
+    Queue a comment's notification, as `email_subscribers` does, and then send it.
+
+    Emails go to the dummy backend, so this covers rendering them but not talking to
+    a mail server.
+    """
+    writes = True
+
+    def prepare(self):
+        comment = self.sample.comment()
+        return comment, self.get_request(comment.user)
+
+    def run(self, comment, request):
+        message = outbox.enqueue(models.OutboxMessage.KIND_COMMENT, comment, request)
+        # The rollback discards the usual on-commit delivery, so send it here.
+        outbox.deliver(models.OutboxMessage.objects.filter(pk=message.pk).claim(1))
+
+
+class WithinDaysScenario(Scenario):
+    """Find the recently active groups and discussions, and count recent comments."""
+    def run(self):
+        list(models.Group.objects.within_days())
+        list(models.Discussion.objects.within_days()[:100])
+        models.BaseComment.objects.within_days().count()
+
+
+class CommentPostByEmailScenario(Scenario):
+    """Post a reply to a notification email, as the email provider would."""
+    writes = True
+    view = staticmethod(CommentPostByEmail.as_view())
+
+    def prepare(self):
+        discussion = self.sample.discussion()
+        user = self.sample.user()
+        reply_uuid = signing.dumps({'discussion_pk': discussion.pk, 'user_pk': user.pk})
+        recipient = 'reply-{}@testserver'.format(reply_uuid.replace(':', '$'))
+        return {'recipient': recipient, 'stripped-text': 'A reply by email.'},
+
+    def run(self, data):
+        self.check(self.view(self.get_request(user=None, method='post', data=data)))
+
+
+SCENARIOS = OrderedDict([
+    ('group_detail', GroupDetailScenario),
+    ('discussion_thread', DiscussionThreadScenario),
+    ('comment_recipients', CommentRecipientsScenario),
+    ('email_subscribers', EmailSubscribersScenario),
+    ('within_days', WithinDaysScenario),
+    ('comment_post_by_email', CommentPostByEmailScenario),
+])
+
+
+class QueryCounter(object):
+    """Count the queries run on every database while the block runs."""
+    def __enter__(self):
+        self.contexts = [CaptureQueriesContext(connections[name]) for name in connections]
+        for context in self.contexts:
+            context.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        for context in reversed(self.contexts):
+            context.__exit__(*exc_info)
+
+    def __len__(self):
+        return sum(len(context) for context in self.contexts)
+
+
+@contextmanager
+def without_rate_limits():
+    """
+    Turn off `GroupsConfig.comment_rate_limits` while the block runs.
+
+    Scenarios post far more comments than a person could, and would otherwise be
+    turned away with 429 responses.
+    """
+    config = apps.get_app_config('groups')
+    limits = config.comment_rate_limits
+    config.comment_rate_limits = {}
+    try:
+        yield
+    finally:
+        config.comment_rate_limits = limits
+
+
+def max_rss_kb():
+    """Return the most memory this process has used so far, in KiB, if known."""
+    try:
+        import resource
+    except ImportError:  # Windows.
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def percentile(values, percent):
+    """Return the nearest-rank `percent`th percentile of sorted `values`."""
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def summarise(values):
+    values = sorted(values)
+    summary = OrderedDict([
+        ('min', values[0]),
+        ('mean', sum(values) / float(len(values))),
+    ])
+    for percent in (50, 90, 95, 99):
+        summary['p{}'.format(percent)] = percentile(values, percent)
+    summary['max'] = values[-1]
+    return summary
+
+
+def time_scenario(scenario, iterations, warmup=1):
+    """Run `scenario` `warmup` times untimed, then time `iterations` more runs."""
+    latencies = []
+    queries = []
+    for iteration in range(warmup + iterations):
+        args = scenario.prepare()
+        with transaction.atomic():
+            with QueryCounter() as counter:
+                start = default_timer()
+                scenario.run(*args)
+                elapsed = default_timer() - start
+            transaction.set_rollback(scenario.writes)
+        if iteration >= warmup:
+            latencies.append(elapsed * 1000)
+            queries.append(len(counter))
+
+    return OrderedDict([
+        ('iterations', iterations),
+        ('latency_ms', summarise(latencies)),
+        ('queries', summarise(queries)),
+    ])
+
+
+def run(names=None, iterations=20, warmup=1, seed=None):
+    """
+    Time the named scenarios (all of them by default) and return a report.
+
+    Latencies are in milliseconds and include rendering templates where a view is
+    involved.  `peak_rss_kb` is the most memory the whole process used, including
+    before the run started, so it isn't broken down by scenario.  Comment rate limits
+    are turned off for the run.
+    """
+    sample = Sample(random.Random(seed))
+    report = OrderedDict([
+        ('python', platform.python_version()),
+        ('django', django.get_version()),
+        ('database', connection.vendor),
+        ('dataset', OrderedDict([
+            ('users', len(sample.user_ids)),
+            ('groups', len(sample.group_ids)),
+            ('discussions', models.Discussion.objects.count()),
+            ('comments', models.BaseComment.objects.count()),
+            ('attachments', models.AttachedFile.objects.count()),
+            ('watchers', models.Group.watchers.through.objects.count()),
+        ])),
+        ('scenarios', OrderedDict()),
+        ('peak_rss_kb', None),
+    ])
+    # Requests are built by `RequestFactory`, for the host 'testserver'.
+    with override_settings(
+        ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver'],
+        EMAIL_BACKEND='django.core.mail.backends.dummy.EmailBackend',
+    ), without_rate_limits():
+        for name in names or SCENARIOS:
+            scenario = SCENARIOS[name](sample)
+            report['scenarios'][name] = time_scenario(scenario, iterations, warmup)
+    report['peak_rss_kb'] = max_rss_kb()
+    return report
@@ -0,0 +1,124 @@
+"""
+Collect changes in memory and write them to the database in batches.
+
+`groups.read_markers` and `groups.reactions` each keep a `WriteBehindBuffer`, so
+that frequent small changes, such as a page view or a like, cost nothing until
+many of them are saved together.  A buffer is saved once it holds its
+`max_pending_setting` keys, or `flush_seconds_setting` after the first change was
+added to it.  Either way it's saved by a timer thread, not by the request that
+happened to fill it, so changes are saved on time even if the process gets no more
+requests, and a slow or failing save never holds up a page.
+
+If saving fails, the changes go back into the buffer, to be tried again with the
+next batch.  Changes still in a buffer are lost if the process stops before it
+flushes.
+"""
+import logging
+import threading
+
+from django.apps import apps
+from django.db import connections
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer(object):
+    """
+    Collect keyed changes in memory and save them in batches.
+
+    Subclasses name the `GroupsConfig` settings that limit how long changes wait
+    (`flush_seconds_setting`) and how many keys can wait (`max_pending_setting`),
+    and define `combine()`, which merges a new change into the one waiting for the
+    same key, and `save()`.
+    """
+    flush_seconds_setting = None
+    max_pending_setting = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.started = None
+        self.timer = None
+        self.flushing_soon = False
+
+    def get_setting(self, name):
+        return getattr(apps.get_app_config('groups'), name)
+
+    def combine(self, waiting, value):
+        """Return the change to save for a key, given the one waiting and a new one."""
+        raise NotImplementedError
+
+    def save(self, pending):
+        """Write the changes in `pending`, a dict of {key: change}, to the database."""
+        raise NotImplementedError
+
+    def add(self, key, value):
+        """Add a change for `key`, and have the timer flush at once if it's time to."""
+        with self.lock:
+            if key in self.pending:
+                value = self.combine(self.pending[key], value)
+            self.pending[key] = value
+            if self.started is None:
+                self.started = timezone.now()
+                self.start_timer(self.get_setting(self.flush_seconds_setting))
+            if not self.flushing_soon and self.is_due():
+                self.flushing_soon = True
+                self.start_timer(0)
+
+    def is_due(self):
+        if len(self.pending) >= self.get_setting(self.max_pending_setting):
+            return True
+        age = timezone.now() - self.started
+        return age.total_seconds() >= self.get_setting(self.flush_seconds_setting)
+
+    def start_timer(self, seconds):
+        """Flush the buffer from another thread in `seconds`, replacing any timer."""
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = threading.Timer(seconds, self.flush_from_timer)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def flush_from_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not save %s.', type(self).__name__)
+        finally:
+            # This thread's database connections aren't closed by any request.
+            connections.close_all()
+
+    def cancel(self):
+        """Stop the timer, leaving anything in the buffer unsaved."""
+        with self.lock:
+            timer, self.timer = self.timer, None
+            self.flushing_soon = False
+        if timer is not None:
+            timer.cancel()
+
+    def flush(self):
+        """Save everything in the buffer, putting it back if that fails."""
+        with self.lock:
+            pending, self.pending, self.started = self.pending, {}, None
+            timer, self.timer = self.timer, None
+            self.flushing_soon = False
+        if timer is not None:
+            timer.cancel()
+        try:
+            self.save(pending)
+        except Exception:
+            self.restore(pending)
+            raise
+
+    def restore(self, pending):
+        """Put back changes that couldn't be saved, ahead of any added since."""
+        with self.lock:
+            for key, value in pending.items():
+                if key in self.pending:
+                    value = self.combine(value, self.pending[key])
+                self.pending[key] = value
+            if pending and self.started is None:
+                self.started = timezone.now()
+                self.start_timer(self.get_setting(self.flush_seconds_setting))
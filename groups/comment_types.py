@@ -0,0 +1,139 @@
+"""
+Everything needed to load, render and serialise each kind of comment, in one place.
+
+`GroupsConfig.ready()` registers every model that's displayed as a comment
+(`BaseComment` subclasses and `ArchivedComment`).  Each entry is built from the
+model's class attributes:
+* `template_name` - the template the comment is rendered with.
+* `comment_select_related` and `comment_prefetch_related` - the relations its
+  template uses, so that a thread's comments can be loaded with them in a few
+  queries rather than a few per comment.
+
+A project can register its own comment types, or replace an entry (e.g. to give
+it a `serialiser`), by calling `registry.register()` from its own `AppConfig.ready()`.
+
+Templates are compiled once per type per process, except with `DEBUG` on, so that
+edits to them show up without a restart.
+"""
+from collections import OrderedDict
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.db.models.query import prefetch_related_objects
+from django.template import loader
+
+
+def default_serialiser(comment_type, comment):
+    """Describe `comment` for the readers of its discussion (see `groups.events`)."""
+    return {
+        'id': comment.pk,
+        'type': comment_type.model._meta.model_name,
+        'anchor': comment.get_pagejump_anchor(),
+        'html': comment_type.render(comment, request=None),
+    }
+
+
+class CommentType(object):
+    """How one model of comment is loaded, rendered and serialised."""
+    def __init__(
+        self,
+        model,
+        template_name,
+        select_related=(),
+        prefetch_related=(),
+        serialiser=default_serialiser,
+    ):
+        self.model = model
+        self.template_name = template_name
+        self.select_related = tuple(select_related)
+        self.prefetch_related = tuple(prefetch_related)
+        self.serialiser = serialiser
+        self._template = None
+
+    def get_template(self):
+        if settings.DEBUG:
+            return loader.get_template(self.template_name)
+        if self._template is None:
+            self._template = loader.get_template(self.template_name)
+        return self._template
+
+    def render(self, comment, request):
+        return self.get_template().render(comment.get_context_data(), request=request)
+
+    def serialise(self, comment):
+        return self.serialiser(self, comment)
+
+    def apply(self, queryset):
+        """Load the relations this type's template uses along with `queryset`."""
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        return queryset
+
+    def load(self, comments):
+        """
+        Load the relations this type's template uses for `comments`, already fetched.
+
+        Polymorphic querysets fetch each subclass's rows in a query of their own,
+        which doesn't keep `select_related()`, so the relations are prefetched
+        instead.
+        """
+        lookups = self.select_related + self.prefetch_related
+        if comments and lookups:
+            # Django 1.8 takes the lookups as a list.
+            args = (lookups,) if django.VERSION < (1, 10) else lookups
+            prefetch_related_objects(comments, *args)
+
+
+class CommentTypeRegistry(object):
+    """The `CommentType` of each model that's displayed as a comment."""
+    def __init__(self):
+        self.types = OrderedDict()
+
+    def register(self, model, **options):
+        """
+        Register (or replace) `model`'s comment type.
+
+        Options default to the model's `template_name`, `comment_select_related`
+        and `comment_prefetch_related` attributes.
+        """
+        options.setdefault('template_name', getattr(model, 'template_name', None))
+        options.setdefault(
+            'select_related',
+            getattr(model, 'comment_select_related', ()),
+        )
+        options.setdefault(
+            'prefetch_related',
+            getattr(model, 'comment_prefetch_related', ()),
+        )
+        self.types[model] = CommentType(model, **options)
+        return self.types[model]
+
+    def get(self, model):
+        """Return the type of `model`, or of its nearest registered parent."""
+        for cls in model.__mro__:
+            if cls in self.types:
+                return self.types[cls]
+        raise LookupError('{} is not a registered comment type.'.format(model.__name__))
+
+    def load(self, comments):
+        """Load what each of `comments` needs to render, a query or two per type."""
+        by_type = OrderedDict()
+        for comment in comments:
+            by_type.setdefault(self.get(type(comment)), []).append(comment)
+        for comment_type, instances in by_type.items():
+            comment_type.load(instances)
+        return comments
+
+    def autodiscover(self):
+        """Register every installed model that's displayed as a comment."""
+        from .models import CommentDisplayMixin
+
+        for model in apps.get_models():
+            if issubclass(model, CommentDisplayMixin) and model not in self.types:
+                self.register(model)
+
+
+registry = CommentTypeRegistry()
@@ -0,0 +1,124 @@
+"""
+Push new comments to the people reading a discussion, as server-sent events.
+
+Posting a comment publishes it, already rendered, to the discussion's channel on a
+broker once the comment's transaction commits.  `views.discussions.DiscussionEvents`
+subscribes to that channel and streams what arrives to the browser.
+
+The broker is set by `GroupsConfig.event_broker_class_path`.  The default,
+`LocalBroker`, only reaches readers served by the same process, which is fine for
+development.  Production sites with several processes should subclass `BaseBroker`
+around something shared, such as Redis pub/sub or Postgres `LISTEN`/`NOTIFY`.
+"""
+import json
+import threading
+from collections import defaultdict
+
+from django.apps import apps
+from django.utils.six.moves import queue
+
+from . import comment_types
+from ._apps_base import get_class_from_path
+from .outbox import on_commit
+
+
+_broker = {}
+
+
+class BaseBroker(object):
+    """
+    Pass messages (strings) between the processes serving a site.
+
+    Subclasses must implement `publish` and `subscribe`.
+    """
+    def publish(self, channel, message):
+        """Send `message` to everyone currently subscribed to `channel`."""
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        """
+        Start listening to `channel`.
+
+        Return an object with a `get(timeout)` method, which returns the next message
+        or None if `timeout` seconds pass without one, and a `close()` method.
+        """
+        raise NotImplementedError
+
+
+class LocalSubscription(object):
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue()
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker(BaseBroker):
+    """A broker that only passes messages between threads of the current process."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.queue.put(message)
+
+    def subscribe(self, channel):
+        subscription = LocalSubscription(self, channel)
+        with self.lock:
+            self.subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions[subscription.channel]
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.subscriptions[subscription.channel]
+
+
+def get_broker():
+    """Return the broker named by `GroupsConfig.event_broker_class_path`."""
+    path = apps.get_app_config('groups').event_broker_class_path
+    if path not in _broker:
+        _broker[path] = get_class_from_path(path)()
+    return _broker[path]
+
+
+def discussion_channel(discussion_id):
+    return 'groups.discussion.{}'.format(discussion_id)
+
+
+def serialise_comment(comment):
+    """
+    Render `comment` as a JSON message for its discussion's readers.
+
+    The message comes from the comment's type's serialiser (see
+    `groups.comment_types`).  The same HTML goes to everyone, so it has no per-user
+    parts such as the delete link.  Those appear once the reader reloads the page.
+    """
+    comment_type = comment_types.registry.get(type(comment))
+    return json.dumps(comment_type.serialise(comment))
+
+
+def format_event(comment_id, message):
+    """Format a message as a server-sent event, using the comment's pk as its id."""
+    return 'id: {}\nevent: comment\ndata: {}\n\n'.format(comment_id, message)
+
+
+def publish_comment(comment):
+    """Send `comment` to its discussion's readers once its transaction commits."""
+    def publish():
+        channel = discussion_channel(comment.discussion_id)
+        get_broker().publish(channel, serialise_comment(comment))
+    on_commit(publish)
@@ -0,0 +1,172 @@
+import heapq
+import json
+
+from django.utils import six
+
+from . import models
+
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# (column name, `values()` lookup) pairs, in output order.
+COMMENT_COLUMNS = (
+    ('id', 'pk'),
+    ('group_id', 'discussion__group_id'),
+    ('group', 'discussion__group__name'),
+    ('discussion_id', 'discussion_id'),
+    ('discussion', 'discussion__name'),
+    ('user_id', 'user_id'),
+    ('date_created', 'date_created'),
+    ('state', 'state'),
+    ('body', 'textcomment__body'),
+)
+COLUMN_NAMES = [name for name, lookup in COMMENT_COLUMNS] + ['attachments']
+
+# Archived comments have the same columns, but no subclasses or attachments.
+ARCHIVED_COMMENT_COLUMNS = COMMENT_COLUMNS[:-1] + (('body', 'body'),)
+
+
+def get_attachment_names(comment_pks):
+    """Return a dict of {comment pk: [attached file names]} using a single query."""
+    attachments = models.AttachedFile.objects.filter(attached_to__in=comment_pks)
+    names = {}
+    for comment_pk, name in attachments.order_by('pk').values_list('attached_to', 'file'):
+        names.setdefault(comment_pk, []).append(name)
+    return names
+
+
+def iter_chunks(queryset, columns, after, chunk_size):
+    """Yield lists of `values_list()` rows from `queryset`, keyset-paginated by pk."""
+    lookups = [lookup for name, lookup in columns]
+    rows = queryset.order_by('pk').values_list(*lookups)
+    while True:
+        chunk = list(rows.filter(pk__gt=after)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1][0]
+
+
+def iter_comment_rows(comments, after=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield a dict per comment in `comments` with a primary key greater than `after`.
+
+    Rows are produced in primary key order and hold the `COLUMN_NAMES` keys.  Two
+    queries are made per `chunk_size` comments: one for the comments themselves and
+    one for their attachments.
+    """
+    for chunk in iter_chunks(comments, COMMENT_COLUMNS, after, chunk_size):
+        attachments = get_attachment_names([values[0] for values in chunk])
+        for values in chunk:
+            row = dict(zip(COLUMN_NAMES, values))
+            row['attachments'] = attachments.get(row['id'], [])
+            yield row
+
+
+def iter_archived_comment_rows(comments, after=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield rows like `iter_comment_rows`, but for a queryset of `ArchivedComment`s."""
+    for chunk in iter_chunks(comments, ARCHIVED_COMMENT_COLUMNS, after, chunk_size):
+        for values in chunk:
+            row = dict(zip(COLUMN_NAMES, values))
+            row['attachments'] = []
+            yield row
+
+
+def iter_all_comment_rows(group=None, after=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield rows for every live and archived comment, optionally only on one `group`.
+
+    Archived comments keep their original primary keys, so the two tables never share
+    a key and can be merged into a single stream in primary key order.
+    """
+    comments = models.BaseComment.objects.all()
+    archived = models.ArchivedComment.objects.all()
+    if group is not None:
+        comments = comments.filter(discussion__group=group)
+        archived = archived.filter(discussion__group=group)
+
+    streams = [
+        iter_comment_rows(comments, after=after, chunk_size=chunk_size),
+        iter_archived_comment_rows(archived, after=after, chunk_size=chunk_size),
+    ]
+    keyed = [((row['id'], row) for row in stream) for stream in streams]
+    for pk, row in heapq.merge(*keyed):
+        yield row
+
+
+def serialise_value(value):
+    """Convert a row value into something that both JSON and CSV can represent."""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def format_ndjson(row):
+    """Format a row as a single line of JSON."""
+    data = {key: serialise_value(value) for key, value in row.items()}
+    return six.text_type(json.dumps(data, sort_keys=True)) + '\n'
+
+
+def format_csv(row):
+    """
+    Format a row as a line of CSV, quoting every field.
+
+    Attachments are separated by spaces, which storage backends don't produce in file
+    names.  The `csv` module isn't used because it can't write unicode on Python 2.
+    """
+    row = dict(row, attachments=' '.join(row['attachments']))
+    cells = []
+    for name in COLUMN_NAMES:
+        value = serialise_value(row[name])
+        value = '' if value is None else six.text_type(value)
+        cells.append('"' + value.replace('"', '""') + '"')
+    return ','.join(cells) + '\r\n'
+
+
+def csv_header():
+    return six.text_type(','.join(COLUMN_NAMES) + '\r\n')
+
+
+FORMATTERS = {
+    'ndjson': format_ndjson,
+    'csv': format_csv,
+}
+
+
+def export_comments(
+    stream,
+    group=None,
+    export_format='ndjson',
+    after=0,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    on_chunk=None,
+):
+    """
+    Write every comment on `group` (or on the whole site) to a text `stream`.
+
+    Comments are read in keyset-paginated chunks of `values()` rows ordered by primary
+    key, so memory use stays constant however big the site is and no polymorphic
+    comment objects are instantiated.  Each chunk is its own short query, rather than
+    one long-lived server-side cursor, so a multi-hour export never holds a transaction
+    open.  Archived comments are included alongside the live ones.
+
+    Only comments with a primary key greater than `after` are written, which allows
+    an interrupted export to be resumed.  `on_chunk`, if given, is called with the
+    primary key of the last comment written after every `chunk_size` comments and at
+    the end of the export; use it to save a checkpoint.  Returns the number of
+    comments written.
+    """
+    formatter = FORMATTERS[export_format]
+
+    count = 0
+    last_pk = after
+    for row in iter_all_comment_rows(group, after=after, chunk_size=chunk_size):
+        stream.write(formatter(row))
+        count += 1
+        last_pk = row['id']
+        if on_chunk is not None and count % chunk_size == 0:
+            on_chunk(last_pk)
+
+    if on_chunk is not None:
+        on_chunk(last_pk)
+    return count
@@ -1,17 +1,42 @@
 from crispy_forms.bootstrap import FormActions, StrictButton
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout
+from crispy_forms.utils import render_crispy_form
 from django import forms
-from django.core.urlresolvers import reverse_lazy
+from django.apps import apps
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.utils.functional import cached_property
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
 
 from . import models
 
 
+def limit_parents(form, discussion):
+    """Only allow `form` to reply to comments on `discussion`."""
+    if 'parent' in form.fields:
+        form.fields['parent'].queryset = discussion.comments.all()
+
+
 class BaseAddCommentForm(forms.ModelForm):
-    """A base class for forms that create models inheriting from BaseComment."""
+    """
+    A base class for forms that create models inheriting from BaseComment.
+
+    Each subclass's helper is built by `build_helper()` the first time the form is
+    used, and then shared by every instance of that subclass.
+
+    Forms with a `parent` field post replies.  Pass them to `limit_parents()` so
+    that only comments on the same discussion can be replied to.
+    """
+    _helpers = {}
+
     def __init__(self, *args, **kwargs):
         super(BaseAddCommentForm, self).__init__(*args, **kwargs)
-        self.helper = self.build_helper()
+        cls = type(self)
+        if cls not in self._helpers:
+            self._helpers[cls] = self.build_helper()
+        self.helper = self._helpers[cls]
 
     def build_helper(self):
         """An overridable method that creates a crispy_forms layout helper."""
@@ -21,6 +46,7 @@ class BaseAddCommentForm(forms.ModelForm):
         helper.field_class = 'col-lg-8'
         helper.layout = Layout(
             'body',
+            'parent',
             FormActions(
                 StrictButton('Post comment', type='submit'),
             ),
@@ -28,7 +54,8 @@ class BaseAddCommentForm(forms.ModelForm):
         return helper
 
     class Meta:
-        fields = ('body',)
+        fields = ('body', 'parent')
+        widgets = {'parent': forms.HiddenInput()}
 
 
 class AddTextComment(BaseAddCommentForm):
@@ -60,6 +87,34 @@ class AddTextCommentWithAttachment(BaseAddCommentForm):
         }
 
 
+class EditTextComment(forms.ModelForm):
+    """Edits a TextComment's body.  Save it with `groups.revisions.edit()`."""
+    helper = FormHelper()
+    helper.form_class = 'form-horizontal'
+    helper.label_class = 'col-lg-2'
+    helper.field_class = 'col-lg-8'
+    helper.layout = Layout(
+        'body',
+        FormActions(
+            StrictButton('Save changes', type='submit'),
+        ),
+    )
+
+    class Meta:
+        model = models.TextComment
+        fields = ('body',)
+
+
+class ReactionForm(forms.Form):
+    """Picks one of `GroupsConfig.reaction_kinds`."""
+    kind = forms.ChoiceField()
+
+    def __init__(self, *args, **kwargs):
+        super(ReactionForm, self).__init__(*args, **kwargs)
+        kinds = apps.get_app_config('groups').reaction_kinds
+        self.fields['kind'].choices = [(kind, kind) for kind in kinds]
+
+
 class DiscussionCreate(forms.Form):
     comment = forms.CharField(widget=forms.Textarea)
     name = forms.CharField(max_length=255)
@@ -77,8 +132,21 @@ class DiscussionCreate(forms.Form):
 
 
 class SubscribeForm(forms.Form):
+    """
+    A button that subscribes the user to an object, or unsubscribes them.
+
+    The button's HTML only depends on the URL it posts to and whether it subscribes
+    or unsubscribes, so `render_button()` caches it, leaving a placeholder for the
+    CSRF token that's filled in each time.
+    """
     subscribe = forms.BooleanField(widget=forms.HiddenInput(), required=False)
 
+    layouts = {
+        True: Layout(FormActions(StrictButton('Subscribe', type='submit'))),
+        False: Layout(FormActions(StrictButton('Unsubscribe', type='submit'))),
+    }
+    csrf_placeholder = 'GROUPS-CSRF-TOKEN'
+
     class Meta:
         fields = ('subscribe',)
 
@@ -89,19 +157,65 @@ class SubscribeForm(forms.Form):
         Accepts (and requires) a user and an instance being subscribed to
         as keyword arguments.
         """
-        to_subscribe = not instance.is_subscribed(user)
+        self.instance = instance
+        self.url_name = url_name
+        self.to_subscribe = not instance.is_subscribed(user)
         initial_values = kwargs.setdefault('initial', {})
-        initial_values['subscribe'] = to_subscribe
+        initial_values['subscribe'] = self.to_subscribe
 
         super(SubscribeForm, self).__init__(*args, **kwargs)
 
-        button_text = 'Subscribe' if to_subscribe else 'Unsubscribe'
+    @cached_property
+    def helper(self):
+        helper = FormHelper()
+        helper.form_class = 'form-horizontal'
+        helper.layout = self.layouts[self.to_subscribe]
+        helper.form_action = reverse(self.url_name, kwargs={'pk': self.instance.pk})
+        return helper
 
-        self.helper = FormHelper()
-        self.helper.form_class = 'form-horizontal'
-        self.helper.layout = Layout(
-            FormActions(
-                StrictButton(button_text, type='submit'),
-            ),
+    def get_cache_key(self):
+        return 'groups:subscribe-button:{}:{}:{}'.format(
+            self.url_name,
+            self.instance.pk,
+            int(self.to_subscribe),
         )
-        self.helper.form_action = reverse_lazy(url_name, kwargs={'pk': instance.pk})
+
+    def render_button(self, csrf_token):
+        """Return the button's HTML, with `csrf_token` in it."""
+        if self.is_bound:
+            return render_crispy_form(self, context={'csrf_token': csrf_token})
+
+        key = self.get_cache_key()
+        html = cache.get(key)
+        if html is None:
+            html = render_crispy_form(self, context={'csrf_token': self.csrf_placeholder})
+            timeout = apps.get_app_config('groups').subscribe_button_cache_seconds
+            cache.set(key, html, timeout)
+        if not csrf_token or csrf_token == 'NOTPROVIDED':
+            csrf_token = ''
+        return mark_safe(html.replace(self.csrf_placeholder, escape(csrf_token)))
+
+
+class ModerationForm(forms.Form):
+    """Hide, delete or restore a number of comments at once."""
+    action = forms.ChoiceField(choices=(
+        (models.BaseComment.STATE_HIDDEN, 'Hide'),
+        (models.BaseComment.STATE_DELETED, 'Delete'),
+        (models.BaseComment.STATE_OK, 'Approve or restore'),
+    ))
+    comments = forms.ModelMultipleChoiceField(queryset=models.BaseComment.objects.none())
+
+    def __init__(self, comments, *args, **kwargs):
+        """Accept (and require) the queryset of comments that may be chosen."""
+        super(ModerationForm, self).__init__(*args, **kwargs)
+        self.fields['comments'].queryset = comments
+
+    def save(self):
+        """Apply the action to the chosen comments, and return how many changed."""
+        return self.cleaned_data['comments'].set_state(self.cleaned_data['action'])
+
+
+class UploadStart(forms.Form):
+    """Start a resumable upload (see `groups.uploads`)."""
+    filename = forms.CharField(max_length=255)
+    size = forms.IntegerField(min_value=1)
@@ -0,0 +1,57 @@
+import datetime
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ... import models
+
+
+class Command(BaseCommand):
+    help = (
+        'Move old and long-deleted comments out of the live comment tables and into '
+        'the archive.'
+    )
+
+    def add_arguments(self, parser):
+        config = apps.get_app_config('groups')
+        parser.add_argument(
+            '--older-than',
+            type=int,
+            default=config.archive_after_days,
+            dest='older_than',
+            help='Archive comments created more than this many days ago.',
+        )
+        parser.add_argument(
+            '--deleted-for',
+            type=int,
+            default=config.archive_deleted_after_days,
+            dest='deleted_for',
+            help='Archive comments that were deleted more than this many days ago.',
+        )
+        parser.add_argument('--batch-size', type=int, default=500, dest='batch_size')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            help='Only report how many comments would be archived.',
+        )
+
+    @staticmethod
+    def days_ago(days):
+        if days is None:
+            return None
+        return timezone.now() - datetime.timedelta(days=days)
+
+    def handle(self, older_than, deleted_for, batch_size, dry_run, **options):
+        comments = models.BaseComment.objects.archivable(
+            created_before=self.days_ago(older_than),
+            deleted_before=self.days_ago(deleted_for),
+        )
+
+        if dry_run:
+            self.stdout.write('{} comments would be archived.'.format(comments.count()))
+            return
+
+        count = comments.archive(batch_size=batch_size)
+        self.stdout.write('Archived {} comments.'.format(count))
@@ -0,0 +1,67 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the slowest parts of groups and print a JSON report.  With --generate, '
+        'first fill the database with a synthetic forum.  Only use a database you can '
+        'throw away: generated data is never removed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--generate',
+            action='store_true',
+            help='Add a synthetic forum to the database before running the benchmarks.',
+        )
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--discussions', type=int, default=100)
+        parser.add_argument('--comments', type=int, default=1000)
+        parser.add_argument('--attachments', type=int, default=0)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument(
+            '--watchers',
+            type=int,
+            default=10,
+            help='How many users watch each group.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, dest='batch_size')
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            choices=list(benchmark.SCENARIOS),
+            dest='scenarios',
+            help='A scenario to run.  Can be repeated.  Defaults to all of them.',
+        )
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=1)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--output', help='Write the report here instead of stdout.')
+
+    def handle(self, generate, scenarios, iterations, warmup, seed, output, **options):
+        if generate:
+            sizes = ('groups', 'discussions', 'comments', 'attachments', 'users',
+                     'watchers', 'batch_size')
+            kwargs = {name: options[name] for name in sizes}
+            generated = benchmark.generate(seed=seed, **kwargs)
+            self.stderr.write('Generated {}.'.format(json.dumps(generated)))
+
+        try:
+            report = benchmark.run(
+                scenarios,
+                iterations=iterations,
+                warmup=warmup,
+                seed=seed,
+            )
+        except benchmark.BenchmarkError as e:
+            raise CommandError(str(e))
+        content = json.dumps(report, indent=2)
+        if output:
+            with open(output, 'w') as report_file:
+                report_file.write(content + '\n')
+        else:
+            self.stdout.write(content)
@@ -0,0 +1,50 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from ... import attachments, uploads
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete attachments that were never attached to a comment, stored attachment '
+        'files that no attachment refers to, and abandoned uploads.'
+    )
+
+    def add_arguments(self, parser):
+        config = apps.get_app_config('groups')
+        parser.add_argument(
+            '--older-than',
+            type=int,
+            default=config.orphaned_attachment_hours,
+            dest='hours',
+            help='Only delete things more than this many hours old.',
+        )
+        parser.add_argument('--batch-size', type=int, default=500, dest='batch_size')
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=None,
+            help='Delete at most this many attachments or files a second.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            help='Only report what would be deleted.',
+        )
+
+    def handle(self, hours, batch_size, rate, dry_run, **options):
+        unattached, unreferenced = attachments.delete_orphans(
+            hours=hours,
+            batch_size=batch_size,
+            dry_run=dry_run,
+            rate=rate,
+        )
+        abandoned = uploads.delete_abandoned(hours=hours, dry_run=dry_run)
+        counts = (
+            '{} unattached attachments, {} orphaned files and {} abandoned uploads'
+        ).format(unattached, unreferenced, abandoned)
+        if dry_run:
+            self.stdout.write('{} would be deleted.'.format(counts))
+        else:
+            self.stdout.write('Deleted {}.'.format(counts))
@@ -0,0 +1,143 @@
+import gzip
+import io
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import export, models
+
+
+class Command(BaseCommand):
+    help = 'Export the comments on one group, or on every group, as NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='The file to write the export to.')
+        parser.add_argument(
+            '--group',
+            type=int,
+            help='The primary key of the group to export.  Defaults to all groups.',
+        )
+        parser.add_argument(
+            '--format',
+            choices=sorted(export.FORMATTERS),
+            default='ndjson',
+            dest='export_format',
+        )
+        parser.add_argument(
+            '--gzip',
+            action='store_true',
+            dest='compress',
+            help='Compress the output with gzip.',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help=(
+                'A file to record progress in.  If it already exists, the export is '
+                'resumed from where it stopped and appended to the output.'
+            ),
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=export.DEFAULT_CHUNK_SIZE,
+            dest='chunk_size',
+        )
+
+    @staticmethod
+    def read_checkpoint(path):
+        """
+        Return the last primary key exported and the output's length at that point.
+
+        Both are 0 if there is no checkpoint yet.
+        """
+        if not path or not os.path.exists(path):
+            return 0, 0
+        with io.open(path) as checkpoint:
+            last_pk, offset = checkpoint.read().split()
+        return int(last_pk), int(offset)
+
+    @staticmethod
+    def write_checkpoint(path, last_pk, offset):
+        with io.open(path, 'w') as checkpoint:
+            checkpoint.write(u'{} {}'.format(last_pk, offset))
+
+    def handle(self, output, group, export_format, compress, checkpoint, chunk_size,
+               **options):
+        if group is not None and not models.Group.objects.filter(pk=group).exists():
+            raise CommandError('Group {} does not exist.'.format(group))
+
+        after, offset = self.read_checkpoint(checkpoint)
+        if offset and (not os.path.exists(output) or os.path.getsize(output) < offset):
+            raise CommandError('{} is shorter than the checkpoint says.'.format(output))
+
+        def save_checkpoint(last_pk):
+            self.write_checkpoint(checkpoint, last_pk, stream.checkpoint())
+
+        stream = ExportOutput(output, offset, compress)
+        with stream:
+            if export_format == 'csv' and not offset:
+                stream.write(export.csv_header())
+            count = export.export_comments(
+                stream,
+                group,
+                export_format=export_format,
+                after=after,
+                chunk_size=chunk_size,
+                on_chunk=save_checkpoint if checkpoint else None,
+            )
+
+        self.stdout.write('Exported {} comments.'.format(count))
+
+
+class ExportOutput(object):
+    """
+    The export file, as a UTF-8 text stream that can be cut back to a checkpoint.
+
+    A resumed export first truncates the file to its length at the last checkpoint,
+    dropping anything written after it, so no comment is written twice.  Gzipped
+    output is written as a separate gzip member per checkpoint, each finished before
+    the checkpoint is saved, so the file is always valid gzip up to that length.
+    """
+    def __init__(self, path, offset=0, compress=False):
+        self.compress = compress
+        self.raw = io.open(path, 'r+b' if offset else 'wb')
+        self.raw.seek(offset)
+        self.raw.truncate()
+        self.open_stream()
+
+    def open_stream(self):
+        self.gzip = None
+        target = self.raw
+        if self.compress:
+            target = self.gzip = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        self.stream = io.TextIOWrapper(target, encoding='utf-8', newline='')
+
+    def close_stream(self):
+        """Write out everything written so far, finishing the current gzip member."""
+        if self.gzip is None:
+            self.stream.flush()
+        else:
+            self.stream.detach()
+            self.gzip.close()
+            self.raw.flush()
+
+    def write(self, text):
+        self.stream.write(text)
+
+    def checkpoint(self):
+        """Write out everything written so far, and return the file's length."""
+        self.close_stream()
+        offset = self.raw.tell()
+        if self.gzip is not None:
+            self.open_stream()
+        return offset
+
+    def close(self):
+        self.close_stream()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from ... import attachments
+
+
+class Command(BaseCommand):
+    help = (
+        'Record the size, type and image dimensions of new attachments, and make '
+        'thumbnails and previews of the images.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, dest='batch_size')
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='How many worker processes make thumbnails.',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            dest='reprocess',
+            help='Process every attachment again, not just new ones.',
+        )
+
+    def handle(self, batch_size, processes, reprocess, **options):
+        count = attachments.process_pending(
+            batch_size=batch_size,
+            processes=processes,
+            reprocess=reprocess,
+        )
+        self.stdout.write('Processed {} attachments.'.format(count))
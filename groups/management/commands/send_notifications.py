@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from ... import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        'Send the notification emails waiting in the outbox.  Several copies can run '
+        'at once without sending anything twice.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, dest='batch_size')
+        parser.add_argument(
+            '--lease',
+            type=int,
+            default=None,
+            dest='lease_seconds',
+            help=(
+                'How many seconds to allow for sending each batch before other workers '
+                'may take it over.'
+            ),
+        )
+
+    def handle(self, batch_size, lease_seconds, **options):
+        sent = outbox.deliver_pending(batch_size=batch_size, lease_seconds=lease_seconds)
+        self.stdout.write('Sent {} notifications.'.format(sent))
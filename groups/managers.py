@@ -1,12 +1,15 @@
 import datetime
+import functools
+import operator
+from collections import OrderedDict
 
 from django.apps import apps
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import connections, IntegrityError, models, router, transaction
+from django.utils import timezone
 from polymorphic.managers import PolymorphicManager, PolymorphicQuerySet
 
-
-DEFAULT_WITHIN_DAYS = apps.get_app_config('groups').default_within_days
+from . import comment_types, threads
 
 
 class WithinDaysQuerySetMixin:
@@ -27,11 +30,18 @@ class WithinDaysQuerySetMixin:
         return datetime.datetime.now() - timedelta
 
     @staticmethod
-    def get_threshold_date(within_days=DEFAULT_WITHIN_DAYS):
-        """Return the earliest posting *date* an item can have and still be recent."""
+    def get_threshold_date(within_days=None):
+        """
+        Return the earliest posting *date* an item can have and still be recent.
+
+        `within_days` defaults to `GroupsConfig.default_within_days`, read when it's
+        needed rather than when this module is imported.
+        """
+        if within_days is None:
+            within_days = apps.get_app_config('groups').default_within_days
         return datetime.date.today() - datetime.timedelta(days=within_days)
 
-    def within_days(self, days=DEFAULT_WITHIN_DAYS):
+    def within_days(self, days=None):
         """All users that created an item within the last `days` days."""
         return self.since(self.get_threshold_date(days))
 
@@ -45,6 +55,33 @@ class WithinDaysQuerySetMixin:
         return self.filter(**since_filter).distinct()
 
 
+def may_see_everything(user):
+    """Return True if `user` bypasses group privacy altogether (staff and superusers)."""
+    return user.is_staff or user.is_superuser
+
+
+def visibility_filter(user, prefix=''):
+    """
+    Build a Q object that matches items in groups `user` is allowed to read.
+
+    `prefix` is the lookup path from the filtered model to its Group, e.g.
+    `'discussion__group__'` for comments.  Public groups are always visible; private
+    ones only to their members and moderators.  Membership is checked with a single
+    subquery against the group table rather than by joining the (possibly huge)
+    membership tables into the outer query, so the result never needs `distinct()`.
+    """
+    from .models import Group
+
+    public = models.Q(**{prefix + 'is_private': False})
+    if user.pk is None:
+        return public
+
+    joined = Group.objects.filter(
+        models.Q(members_if_private=user) | models.Q(moderators=user)
+    ).values('pk')
+    return public | models.Q(**{prefix + 'pk__in': joined})
+
+
 class GroupQuerySet(WithinDaysQuerySetMixin, models.QuerySet):
     """A queryset for Groups allowing for smarter retrieval of related objects."""
     since_filter = 'discussions__comments__date_created__gte'
@@ -64,6 +101,12 @@ class GroupQuerySet(WithinDaysQuerySetMixin, models.QuerySet):
         User = get_user_model()
         return User.objects.filter(comments__in=self.comments()).distinct()
 
+    def visible_to(self, user):
+        """The groups `user` is allowed to read."""
+        if may_see_everything(user):
+            return self.all()
+        return self.filter(visibility_filter(user))
+
 
 class DiscussionQuerySet(WithinDaysQuerySetMixin, models.QuerySet):
     """A queryset for Discussions allowing for smarter retrieval of related objects."""
@@ -83,9 +126,124 @@ class DiscussionQuerySet(WithinDaysQuerySetMixin, models.QuerySet):
         User = get_user_model()
         return User.objects.filter(comments__discussion__in=self).distinct()
 
+    def visible_to(self, user):
+        """The discussions on groups `user` is allowed to read."""
+        if may_see_everything(user):
+            return self.all()
+        return self.filter(visibility_filter(user, prefix='group__'))
+
     def with_last_updated(self):
         return self.annotate(last_updated=models.Max('comments__date_created'))
 
+    def with_unread_count(self, user):
+        """
+        Annotate each discussion with how many comments `user` hasn't read yet.
+
+        That's every comment by someone else posted since the one recorded by the
+        user's `ReadMarker` for the discussion (or every comment, if they've never
+        opened it).  The count is a correlated subquery, so the whole list is still
+        one query, and it only reads the comments of the discussions being listed.
+        Anonymous users get no annotation.
+        """
+        if not user.is_authenticated():
+            return self.all()
+
+        from .models import BaseComment, ReadMarker
+        qn = connections[self.db].ops.quote_name
+        discussion_id = '{}.{}'.format(qn(self.model._meta.db_table), qn('id'))
+        sql = (
+            'SELECT COUNT(*) FROM {comments} WHERE {comments}.{discussion} = {outer} '
+            'AND {comments}.{user} != %s AND {comments}.{id} > COALESCE(('
+            'SELECT {markers}.{last_read} FROM {markers} '
+            'WHERE {markers}.{discussion} = {outer} AND {markers}.{user} = %s'
+            '), 0)'
+        ).format(
+            comments=qn(BaseComment._meta.db_table),
+            markers=qn(ReadMarker._meta.db_table),
+            discussion=qn('discussion_id'),
+            user=qn('user_id'),
+            id=qn('id'),
+            last_read=qn('last_read_comment_id'),
+            outer=discussion_id,
+        )
+        return self.extra(select={'unread_count': sql}, select_params=[user.pk, user.pk])
+
+    def with_thread_activity(self, user):
+        """
+        Annotate each discussion with what changes its thread page besides comments.
+
+        That's when its attachments were last processed (`last_processed`) and its
+        reaction counts last saved (`last_reacted`), how many reactions `user` has left
+        on it and when they last did (`own_reaction_count` and `last_own_reaction`),
+        and whether `user` is subscribed to it (`subscribed`, a count of 0 or 1).  Each
+        is a correlated subquery, so the whole lot is one query, and it can be combined
+        with aggregates over the comments.  Dates are left as the database returns
+        them, which on SQLite is a string.
+        """
+        from .models import AttachedFile, BaseComment, Discussion, Reaction, ReactionCount
+        qn = connections[self.db].ops.quote_name
+        names = {
+            'comments': qn(BaseComment._meta.db_table),
+            'attachments': qn(AttachedFile._meta.db_table),
+            'counts': qn(ReactionCount._meta.db_table),
+            'reactions': qn(Reaction._meta.db_table),
+            'subscriptions': qn(Discussion.subscribers.through._meta.db_table),
+            'outer': '{}.{}'.format(qn(self.model._meta.db_table), qn('id')),
+        }
+        names.update((name, qn(name)) for name in (
+            'id', 'discussion_id', 'comment_id', 'attached_to_id', 'user_id',
+            'date_processed', 'date_updated', 'date_created',
+        ))
+        attachments = (
+            'SELECT MAX({attachments}.{date_processed}) FROM {attachments} '
+            'INNER JOIN {comments} ON {attachments}.{attached_to_id} = {comments}.{id} '
+            'WHERE {comments}.{discussion_id} = {outer}'
+        )
+        counts = (
+            'SELECT MAX({counts}.{date_updated}) FROM {counts} '
+            'INNER JOIN {comments} ON {counts}.{comment_id} = {comments}.{id} '
+            'WHERE {comments}.{discussion_id} = {outer}'
+        )
+        reactions = (
+            'SELECT {aggregate} FROM {reactions} '
+            'INNER JOIN {comments} ON {reactions}.{comment_id} = {comments}.{id} '
+            'WHERE {comments}.{discussion_id} = {outer} AND {reactions}.{user_id} = %s'
+        )
+        subscribed = (
+            'SELECT COUNT(*) FROM {subscriptions} '
+            'WHERE {subscriptions}.{discussion_id} = {outer} '
+            'AND {subscriptions}.{user_id} = %s'
+        )
+        # Parameters are filled in the order of the `select` keys.
+        select = OrderedDict([
+            ('last_processed', attachments.format(**names)),
+            ('last_reacted', counts.format(**names)),
+            ('own_reaction_count', reactions.format(aggregate='COUNT(*)', **names)),
+            ('last_own_reaction', reactions.format(
+                aggregate='MAX({reactions}.{date_created})'.format(**names),
+                **names
+            )),
+            ('subscribed', subscribed.format(**names)),
+        ])
+        return self.extra(select=select, select_params=[user.pk] * 3)
+
+    def start(self, group, creator, name, comment):
+        """
+        Create a discussion in `group`, with `comment` as the text of its first post.
+
+        The creator is subscribed to the new discussion.
+        """
+        from .models import TextComment
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            discussion = self.create(group=group, creator=creator, name=name)
+            discussion.subscribers.add(creator)
+            TextComment.objects.create(
+                body=comment,
+                discussion=discussion,
+                user=creator,
+            )
+        return discussion
+
 
 class CommentManagerMixin(WithinDaysQuerySetMixin):
     """
@@ -111,17 +269,177 @@ class CommentManagerMixin(WithinDaysQuerySetMixin):
         User = get_user_model()
         return User.objects.filter(comments__in=self.all()).distinct()
 
+    def visible_to(self, user):
+        """The comments on groups `user` is allowed to read."""
+        if may_see_everything(user):
+            return self.all()
+        return self.filter(visibility_filter(user, prefix='discussion__group__'))
+
+    def subtree(self, comment, depth=None):
+        """
+        `comment` and its replies, their replies, and so on.
+
+        With `depth`, only replies up to that many levels below `comment` are included.
+        """
+        replies = models.Q(path__startswith=threads.get_reply_path(comment))
+        comments = self.filter(models.Q(pk=comment.pk) | replies)
+        if depth is not None:
+            comments = comments.filter(depth__lte=comment.depth + depth)
+        return comments
+
+    def with_reply_counts(self):
+        """Annotate each comment with its number of direct replies, as `reply_count`."""
+        return self.annotate(reply_count=models.Count('replies'))
+
+    def archivable(self, created_before=None, deleted_before=None):
+        """
+        The comments that may be moved into the archive.
+
+        That's any comment created before `created_before`, or soft-deleted before
+        `deleted_before` (either can be None to skip that condition).  Only plain and
+        text comments can be archived, and only if they have no attachments, earlier
+        versions, reactions or mentions, since `ArchivedComment` has nowhere to keep
+        them and deleting the comment would delete them too.  Comments with replies
+        stay as well: the replies' paths lead through them, and replies deeper than
+        `thread_page_depth` are only shown on the pages of the comments above them.
+        """
+        from django.contrib.contenttypes.models import ContentType
+        from .models import (
+            AttachedFile,
+            BaseComment,
+            CommentRevision,
+            Mention,
+            Reaction,
+            TextComment,
+        )
+
+        conditions = []
+        if created_before is not None:
+            conditions.append(models.Q(date_created__lt=created_before))
+        if deleted_before is not None:
+            conditions.append(models.Q(
+                state=BaseComment.STATE_DELETED,
+                date_deleted__lt=deleted_before,
+            ))
+        if not conditions:
+            return self.none()
+
+        archivable_types = ContentType.objects.get_for_models(
+            BaseComment,
+            TextComment,
+            for_concrete_models=False,
+        ).values()
+        archivable = self.filter(
+            functools.reduce(operator.or_, conditions),
+            polymorphic_ctype__in=archivable_types,
+        )
+        kept = [
+            AttachedFile.objects.filter(attached_to__isnull=False).values('attached_to'),
+            CommentRevision.objects.values('comment'),
+            Reaction.objects.values('comment'),
+            Mention.objects.values('comment'),
+            BaseComment.objects.filter(parent__isnull=False).values('parent'),
+        ]
+        for comment_ids in kept:
+            archivable = archivable.exclude(pk__in=comment_ids)
+        return archivable
+
+    def archive(self, batch_size=500):
+        """
+        Move these comments into the `ArchivedComment` table.
+
+        Comments are copied and then deleted in batches, each batch in its own
+        transaction, so a long archival run never holds many rows locked.  Everything
+        is read from and written to the primary database, so a lagging replica can't
+        hand it stale rows.  Returns the number of comments archived.
+        """
+        from .models import ArchivedComment, BaseComment
+
+        fields = ('id', 'discussion_id', 'user_id', 'date_created', 'state', 'body')
+        lookups = ('pk', 'discussion_id', 'user_id', 'date_created', 'state',
+                   'textcomment__body')
+        using = router.db_for_write(BaseComment)
+        rows = self.using(using).order_by('pk').values_list(*lookups)
+
+        count = 0
+        last_pk = 0
+        while True:
+            batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return count
+
+            last_pk = batch[-1][0]
+            archived = []
+            for values in batch:
+                data = dict(zip(fields, values))
+                data['body'] = data['body'] or ''
+                archived.append(ArchivedComment(**data))
+            with transaction.atomic(using=using):
+                ArchivedComment.objects.using(using).bulk_create(archived)
+                comments = BaseComment.objects.using(using)
+                comments.filter(pk__in=[c.pk for c in archived]).delete()
+            count += len(archived)
+
+    def set_state(self, state, batch_size=500):
+        """
+        Move these comments into `state` (one of `BaseComment.STATE_CHOICES`).
+
+        Comments are changed with one `UPDATE ... WHERE id IN (...)` on the base table
+        per `batch_size` comments, rather than a `save()` each, so bodies and other
+        subclass columns are never rewritten.  Only `state` is written, along with
+        `date_deleted` when deleting.  Comments that can't move into `state` (see
+        `BaseComment.TRANSITIONS`), including those already in it, are left alone.
+        Each batch's rows are locked and read again before they're updated, so that
+        `signals.comment_state_changed`, sent once for the lot, only lists comments
+        this call changed, not ones another moderator moved first.  Returns the number
+        of comments changed.
+        """
+        from .models import BaseComment
+        from .signals import comment_state_changed
+
+        from_states = BaseComment.TRANSITIONS[state]
+        using = router.db_for_write(BaseComment)
+        candidates = self.using(using).filter(state__in=from_states)
+        candidate_ids = list(candidates.values_list('pk', flat=True))
+        if not candidate_ids:
+            return 0
+
+        values = BaseComment.get_state_values(state)
+        comments = BaseComment._base_manager.using(using).filter(state__in=from_states)
+        changed = []
+        with transaction.atomic(using=using):
+            for start in range(0, len(candidate_ids), batch_size):
+                batch = comments.select_for_update().filter(
+                    pk__in=candidate_ids[start:start + batch_size],
+                ).values_list('pk', 'discussion_id')
+                batch = list(batch)
+                if batch:
+                    comments.filter(pk__in=[pk for pk, _ in batch]).update(**values)
+                    changed.extend(batch)
+
+        if changed:
+            comment_state_changed.send(
+                sender=BaseComment,
+                comment_ids=[pk for pk, _ in changed],
+                discussion_ids=sorted({discussion_id for _, discussion_id in changed}),
+                state=state,
+            )
+        return len(changed)
+
     def with_user_may_delete(self, user):
         """
         Return a list of comments annotated with 'user_may_delete' values.
 
         The value denotes if the passed-in user is allowed to delete this particular
-        comment. The method returns a list instead of a QuerySet to avoid removing the
-        added variable with further filters.
+        comment, and 'user_may_edit' if they're allowed to edit it.  The method returns
+        a list instead of a QuerySet to avoid removing the added variables with further
+        filters.  The relations each type of comment needs to render are loaded too
+        (see `groups.comment_types`).
         """
-        comments = list(self.all())
+        comments = comment_types.registry.load(list(self.all()))
         for comment in comments:
             comment.user_may_delete = comment.may_be_deleted(user)
+            comment.user_may_edit = comment.may_be_edited(user)
 
         return comments
 
@@ -130,7 +448,297 @@ class CommentQuerySet(PolymorphicQuerySet, CommentManagerMixin):
     """A queryset for BaseComments allowing for smarter retrieval of related objects."""
 
 
+def get_inheritance_chain(model):
+    """Return the concrete tables behind `model`, root model first."""
+    chain = [model._meta.concrete_model]
+    while chain[0]._meta.parents:
+        chain.insert(0, next(iter(chain[0]._meta.parents)))
+    return chain
+
+
 class CommentManager(PolymorphicManager, CommentManagerMixin):
     """PolymorphicManager for BaseComments with custom methods."""
     def get_queryset(self):
         return CommentQuerySet(self.model, using=self._db)
+
+    def bulk_create_comments(self, comments, attachments=(), batch_size=None):
+        """
+        Insert a large number of unsaved comments, of any BaseComment subclass, at once.
+
+        Intended for importing existing forums.  `Model.save()` is skipped, so each
+        table in a comment's multi-table inheritance chain gets one multi-row INSERT per
+        batch instead of one INSERT per comment, and the polymorphic content type is
+        looked up once per comment class.  On databases that can't return ids from a
+        bulk insert (SQLite, and everything on Django < 1.10) the root `BaseComment`
+        rows are inserted one at a time, but the subclass rows are still batched.
+
+        Replies to comments that are already saved get their `path` and `depth` as
+        they would from `save()`.  Replies to comments in the same import need their
+        parents saved first, in an earlier call.
+
+        `attachments` is an iterable of `(comment, attached_file)` pairs, where each
+        `attached_file` is an unsaved `AttachedFile` for one of the `comments`.  They are
+        attached and created with `bulk_create` once the comments have primary keys.
+
+        Notifications are sent by the views, not by the models, so nothing is emailed
+        to subscribers about imported comments.
+
+        Returns the comments, which now have their primary keys set.
+        """
+        from django.contrib.contenttypes.models import ContentType
+        from .models import AttachedFile
+
+        comments = list(comments)
+        using = router.db_for_write(self.model)
+        by_model = OrderedDict()
+        for comment in comments:
+            if comment.parent_id is not None and not comment.path:
+                comment.set_parent(comment.parent)
+            by_model.setdefault(type(comment), []).append(comment)
+
+        with transaction.atomic(using=using):
+            for model, instances in by_model.items():
+                ctype = ContentType.objects.db_manager(using).get_for_model(
+                    model,
+                    for_concrete_model=False,
+                )
+                for instance in instances:
+                    instance.polymorphic_ctype_id = ctype.pk
+                self._insert_chain(model, instances, batch_size, using)
+
+            files = []
+            for comment, attached_file in attachments:
+                attached_file.attached_to = comment
+                files.append(attached_file)
+            AttachedFile.objects.using(using).bulk_create(files, batch_size=batch_size)
+
+        return comments
+
+    def _insert_chain(self, model, instances, batch_size, using):
+        """Insert `instances` into each table of `model`'s inheritance chain in turn."""
+        connection = connections[using]
+        chain = get_inheritance_chain(model)
+        root_pk = chain[0]._meta.pk
+
+        root_fields = [f for f in chain[0]._meta.local_concrete_fields if f != root_pk]
+        for batch in self._batches(instances, root_fields, batch_size, connection):
+            pks = self._insert_returning_ids(chain[0], batch, root_fields, using)
+            for instance, pk in zip(batch, pks):
+                setattr(instance, root_pk.attname, pk)
+
+        for child in chain[1:]:
+            fields = child._meta.local_concrete_fields
+            for batch in self._batches(instances, fields, batch_size, connection):
+                for instance in batch:
+                    pk = getattr(instance, root_pk.attname)
+                    setattr(instance, child._meta.pk.attname, pk)
+                child._base_manager._insert(batch, fields=fields, using=using)
+
+        for instance in instances:
+            instance._state.adding = False
+            instance._state.db = using
+
+    @staticmethod
+    def _batches(instances, fields, batch_size, connection):
+        """Split `instances` into lists no bigger than the database allows per INSERT."""
+        size = max(connection.ops.bulk_batch_size(fields, instances), 1)
+        if batch_size:
+            size = min(size, batch_size)
+        for start in range(0, len(instances), size):
+            yield instances[start:start + size]
+
+    @staticmethod
+    def _insert_returning_ids(model, batch, fields, using):
+        """Insert rows for `model` and return their new primary keys, in order."""
+        manager = model._base_manager
+        features = connections[using].features
+        if len(batch) > 1 and getattr(features, 'can_return_ids_from_bulk_insert', False):
+            return manager._insert(batch, fields=fields, return_id=True, using=using)
+
+        return [
+            manager._insert([instance], fields=fields, return_id=True, using=using)
+            for instance in batch
+        ]
+
+
+class BatchedWriteQuerySet(models.QuerySet):
+    """
+    A queryset for rows saved in batches from a `groups.buffers.WriteBehindBuffer`.
+
+    Each row is identified by the two fields in `key_fields`, and holds a value in
+    `value_field`.  Subclasses define how a batch changes rows that already exist, with
+    `get_when()` and `get_update()`.
+    """
+    key_fields = ()
+    value_field = None
+
+    def get_when(self, pk, current, value):
+        """Return a `When` applying `value` to the row `pk`, or None to leave it."""
+        raise NotImplementedError
+
+    def get_update(self, whens):
+        """Return the expression that updates `value_field`, from the `whens`."""
+        raise NotImplementedError
+
+    def get_existing_keys(self, using, keys):
+        """Return those of `keys` whose related objects still exist."""
+        keys = set(keys)
+        for position, name in enumerate(self.key_fields):
+            field = self.model._meta.get_field(name)
+            if field.is_relation:
+                related = field.related_model._base_manager.using(using)
+                ids = related.filter(
+                    pk__in={key[position] for key in keys},
+                ).values_list('pk', flat=True)
+                ids = set(ids)
+                keys = {key for key in keys if key[position] in ids}
+        return keys
+
+    def record(self, values):
+        """
+        Save a batch of values at once.
+
+        `values` maps a pair of `key_fields` values to a value.  Existing rows are
+        changed by a single `UPDATE ... CASE` statement, so a batch is one query
+        however big it is, and the rest are created with one `bulk_create`.  Values
+        for rows whose related objects have been deleted since are dropped.
+        """
+        values = dict(values)
+        if not values:
+            return
+
+        using = router.db_for_write(self.model)
+        rows = self.using(using)
+        first, second = self.key_fields
+        now = timezone.now()
+        with transaction.atomic(using=using):
+            existing = rows.filter(**{
+                first + '__in': {key[0] for key in values},
+                second + '__in': {key[1] for key in values},
+            }).values_list('pk', first, second, self.value_field)
+
+            whens = {}
+            for pk, first_value, second_value, current in existing:
+                value = values.pop((first_value, second_value), None)
+                if value is not None:
+                    when = self.get_when(pk, current, value)
+                    if when is not None:
+                        whens[pk] = when
+            if whens:
+                rows.filter(pk__in=list(whens)).update(**{
+                    self.value_field: self.get_update(list(whens.values())),
+                    'date_updated': now,
+                })
+            if not values:
+                return
+
+            keys = self.get_existing_keys(using, values)
+            new_rows = [
+                self.model(**{
+                    first: key[0],
+                    second: key[1],
+                    self.value_field: value,
+                    'date_updated': now,
+                })
+                for key, value in values.items()
+                if key in keys
+            ]
+            try:
+                with transaction.atomic(using=using):
+                    rows.bulk_create(new_rows)
+            except IntegrityError:
+                # Another process created some of them since we looked, so go round
+                # again: they'll be updated this time.
+                self.record({key: values[key] for key in keys})
+
+
+class ReadMarkerQuerySet(BatchedWriteQuerySet):
+    """
+    A queryset for ReadMarkers, with the batched write `groups.read_markers` uses.
+
+    `record()` takes `{(user_id, discussion_id): comment_id}`, the latest comment each
+    user has read in each discussion, and moves markers forward, never back.
+    """
+    key_fields = ('user_id', 'discussion_id')
+    value_field = 'last_read_comment_id'
+
+    def get_when(self, pk, current, value):
+        if value > current:
+            return models.When(
+                pk=pk,
+                last_read_comment_id__lt=value,
+                then=models.Value(value),
+            )
+
+    def get_update(self, whens):
+        return models.Case(
+            *whens,
+            default=models.F('last_read_comment_id'),
+            output_field=models.PositiveIntegerField()
+        )
+
+
+class ReactionCountQuerySet(BatchedWriteQuerySet):
+    """
+    A queryset for ReactionCounts, with the batched write `groups.reactions` uses.
+
+    `record()` takes `{(comment_id, kind): n}`, the number to add to each count, which
+    may be negative.  Counts are set to `count + CASE ...`, so changes made by other
+    processes in the meantime aren't lost.
+    """
+    key_fields = ('comment_id', 'kind')
+    value_field = 'count'
+
+    def get_when(self, pk, current, value):
+        return models.When(pk=pk, then=models.Value(value))
+
+    def get_update(self, whens):
+        return models.F('count') + models.Case(
+            *whens,
+            default=models.Value(0),
+            output_field=models.IntegerField()
+        )
+
+    def record(self, values):
+        super(ReactionCountQuerySet, self).record({
+            key: n for key, n in values.items() if n
+        })
+
+
+class OutboxQuerySet(models.QuerySet):
+    """A queryset for OutboxMessages, with the methods used to hand them to workers."""
+    def pending(self, now=None):
+        """Return messages that haven't been sent and aren't claimed by a worker."""
+        if now is None:
+            now = timezone.now()
+        max_attempts = apps.get_app_config('groups').outbox_max_attempts
+        unlocked = models.Q(locked_until__isnull=True) | models.Q(locked_until__lt=now)
+        return self.filter(unlocked, date_sent__isnull=True, attempts__lt=max_attempts)
+
+    def claim(self, limit, lease_seconds=None):
+        """
+        Claim up to `limit` pending messages for the caller to send, oldest first.
+
+        Each claimed message is locked for `lease_seconds`, so other workers skip it
+        until then.  Rows are picked with `SELECT ... FOR UPDATE SKIP LOCKED` where the
+        database supports it, so workers don't queue up behind each other, and the
+        pick is only held for as long as it takes to write the lease.  If a worker
+        dies mid-send its messages become pending again once their lease runs out.
+        """
+        if lease_seconds is None:
+            lease_seconds = apps.get_app_config('groups').outbox_lease_seconds
+        using = router.db_for_write(self.model)
+        now = timezone.now()
+        features = connections[using].features
+        lock_kwargs = {}
+        if getattr(features, 'has_select_for_update_skip_locked', False):
+            lock_kwargs['skip_locked'] = True
+
+        with transaction.atomic(using=using):
+            pending = self.using(using).pending(now).order_by('pk')
+            pending = pending.select_for_update(**lock_kwargs)
+            pks = list(pending.values_list('pk', flat=True)[:limit])
+            self.model._base_manager.using(using).filter(pk__in=pks).update(
+                locked_until=now + datetime.timedelta(seconds=lease_seconds),
+            )
+        return list(self.model._base_manager.using(using).filter(pk__in=pks))
@@ -0,0 +1,61 @@
+"""
+Notify users `@mentioned` in a comment, whether or not they're subscribed to it.
+
+`@username` in a text comment's body mentions the user with that username.  When
+the comment's notification is sent (see `groups.outbox`), the mentioned usernames
+are looked up in a single query and a `Mention` is saved for each user found.
+`outbox.comment_recipients()` then includes those users along with the subscribers,
+so a subscriber who's also mentioned still gets one email.
+"""
+import re
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+
+from . import models
+
+
+# Not preceded by a word character or another `@`, so email addresses don't count,
+# and not ending in punctuation, so `@alice.` at the end of a sentence is `alice`.
+MENTION_RE = re.compile(r'(?<![\w@])@(\w(?:[\w.+-]*\w)?)', re.UNICODE)
+
+
+def parse(text):
+    """
+    Return the usernames mentioned in `text`, in order and without repeats.
+
+    Only the first `max_mentions_per_comment` are returned.
+    """
+    limit = apps.get_app_config('groups').max_mentions_per_comment
+    usernames = []
+    for match in MENTION_RE.finditer(text):
+        username = match.group(1)
+        if username not in usernames:
+            usernames.append(username)
+            if len(usernames) == limit:
+                break
+    return usernames
+
+
+def record(comment):
+    """
+    Save a `Mention` for each user mentioned in `comment`, other than its author.
+
+    Mentions that were already recorded are left alone, so this can run again when
+    a notification is retried.  Return the mentioned users.
+    """
+    usernames = parse(getattr(comment, 'body', ''))
+    if not usernames:
+        return []
+
+    User = get_user_model()
+    lookup = '{}__in'.format(User.USERNAME_FIELD)
+    users = list(
+        User._default_manager.filter(**{lookup: usernames}).exclude(pk=comment.user_id)
+    )
+    recorded = set(comment.mentions.values_list('user', flat=True))
+    models.Mention.objects.bulk_create(
+        models.Mention(comment=comment, user=user)
+        for user in users if user.pk not in recorded
+    )
+    return users
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 09:05
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import groups.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('groups', '0018_textcomment_managers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedComment',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('date_created', models.DateTimeField(db_index=True)),
+                ('state', models.CharField(choices=[('ok', 'OK'), ('deleted', 'Deleted')], default='ok', max_length=255)),
+                ('body', models.TextField(blank=True)),
+                ('date_archived', models.DateTimeField(default=django.utils.timezone.now)),
+                ('discussion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_comments', to='groups.Discussion')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_comments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('date_created',),
+            },
+            bases=(groups.models.CommentDisplayMixin, models.Model),
+        ),
+        migrations.AddField(
+            model_name='basecomment',
+            name='date_deleted',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
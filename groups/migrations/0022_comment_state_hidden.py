@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 09:29
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0021_readmarker'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedcomment',
+            name='state',
+            field=models.CharField(choices=[('ok', 'OK'), ('deleted', 'Deleted'), ('hidden', 'Hidden by a moderator')], default='ok', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='basecomment',
+            name='state',
+            field=models.CharField(choices=[('ok', 'OK'), ('deleted', 'Deleted'), ('hidden', 'Hidden by a moderator')], default='ok', max_length=255),
+        ),
+    ]
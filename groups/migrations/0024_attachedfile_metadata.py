@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 09:33
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0023_comment_state_pending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachedfile',
+            name='date_processed',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='attachedfile',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='attachedfile',
+            name='mime_type',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='attachedfile',
+            name='preview',
+            field=models.FileField(blank=True, upload_to='groups/derivatives'),
+        ),
+        migrations.AddField(
+            model_name='attachedfile',
+            name='size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='attachedfile',
+            name='thumbnail',
+            field=models.FileField(blank=True, upload_to='groups/derivatives'),
+        ),
+        migrations.AddField(
+            model_name='attachedfile',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,14 +1,15 @@
 import os
+import uuid
 
+from django.apps import apps
 from django.conf import settings
 from django.core import signing
 from django.core.urlresolvers import reverse
 from django.db import models
-from django.template import loader
 from django.utils import timezone
 from polymorphic.models import PolymorphicModel
 
-from . import managers
+from . import comment_types, managers, threads
 
 
 class Group(models.Model):
@@ -51,6 +52,27 @@ class Group(models.Model):
     def is_subscribed(self, user):
         return self.watchers.filter(id=user.pk).exists()
 
+    def may_moderate(self, user):
+        """Return true if the user may hide, delete and restore comments in this group."""
+        if user.is_superuser or user.is_staff:
+            return True
+        return self.moderators.filter(id=user.pk).exists()
+
+    def filter_readers(self, users):
+        """
+        Narrow a queryset of users down to those allowed to read this group.
+
+        Public groups can be read by everyone.  Private groups can only be read by their
+        members, their moderators and staff.
+        """
+        if not self.is_private:
+            return users
+
+        staff = models.Q(is_staff=True) | models.Q(is_superuser=True)
+        members = models.Q(pk__in=self.members_if_private.values('pk'))
+        moderators = models.Q(pk__in=self.moderators.values('pk'))
+        return users.filter(staff | members | moderators)
+
     def get_all_comments(self):
         return self.discussions.comments()
 
@@ -118,36 +140,127 @@ class Discussion(models.Model):
         return self.name
 
 
-class BaseComment(PolymorphicModel):
+class CommentDisplayMixin(object):
+    """
+    Behaviour shared by everything that is displayed as a comment in a thread.
+
+    Requires `discussion`, `state`, `STATE_DELETED`, `STATE_HIDDEN`, `STATE_PENDING`
+    and `template_name` members on the inheriting class.  `comment_select_related`
+    and `comment_prefetch_related` list the relations its template uses (see
+    `groups.comment_types`), and `accepts_replies` whether it can be replied to.
+    """
+    comment_select_related = ('user',)
+    comment_prefetch_related = ()
+    accepts_replies = False
+
+    def get_pagejump_anchor(self):
+        """Return a string suitable for use in a page jump to this comment."""
+        return 'c{}'.format(self.pk)
+
+    def get_pagejump(self):
+        """Return the URL suffix that'll jump to this comment's anchor point."""
+        return '#' + self.get_pagejump_anchor()
+
+    def get_absolute_url(self):
+        """Return a permalink that'll scroll to this comment on the page."""
+        url = reverse('discussion-thread', kwargs={'pk': self.discussion.pk})
+        return url + self.get_pagejump()
+
+    def get_context_data(self):
+        """Get the context data, used by `comment.render()`."""
+        return {'comment': self}
+
+    def render(self, request):
+        """
+        Render the comment in the template, used by `groups_tags.comment_render`.
+
+        Enables simple override of the comment template, also simplifying the
+        structure of `templates/groups/disucssion_thread_base.html`.  The template is
+        looked up through `comment_types.registry`, so it's only compiled once.
+        """
+        return comment_types.registry.get(type(self)).render(self, request)
+
+    def is_deleted(self):
+        return self.state == self.STATE_DELETED
+
+    def is_hidden(self):
+        return self.state == self.STATE_HIDDEN
+
+    def is_pending(self):
+        return self.state == self.STATE_PENDING
+
+
+class BaseComment(CommentDisplayMixin, PolymorphicModel):
     """A model for a comment in a discussion thread."""
     STATE_OK = 'ok'
     STATE_DELETED = 'deleted'
+    STATE_HIDDEN = 'hidden'
+    STATE_PENDING = 'pending'
     STATE_CHOICES = (
         (STATE_OK, 'OK'),
         (STATE_DELETED, 'Deleted'),
+        (STATE_HIDDEN, 'Hidden by a moderator'),
+        (STATE_PENDING, 'Awaiting moderation'),
     )
+    # {state: the states a comment may move into it from}
+    TRANSITIONS = {
+        STATE_OK: (STATE_HIDDEN, STATE_PENDING, STATE_DELETED),
+        STATE_DELETED: (STATE_OK, STATE_HIDDEN, STATE_PENDING),
+        STATE_HIDDEN: (STATE_OK, STATE_PENDING),
+        STATE_PENDING: (STATE_OK,),
+    }
 
     discussion = models.ForeignKey('groups.Discussion', related_name='comments')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='comments')
     date_created = models.DateTimeField(default=timezone.now)
     state = models.CharField(max_length=255, choices=STATE_CHOICES, default=STATE_OK)
+    date_deleted = models.DateTimeField(blank=True, null=True)
+    # Replies (see `groups.threads`).  Archiving a comment leaves its replies in
+    # place, with their paths unchanged.
+    parent = models.ForeignKey(
+        'self',
+        blank=True,
+        null=True,
+        related_name='replies',
+        on_delete=models.SET_NULL,
+    )
+    path = models.CharField(max_length=255, blank=True, db_index=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
 
     objects = managers.CommentManager()
 
+    accepts_replies = True
+
     class Meta:
         ordering = ('date_created',)
 
-    def get_pagejump_anchor(self):
-        """Return a string suitable for use in a page jump to this comment."""
-        return 'c{}'.format(self.pk)
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.parent_id is not None and not self.path:
+            self.set_parent(self.parent)
+        super(BaseComment, self).save(*args, **kwargs)
 
-    def get_pagejump(self):
-        """Return the URL suffix that'll jump to this comment's anchor point."""
-        return '#' + self.get_pagejump_anchor()
+    def set_parent(self, parent):
+        """
+        Make this unsaved comment a reply to `parent`.
+
+        Replies to comments at `max_reply_depth` become replies to their parent
+        instead, so that paths stay short.
+        """
+        if parent.depth >= apps.get_app_config('groups').max_reply_depth:
+            self.parent = parent.parent
+            self.path = parent.path
+            self.depth = parent.depth
+        else:
+            self.parent = parent
+            self.path = threads.get_reply_path(parent)
+            self.depth = parent.depth + 1
 
     def get_absolute_url(self):
-        """Return a permalink that'll scroll to this comment on the page."""
-        url = reverse('discussion-thread', kwargs={'pk': self.discussion.pk})
+        """Return a permalink to the page that shows this comment, scrolled to it."""
+        root_id = threads.get_page_root_id(self)
+        if root_id is None:
+            return super(BaseComment, self).get_absolute_url()
+        url = reverse('comment-replies', kwargs={'pk': root_id})
         return url + self.get_pagejump()
 
     def may_be_deleted(self, user):
@@ -158,24 +271,55 @@ class BaseComment(PolymorphicModel):
         if user.is_superuser or user.is_staff:
             return True
 
-        if user.pk == self.user.pk:
+        if user.pk == self.user_id:
             return True
 
         return False
 
-    def get_context_data(self):
-        """Get the context data, used by `comment.render()`."""
-        return {'comment': self}
+    def may_be_edited(self, user):
+        """Return true if the user is allowed to edit this comment's content."""
+        return False
 
-    def render(self, request):
+    @classmethod
+    def get_state_values(cls, state):
+        """Return the fields to update to move a comment into `state`."""
+        values = {'state': state}
+        if state == cls.STATE_DELETED:
+            values['date_deleted'] = timezone.now()
+        return values
+
+    def transition(self, state):
         """
-        Render the comment in the template, used by `groups_tags.comment_render`.
+        Move this comment from the state it was loaded in to `state`.
 
-        Enables simple override of the comment template, also simplifying the
-        structure of `templates/groups/disucssion_thread_base.html`.
+        This is a single `UPDATE` of the base comment table, which only matches if the
+        comment is still in the state it was loaded in, so if two moderators act on it
+        at once only the first succeeds.  Nothing else about the comment is saved.
+        Returns whether the comment was changed, and sends
+        `signals.comment_state_changed` if it was.
+
+        Raises ValueError if the comment can't move from its state to `state`.
         """
-        template = loader.get_template(self.template_name)
-        return template.render(self.get_context_data(), request=request)
+        from .signals import comment_state_changed
+
+        if self.state not in self.TRANSITIONS[state]:
+            message = 'A comment cannot move from {} to {}.'
+            raise ValueError(message.format(self.state, state))
+
+        values = self.get_state_values(state)
+        comments = BaseComment._base_manager.filter(pk=self.pk, state=self.state)
+        if not comments.update(**values):
+            return False
+
+        for field, value in values.items():
+            setattr(self, field, value)
+        comment_state_changed.send(
+            sender=BaseComment,
+            comment_ids=[self.pk],
+            discussion_ids=[self.discussion_id],
+            state=state,
+        )
+        return True
 
     def delete_state(self):
         """
@@ -184,11 +328,7 @@ class BaseComment(PolymorphicModel):
         Named so as not to conflict with the model's built-in delete() method, which
         removes it from the database.
         """
-        self.state = self.STATE_DELETED
-        self.save()
-
-    def is_deleted(self):
-        return self.state == self.STATE_DELETED
+        return self.transition(self.STATE_DELETED)
 
     def __str__(self):
         return '{} on Discussion #{}'.format(
@@ -198,13 +338,78 @@ class BaseComment(PolymorphicModel):
 
 
 class TextComment(BaseComment):
-    """A normal comment consisting only of some text."""
+    """
+    A normal comment consisting only of some text.
+
+    Its author can edit it (see `groups.revisions`).  `version` goes up by one with
+    each edit, so anything kept about the comment's text, such as its rendered HTML
+    or a search index entry, can be keyed on it.
+    """
     body = models.TextField()
+    version = models.PositiveIntegerField(default=1, editable=False)
+    date_edited = models.DateTimeField(blank=True, null=True, editable=False)
     template_name = 'groups/text_comment.html'
+    comment_prefetch_related = ('attachments',)
+
+    def may_be_edited(self, user):
+        """Return true if the user is allowed to edit this comment, false otherwise."""
+        return self.state == self.STATE_OK and user.pk == self.user_id
+
+    def is_edited(self):
+        return self.version > 1
+
+
+class ArchivedComment(CommentDisplayMixin, models.Model):
+    """
+    A comment that has been moved out of the live comment tables into the archive.
+
+    Archived comments keep their original primary key, so their permalinks and page
+    jump anchors don't change.  Only plain and text comments without attachments are
+    ever archived, so the body is all the content there is to keep.  See
+    `CommentManagerMixin.archive()`.
+    """
+    STATE_OK = BaseComment.STATE_OK
+    STATE_DELETED = BaseComment.STATE_DELETED
+    STATE_HIDDEN = BaseComment.STATE_HIDDEN
+    STATE_PENDING = BaseComment.STATE_PENDING
+    STATE_CHOICES = BaseComment.STATE_CHOICES
+
+    id = models.IntegerField(primary_key=True)
+    discussion = models.ForeignKey(
+        'groups.Discussion',
+        related_name='archived_comments',
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name='archived_comments',
+    )
+    date_created = models.DateTimeField(db_index=True)
+    state = models.CharField(max_length=255, choices=STATE_CHOICES, default=STATE_OK)
+    body = models.TextField(blank=True)
+    date_archived = models.DateTimeField(default=timezone.now)
+
+    template_name = 'groups/archived_comment.html'
+
+    class Meta:
+        ordering = ('date_created',)
+
+    def get_absolute_url(self):
+        """Return a permalink to this comment on the thread's archive page."""
+        url = reverse('discussion-thread', kwargs={'pk': self.discussion_id})
+        return url + '?archived=1' + self.get_pagejump()
+
+    def __str__(self):
+        return 'Archived comment on Discussion #{}'.format(self.discussion_id)
 
 
 class AttachedFile(models.Model):
-    """A file upload that can be attached to a comment."""
+    """
+    A file upload that can be attached to a comment.
+
+    The file's size, MIME type and (for images) dimensions, thumbnail and preview
+    are filled in later by `groups.attachments`, and `date_processed` is set once
+    they have been, so that displaying an attachment never has to read the file.
+    """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='attachments')
     date_created = models.DateTimeField(default=timezone.now)
     file = models.FileField(upload_to='groups/attachments')
@@ -214,7 +419,183 @@ class AttachedFile(models.Model):
         null=True,
         related_name='attachments'
     )
+    size = models.PositiveIntegerField(null=True, blank=True)
+    mime_type = models.CharField(max_length=255, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    thumbnail = models.FileField(upload_to='groups/derivatives', blank=True)
+    preview = models.FileField(upload_to='groups/derivatives', blank=True)
+    date_processed = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def is_image(self):
+        return self.mime_type.startswith('image/')
 
     def short_filename(self):
         """Display only the name of the file, sans its path within client_media."""
         return os.path.basename(self.file.name)
+
+
+class UploadSession(models.Model):
+    """
+    A file being uploaded in chunks, which becomes an `AttachedFile` once it's complete.
+
+    `offset` counts the bytes received so far, which are kept on local disk until
+    the upload is finished.  See `groups.uploads`.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    date_created = models.DateTimeField(default=timezone.now, db_index=True)
+    attachment = models.OneToOneField(
+        'groups.AttachedFile',
+        blank=True,
+        null=True,
+        related_name='upload_session',
+    )
+
+    def __str__(self):
+        return 'Upload of {}'.format(self.filename)
+
+    def is_complete(self):
+        return self.attachment_id is not None
+
+
+class ReadMarker(models.Model):
+    """
+    How far a user has read a discussion: the pk of the latest comment they've seen.
+
+    Markers are written in batches, through `groups.read_markers`, rather than on
+    every page view.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='read_markers')
+    discussion = models.ForeignKey('groups.Discussion', related_name='read_markers')
+    last_read_comment_id = models.PositiveIntegerField(default=0)
+    date_updated = models.DateTimeField(default=timezone.now)
+
+    objects = managers.ReadMarkerQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('user', 'discussion')
+
+    def __str__(self):
+        return 'Read marker for {} on Discussion #{}'.format(
+            self.user,
+            self.discussion_id,
+        )
+
+
+class Reaction(models.Model):
+    """
+    A user's reaction to a comment, one of `GroupsConfig.reaction_kinds`.
+
+    Each user can give each kind of reaction once per comment.  The number of each
+    kind a comment has is kept in `ReactionCount`, so it's never counted from these.
+    """
+    comment = models.ForeignKey('groups.BaseComment', related_name='reactions')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='reactions')
+    kind = models.CharField(max_length=32)
+    date_created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('comment', 'user', 'kind')
+
+    def __str__(self):
+        return '{} from {} on Comment #{}'.format(self.kind, self.user, self.comment_id)
+
+
+class ReactionCount(models.Model):
+    """
+    How many reactions of one kind a comment has.
+
+    Counts are changed in batches, through `groups.reactions`, rather than on every
+    reaction, so they can lag behind the `Reaction` rows for a few seconds.
+    """
+    comment = models.ForeignKey('groups.BaseComment', related_name='reaction_counts')
+    kind = models.CharField(max_length=32)
+    count = models.IntegerField(default=0)
+    date_updated = models.DateTimeField(default=timezone.now)
+
+    objects = managers.ReactionCountQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('comment', 'kind')
+
+    def __str__(self):
+        return '{} {} on Comment #{}'.format(self.count, self.kind, self.comment_id)
+
+
+class Mention(models.Model):
+    """
+    A user `@mentioned` in a comment.
+
+    Recorded by `groups.mentions` when the comment's notification is sent, so that a
+    user's mentions can be listed.
+    """
+    comment = models.ForeignKey('groups.BaseComment', related_name='mentions')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='mentions')
+
+    class Meta:
+        unique_together = ('comment', 'user')
+
+    def __str__(self):
+        return 'Mention of {} in Comment #{}'.format(self.user, self.comment_id)
+
+
+class CommentRevision(models.Model):
+    """
+    One version of a `TextComment`'s body.
+
+    Most revisions hold a compressed diff from the version before, and every
+    `revision_snapshot_interval`th holds the whole body, so any version can be rebuilt
+    from a few rows.  See `groups.revisions`.
+    """
+    comment = models.ForeignKey('groups.TextComment', related_name='revisions')
+    number = models.PositiveIntegerField()
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='comment_revisions')
+    date_created = models.DateTimeField(default=timezone.now)
+    is_snapshot = models.BooleanField(default=False)
+    data = models.BinaryField()
+
+    class Meta:
+        ordering = ('number',)
+        unique_together = ('comment', 'number')
+
+    def __str__(self):
+        return 'Revision {} of Comment #{}'.format(self.number, self.comment_id)
+
+
+class OutboxMessage(models.Model):
+    """
+    A notification waiting to be emailed to the subscribers of a comment or discussion.
+
+    Messages are written in the same transaction as the thing they announce, and sent
+    after it commits, either straight away or by the `send_notifications` command.  The
+    domain and protocol of the request that created the message are kept so that links
+    in the emails can be built without it.  See `groups.outbox`.
+    """
+    KIND_COMMENT = 'comment'
+    KIND_DISCUSSION = 'discussion'
+    KIND_CHOICES = (
+        (KIND_COMMENT, 'New comment'),
+        (KIND_DISCUSSION, 'New discussion'),
+    )
+
+    kind = models.CharField(max_length=255, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    domain = models.CharField(max_length=255)
+    protocol = models.CharField(max_length=5, default='http')
+    date_created = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    date_sent = models.DateTimeField(null=True, blank=True, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    objects = managers.OutboxQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('date_created',)
+
+    def __str__(self):
+        return '{} #{}'.format(self.get_kind_display(), self.object_id)
@@ -0,0 +1,295 @@
+"""
+A transactional outbox for notification emails.
+
+Views call `enqueue()` inside the transaction that creates a comment or discussion.
+That only writes one `OutboxMessage` row, so the transaction (and any row locks it
+holds) stays short.  Working out who to notify and sending them email happens after
+the transaction commits: straight away in the same process if
+`deliver_notifications_on_commit` is set, and otherwise (or if that fails) when the
+`send_notifications` command next runs.
+"""
+import functools
+import logging
+import operator
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.contrib.sites.shortcuts import get_current_site
+from django.core import mail
+from django.db import router, transaction
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import six, timezone
+
+from . import mentions, models, routers
+
+
+logger = logging.getLogger(__name__)
+
+
+def on_commit(func, using=None):
+    """Run `func` once the current transaction commits (at once on Django < 1.9)."""
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(func, using=using)
+    else:
+        func()
+
+
+def get_config():
+    return apps.get_app_config('groups')
+
+
+class EmailSite(object):
+    """The parts of a `Site` the notification emails use, rebuilt from a domain."""
+    def __init__(self, domain):
+        self.domain = self.name = domain
+
+    def __str__(self):
+        return self.domain
+
+
+def get_reply_address(discussion, user, site):
+    """
+    Wrap a discussion reply UUID in an email address suitable for use as a reply-to.
+
+    reply-{uuid}@{domain}
+
+    The UUID contains colons, which aren't allowed in email addresses, so swap those
+    out for dollar signs ($) as a placeholder using a string `replace`.  The rest of
+    the UUID is base64-encoded, so there will be neither colons nor dollar signs in it
+    (it's only alphanumerics, hyphens, and underscores).
+    """
+    uuid = discussion.generate_reply_uuid(user).replace(':', '$')
+    return 'reply-{}@{}'.format(uuid, site)
+
+
+def mentioned_users(comment_id):
+    """Return the users whose mentions in the comment `comment_id` are recorded."""
+    mentioned = models.Mention.objects.filter(comment=comment_id).values('user')
+    return get_user_model()._default_manager.filter(pk__in=mentioned)
+
+
+def any_of(*querysets):
+    """
+    Return the users in any of `querysets`, each of them once.
+
+    Each queryset becomes an id subquery.  ORing the querysets themselves would join
+    all their tables into one query, and a user who matched through a many-to-many
+    table (such as a watcher of several groups) would come back once per row.
+    """
+    ids = [Q(pk__in=users.values('pk')) for users in querysets]
+    return get_user_model()._default_manager.filter(functools.reduce(operator.or_, ids))
+
+
+def comment_recipients(comment):
+    """
+    Return subscribers to the comment's discussion or its parent group, and users
+    mentioned in the comment.
+
+    Exclude subscribers who've explicitly ignored this discussion, anyone who can no
+    longer read a private group, and the person who posted the comment.
+    """
+    discussion = comment.discussion
+    group = discussion.group
+    discussion_subscribers = discussion.subscribers.all()
+    group_subscribers = group.watchers.exclude(ignored_discussions=discussion)
+
+    all_recipients = any_of(
+        discussion_subscribers,
+        group_subscribers,
+        mentioned_users(comment.pk),
+    )
+    return group.filter_readers(all_recipients).exclude(pk=comment.user_id)
+
+
+def discussion_recipients(discussion, first_comment=None):
+    """
+    Return readers subscribed to the discussion's group, or mentioned in its
+    `first_comment`, except its creator.
+    """
+    group = discussion.group
+    recipients = [group.watchers.all()]
+    if first_comment is not None:
+        recipients.append(mentioned_users(first_comment.pk))
+    recipients = any_of(*recipients)
+    return group.filter_readers(recipients).exclude(pk=discussion.creator_id)
+
+
+def build_email(template_name, to, subject, reply_to, context):
+    """Render a notification email, as `incuna_mail.send` would, without sending it."""
+    return mail.EmailMessage(
+        subject=six.text_type(subject),
+        body=render_to_string(template_name, context),
+        to=[to],
+        reply_to=[reply_to],
+    )
+
+
+def send_batch(emails):
+    """Send `emails` over a single connection to the mail server."""
+    return mail.get_connection().send_messages(emails) or 0
+
+
+def send_emails(emails, concurrency=None):
+    """
+    Send rendered `emails`, sharing connections to the mail server between them.
+
+    Up to `concurrency` connections (`notification_concurrency` by default) are used
+    at once, each from its own thread.  Only the sending happens in those threads; the
+    emails are rendered, and the database queried, beforehand in the calling thread.
+    Return the number of emails sent.
+    """
+    if concurrency is None:
+        concurrency = get_config().notification_concurrency
+    emails = list(emails)
+    workers = max(1, min(concurrency, len(emails)))
+    if workers == 1:
+        return send_batch(emails) if emails else 0
+
+    # Imported here, as multiprocessing is slow to import and most sends use one thread.
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(workers)
+    try:
+        return sum(pool.map(send_batch, [emails[i::workers] for i in range(workers)]))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def send_comment_emails(comment, site, protocol):
+    """
+    Notify all subscribers to the discussion or its group, and everyone mentioned in
+    the comment, except the poster.
+    """
+    mentions.record(comment)
+    subject = get_config().new_comment_subject.format(discussion=comment.discussion.name)
+    send_emails(
+        build_email(
+            to=user.email,
+            subject=subject,
+            template_name='groups/emails/new_comment.txt',
+            reply_to=get_reply_address(comment.discussion, user, site),
+            context={
+                'comment': comment,
+                'user': user,
+                'site': site,
+                'protocol': protocol,
+            },
+        )
+        for user in comment_recipients(comment)
+    )
+
+
+def send_discussion_emails(discussion, site, protocol):
+    """
+    Notify all subscribers to the discussion's parent group, and everyone mentioned
+    in its first comment, except its creator.
+    """
+    first_comment = discussion.comments.order_by('pk').first()
+    if first_comment is not None:
+        mentions.record(first_comment)
+    subject = get_config().new_discussion_subject.format(group=discussion.group.name)
+    send_emails(
+        build_email(
+            to=user.email,
+            subject=subject,
+            template_name='groups/emails/new_discussion.txt',
+            reply_to=get_reply_address(discussion, user, site),
+            context={
+                'discussion': discussion,
+                'user': user,
+                'site': site,
+                'protocol': protocol,
+            },
+        )
+        for user in discussion_recipients(discussion, first_comment)
+    )
+
+
+SENDERS = {
+    models.OutboxMessage.KIND_COMMENT: (models.BaseComment, send_comment_emails),
+    models.OutboxMessage.KIND_DISCUSSION: (models.Discussion, send_discussion_emails),
+}
+
+
+def enqueue(kind, instance, request):
+    """
+    Record that subscribers need to hear about `instance`, a new comment or discussion.
+
+    Call this in the same transaction that saved `instance`.  The message is sent
+    after that transaction commits.
+    """
+    message = models.OutboxMessage.objects.create(
+        kind=kind,
+        object_id=instance.pk,
+        domain=get_current_site(request).domain,
+        protocol='https' if request.is_secure() else 'http',
+    )
+    if get_config().deliver_notifications_on_commit:
+        claimed = models.OutboxMessage.objects.filter(pk=message.pk)
+        on_commit(
+            lambda: deliver(claimed.claim(1)),
+            using=message._state.db,
+        )
+    return message
+
+
+def send_message(message):
+    """Email everyone who should hear about `message`'s comment or discussion."""
+    model, sender = SENDERS[message.kind]
+    instances = model.objects.using(router.db_for_write(model))
+    try:
+        instance = instances.get(pk=message.object_id)
+    except model.DoesNotExist:
+        # The primary database doesn't have it, so it's been deleted (or archived)
+        # since, rather than not reached a replica yet; there's nothing to announce.
+        return
+    sender(instance, EmailSite(message.domain), message.protocol)
+
+
+def deliver(messages):
+    """
+    Send claimed `messages`, recording each one as sent or failed.
+
+    Failures are logged rather than raised.  A failed message is retried by a later
+    `send_notifications` run once its lease runs out, until it has been tried
+    `outbox_max_attempts` times.  Return the number of messages that were sent.
+
+    Everything is read from the primary database, as messages are often delivered
+    moments after their comment is saved, before a read replica could have it.
+    """
+    with routers.reading_from_primary():
+        return deliver_messages(messages)
+
+
+def deliver_messages(messages):
+    queryset = models.OutboxMessage._base_manager
+    sent = 0
+    for message in messages:
+        try:
+            send_message(message)
+        except Exception as e:
+            logger.exception('Could not send %s.', message)
+            queryset.filter(pk=message.pk).update(
+                attempts=message.attempts + 1,
+                last_error=repr(e),
+            )
+        else:
+            queryset.filter(pk=message.pk).update(
+                attempts=message.attempts + 1,
+                date_sent=timezone.now(),
+                locked_until=None,
+            )
+            sent += 1
+    return sent
+
+
+def deliver_pending(batch_size=100, lease_seconds=None):
+    """Claim and send pending messages in batches until there are none left."""
+    sent = 0
+    while True:
+        messages = models.OutboxMessage.objects.claim(batch_size, lease_seconds)
+        if not messages:
+            return sent
+        sent += deliver(messages)
@@ -0,0 +1,112 @@
+"""
+Limit how fast comments can be posted, before they're saved and notified about.
+
+Every posted comment takes a token from a bucket per user and per discussion, and
+comments posted by email take one from a bucket per reply address too.  Each bucket
+holds up to `capacity` tokens and refills at `capacity` tokens every `seconds`, as
+configured for its scope in `GroupsConfig.comment_rate_limits`.  A comment that
+finds any of its buckets empty is rejected, without taking from the others.
+
+Buckets live in the `rate_limit_cache` cache, so every process shares them as long
+as that cache is shared.  They're read and written without a lock, so a few
+simultaneous requests can get past a nearly empty bucket.  The limits are there to
+stop runaway clients and mail loops, not to enforce exact quotas.
+
+Each rejection sends `signals.comment_rate_limited`, for recording in metrics.
+"""
+import hashlib
+import logging
+import math
+import time
+
+from django.apps import apps
+from django.core.cache import caches
+
+from . import models, signals
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    """A comment that would exceed the rate limit of `scope`."""
+    def __init__(self, scope, retry_after):
+        message = 'Too many comments.  Try again in {} seconds.'.format(retry_after)
+        super(RateLimited, self).__init__(message)
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class TokenBucket(object):
+    """A bucket of `capacity` tokens, refilled at `capacity` every `seconds`."""
+    def __init__(self, cache, key, capacity, seconds):
+        self.cache = cache
+        self.key = key
+        self.capacity = capacity
+        self.seconds = seconds
+
+    def get_tokens(self, now):
+        """Return the number of tokens in the bucket at `now`."""
+        tokens, updated = self.cache.get(self.key, (self.capacity, now))
+        refilled = (now - updated) * self.capacity / float(self.seconds)
+        return min(self.capacity, tokens + refilled)
+
+    def set_tokens(self, tokens, now):
+        # An untouched bucket is full again after `seconds`, so it can expire then.
+        self.cache.set(self.key, (tokens, now), timeout=self.seconds)
+
+    def get_wait(self, tokens):
+        """Return how many seconds it will take the bucket to refill to one token."""
+        return int(math.ceil((1 - tokens) * self.seconds / float(self.capacity)))
+
+
+def get_buckets(scopes):
+    """
+    Return a (scope, bucket) pair for each limited scope in `scopes`.
+
+    `scopes` is a list of (scope, identifier) pairs.
+    """
+    config = apps.get_app_config('groups')
+    cache = caches[config.rate_limit_cache]
+    buckets = []
+    for scope, identifier in scopes:
+        limit = config.comment_rate_limits.get(scope)
+        if limit:
+            key = 'groups:rate-limit:{}:{}'.format(scope, identifier)
+            buckets.append((scope, TokenBucket(cache, key, *limit)))
+    return buckets
+
+
+def check_comment(user, discussion, reply_token=None):
+    """
+    Take a token for a comment by `user` on `discussion`, or raise `RateLimited`.
+
+    `reply_token` is the reply address's token, for comments posted by email.
+    """
+    scopes = [('user', user.pk), ('discussion', discussion.pk)]
+    if reply_token is not None:
+        digest = hashlib.md5(reply_token.encode('utf-8')).hexdigest()
+        scopes.append(('reply_token', digest))
+
+    now = time.time()
+    buckets = [
+        (scope, bucket, bucket.get_tokens(now))
+        for scope, bucket in get_buckets(scopes)
+    ]
+    for scope, bucket, tokens in buckets:
+        if tokens < 1:
+            retry_after = bucket.get_wait(tokens)
+            logger.warning(
+                'Rejected a comment by user %s on discussion %s: the %s limit.',
+                user.pk, discussion.pk, scope,
+            )
+            signals.comment_rate_limited.send(
+                sender=models.BaseComment,
+                scope=scope,
+                user=user,
+                discussion=discussion,
+                retry_after=retry_after,
+            )
+            raise RateLimited(scope, retry_after)
+    for scope, bucket, tokens in buckets:
+        bucket.set_tokens(tokens - 1, now)
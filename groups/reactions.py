@@ -0,0 +1,144 @@
+"""
+Let people react to comments, and count the reactions without counting rows.
+
+Each reaction is a `Reaction` row, so that nobody can give the same one twice, but
+the number of each kind on a comment lives in `ReactionCount`.  Reacting doesn't
+write to the counts straight away: `react()` and `unreact()` only add to a tally in
+a process-local buffer (see `groups.buffers`).  The buffer is written out with
+`ReactionCount.objects.record()`, as `count = count + n` for each comment and kind
+at once, once it holds `reaction_max_pending` tallies or is
+`reaction_flush_seconds` old.  A popular comment being liked a hundred times in
+between costs one `UPDATE`.  A batch is saved in one transaction, so if saving it
+fails none of it is, and its tallies go back into the buffer for the next try.
+
+`load_counts()` reads the counts of a page's comments in one query, and adds what's
+still waiting in this process's buffer, so people see their own reactions at once.
+Other processes' reactions show up once they're flushed.  Tallies still in a
+buffer are lost if its process stops before flushing, so counts can drift from
+the `Reaction` rows; `recount()` puts them right.
+"""
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import buffers, models
+
+
+class ReactionBuffer(buffers.WriteBehindBuffer):
+    """Collect changes to reaction counts, keyed by (comment_id, kind), in memory."""
+    flush_seconds_setting = 'reaction_flush_seconds'
+    max_pending_setting = 'reaction_max_pending'
+
+    def combine(self, waiting, value):
+        return waiting + value
+
+    def save(self, pending):
+        models.ReactionCount.objects.record(pending)
+
+    def get_pending(self, comment_ids):
+        """Return {(comment_id, kind): n} for the unsaved changes to `comment_ids`."""
+        with self.lock:
+            return {
+                key: n for key, n in self.pending.items()
+                if key[0] in comment_ids
+            }
+
+
+buffer = ReactionBuffer()
+
+
+def get_kinds():
+    return apps.get_app_config('groups').reaction_kinds
+
+
+def react(user, comment, kind):
+    """Add `user`'s reaction of `kind` to `comment`.  Return False if it was already."""
+    if kind not in get_kinds():
+        raise ValueError('Unknown reaction: {}'.format(kind))
+    try:
+        with transaction.atomic():
+            models.Reaction.objects.create(comment=comment, user=user, kind=kind)
+    except IntegrityError:
+        return False
+    buffer.add((comment.pk, kind), 1)
+    return True
+
+
+def unreact(user, comment, kind):
+    """Take back `user`'s reaction of `kind` to `comment`.  Return False if it wasn't."""
+    with transaction.atomic():
+        reactions = models.Reaction.objects.select_for_update().filter(
+            comment=comment,
+            user=user,
+            kind=kind,
+        )
+        reaction = reactions.first()
+        if reaction is None:
+            return False
+        reaction.delete()
+    buffer.add((comment.pk, kind), -1)
+    return True
+
+
+def get_counts(comment_ids):
+    """Return {comment_id: {kind: count}} for `comment_ids`, in one query."""
+    comment_ids = set(comment_ids)
+    counts = defaultdict(dict)
+    rows = models.ReactionCount.objects.filter(comment_id__in=comment_ids)
+    for comment_id, kind, count in rows.values_list('comment_id', 'kind', 'count'):
+        counts[comment_id][kind] = count
+    for (comment_id, kind), n in buffer.get_pending(comment_ids).items():
+        counts[comment_id][kind] = counts[comment_id].get(kind, 0) + n
+    return counts
+
+
+def load_counts(comments):
+    """
+    Give each of `comments` its `reaction_totals`, a list of (kind, count) pairs.
+
+    Every kind in `reaction_kinds` is listed, in that order.  Comments that can't be
+    reacted to, such as archived ones, are left alone.
+    """
+    comments = [c for c in comments if isinstance(c, models.BaseComment)]
+    counts = get_counts(comment.pk for comment in comments)
+    kinds = get_kinds()
+    for comment in comments:
+        comment_counts = counts.get(comment.pk, {})
+        comment.reaction_totals = [
+            (kind, max(0, comment_counts.get(kind, 0))) for kind in kinds
+        ]
+
+
+def recount(comment_ids=None):
+    """
+    Set reaction counts from the `Reaction` rows, for `comment_ids` or every comment.
+
+    This reads every reaction to those comments, so it's for repairs, not for pages.
+    Changes still waiting in a process's buffer are added on top when it flushes.
+    """
+    reactions = models.Reaction.objects.all()
+    counts = models.ReactionCount.objects.all()
+    if comment_ids is not None:
+        reactions = reactions.filter(comment_id__in=comment_ids)
+        counts = counts.filter(comment_id__in=comment_ids)
+    totals = reactions.values_list('comment_id', 'kind').annotate(total=Count('pk'))
+    now = timezone.now()
+    with transaction.atomic():
+        counts.delete()
+        models.ReactionCount.objects.bulk_create([
+            models.ReactionCount(
+                comment_id=comment_id,
+                kind=kind,
+                count=total,
+                date_updated=now,
+            )
+            for comment_id, kind, total in totals
+        ])
+
+
+def flush():
+    """Save any reaction counts still waiting in this process's buffer."""
+    buffer.flush()
@@ -0,0 +1,71 @@
+"""
+Remember how far people have read each discussion, without a write per page view.
+
+`mark_read()` only notes the latest comment a user has seen in a process-local
+buffer (see `groups.buffers`).  The buffer is written out with
+`ReadMarker.objects.record()`, a handful of queries whatever its size, once it holds
+`read_marker_max_pending` markers or is `read_marker_flush_seconds` old.  Reading
+the same discussion repeatedly in between costs nothing more.
+
+Markers still in the buffer are lost if the process stops before it flushes, so a
+discussion may show a few comments as unread again; nothing worse happens.
+"""
+from django.db.models import Min
+
+from . import buffers, models
+
+
+class ReadMarkerBuffer(buffers.WriteBehindBuffer):
+    """Collect read markers, keyed by (user_id, discussion_id), in memory."""
+    flush_seconds_setting = 'read_marker_flush_seconds'
+    max_pending_setting = 'read_marker_max_pending'
+
+    def combine(self, waiting, value):
+        return max(waiting, value)
+
+    def save(self, pending):
+        models.ReadMarker.objects.record(pending)
+
+
+buffer = ReadMarkerBuffer()
+
+
+def mark_read(user, discussion, comment_id):
+    """Record that `user` has read `discussion` up to the comment `comment_id`."""
+    if user.is_authenticated() and comment_id:
+        buffer.add((user.pk, discussion.pk), comment_id)
+
+
+def get_last_read(user, discussion):
+    """Return the latest comment `user` is known to have read in `discussion`, or 0."""
+    with buffer.lock:
+        waiting = buffer.pending.get((user.pk, discussion.pk), 0)
+    markers = models.ReadMarker.objects.filter(user=user, discussion=discussion)
+    saved = markers.values_list('last_read_comment_id', flat=True).first()
+    return max(waiting, saved or 0)
+
+
+def mark_page_read(user, discussion, shown_ids, not_shown):
+    """
+    Record that `user` has read a page showing the comments `shown_ids`.
+
+    `not_shown` is a queryset of `discussion`'s comments that weren't on the page,
+    such as replies too deep for it.  The marker moves up to the newest comment shown,
+    but stops short of any unread comment by someone else in `not_shown` that's older,
+    so that it still counts as unread until a page shows it.
+    """
+    last_shown = max(shown_ids or [0])
+    if not user.is_authenticated() or not last_shown:
+        return
+    not_shown = not_shown.filter(pk__lt=last_shown).exclude(user=user)
+    if not_shown.exists():
+        unread = not_shown.filter(pk__gt=get_last_read(user, discussion))
+        first_unread = unread.aggregate(first=Min('pk'))['first']
+        if first_unread is not None:
+            last_shown = first_unread - 1
+    mark_read(user, discussion, last_shown)
+
+
+def flush():
+    """Save any read markers still waiting in this process's buffer."""
+    buffer.flush()
@@ -0,0 +1,153 @@
+"""
+Edit text comments, keeping every earlier version of their bodies.
+
+Each version of an edited comment is a `CommentRevision`, numbered from 1 (the body
+as it was posted) up to the comment's `version`.  A revision usually holds only the
+difference from the version before: the runs of words kept from it, and the text
+put in between them, compressed with zlib.  Every `revision_snapshot_interval`th
+revision holds the whole body instead, so rebuilding any version means reading the
+snapshot at or before it and at most `revision_snapshot_interval - 1` diffs after
+it.  Comments that have never been edited have no revisions.
+
+Each edit bumps the comment's `version` and sends `signals.comment_edited`, so
+caches of its text can be keyed on the version and dropped when it changes.
+"""
+import difflib
+import json
+import re
+import zlib
+
+from django.apps import apps
+from django.db import transaction
+from django.utils import timezone
+
+from . import models, signals
+
+
+TOKEN_RE = re.compile(r'\s+|\S+')
+
+
+def get_config():
+    return apps.get_app_config('groups')
+
+
+def encode(data):
+    return zlib.compress(json.dumps(data).encode('utf-8'))
+
+
+def decode(data):
+    return json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+
+
+def make_diff(old, new):
+    """
+    Return the changes from `old` to `new`.
+
+    A diff is a list of `[start, end]` slices of `old`'s words, to be kept, and
+    strings, to be put in.
+    """
+    old_tokens = TOKEN_RE.findall(old)
+    new_tokens = TOKEN_RE.findall(new)
+    matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    diff = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            diff.append([i1, i2])
+        elif j1 < j2:
+            diff.append(''.join(new_tokens[j1:j2]))
+    return diff
+
+
+def apply_diff(old, diff):
+    """Return the text `diff` turns `old` into."""
+    old_tokens = TOKEN_RE.findall(old)
+    parts = []
+    for item in diff:
+        if isinstance(item, list):
+            parts.extend(old_tokens[item[0]:item[1]])
+        else:
+            parts.append(item)
+    return ''.join(parts)
+
+
+def build_revision(comment, number, body, previous_body, user_id, date_created):
+    """Return an unsaved revision `number` of `comment`, whose body is `body`."""
+    is_snapshot = (number - 1) % get_config().revision_snapshot_interval == 0
+    data = body if is_snapshot else make_diff(previous_body, body)
+    return models.CommentRevision(
+        comment=comment,
+        number=number,
+        user_id=user_id,
+        date_created=date_created,
+        is_snapshot=is_snapshot,
+        data=encode(data),
+    )
+
+
+def edit(comment, body, user):
+    """
+    Replace the body of the `TextComment` `comment` with `body`, as edited by `user`.
+
+    The comment is locked while it's changed, so simultaneous edits are numbered one
+    after the other.  Return whether the body changed.
+    """
+    with transaction.atomic():
+        current = models.TextComment.objects.select_for_update().get(pk=comment.pk)
+        if body == current.body:
+            return False
+
+        now = timezone.now()
+        revisions = []
+        if current.version == 1:
+            # Keep the body as it was posted, as the first revision.
+            revisions.append(build_revision(
+                current, 1, current.body, None, current.user_id, current.date_created,
+            ))
+        number = current.version + 1
+        revisions.append(build_revision(
+            current, number, body, current.body, user.pk, now,
+        ))
+        models.CommentRevision.objects.bulk_create(revisions)
+
+        comment.body = body
+        comment.version = number
+        comment.date_edited = now
+        comment.save(update_fields=['body', 'version', 'date_edited'])
+
+    signals.comment_edited.send(
+        sender=models.BaseComment,
+        comment=comment,
+        version=number,
+    )
+    return True
+
+
+def get_history(comment):
+    """Return `comment`'s revisions, oldest first, without their contents."""
+    return comment.revisions.select_related('user').defer('data')
+
+
+def get_body(comment, number):
+    """
+    Return the body of version `number` of `comment`.
+
+    The current version is the comment's own body.  Older ones are rebuilt from the
+    nearest snapshot in two queries.  Raise `CommentRevision.DoesNotExist` for
+    versions the comment doesn't have.
+    """
+    if number == comment.version:
+        return comment.body
+
+    revisions = comment.revisions.filter(number__lte=number)
+    snapshots = revisions.filter(is_snapshot=True).order_by('-number')
+    start = snapshots.values_list('number', flat=True).first()
+    if start is None:
+        raise models.CommentRevision.DoesNotExist
+    rows = list(revisions.filter(number__gte=start).values_list('number', 'data'))
+    if rows[-1][0] != number:
+        raise models.CommentRevision.DoesNotExist
+
+    body = decode(rows[0][1])
+    for _, data in rows[1:]:
+        body = apply_diff(body, decode(data))
+    return body
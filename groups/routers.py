@@ -0,0 +1,123 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import deprecation
+
+
+# Old-style middleware is still used with Django < 1.10.
+MiddlewareMixin = getattr(deprecation, 'MiddlewareMixin', object)
+
+PIN_SESSION_KEY = 'groups_pinned_to_primary_until'
+
+_local = threading.local()
+
+
+def get_config():
+    return apps.get_app_config('groups')
+
+
+def is_pinned_to_primary():
+    """
+    Return True if reads in the current thread should go to the primary database.
+
+    They do unless `ReplicaPinningMiddleware` has let the current request use the
+    replicas.  So management commands, background workers and timer threads, which
+    often read rows and then change them, never read from a replica that's behind.
+    """
+    return getattr(_local, 'pinned', True)
+
+
+def set_pinned_to_primary(pinned):
+    _local.pinned = pinned
+
+
+@contextmanager
+def reading_from_primary():
+    """Send reads in the current thread to the primary database inside the block."""
+    pinned = is_pinned_to_primary()
+    set_pinned_to_primary(True)
+    try:
+        yield
+    finally:
+        set_pinned_to_primary(pinned)
+
+
+def pin_to_primary(request):
+    """
+    Send the request user's reads to the primary database for a short time.
+
+    Call this after a user changes something, so that the pages they see next show
+    their own changes even if the replicas haven't caught up yet.  The rest of the
+    current request is pinned straight away; later requests are pinned (until
+    `replica_pin_seconds` have passed) by `ReplicaPinningMiddleware`, which needs the
+    request to have a session.
+    """
+    set_pinned_to_primary(True)
+    session = getattr(request, 'session', None)
+    if session is not None:
+        session[PIN_SESSION_KEY] = time.time() + get_config().replica_pin_seconds
+
+
+class ReplicaPinningMiddleware(MiddlewareMixin):
+    """
+    Let requests read from the replicas, unless `pin_to_primary` was called recently.
+
+    Reads only go to a replica during a request this middleware has seen, and the
+    thread goes back to the primary once the response is ready.  Must come after
+    `SessionMiddleware`.
+    """
+    def process_request(self, request):
+        session = getattr(request, 'session', None)
+        pinned_until = session.get(PIN_SESSION_KEY, 0) if session is not None else 0
+        set_pinned_to_primary(pinned_until > time.time())
+
+    def process_response(self, request, response):
+        set_pinned_to_primary(True)
+        return response
+
+
+class ReplicaRouter(object):
+    """
+    A database router that sends reads of `groups` models to read replicas.
+
+    The replicas are the database aliases listed in the `replica_databases` attribute of
+    the `groups` AppConfig; with none listed (the default) this router does nothing.
+    Only reads made during a request, by way of `ReplicaPinningMiddleware`, go to a
+    replica.  Writes, reads outside requests, and reads made while the current request
+    is pinned to the primary by `pin_to_primary`, go to the default database.
+
+    To use it, add `'groups.routers.ReplicaRouter'` to `DATABASE_ROUTERS` and
+    `'groups.routers.ReplicaPinningMiddleware'` to your middleware.
+    """
+    def get_replicas(self):
+        return get_config().replica_databases
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'groups':
+            return None
+
+        replicas = self.get_replicas()
+        if not replicas or is_pinned_to_primary():
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != 'groups':
+            return None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """
+        Allow relations between objects read from the primary and from a replica.
+
+        They hold the same data, so an object read from a replica can be used as, say,
+        the discussion of a comment that's about to be saved to the primary.
+        """
+        databases = {DEFAULT_DB_ALIAS}.union(self.get_replicas())
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
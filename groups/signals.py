@@ -0,0 +1,20 @@
+from django.dispatch import Signal
+
+
+# Sent with `sender=BaseComment` once comments have moved to a new state, once per
+# batch rather than once per comment.  `comment_ids` and `discussion_ids` list the
+# comments changed and the discussions they're on.  Nothing in `groups` caches
+# anything that depends on a comment's state, so nothing here listens to it; it's
+# for projects that do.
+comment_state_changed = Signal(providing_args=['comment_ids', 'discussion_ids', 'state'])
+
+# Sent with `sender=BaseComment` when a comment is rejected by a rate limit (see
+# `groups.ratelimits`).  `scope` is the limit that was hit, and `retry_after` how
+# many seconds until it would let the comment through.
+comment_rate_limited = Signal(
+    providing_args=['scope', 'user', 'discussion', 'retry_after'],
+)
+
+# Sent with `sender=BaseComment` when a comment's text is edited (see
+# `groups.revisions`).  `version` is the comment's new content version.
+comment_edited = Signal(providing_args=['comment', 'version'])
@@ -8,3 +8,27 @@ register = template.Library()
 def comment_render(comment, request):
     """Render the comment template in the view."""
     return comment.render(request)
+
+
+class SubscribeButtonNode(template.Node):
+    def __init__(self, form):
+        # Resolved like `{% crispy %}` resolves its form, so that context names
+        # such as `discussion-subscribe-form` work.
+        self.form = template.Variable(form)
+
+    def render(self, context):
+        form = self.form.resolve(context)
+        return form.render_button(str(context.get('csrf_token', '')))
+
+
+@register.tag
+def subscribe_button(parser, token):
+    """
+    Render a `SubscribeForm`, e.g. `{% subscribe_button discussion-subscribe-form %}`.
+
+    Its HTML is cached (see `SubscribeForm.render_button`).
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError('subscribe_button takes one form.')
+    return SubscribeButtonNode(bits[1])
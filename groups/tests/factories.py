@@ -1,5 +1,6 @@
 import factory
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from incuna_test_utils.factories import images
 
 from .. import models
@@ -60,6 +61,17 @@ class TextCommentFactory(BaseCommentFactory):
         model = models.TextComment
 
 
+class ArchivedCommentFactory(factory.DjangoModelFactory):
+    id = factory.Sequence(lambda n: 100000 + n)
+    discussion = factory.SubFactory(DiscussionFactory)
+    user = factory.SubFactory(UserFactory)
+    date_created = factory.LazyAttribute(lambda comment: timezone.now())
+    body = factory.Sequence('Archived comment {}'.format)
+
+    class Meta:
+        model = models.ArchivedComment
+
+
 class AttachedFileFactory(factory.DjangoModelFactory):
     user = factory.SubFactory(UserFactory)
     file = images.LocalFileField()
@@ -67,3 +79,54 @@ class AttachedFileFactory(factory.DjangoModelFactory):
 
     class Meta:
         model = models.AttachedFile
+
+
+class UploadSessionFactory(factory.DjangoModelFactory):
+    user = factory.SubFactory(UserFactory)
+    filename = 'upload.txt'
+    size = 10
+
+    class Meta:
+        model = models.UploadSession
+
+
+class OutboxMessageFactory(factory.DjangoModelFactory):
+    kind = models.OutboxMessage.KIND_COMMENT
+    object_id = factory.LazyAttribute(lambda m: TextCommentFactory.create().pk)
+    domain = 'testserver'
+
+    class Meta:
+        model = models.OutboxMessage
+
+
+class ReadMarkerFactory(factory.DjangoModelFactory):
+    user = factory.SubFactory(UserFactory)
+    discussion = factory.SubFactory(DiscussionFactory)
+
+    class Meta:
+        model = models.ReadMarker
+
+
+class MentionFactory(factory.DjangoModelFactory):
+    comment = factory.SubFactory(TextCommentFactory)
+    user = factory.SubFactory(UserFactory)
+
+    class Meta:
+        model = models.Mention
+
+
+class ReactionFactory(factory.DjangoModelFactory):
+    comment = factory.SubFactory(TextCommentFactory)
+    user = factory.SubFactory(UserFactory)
+    kind = 'like'
+
+    class Meta:
+        model = models.Reaction
+
+
+class ReactionCountFactory(factory.DjangoModelFactory):
+    comment = factory.SubFactory(TextCommentFactory)
+    kind = 'like'
+
+    class Meta:
+        model = models.ReactionCount
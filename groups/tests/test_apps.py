@@ -1,7 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+
 from django.apps import apps as django_apps
+from django.conf import settings
 from django.test import TestCase
 
 
+# Run in a fresh interpreter, so that nothing is imported already.  Records the time
+# taken, and the modules first imported, by importing `groups.models` and by
+# `GroupsConfig.ready()` itself (not just the `AppConfig.ready()` it overrides).
+STARTUP_PROBE = """
+import json
+import sys
+import time
+
+import django
+from django.apps.config import AppConfig
+from groups.apps import GroupsConfig
+
+costs = {}
+
+
+def measure(method):
+    def wrapper(self, *args):
+        before = set(sys.modules)
+        started = time.time()
+        method(self, *args)
+        if self.label == 'groups':
+            costs[method.__name__] = {
+                'seconds': time.time() - started,
+                'modules': sorted(set(sys.modules) - before),
+            }
+    return wrapper
+
+
+AppConfig.import_models = measure(AppConfig.import_models)
+GroupsConfig.ready = measure(GroupsConfig.ready)
+django.setup()
+print(json.dumps(costs))
+"""
+
+
 class TestGroupsConfig(TestCase):
     config = django_apps.get_app_config('groups')
 
@@ -9,3 +50,54 @@ class TestGroupsConfig(TestCase):
         """Assert this member exists and has the right value."""
         value = self.config.default_within_days
         self.assertEqual(value, 7)
+
+
+class TestStartupBudget(TestCase):
+    """
+    Keep `groups` cheap to start, for short-lived commands and worker processes.
+
+    Importing `groups.models` and running `GroupsConfig.ready()` mustn't pull in the
+    views, forms or their heavy dependencies, and must stay well inside a time budget.
+    """
+    budget_seconds = 0.5
+    heavy_modules = (
+        'PIL',
+        'crispy_forms',
+        'groups.attachments',
+        'groups.forms',
+        'groups.outbox',
+        'groups.urls',
+        'groups.views',
+        'incuna_mail',
+        'multiprocessing',
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestStartupBudget, cls).setUpClass()
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE,
+            PYTHONPATH=os.pathsep.join(sys.path),
+        )
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_PROBE], env=env)
+        cls.costs = json.loads(output.decode('utf-8').splitlines()[-1])
+
+    def assert_within_budget(self, step):
+        cost = self.costs[step]
+        heavy = [
+            name for name in cost['modules']
+            if any(name == h or name.startswith(h + '.') for h in self.heavy_modules)
+        ]
+        self.assertEqual(heavy, [])
+        self.assertLess(cost['seconds'], self.budget_seconds)
+
+    def test_import_models(self):
+        self.assert_within_budget('import_models')
+
+    def test_ready(self):
+        self.assert_within_budget('ready')
+
+    def test_ready_measured(self):
+        """The probe sees the work `ready()` does, registering the admin classes."""
+        self.assertIn('groups.admin', self.costs['ready']['modules'])
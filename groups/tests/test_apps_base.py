@@ -40,6 +40,18 @@ class TestAdminRegisteringAppConfig(TestCase):
         get_model.assert_called_once_with('Group')
         site_register.assert_called_once_with(Group, GroupAdmin)
 
+    def test_register_admin_classes_no_admin(self):
+        """Assert that nothing is registered if the admin isn't installed."""
+        self.config.admin_classes = {
+            'Group': 'groups.admin.GroupAdmin',
+        }
+
+        with mock.patch('django.apps.apps.is_installed', return_value=False):
+            with mock.patch('django.contrib.admin.site.register') as site_register:
+                self.config._register_admin_classes()
+
+        self.assertFalse(site_register.called)
+
     def test_ready(self):
         """
         Assert that ready() calls _register_admin_classes() and the superclass's ready().
@@ -0,0 +1,307 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import datetime
+
+from django.core.files.base import ContentFile
+from django.test import TestCase
+from django.utils import six, timezone
+from incuna_test_utils.compat import Python2AssertMixin
+from inmemorystorage import InMemoryStorage
+
+from . import factories
+from .. import attachments, models
+
+
+class TestDerive(TestCase):
+    def test_image(self):
+        attachment = factories.AttachedFileFactory.create()
+        storage = attachment.file.storage
+
+        values = attachments.derive(attachment.pk, attachment.file.name)
+
+        self.assertEqual(values['mime_type'], 'image/png')
+        self.assertEqual(values['size'], attachment.file.size)
+        prefix = 'groups/derivatives/{}'.format(attachment.pk)
+        self.assertEqual(values['thumbnail'], prefix + '-thumbnail.jpg')
+        self.assertEqual(values['preview'], prefix + '-preview.jpg')
+        for kind in attachments.DERIVATIVES:
+            self.assertTrue(storage.exists(values[kind]))
+
+        Image = attachments.get_image_module()
+        original = Image.open(storage.open(attachment.file.name))
+        self.assertEqual((values['width'], values['height']), original.size)
+
+    def test_image_resized(self):
+        """Derivatives are scaled down to the configured size, keeping their shape."""
+        image = attachments.get_image_module().new('RGBA', (400, 100))
+        content = six.BytesIO()
+        image.save(content, 'PNG')
+        attachment = factories.AttachedFileFactory.create(
+            file=ContentFile(content.getvalue(), name='wide.png'),
+        )
+        values = attachments.derive(attachment.pk, attachment.file.name)
+
+        Image = attachments.get_image_module()
+        storage = attachment.file.storage
+        self.assertEqual((values['width'], values['height']), (400, 100))
+        self.assertEqual(Image.open(storage.open(values['thumbnail'])).size, (200, 50))
+        self.assertEqual(Image.open(storage.open(values['preview'])).size, (400, 100))
+
+    def test_reprocess(self):
+        """Processing an image again replaces its derivatives instead of adding more."""
+        attachment = factories.AttachedFileFactory.create()
+        first = attachments.derive(attachment.pk, attachment.file.name)
+        second = attachments.derive(attachment.pk, attachment.file.name)
+        self.assertEqual(first, second)
+
+    def test_not_image(self):
+        attachment = factories.AttachedFileFactory.create(
+            file=ContentFile(b'Notes', name='notes.txt'),
+        )
+        values = attachments.derive(attachment.pk, attachment.file.name)
+        self.assertEqual(values, {'size': 5, 'mime_type': 'text/plain'})
+
+    def test_unknown_type(self):
+        attachment = factories.AttachedFileFactory.create(
+            file=ContentFile(b'???', name='mystery'),
+        )
+        values = attachments.derive(attachment.pk, attachment.file.name)
+        self.assertEqual(values['mime_type'], 'application/octet-stream')
+
+    def test_no_pillow(self):
+        """Without Pillow, images just get their size and type."""
+        attachment = factories.AttachedFileFactory.create()
+        with mock.patch.dict('sys.modules', PIL=None):
+            self.assertIsNone(attachments.get_image_module())
+            values = attachments.derive(attachment.pk, attachment.file.name)
+        self.assertEqual(set(values), {'size', 'mime_type'})
+
+    def test_broken_image(self):
+        attachment = factories.AttachedFileFactory.create(
+            file=ContentFile(b'Not a PNG', name='broken.png'),
+        )
+        with mock.patch.object(attachments.logger, 'exception') as log:
+            values = attachments.derive(attachment.pk, attachment.file.name)
+        self.assertEqual(values, {'size': 9, 'mime_type': 'image/png'})
+        self.assertTrue(log.called)
+
+    def test_missing_file(self):
+        with mock.patch.object(attachments.logger, 'warning') as log:
+            self.assertIsNone(attachments.derive(1, 'groups/attachments/missing.png'))
+        self.assertTrue(log.called)
+
+
+class TestProcessPending(TestCase):
+    def test_process(self):
+        images = factories.AttachedFileFactory.create_batch(3)
+        text = factories.AttachedFileFactory.create(
+            file=ContentFile(b'Notes', name='notes.txt'),
+        )
+
+        self.assertEqual(attachments.process_pending(batch_size=2), 4)
+
+        for attachment in images:
+            attachment.refresh_from_db()
+            self.assertIsNotNone(attachment.date_processed)
+            self.assertTrue(attachment.is_image())
+            self.assertTrue(attachment.thumbnail)
+        text.refresh_from_db()
+        self.assertEqual(text.mime_type, 'text/plain')
+        self.assertFalse(text.thumbnail)
+
+    def test_only_new(self):
+        processed, new = factories.AttachedFileFactory.create_batch(2)
+        attachments.process_pending()
+        new_attachment = factories.AttachedFileFactory.create()
+
+        with mock.patch.object(attachments, 'derive', return_value={}) as derive:
+            self.assertEqual(attachments.process_pending(), 1)
+        derive.assert_called_once_with(new_attachment.pk, new_attachment.file.name)
+
+        with mock.patch.object(attachments, 'derive', return_value={}) as derive:
+            self.assertEqual(attachments.process_pending(reprocess=True), 3)
+
+    def test_missing_file(self):
+        """Attachments without a file are marked as processed, so they aren't retried."""
+        attachment = factories.AttachedFileFactory.create()
+        attachment.file.storage.delete(attachment.file.name)
+
+        with mock.patch.object(attachments.logger, 'warning'):
+            self.assertEqual(attachments.process_pending(), 1)
+        attachment.refresh_from_db()
+        self.assertIsNotNone(attachment.date_processed)
+        self.assertIsNone(attachment.size)
+
+    def test_processes(self):
+        """Files can be handled by a pool of processes, which is always shut down."""
+        factories.AttachedFileFactory.create_batch(2)
+        pool = mock.Mock()
+        pool.imap_unordered.side_effect = six.moves.map
+        with mock.patch('multiprocessing.Pool') as Pool:
+            Pool.return_value = pool
+            self.assertEqual(attachments.process_pending(processes=3), 2)
+
+        Pool.assert_called_once_with(3)
+        self.assertTrue(pool.close.called)
+        self.assertTrue(pool.join.called)
+        unprocessed = models.AttachedFile.objects.filter(date_processed__isnull=True)
+        self.assertFalse(unprocessed.exists())
+
+
+class FreshStorageMixin(object):
+    """Give attachments an empty storage, without the files of earlier tests."""
+    def setUp(self):
+        super(FreshStorageMixin, self).setUp()
+        self.storage = InMemoryStorage()
+        for field in ('file',) + attachments.DERIVATIVES:
+            field = models.AttachedFile._meta.get_field(field)
+            patcher = mock.patch.object(field, 'storage', self.storage)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TestDeleteUnattached(Python2AssertMixin, FreshStorageMixin, TestCase):
+    def setUp(self):
+        super(TestDeleteUnattached, self).setUp()
+        self.cutoff = timezone.now() - datetime.timedelta(hours=1)
+        self.before = self.cutoff - datetime.timedelta(minutes=1)
+
+    def test_delete(self):
+        """Old attachments without a comment are deleted, along with their files."""
+        old = factories.AttachedFileFactory.create_batch(3, date_created=self.before)
+        attachments.process_pending()
+        names = []
+        for attachment in old:
+            attachment.refresh_from_db()
+            names.extend([attachment.file.name, attachment.thumbnail.name])
+        new = factories.AttachedFileFactory.create()
+        attached = factories.AttachedFileFactory.create(
+            date_created=self.before,
+            attached_to=factories.TextCommentFactory.create(),
+        )
+
+        count = attachments.delete_unattached(self.cutoff, batch_size=2)
+
+        self.assertEqual(count, 3)
+        remaining = models.AttachedFile.objects.all()
+        self.assertCountEqual(remaining, [new, attached])
+        for name in names:
+            self.assertFalse(self.storage.exists(name))
+        self.assertTrue(self.storage.exists(new.file.name))
+
+    def test_dry_run(self):
+        attachment = factories.AttachedFileFactory.create(date_created=self.before)
+        count = attachments.delete_unattached(self.cutoff, dry_run=True)
+        self.assertEqual(count, 1)
+        self.assertTrue(models.AttachedFile.objects.filter(pk=attachment.pk).exists())
+        self.assertTrue(self.storage.exists(attachment.file.name))
+
+    def test_throttle(self):
+        factories.AttachedFileFactory.create_batch(3, date_created=self.before)
+        throttle = mock.Mock()
+        attachments.delete_unattached(self.cutoff, batch_size=2, throttle=throttle)
+        self.assertEqual(throttle.wait.call_args_list, [mock.call(2), mock.call(1)])
+
+
+class TestDeleteUnreferenced(FreshStorageMixin, TestCase):
+    def save(self, name):
+        return self.storage.save(name, ContentFile(b'Orphan'))
+
+    def test_delete(self):
+        """Files that no attachment refers to are deleted, in every upload directory."""
+        attachment = factories.AttachedFileFactory.create()
+        attachments.process_pending()
+        attachment.refresh_from_db()
+        orphans = [
+            self.save('groups/attachments/orphan.txt'),
+            self.save('groups/attachments/nested/orphan.txt'),
+            self.save('groups/derivatives/999-thumbnail.jpg'),
+        ]
+        cutoff = timezone.now() + datetime.timedelta(minutes=1)
+
+        count = attachments.delete_unreferenced(cutoff, batch_size=2)
+
+        self.assertEqual(count, 3)
+        for name in orphans:
+            self.assertFalse(self.storage.exists(name))
+        for name in (attachment.file, attachment.thumbnail, attachment.preview):
+            self.assertTrue(self.storage.exists(name.name))
+
+    def test_recent(self):
+        """Files modified since the cutoff might belong to an upload in progress."""
+        name = self.save('groups/attachments/uploading.txt')
+        cutoff = timezone.now() - datetime.timedelta(minutes=1)
+        self.assertEqual(attachments.delete_unreferenced(cutoff), 0)
+        self.assertTrue(self.storage.exists(name))
+
+    def test_dry_run(self):
+        name = self.save('groups/attachments/orphan.txt')
+        cutoff = timezone.now() + datetime.timedelta(minutes=1)
+        throttle = mock.Mock()
+        count = attachments.delete_unreferenced(cutoff, dry_run=True, throttle=throttle)
+        self.assertEqual(count, 1)
+        self.assertTrue(self.storage.exists(name))
+        self.assertFalse(throttle.wait.called)
+
+    def test_empty_storage(self):
+        self.assertEqual(attachments.delete_unreferenced(timezone.now()), 0)
+
+
+class TestDeleteOrphans(Python2AssertMixin, FreshStorageMixin, TestCase):
+    def test_grace_period(self):
+        """By default, only orphans more than a day old are deleted."""
+        day_ago = timezone.now() - datetime.timedelta(hours=24, minutes=1)
+        old = factories.AttachedFileFactory.create(date_created=day_ago)
+        new = factories.AttachedFileFactory.create()
+
+        self.assertEqual(attachments.delete_orphans(), (1, 0))
+        self.assertCountEqual(models.AttachedFile.objects.all(), [new])
+        self.assertFalse(self.storage.exists(old.file.name))
+
+    def test_hours(self):
+        factories.AttachedFileFactory.create()
+        self.storage.save('groups/attachments/orphan.txt', ContentFile(b'Orphan'))
+        self.assertEqual(attachments.delete_orphans(hours=-1, dry_run=True), (1, 1))
+
+
+class TestThrottle(TestCase):
+    @mock.patch.object(attachments.time, 'sleep')
+    @mock.patch.object(attachments.time, 'time')
+    def test_wait(self, now, sleep):
+        now.return_value = 100.0
+        throttle = attachments.Throttle(rate=10)
+
+        # 20 operations at 10 a second should take two seconds.
+        now.return_value = 100.5
+        throttle.wait(20)
+        sleep.assert_called_once_with(1.5)
+
+        # Slow enough already.
+        sleep.reset_mock()
+        now.return_value = 104.0
+        throttle.wait(10)
+        self.assertFalse(sleep.called)
+
+    @mock.patch.object(attachments.time, 'sleep')
+    def test_no_rate(self, sleep):
+        attachments.Throttle().wait(1000)
+        self.assertFalse(sleep.called)
+
+
+class TestGetModifiedTime(TestCase):
+    def test_modified_time(self):
+        """Django 1.8 storages only have `modified_time`, which returns local time."""
+        modified = datetime.datetime(2017, 1, 1)
+        storage = mock.Mock(spec=['modified_time'])
+        storage.modified_time.return_value = modified
+
+        result = attachments.get_modified_time(storage, 'name')
+        self.assertEqual(result, modified)
+        storage.modified_time.assert_called_once_with('name')
+
+        with self.settings(USE_TZ=True):
+            result = attachments.get_modified_time(storage, 'name')
+        self.assertEqual(result, timezone.make_aware(modified))
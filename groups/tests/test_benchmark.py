@@ -0,0 +1,204 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import datetime
+import json
+import os
+import shutil
+import tempfile
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import call_command, CommandError
+from django.http import HttpResponse
+from django.test import TestCase
+from django.utils import six, timezone
+
+from . import factories
+from .utils import WriteBehindBufferMixin
+from .. import benchmark, models
+
+
+class TestGenerate(TestCase):
+    def test_generate(self):
+        created = benchmark.generate(
+            groups=2,
+            discussions=4,
+            comments=20,
+            attachments=5,
+            users=6,
+            watchers=3,
+            days=10,
+            batch_size=3,
+            seed=1,
+        )
+
+        self.assertEqual(created['users'], 6)
+        self.assertEqual(created['groups'], 2)
+        self.assertEqual(created['discussions'], 4)
+        self.assertEqual(created['comments'], 20)
+        self.assertEqual(created['attachments'], 5)
+        self.assertEqual(created['watchers'], 6)
+
+        prefix = created['prefix']
+        self.assertEqual(User.objects.filter(username__startswith=prefix).count(), 6)
+        for group in models.Group.objects.all():
+            self.assertEqual(group.watchers.count(), 3)
+            self.assertEqual(group.discussions.count(), 2)
+        for discussion in models.Discussion.objects.all():
+            self.assertEqual(list(discussion.subscribers.all()), [discussion.creator])
+
+        comments = models.TextComment.objects.all()
+        self.assertEqual(comments.count(), 20)
+        cutoff = timezone.now() - datetime.timedelta(days=10, minutes=1)
+        self.assertFalse(comments.filter(date_created__lt=cutoff).exists())
+        self.assertEqual(models.AttachedFile.objects.filter(
+            attached_to__in=comments,
+        ).count(), 5)
+
+    def test_generate_more_watchers_than_users(self):
+        created = benchmark.generate(groups=1, discussions=1, comments=1, users=2)
+        self.assertEqual(created['watchers'], 2)
+        self.assertEqual(created['attachments'], 0)
+
+
+class TestRun(WriteBehindBufferMixin, TestCase):
+    def setUp(self):
+        super(TestRun, self).setUp()
+        benchmark.generate(groups=2, discussions=3, comments=12, users=4, watchers=2)
+
+    def test_run(self):
+        comments = models.BaseComment.objects.count()
+
+        report = benchmark.run(iterations=2, seed=1)
+
+        self.assertEqual(report['dataset']['comments'], comments)
+        self.assertEqual(list(report['scenarios']), list(benchmark.SCENARIOS))
+        for name, result in report['scenarios'].items():
+            self.assertEqual(result['iterations'], 2)
+            self.assertGreater(result['queries']['min'], 0, name)
+            latency = result['latency_ms']
+            self.assertLessEqual(latency['min'], latency['p50'])
+            self.assertLessEqual(latency['p50'], latency['max'])
+            self.assertNotIn('max_rss_kb', result)
+        self.assertIn('peak_rss_kb', report)
+
+        # Scenarios that write are rolled back.
+        self.assertEqual(models.BaseComment.objects.count(), comments)
+        self.assertFalse(models.OutboxMessage.objects.exists())
+
+    def test_run_named(self):
+        report = benchmark.run(['within_days'], iterations=1, warmup=0)
+        self.assertEqual(list(report['scenarios']), ['within_days'])
+
+    def test_comment_post_by_email(self):
+        """The scenario really posts a comment, rather than timing an error page."""
+        sample = benchmark.Sample(mock.Mock())
+        sample.rng.choice.side_effect = lambda choices: choices[0]
+        scenario = benchmark.CommentPostByEmailScenario(sample)
+        comments = models.BaseComment.objects.count()
+
+        with self.settings(ALLOWED_HOSTS=['testserver']):
+            scenario.run(*scenario.prepare())
+
+        self.assertEqual(models.BaseComment.objects.count(), comments + 1)
+
+    def test_run_unexpected_status(self):
+        """An error page stops the run rather than being timed."""
+        response = HttpResponse(status=429)
+        with mock.patch.object(benchmark.GroupDetailScenario, 'view') as view:
+            view.return_value = response
+            with self.assertRaises(benchmark.BenchmarkError) as context:
+                benchmark.run(['group_detail'], iterations=1, warmup=0)
+        self.assertEqual(
+            str(context.exception),
+            'GroupDetailScenario got a 429 response, not 200.',
+        )
+
+    def test_run_without_rate_limits(self):
+        """Replies by email aren't turned away however many are posted."""
+        config = apps.get_app_config('groups')
+        limits = {'user': (1, 3600), 'discussion': (1, 3600)}
+        with mock.patch.object(config, 'comment_rate_limits', limits):
+            benchmark.run(['comment_post_by_email'], iterations=3, seed=1)
+            self.assertEqual(config.comment_rate_limits, limits)
+
+    def test_scenario_run(self):
+        with self.assertRaises(NotImplementedError):
+            benchmark.Scenario(sample=None).run()
+
+
+class TestMeasurement(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 99), 99)
+        self.assertEqual(benchmark.percentile([7], 99), 7)
+
+    def test_summarise(self):
+        summary = benchmark.summarise([3, 1, 2])
+        self.assertEqual(summary['min'], 1)
+        self.assertEqual(summary['mean'], 2.0)
+        self.assertEqual(summary['p50'], 2)
+        self.assertEqual(summary['max'], 3)
+
+    def test_query_counter(self):
+        with benchmark.QueryCounter() as counter:
+            list(models.Group.objects.all())
+            list(models.Discussion.objects.all())
+        self.assertEqual(len(counter), 2)
+
+    def test_max_rss_kb(self):
+        resource = mock.Mock()
+        resource.getrusage.return_value.ru_maxrss = 2048
+        with mock.patch.dict('sys.modules', resource=resource):
+            with mock.patch.object(benchmark.sys, 'platform', 'linux'):
+                self.assertEqual(benchmark.max_rss_kb(), 2048)
+            with mock.patch.object(benchmark.sys, 'platform', 'darwin'):
+                self.assertEqual(benchmark.max_rss_kb(), 2)
+
+    def test_max_rss_kb_unknown(self):
+        """The `resource` module isn't available on Windows."""
+        with mock.patch.dict('sys.modules', resource=None):
+            self.assertIsNone(benchmark.max_rss_kb())
+
+
+class TestBenchmarkGroupsCommand(WriteBehindBufferMixin, TestCase):
+    def call(self, **kwargs):
+        stdout = six.StringIO()
+        call_command('benchmark_groups', stdout=stdout, stderr=six.StringIO(), **kwargs)
+        return stdout.getvalue()
+
+    def test_generate(self):
+        output = self.call(
+            generate=True,
+            groups=1,
+            discussions=2,
+            comments=5,
+            scenarios=['group_detail', 'within_days'],
+            iterations=1,
+        )
+
+        report = json.loads(output)
+        self.assertEqual(report['dataset']['comments'], 5)
+        self.assertEqual(list(report['scenarios']), ['group_detail', 'within_days'])
+
+    def test_output(self):
+        factories.TextCommentFactory.create()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'report.json')
+
+        self.assertEqual(self.call(output=path, iterations=1), '')
+        with open(path) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(report['dataset']['comments'], 1)
+
+    def test_unexpected_status(self):
+        error = benchmark.BenchmarkError('GroupDetailScenario got a 404 response.')
+        with mock.patch.object(benchmark, 'run', side_effect=error):
+            with self.assertRaises(CommandError) as context:
+                self.call(iterations=1)
+        self.assertEqual(str(context.exception), str(error))
@@ -0,0 +1,163 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import datetime
+
+from django.apps import apps
+from django.test import TestCase
+
+from .. import buffers
+
+
+class CountingBuffer(buffers.WriteBehindBuffer):
+    """Add up changes for each key, and keep the batches it's asked to save."""
+    flush_seconds_setting = 'reaction_flush_seconds'
+    max_pending_setting = 'reaction_max_pending'
+
+    def __init__(self):
+        super(CountingBuffer, self).__init__()
+        self.saved = []
+
+    def combine(self, waiting, value):
+        return waiting + value
+
+    def save(self, pending):
+        self.saved.append(pending)
+
+
+class TestWriteBehindBuffer(TestCase):
+    def setUp(self):
+        self.buffer = CountingBuffer()
+        self.addCleanup(self.buffer.cancel)
+        self.config = apps.get_app_config('groups')
+
+    def test_add(self):
+        self.buffer.add('a', 1)
+        self.buffer.add('a', 2)
+        self.buffer.add('b', 1)
+
+        self.assertEqual(self.buffer.pending, {'a': 3, 'b': 1})
+        self.assertEqual(self.buffer.saved, [])
+
+    def test_flush(self):
+        self.buffer.add('a', 1)
+        timer = self.buffer.timer
+
+        self.buffer.flush()
+
+        self.assertEqual(self.buffer.saved, [{'a': 1}])
+        self.assertEqual(self.buffer.pending, {})
+        self.assertIsNone(self.buffer.started)
+        self.assertIsNone(self.buffer.timer)
+        self.assertTrue(timer.finished.is_set())
+
+    def test_flush_when_full(self):
+        """A full buffer is flushed by the timer at once, not by the request adding."""
+        with mock.patch.object(self.config, 'reaction_max_pending', 2):
+            with mock.patch('threading.Timer') as timer:
+                self.buffer.add('a', 1)
+                self.buffer.add('a', 1)
+                self.assertEqual(timer.call_count, 1)
+                self.buffer.add('b', 1)
+                self.buffer.add('c', 1)
+
+        self.assertEqual(timer.call_args_list, [
+            mock.call(self.config.reaction_flush_seconds, self.buffer.flush_from_timer),
+            mock.call(0, self.buffer.flush_from_timer),
+        ])
+        self.assertTrue(timer.return_value.cancel.called)
+        self.assertEqual(self.buffer.saved, [])
+
+        with mock.patch('groups.buffers.connections'):
+            self.buffer.flush_from_timer()
+        self.assertEqual(self.buffer.saved, [{'a': 2, 'b': 1, 'c': 1}])
+        self.assertFalse(self.buffer.flushing_soon)
+
+    def test_flush_when_old(self):
+        self.buffer.add('a', 1)
+        self.buffer.started -= datetime.timedelta(
+            seconds=self.config.reaction_flush_seconds,
+        )
+
+        with mock.patch('threading.Timer') as timer:
+            self.buffer.add('a', 1)
+
+        timer.assert_called_once_with(0, self.buffer.flush_from_timer)
+        self.assertEqual(self.buffer.saved, [])
+
+    def test_timer(self):
+        """A buffer is saved on time without anything more being added to it."""
+        with mock.patch('threading.Timer') as timer:
+            self.buffer.add('a', 1)
+            self.buffer.add('a', 1)
+
+        timer.assert_called_once_with(
+            self.config.reaction_flush_seconds,
+            self.buffer.flush_from_timer,
+        )
+        self.assertTrue(timer.return_value.daemon)
+        timer.return_value.start.assert_called_once_with()
+
+        # Don't close the test's own database connection.
+        with mock.patch('groups.buffers.connections') as connections:
+            self.buffer.flush_from_timer()
+        self.assertEqual(self.buffer.saved, [{'a': 2}])
+        self.assertTrue(connections.close_all.called)
+
+    def test_timer_failure(self):
+        self.buffer.add('a', 1)
+        with mock.patch.object(self.buffer, 'save', side_effect=ValueError):
+            with mock.patch('groups.buffers.logger') as logger:
+                with mock.patch('groups.buffers.connections'):
+                    self.buffer.flush_from_timer()
+        self.assertTrue(logger.exception.called)
+
+    def test_flush_failure(self):
+        """Changes that couldn't be saved are kept, and tried again later."""
+        self.buffer.add('a', 1)
+        self.buffer.add('b', 1)
+        with mock.patch.object(self.buffer, 'save', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                self.buffer.flush()
+
+        self.assertEqual(self.buffer.pending, {'a': 1, 'b': 1})
+        self.assertIsNotNone(self.buffer.started)
+        self.assertIsNotNone(self.buffer.timer)
+
+        self.buffer.add('a', 2)
+        self.buffer.flush()
+        self.assertEqual(self.buffer.saved, [{'a': 3, 'b': 1}])
+
+    def test_flush_failure_with_more_added(self):
+        """Changes added while a failed save was running are combined with it."""
+        self.buffer.add('a', 1)
+
+        def save(pending):
+            self.buffer.add('a', 2)
+            self.buffer.add('b', 1)
+            raise ValueError
+
+        with mock.patch.object(self.buffer, 'save', side_effect=save):
+            with self.assertRaises(ValueError):
+                self.buffer.flush()
+
+        self.assertEqual(self.buffer.pending, {'a': 3, 'b': 1})
+
+    def test_cancel(self):
+        self.buffer.add('a', 1)
+        timer = self.buffer.timer
+
+        self.buffer.cancel()
+
+        self.assertIsNone(self.buffer.timer)
+        self.assertTrue(timer.finished.is_set())
+        self.assertEqual(self.buffer.pending, {'a': 1})
+
+    def test_not_implemented(self):
+        buffer = buffers.WriteBehindBuffer()
+        with self.assertRaises(NotImplementedError):
+            buffer.combine(1, 2)
+        with self.assertRaises(NotImplementedError):
+            buffer.save({})
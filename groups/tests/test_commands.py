@@ -0,0 +1,119 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import datetime
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import six, timezone
+
+from . import factories
+from .. import attachments, models
+
+
+class TestArchiveCommentsCommand(TestCase):
+    def call(self, **kwargs):
+        stdout = six.StringIO()
+        call_command('archive_comments', stdout=stdout, **kwargs)
+        return stdout.getvalue()
+
+    def test_archive_deleted(self):
+        """By default, comments deleted more than 30 days ago are archived."""
+        old_deleted, new_deleted = factories.TextCommentFactory.create_batch(2)
+        for comment in (old_deleted, new_deleted):
+            comment.delete_state()
+        models.BaseComment.objects.filter(pk=old_deleted.pk).update(
+            date_deleted=timezone.now() - datetime.timedelta(days=31),
+        )
+
+        output = self.call()
+        self.assertEqual(output, 'Archived 1 comments.\n')
+        self.assertEqual(models.ArchivedComment.objects.get().pk, old_deleted.pk)
+
+    def test_archive_old(self):
+        old = factories.TextCommentFactory.create(
+            date_created=timezone.now() - datetime.timedelta(days=10),
+        )
+        factories.TextCommentFactory.create()
+
+        self.call(older_than=5)
+        self.assertEqual(models.ArchivedComment.objects.get().pk, old.pk)
+
+    def test_dry_run(self):
+        factories.TextCommentFactory.create(
+            date_created=timezone.now() - datetime.timedelta(days=10),
+        )
+
+        output = self.call(older_than=5, dry_run=True)
+        self.assertEqual(output, '1 comments would be archived.\n')
+        self.assertFalse(models.ArchivedComment.objects.exists())
+
+
+class TestSendNotificationsCommand(TestCase):
+    def test_send_notifications(self):
+        factories.OutboxMessageFactory.create_batch(2)
+
+        stdout = six.StringIO()
+        call_command('send_notifications', batch_size=1, stdout=stdout)
+
+        self.assertEqual(stdout.getvalue(), 'Sent 2 notifications.\n')
+        self.assertFalse(models.OutboxMessage.objects.pending().exists())
+
+
+class TestProcessAttachmentsCommand(TestCase):
+    def call(self, **kwargs):
+        stdout = six.StringIO()
+        call_command('process_attachments', stdout=stdout, **kwargs)
+        return stdout.getvalue()
+
+    def test_process(self):
+        attachment = factories.AttachedFileFactory.create()
+
+        output = self.call()
+        self.assertEqual(output, 'Processed 1 attachments.\n')
+        attachment.refresh_from_db()
+        self.assertEqual(attachment.mime_type, 'image/png')
+
+        # Only new attachments are processed, unless all of them are asked for.
+        self.assertEqual(self.call(), 'Processed 0 attachments.\n')
+        self.assertEqual(self.call(reprocess=True), 'Processed 1 attachments.\n')
+
+
+class TestDeleteOrphanedAttachmentsCommand(TestCase):
+    def call(self, **kwargs):
+        stdout = six.StringIO()
+        call_command('delete_orphaned_attachments', stdout=stdout, **kwargs)
+        return stdout.getvalue()
+
+    def test_delete(self):
+        factories.UploadSessionFactory.create(
+            date_created=timezone.now() - datetime.timedelta(hours=7),
+        )
+        with mock.patch.object(attachments, 'delete_orphans') as delete_orphans:
+            delete_orphans.return_value = (2, 3)
+            output = self.call(hours=6, rate=50.0)
+        expected = (
+            'Deleted 2 unattached attachments, 3 orphaned files and 1 abandoned '
+            'uploads.\n'
+        )
+        self.assertEqual(output, expected)
+        delete_orphans.assert_called_once_with(
+            hours=6,
+            batch_size=500,
+            dry_run=False,
+            rate=50.0,
+        )
+        self.assertFalse(models.UploadSession.objects.exists())
+
+    def test_dry_run(self):
+        with mock.patch.object(attachments, 'delete_orphans') as delete_orphans:
+            delete_orphans.return_value = (2, 3)
+            output = self.call(dry_run=True)
+        expected = (
+            '2 unattached attachments, 3 orphaned files and 0 abandoned uploads would be '
+            'deleted.\n'
+        )
+        self.assertEqual(output, expected)
+        self.assertEqual(delete_orphans.call_args[1]['hours'], 24)
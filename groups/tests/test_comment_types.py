@@ -0,0 +1,139 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.test import TestCase
+
+from . import factories
+from .. import comment_types, models
+
+
+class TestCommentType(TestCase):
+    def test_template_compiled_once(self):
+        comment_type = comment_types.CommentType(
+            models.TextComment,
+            'groups/text_comment.html',
+        )
+        comment = factories.TextCommentFactory.create()
+        loader = mock.Mock(wraps=comment_types.loader)
+        with mock.patch.object(comment_types, 'loader', loader):
+            comment_type.render(comment, request=None)
+            html = comment_type.render(comment, request=None)
+        self.assertIn(comment.body, html)
+        loader.get_template.assert_called_once_with('groups/text_comment.html')
+
+    def test_template_debug(self):
+        """Templates are read afresh each time with DEBUG on, so edits show up."""
+        comment_type = comment_types.CommentType(
+            models.TextComment,
+            'groups/text_comment.html',
+        )
+        comment = factories.TextCommentFactory.create()
+        loader = mock.Mock(wraps=comment_types.loader)
+        with self.settings(DEBUG=True):
+            with mock.patch.object(comment_types, 'loader', loader):
+                comment_type.render(comment, request=None)
+                comment_type.render(comment, request=None)
+        self.assertEqual(loader.get_template.call_count, 2)
+
+    def test_apply(self):
+        comment_type = comment_types.CommentType(
+            models.TextComment,
+            'groups/text_comment.html',
+            select_related=('user',),
+            prefetch_related=('attachments',),
+        )
+        comment = factories.TextCommentFactory.create()
+        factories.AttachedFileFactory.create(attached_to=comment)
+
+        with self.assertNumQueries(2):
+            comments = list(comment_type.apply(models.TextComment.objects.all()))
+            self.assertEqual(comments[0].user, comment.user)
+            self.assertEqual(len(comments[0].attachments.all()), 1)
+
+    def test_apply_nothing(self):
+        comment_type = comment_types.CommentType(models.ArchivedComment, 'template.html')
+        queryset = models.ArchivedComment.objects.all()
+        self.assertIs(comment_type.apply(queryset), queryset)
+
+    def test_serialise(self):
+        comment = factories.TextCommentFactory.create()
+        comment_type = comment_types.registry.get(models.TextComment)
+        data = comment_type.serialise(comment)
+        self.assertEqual(data['id'], comment.pk)
+        self.assertEqual(data['type'], 'textcomment')
+        self.assertEqual(data['anchor'], comment.get_pagejump_anchor())
+        self.assertIn(comment.body, data['html'])
+
+    def test_custom_serialiser(self):
+        comment = factories.TextCommentFactory.create()
+        serialiser = mock.Mock(return_value={'id': comment.pk})
+        comment_type = comment_types.CommentType(
+            models.TextComment,
+            'groups/text_comment.html',
+            serialiser=serialiser,
+        )
+        self.assertEqual(comment_type.serialise(comment), {'id': comment.pk})
+        serialiser.assert_called_once_with(comment_type, comment)
+
+
+class TestCommentTypeRegistry(TestCase):
+    def test_autodiscover(self):
+        """Every model displayed as a comment is registered when the app is ready."""
+        registry = comment_types.registry
+        expected = {models.BaseComment, models.TextComment, models.ArchivedComment}
+        self.assertTrue(expected <= set(registry.types))
+
+        text = registry.get(models.TextComment)
+        self.assertEqual(text.template_name, 'groups/text_comment.html')
+        self.assertEqual(text.select_related, ('user',))
+        self.assertEqual(text.prefetch_related, ('attachments',))
+        archived = registry.get(models.ArchivedComment)
+        self.assertEqual(archived.template_name, 'groups/archived_comment.html')
+        self.assertEqual(archived.prefetch_related, ())
+
+    def test_autodiscover_keeps_registered(self):
+        """Types registered before the app is ready aren't replaced."""
+        registry = comment_types.CommentTypeRegistry()
+        custom = registry.register(models.TextComment, template_name='custom.html')
+        registry.autodiscover()
+        self.assertIs(registry.get(models.TextComment), custom)
+
+    def test_get_parent(self):
+        registry = comment_types.CommentTypeRegistry()
+        base = registry.register(models.BaseComment)
+        self.assertIs(registry.get(models.TextComment), base)
+        self.assertIsNone(base.template_name)
+
+    def test_get_unregistered(self):
+        registry = comment_types.CommentTypeRegistry()
+        with self.assertRaises(LookupError):
+            registry.get(models.TextComment)
+
+    def test_load(self):
+        """Comments of different types are each loaded with their own relations."""
+        text = factories.TextCommentFactory.create()
+        factories.AttachedFileFactory.create(attached_to=text)
+        archived = models.ArchivedComment.objects.create(
+            id=text.pk + 1,
+            discussion=text.discussion,
+            user=text.user,
+            date_created=text.date_created,
+        )
+        comments = [
+            models.TextComment.objects.get(pk=text.pk),
+            models.ArchivedComment.objects.get(pk=archived.pk),
+        ]
+
+        # Users of the text comments, their attachments, and users of the archived.
+        with self.assertNumQueries(3):
+            self.assertEqual(comment_types.registry.load(comments), comments)
+        with self.assertNumQueries(0):
+            for comment in comments:
+                comment.user
+            list(comments[0].attachments.all())
+
+    def test_load_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(comment_types.registry.load([]), [])
@@ -0,0 +1,90 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import json
+
+from django.test import TestCase
+
+from . import factories
+from .. import events
+
+
+class TestLocalBroker(TestCase):
+    def setUp(self):
+        self.broker = events.LocalBroker()
+
+    def test_publish(self):
+        """Messages go to every subscriber to the channel, and no one else."""
+        first = self.broker.subscribe('channel')
+        second = self.broker.subscribe('channel')
+        other = self.broker.subscribe('other')
+
+        self.broker.publish('channel', 'message')
+
+        self.assertEqual(first.get(timeout=0), 'message')
+        self.assertEqual(second.get(timeout=0), 'message')
+        self.assertIsNone(other.get(timeout=0))
+
+    def test_publish_no_subscribers(self):
+        self.broker.publish('channel', 'message')
+        self.assertEqual(self.broker.subscriptions, {})
+
+    def test_close(self):
+        first = self.broker.subscribe('channel')
+        second = self.broker.subscribe('channel')
+
+        first.close()
+        self.assertEqual(self.broker.subscriptions, {'channel': {second}})
+        second.close()
+        self.assertEqual(self.broker.subscriptions, {})
+
+
+class TestBaseBroker(TestCase):
+    def test_not_implemented(self):
+        broker = events.BaseBroker()
+        with self.assertRaises(NotImplementedError):
+            broker.publish('channel', 'message')
+        with self.assertRaises(NotImplementedError):
+            broker.subscribe('channel')
+
+
+class TestGetBroker(TestCase):
+    def test_get_broker(self):
+        """The configured broker is created once and then reused."""
+        broker = events.get_broker()
+        self.assertIsInstance(broker, events.LocalBroker)
+        self.assertIs(events.get_broker(), broker)
+
+    def test_get_broker_configured(self):
+        path = 'groups.apps.GroupsConfig.event_broker_class_path'
+        with mock.patch(path, new='groups.events.BaseBroker'):
+            self.assertIsInstance(events.get_broker(), events.BaseBroker)
+
+
+class TestPublishComment(TestCase):
+    def test_publish_comment(self):
+        """The rendered comment is published when the transaction commits."""
+        comment = factories.TextCommentFactory.create()
+        subscription = events.get_broker().subscribe(
+            events.discussion_channel(comment.discussion_id),
+        )
+        self.addCleanup(subscription.close)
+
+        with mock.patch('groups.events.on_commit') as on_commit:
+            events.publish_comment(comment)
+        self.assertIsNone(subscription.get(timeout=0))
+
+        on_commit.call_args[0][0]()
+        message = json.loads(subscription.get(timeout=0))
+        self.assertEqual(message['id'], comment.pk)
+        self.assertEqual(message['type'], 'textcomment')
+        self.assertEqual(message['anchor'], 'c{}'.format(comment.pk))
+        self.assertIn(comment.body, message['html'])
+
+    def test_format_event(self):
+        self.assertEqual(
+            events.format_event(42, '{}'),
+            'id: 42\nevent: comment\ndata: {}\n\n',
+        )
@@ -0,0 +1,240 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import six
+from incuna_test_utils.compat import Python2AssertMixin
+
+from . import factories
+from .. import export, models
+from ..management.commands import export_groups
+
+
+class TestIterCommentRows(Python2AssertMixin, TestCase):
+    def test_rows(self):
+        comment = factories.TextCommentFactory.create(
+            date_created=datetime.datetime(2017, 1, 1),
+        )
+        attachment = factories.AttachedFileFactory.create(attached_to=comment)
+
+        rows = list(export.iter_comment_rows(models.BaseComment.objects.all()))
+        expected = {
+            'id': comment.pk,
+            'group_id': comment.discussion.group_id,
+            'group': comment.discussion.group.name,
+            'discussion_id': comment.discussion_id,
+            'discussion': comment.discussion.name,
+            'user_id': comment.user_id,
+            'date_created': datetime.datetime(2017, 1, 1),
+            'state': 'ok',
+            'body': comment.body,
+            'attachments': [attachment.file.name],
+        }
+        self.assertEqual(rows, [expected])
+
+    def test_chunks(self):
+        """Each chunk of comments takes two queries, however many attachments exist."""
+        comments = factories.TextCommentFactory.create_batch(3)
+        for comment in comments:
+            factories.AttachedFileFactory.create_batch(2, attached_to=comment)
+
+        queryset = models.BaseComment.objects.all()
+        with self.assertNumQueries(5):  # Two chunks of two queries, then an empty one.
+            rows = list(export.iter_comment_rows(queryset, chunk_size=2))
+        self.assertEqual([row['id'] for row in rows], [c.pk for c in comments])
+
+    def test_after(self):
+        first, second = factories.TextCommentFactory.create_batch(2)
+
+        queryset = models.BaseComment.objects.all()
+        rows = list(export.iter_comment_rows(queryset, after=first.pk))
+        self.assertEqual([row['id'] for row in rows], [second.pk])
+
+
+class TestIterAllCommentRows(TestCase):
+    def test_archived(self):
+        """Archived comments are merged in with the live ones, in primary key order."""
+        discussion = factories.DiscussionFactory.create()
+        factories.TextCommentFactory.create(id=10, discussion=discussion)
+        factories.TextCommentFactory.create(id=30, discussion=discussion)
+        archived = factories.ArchivedCommentFactory.create(id=20, discussion=discussion)
+        factories.ArchivedCommentFactory.create()  # On another group.
+
+        rows = list(export.iter_all_comment_rows(discussion.group))
+        self.assertEqual([row['id'] for row in rows], [10, 20, 30])
+        self.assertEqual(rows[1]['body'], archived.body)
+        self.assertEqual(rows[1]['attachments'], [])
+
+
+class TestFormatters(TestCase):
+    row = {
+        'id': 1,
+        'group_id': 2,
+        'group': 'A "group"',
+        'discussion_id': 3,
+        'discussion': 'Discussion',
+        'user_id': 4,
+        'date_created': datetime.datetime(2017, 1, 1),
+        'state': 'ok',
+        'body': None,
+        'attachments': ['one.png', 'two.png'],
+    }
+
+    def test_format_ndjson(self):
+        line = export.format_ndjson(self.row)
+        self.assertTrue(line.endswith('\n'))
+        self.assertEqual(json.loads(line), dict(
+            self.row,
+            date_created='2017-01-01T00:00:00',
+        ))
+
+    def test_format_csv(self):
+        line = export.format_csv(self.row)
+        expected = (
+            '"1","2","A ""group""","3","Discussion","4","2017-01-01T00:00:00","ok","",'
+            '"one.png two.png"\r\n'
+        )
+        self.assertEqual(line, expected)
+
+    def test_csv_header(self):
+        expected = (
+            'id,group_id,group,discussion_id,discussion,user_id,date_created,state,'
+            'body,attachments\r\n'
+        )
+        self.assertEqual(export.csv_header(), expected)
+
+
+class TestExportComments(TestCase):
+    def test_export_comments(self):
+        comments = factories.TextCommentFactory.create_batch(3)
+        stream = six.StringIO()
+        checkpoints = []
+
+        count = export.export_comments(stream, chunk_size=2, on_chunk=checkpoints.append)
+        self.assertEqual(count, 3)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [
+            comment.pk for comment in comments
+        ])
+        self.assertEqual(checkpoints, [comments[1].pk, comments[2].pk])
+
+    def test_export_comments_csv(self):
+        comment = factories.TextCommentFactory.create()
+        factories.TextCommentFactory.create()  # On a different group.
+        stream = six.StringIO()
+
+        group = comment.discussion.group
+        export.export_comments(stream, group, export_format='csv')
+        self.assertEqual(stream.getvalue().count('\r\n'), 1)
+        self.assertIn(comment.body, stream.getvalue())
+
+
+class TestExportGroupsCommand(Python2AssertMixin, TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'export')
+        self.checkpoint = os.path.join(self.directory, 'checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def call(self, *args, **kwargs):
+        call_command('export_groups', self.output, stdout=six.StringIO(), *args, **kwargs)
+
+    def read_lines(self, opener=io.open):
+        with opener(self.output, 'rb') as output:
+            return output.read().decode('utf-8').splitlines()
+
+    def test_export(self):
+        comment = factories.TextCommentFactory.create()
+        self.call()
+        self.assertEqual(json.loads(self.read_lines()[0])['id'], comment.pk)
+
+    def test_group(self):
+        comment = factories.TextCommentFactory.create()
+        factories.TextCommentFactory.create()
+
+        self.call(group=comment.discussion.group_id, export_format='csv')
+        lines = self.read_lines()
+        self.assertEqual(lines[0], export.csv_header().strip())
+        self.assertEqual(len(lines), 2)
+
+    def test_missing_group(self):
+        with self.assertRaises(CommandError):
+            self.call(group=42)
+
+    def test_gzip(self):
+        factories.TextCommentFactory.create_batch(2)
+        self.call(compress=True)
+        self.assertEqual(len(self.read_lines(opener=gzip.open)), 2)
+
+    def test_resume(self):
+        """A checkpointed export carries on from the last comment it wrote."""
+        first = factories.TextCommentFactory.create()
+        self.call(checkpoint=self.checkpoint)
+        with io.open(self.checkpoint) as checkpoint:
+            expected = '{} {}'.format(first.pk, os.path.getsize(self.output))
+            self.assertEqual(checkpoint.read(), expected)
+
+        second = factories.TextCommentFactory.create()
+        self.call(checkpoint=self.checkpoint)
+        ids = [json.loads(line)['id'] for line in self.read_lines()]
+        self.assertEqual(ids, [first.pk, second.pk])
+
+    def kill_after_first_checkpoint(self, **kwargs):
+        """
+        Export, then leave the output and checkpoint as they'd be if the export had
+        been killed partway through writing the chunk after its first checkpoint.
+        """
+        write_checkpoint = export_groups.Command.write_checkpoint
+        patch = mock.patch.object(
+            export_groups.Command,
+            'write_checkpoint',
+            wraps=write_checkpoint,
+        )
+        with patch as write:
+            self.call(checkpoint=self.checkpoint, chunk_size=2, **kwargs)
+        write_checkpoint(*write.call_args_list[0][0])
+        with io.open(self.output, 'ab') as output:
+            output.write(b'\x1f\x8b\x08{"id": ')
+
+    def test_resume_killed(self):
+        """Anything written after the last checkpoint is replaced, not repeated."""
+        comments = factories.TextCommentFactory.create_batch(3)
+        self.kill_after_first_checkpoint()
+
+        self.call(checkpoint=self.checkpoint, chunk_size=2)
+
+        ids = [json.loads(line)['id'] for line in self.read_lines()]
+        self.assertEqual(ids, [comment.pk for comment in comments])
+
+    def test_resume_killed_gzip(self):
+        comments = factories.TextCommentFactory.create_batch(3)
+        self.kill_after_first_checkpoint(compress=True, export_format='csv')
+
+        self.call(checkpoint=self.checkpoint, chunk_size=2, compress=True,
+                  export_format='csv')
+
+        lines = self.read_lines(opener=gzip.open)
+        self.assertEqual(lines[0], export.csv_header().strip())
+        ids = [int(line.split(',')[0].strip('"')) for line in lines[1:]]
+        self.assertEqual(ids, [comment.pk for comment in comments])
+
+    def test_resume_missing_output(self):
+        factories.TextCommentFactory.create()
+        self.call(checkpoint=self.checkpoint)
+        os.remove(self.output)
+        with self.assertRaises(CommandError):
+            self.call(checkpoint=self.checkpoint)
@@ -1,5 +1,13 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 from bs4 import BeautifulSoup
 from crispy_forms.utils import render_crispy_form
+from django.core.cache import cache
+from django.template import Context, Template, TemplateSyntaxError
+from django.test import TestCase
 from incuna_test_utils.compat import Python2AssertMixin
 from incuna_test_utils.factories.images import uploadable_file
 
@@ -25,7 +33,7 @@ class TestAddTextComment(Python2AssertMixin, RequestTestCase):
     model = models.TextComment
 
     def test_form_fields(self):
-        expected = ['body']
+        expected = ['body', 'parent']
         fields = self.form.base_fields.keys()
         self.assertCountEqual(fields, expected)
 
@@ -53,6 +61,12 @@ class TestAddTextComment(Python2AssertMixin, RequestTestCase):
         button = get_button(self.form())
         self.assertEqual(button.get('type'), 'submit')
 
+    def test_helper_shared(self):
+        """Each form class builds its helper once, and every instance shares it."""
+        self.assertIs(self.form().helper, self.form().helper)
+        other = forms.AddTextCommentWithAttachment()
+        self.assertIsNot(self.form().helper, other.helper)
+
 
 class TestAddTextCommentWithAttachment(Python2AssertMixin, RequestTestCase):
     form = forms.AddTextCommentWithAttachment
@@ -179,3 +193,86 @@ class TestSubscribeForm(Python2AssertMixin, RequestTestCase):
         self.discussion.subscribers.add(self.user)
         button = get_button(self.get_form())
         self.assertEqual(button.string, 'Unsubscribe')
+
+    def test_form_action(self):
+        form = self.get_form()
+        expected = '/groups/discussions/{}/subscribe/'.format(self.discussion.pk)
+        self.assertEqual(form.helper.form_action, expected)
+
+    def test_render_button(self):
+        """The button's HTML is cached, with the CSRF token filled in each time."""
+        cache.clear()
+        form = self.get_form()
+        render = mock.Mock(wraps=render_crispy_form)
+        with mock.patch.object(forms, 'render_crispy_form', render):
+            first = form.render_button('token-one')
+            second = self.get_form().render_button('token-two')
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first.replace('token-one', 'token-two'), second)
+        self.assertIn("value='token-one'", first)
+        self.assertNotIn(forms.SubscribeForm.csrf_placeholder, second)
+
+    def test_render_button_state(self):
+        """Subscribe and unsubscribe buttons are cached separately."""
+        cache.clear()
+        subscribe = self.get_form().render_button('token')
+        self.discussion.subscribers.add(self.user)
+        unsubscribe = self.get_form().render_button('token')
+        self.assertIn('Subscribe', subscribe)
+        self.assertIn('Unsubscribe', unsubscribe)
+
+    def test_render_button_no_token(self):
+        for token in ('', 'NOTPROVIDED'):
+            html = self.get_form().render_button(token)
+            self.assertIn("value=''", html)
+
+    def test_render_button_bound(self):
+        """A submitted form isn't cached."""
+        form = self.get_form(data={'subscribe': 'True'})
+        with mock.patch.object(forms.cache, 'set') as cache_set:
+            html = form.render_button('token')
+        self.assertFalse(cache_set.called)
+        self.assertIn("value='token'", html)
+
+
+class TestModerationForm(TestCase):
+    def test_save(self):
+        comment, other = factories.TextCommentFactory.create_batch(2)
+        form = forms.ModerationForm(
+            comments=models.BaseComment.objects.filter(pk=comment.pk),
+            data={'action': models.BaseComment.STATE_HIDDEN, 'comments': [comment.pk]},
+        )
+
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.save(), 1)
+        comment.refresh_from_db()
+        self.assertTrue(comment.is_hidden())
+
+    def test_other_comments(self):
+        """Only comments from the queryset the form was given can be chosen."""
+        comment, other = factories.TextCommentFactory.create_batch(2)
+        form = forms.ModerationForm(
+            comments=models.BaseComment.objects.filter(pk=comment.pk),
+            data={'action': models.BaseComment.STATE_HIDDEN, 'comments': [other.pk]},
+        )
+        self.assertFalse(form.is_valid())
+        self.assertIn('comments', form.errors)
+
+
+class TestSubscribeButtonTag(RequestTestCase):
+    def test_render(self):
+        discussion = factories.DiscussionFactory.create()
+        form = forms.SubscribeForm(
+            user=discussion.creator,
+            instance=discussion,
+            url_name='discussion-subscribe',
+        )
+        source = '{% load groups_tags %}{% subscribe_button discussion-subscribe-form %}'
+        context = Context({'discussion-subscribe-form': form, 'csrf_token': 'token'})
+        html = Template(source).render(context)
+        self.assertIn('Subscribe', html)
+        self.assertIn("value='token'", html)
+
+    def test_syntax_error(self):
+        with self.assertRaises(TemplateSyntaxError):
+            Template('{% load groups_tags %}{% subscribe_button %}')
@@ -1,12 +1,21 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 import datetime
+from unittest import skipUnless
 
-from django.contrib.auth.models import User
-from django.db import models as django_models
+from django.apps import apps as django_apps
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection, IntegrityError, models as django_models
+from django.db.models.query import QuerySet
 from django.test import TestCase
+from django.utils import timezone
 from incuna_test_utils.compat import Python2AssertMixin
 
 from . import factories
-from .. import managers, models
+from .. import managers, models, revisions, signals
 
 
 class TestGroupManager(Python2AssertMixin, TestCase):
@@ -46,6 +55,18 @@ class TestGroupManager(Python2AssertMixin, TestCase):
         results = models.Group.objects.within_days()
         self.assertCountEqual([comment.discussion.group], results)
 
+    def test_within_days_config(self):
+        """The default number of days is read from the app config when it's used."""
+        comment = factories.TextCommentFactory.create(
+            date_created=timezone.now() - datetime.timedelta(days=10),
+        )
+        config = django_apps.get_app_config('groups')
+
+        self.assertCountEqual([], models.Group.objects.within_days())
+        with mock.patch.object(config, 'default_within_days', 30):
+            results = models.Group.objects.within_days()
+        self.assertCountEqual([comment.discussion.group], results)
+
     def test_within_time(self):
         comment = factories.TextCommentFactory.create()
         factories.TextCommentFactory.create(date_created=datetime.date(1970, 1, 1))
@@ -81,6 +102,48 @@ class TestGroupManager(Python2AssertMixin, TestCase):
 
         self.assertCountEqual([group], models.Group.objects.within_time(delta))
 
+    def test_visible_to(self):
+        """Private groups are only visible to their members and moderators."""
+        public = factories.GroupFactory.create()
+        joined, moderated = factories.GroupFactory.create_batch(2, is_private=True)
+        factories.GroupFactory.create(is_private=True)
+        user = factories.UserFactory.create()
+        joined.members_if_private.add(user)
+        moderated.moderators.add(user)
+
+        results = models.Group.objects.visible_to(user)
+        self.assertCountEqual([public, joined, moderated], results)
+
+    def test_visible_to_anonymous(self):
+        public = factories.GroupFactory.create()
+        factories.GroupFactory.create(is_private=True)
+
+        results = models.Group.objects.visible_to(AnonymousUser())
+        self.assertCountEqual([public], results)
+
+    def test_visible_to_staff(self):
+        """Staff skip the membership check entirely."""
+        groups = [
+            factories.GroupFactory.create(),
+            factories.GroupFactory.create(is_private=True),
+        ]
+        admin = factories.AdminFactory.create()
+
+        with self.assertNumQueries(1):
+            results = list(models.Group.objects.visible_to(admin))
+        self.assertCountEqual(groups, results)
+
+    def test_visible_to_single_query(self):
+        """Visibility is resolved in SQL without duplicating rows."""
+        group = factories.GroupFactory.create(is_private=True)
+        user = factories.UserFactory.create()
+        group.members_if_private.add(user)
+        group.moderators.add(user)
+
+        with self.assertNumQueries(1):
+            results = list(models.Group.objects.visible_to(user))
+        self.assertEqual([group], results)
+
 
 class TestDiscussionManager(Python2AssertMixin, TestCase):
     def test_for_group(self):
@@ -164,6 +227,113 @@ class TestDiscussionManager(Python2AssertMixin, TestCase):
 
         self.assertCountEqual([discussion], models.Discussion.objects.within_time(delta))
 
+    def test_visible_to(self):
+        public = factories.DiscussionFactory.create()
+        joined = factories.DiscussionFactory.create(group__is_private=True)
+        factories.DiscussionFactory.create(group__is_private=True)
+        user = factories.UserFactory.create()
+        joined.group.members_if_private.add(user)
+
+        results = models.Discussion.objects.visible_to(user)
+        self.assertCountEqual([public, joined], results)
+
+    def test_visible_to_staff(self):
+        discussions = [
+            factories.DiscussionFactory.create(),
+            factories.DiscussionFactory.create(group__is_private=True),
+        ]
+        admin = factories.AdminFactory.create()
+
+        results = models.Discussion.objects.visible_to(admin)
+        self.assertCountEqual(discussions, results)
+
+    def test_with_unread_count(self):
+        user = factories.UserFactory.create()
+        read, unread, unopened = factories.DiscussionFactory.create_batch(3)
+        first = factories.TextCommentFactory.create(discussion=read)
+        factories.TextCommentFactory.create(discussion=unread)
+        factories.TextCommentFactory.create(discussion=unread, user=user)
+        factories.TextCommentFactory.create_batch(2, discussion=unopened)
+        factories.ReadMarkerFactory.create(
+            user=user,
+            discussion=read,
+            last_read_comment_id=first.pk,
+        )
+        factories.ReadMarkerFactory.create(user=user, discussion=unread)
+        factories.TextCommentFactory.create(discussion=read)
+        factories.TextCommentFactory.create(discussion=unread)
+
+        with self.assertNumQueries(1):
+            results = {
+                discussion.pk: discussion.unread_count
+                for discussion in models.Discussion.objects.with_unread_count(user)
+            }
+
+        # The user's own comment isn't unread.
+        self.assertEqual(results, {read.pk: 1, unread.pk: 2, unopened.pk: 2})
+
+    def test_with_unread_count_last_updated(self):
+        """Assert the count can be combined with the aggregate GroupDetail uses."""
+        user = factories.UserFactory.create()
+        comment = factories.TextCommentFactory.create()
+        factories.TextCommentFactory.create(discussion=comment.discussion)
+
+        discussions = models.Discussion.objects.with_last_updated()
+        discussion = discussions.with_unread_count(user).get()
+
+        self.assertEqual(discussion.unread_count, 2)
+        latest = comment.discussion.comments.last()
+        self.assertEqual(discussion.last_updated, latest.date_created)
+
+    def test_with_unread_count_anonymous(self):
+        factories.DiscussionFactory.create()
+
+        discussion = models.Discussion.objects.with_unread_count(AnonymousUser()).get()
+        self.assertFalse(hasattr(discussion, 'unread_count'))
+
+    def test_with_thread_activity(self):
+        user = factories.UserFactory.create()
+        discussion, other = factories.DiscussionFactory.create_batch(2)
+        comment = factories.TextCommentFactory.create(discussion=discussion)
+        factories.AttachedFileFactory.create(
+            attached_to=comment,
+            date_processed=datetime.datetime(2017, 1, 1),
+        )
+        factories.ReactionCountFactory.create(comment=comment)
+        factories.ReactionFactory.create(comment=comment, user=user)
+        factories.ReactionFactory.create(comment=comment, kind='love', user=user)
+        factories.ReactionFactory.create(comment=comment)
+        discussion.subscribe(user)
+
+        with self.assertNumQueries(1):
+            results = {
+                result.pk: result
+                for result in models.Discussion.objects.with_thread_activity(user)
+            }
+
+        result = results[discussion.pk]
+        self.assertIsNotNone(result.last_processed)
+        self.assertIsNotNone(result.last_reacted)
+        self.assertEqual(result.own_reaction_count, 2)
+        self.assertIsNotNone(result.last_own_reaction)
+        self.assertEqual(result.subscribed, 1)
+
+        result = results[other.pk]
+        self.assertIsNone(result.last_processed)
+        self.assertIsNone(result.last_reacted)
+        self.assertEqual(result.own_reaction_count, 0)
+        self.assertIsNone(result.last_own_reaction)
+        self.assertEqual(result.subscribed, 0)
+
+    def test_with_thread_activity_anonymous(self):
+        comment = factories.TextCommentFactory.create()
+        factories.ReactionFactory.create(comment=comment)
+
+        results = models.Discussion.objects.with_thread_activity(AnonymousUser())
+        result = results.get()
+        self.assertEqual(result.own_reaction_count, 0)
+        self.assertEqual(result.subscribed, 0)
+
     def test_with_last_updated(self):
         discussion = factories.DiscussionFactory.create()
         latest = factories.TextCommentFactory.create(
@@ -178,6 +348,161 @@ class TestDiscussionManager(Python2AssertMixin, TestCase):
         last_updated = models.Discussion.objects.with_last_updated()
         self.assertEqual(last_updated.get().last_updated, latest.date_created)
 
+    def test_start(self):
+        group = factories.GroupFactory.create()
+        user = factories.UserFactory.create()
+
+        discussion = models.Discussion.objects.start(group, user, 'Name', 'First!')
+
+        self.assertEqual(discussion.group, group)
+        self.assertEqual(discussion.creator, user)
+        self.assertEqual(discussion.name, 'Name')
+        self.assertEqual(discussion.subscribers.get(), user)
+        comment = discussion.comments.get()
+        self.assertEqual((comment.body, comment.user), ('First!', user))
+
+
+class TestBatchedWriteQuerySet(TestCase):
+    def test_not_implemented(self):
+        queryset = managers.BatchedWriteQuerySet(model=models.ReadMarker)
+        with self.assertRaises(NotImplementedError):
+            queryset.get_when(1, 2, 3)
+        with self.assertRaises(NotImplementedError):
+            queryset.get_update([])
+
+
+class TestReadMarkerQuerySet(TestCase):
+    def test_record(self):
+        user = factories.UserFactory.create()
+        discussion, other = factories.DiscussionFactory.create_batch(2)
+        marker = factories.ReadMarkerFactory.create(
+            user=user,
+            discussion=discussion,
+            last_read_comment_id=3,
+        )
+
+        # Selects of the markers, the users and the discussions, an update and an
+        # insert, plus two savepoints and their releases.
+        with self.assertNumQueries(9):
+            models.ReadMarker.objects.record({
+                (user.pk, discussion.pk): 7,
+                (user.pk, other.pk): 5,
+            })
+
+        marker.refresh_from_db()
+        self.assertEqual(marker.last_read_comment_id, 7)
+        created = models.ReadMarker.objects.get(user=user, discussion=other)
+        self.assertEqual(created.last_read_comment_id, 5)
+
+    def test_record_never_goes_back(self):
+        marker = factories.ReadMarkerFactory.create(last_read_comment_id=7)
+        key = (marker.user_id, marker.discussion_id)
+
+        models.ReadMarker.objects.record({key: 4})
+
+        marker.refresh_from_db()
+        self.assertEqual(marker.last_read_comment_id, 7)
+
+    def test_record_only_matching_pairs(self):
+        """Assert other markers for the same users and discussions are left alone."""
+        user, other_user = factories.UserFactory.create_batch(2)
+        discussion, other_discussion = factories.DiscussionFactory.create_batch(2)
+        marker = factories.ReadMarkerFactory.create(
+            user=user,
+            discussion=other_discussion,
+            last_read_comment_id=1,
+        )
+
+        models.ReadMarker.objects.record({
+            (user.pk, discussion.pk): 5,
+            (other_user.pk, other_discussion.pk): 5,
+        })
+
+        marker.refresh_from_db()
+        self.assertEqual(marker.last_read_comment_id, 1)
+        self.assertEqual(models.ReadMarker.objects.count(), 3)
+
+    def test_record_nothing(self):
+        with self.assertNumQueries(0):
+            models.ReadMarker.objects.record({})
+
+    def test_record_deleted_discussion(self):
+        """Markers for discussions that have gone are dropped."""
+        user = factories.UserFactory.create()
+        discussion = factories.DiscussionFactory.create()
+        models.ReadMarker.objects.record({(user.pk, discussion.pk + 1): 5})
+        self.assertFalse(models.ReadMarker.objects.exists())
+
+    def test_record_created_concurrently(self):
+        """Assert the batch is retried if someone else creates a marker mid-batch."""
+        user = factories.UserFactory.create()
+        discussion = factories.DiscussionFactory.create()
+        bulk_create = QuerySet.bulk_create
+        calls = []
+
+        def racing_bulk_create(self, objs, *args, **kwargs):
+            calls.append(len(objs))
+            if len(calls) == 1:
+                raise IntegrityError
+            return bulk_create(self, objs, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'bulk_create', racing_bulk_create):
+            models.ReadMarker.objects.record({(user.pk, discussion.pk): 5})
+
+        self.assertEqual(calls, [1, 1])
+        marker = models.ReadMarker.objects.get()
+        self.assertEqual(marker.last_read_comment_id, 5)
+
+
+class TestReactionCountQuerySet(TestCase):
+    def test_record(self):
+        comment, other = factories.TextCommentFactory.create_batch(2)
+        count = factories.ReactionCountFactory.create(comment=comment, count=3)
+
+        # Selects of the counts and the comments, an update and an insert, plus two
+        # savepoints and their releases.
+        with self.assertNumQueries(8):
+            models.ReactionCount.objects.record({
+                (comment.pk, 'like'): 2,
+                (comment.pk, 'love'): 1,
+                (other.pk, 'like'): -1,
+            })
+
+        count.refresh_from_db()
+        self.assertEqual(count.count, 5)
+        created = models.ReactionCount.objects.exclude(pk=count.pk)
+        self.assertCountEqual(
+            created.values_list('comment_id', 'kind', 'count'),
+            [(comment.pk, 'love', 1), (other.pk, 'like', -1)],
+        )
+
+    def test_record_adds(self):
+        """Counts are added to as they are in the database, not as they were read."""
+        count = factories.ReactionCountFactory.create(count=3)
+        key = (count.comment_id, count.kind)
+        update = QuerySet.update
+
+        def racing_update(self, **kwargs):
+            # Another process saves its changes first.
+            update(models.ReactionCount.objects.filter(pk=count.pk), count=10)
+            return update(self, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', racing_update):
+            models.ReactionCount.objects.record({key: 2})
+
+        count.refresh_from_db()
+        self.assertEqual(count.count, 12)
+
+    def test_record_nothing(self):
+        with self.assertNumQueries(0):
+            models.ReactionCount.objects.record({(1, 'like'): 0})
+
+    def test_record_deleted_comment(self):
+        """Changes to comments that have gone are dropped."""
+        comment = factories.TextCommentFactory.create()
+        models.ReactionCount.objects.record({(comment.pk + 1, 'like'): 1})
+        self.assertFalse(models.ReactionCount.objects.exists())
+
 
 class TestCommentManager(Python2AssertMixin, TestCase):
     def test_for_group(self):
@@ -248,6 +573,418 @@ class TestCommentManager(Python2AssertMixin, TestCase):
 
         may_delete_values = [comment.user_may_delete for comment in results]
         self.assertCountEqual([True, False], may_delete_values)
+        may_edit_values = [comment.user_may_edit for comment in results]
+        self.assertCountEqual([True, False], may_edit_values)
+
+    def test_with_user_may_delete_queries(self):
+        """Each type's relations are loaded once for all its comments."""
+        comments = factories.TextCommentFactory.create_batch(3)
+        for comment in comments:
+            factories.AttachedFileFactory.create(attached_to=comment)
+        user = factories.UserFactory.create()
+
+        # Comments, their text, their users and their attachments.
+        with self.assertNumQueries(4):
+            results = models.BaseComment.objects.with_user_may_delete(user)
+            for comment in results:
+                comment.user.username
+                list(comment.attachments.all())
+
+    def test_visible_to(self):
+        public = factories.TextCommentFactory.create()
+        moderated = factories.TextCommentFactory.create(
+            discussion__group__is_private=True,
+        )
+        factories.TextCommentFactory.create(discussion__group__is_private=True)
+        user = factories.UserFactory.create()
+        moderated.discussion.group.moderators.add(user)
+
+        results = models.BaseComment.objects.visible_to(user)
+        self.assertCountEqual([public, moderated], results)
+
+    def test_visible_to_staff(self):
+        comments = [
+            factories.TextCommentFactory.create(),
+            factories.TextCommentFactory.create(discussion__group__is_private=True),
+        ]
+        admin = factories.AdminFactory.create()
+
+        results = models.BaseComment.objects.visible_to(admin)
+        self.assertCountEqual(comments, results)
+
+    def test_subtree(self):
+        comment = factories.TextCommentFactory.create()
+        reply = factories.TextCommentFactory.create(parent=comment)
+        nested = factories.TextCommentFactory.create(parent=reply)
+        factories.TextCommentFactory.create(discussion=comment.discussion)
+
+        results = models.BaseComment.objects.subtree(comment)
+        self.assertCountEqual(results, [comment, reply, nested])
+        results = models.BaseComment.objects.subtree(reply)
+        self.assertCountEqual(results, [reply, nested])
+
+    def test_subtree_depth(self):
+        comment = factories.TextCommentFactory.create()
+        reply = factories.TextCommentFactory.create(parent=comment)
+        factories.TextCommentFactory.create(parent=reply)
+
+        results = models.BaseComment.objects.subtree(comment, depth=1)
+        self.assertCountEqual(results, [comment, reply])
+
+    def test_with_reply_counts(self):
+        comment = factories.TextCommentFactory.create()
+        factories.TextCommentFactory.create_batch(2, parent=comment)
+
+        results = models.BaseComment.objects.with_reply_counts().filter(depth=0)
+        self.assertEqual([c.reply_count for c in results], [2])
+
+
+class TestSetState(Python2AssertMixin, TestCase):
+    def test_set_state(self):
+        comments = factories.TextCommentFactory.create_batch(3)
+        other = factories.TextCommentFactory.create()
+        ids = [comment.pk for comment in comments]
+
+        # Listing the comments, then locking and updating them, in a savepoint.
+        with self.assertNumQueries(5):
+            count = models.BaseComment.objects.filter(pk__in=ids).set_state('hidden')
+
+        self.assertEqual(count, 3)
+        for comment in comments:
+            comment.refresh_from_db()
+            self.assertEqual(comment.state, models.BaseComment.STATE_HIDDEN)
+            self.assertIsNone(comment.date_deleted)
+        other.refresh_from_db()
+        self.assertEqual(other.state, models.BaseComment.STATE_OK)
+
+    def test_set_state_leaves_body(self):
+        """Only the base table is written, so a body edited meanwhile isn't reverted."""
+        comment = factories.TextCommentFactory.create(body='Before')
+        comments = models.BaseComment.objects.filter(pk=comment.pk)
+        models.TextComment.objects.filter(pk=comment.pk).update(body='After')
+
+        with mock.patch.object(django_models.Model, 'save') as save:
+            comments.set_state(models.BaseComment.STATE_DELETED)
+
+        self.assertFalse(save.called)
+        comment = models.TextComment.objects.get()
+        self.assertEqual(comment.body, 'After')
+        self.assertTrue(comment.is_deleted())
+        self.assertIsNotNone(comment.date_deleted)
+
+    def test_set_state_batches(self):
+        comments = factories.TextCommentFactory.create_batch(3)
+
+        with self.assertNumQueries(7):
+            count = models.BaseComment.objects.all().set_state('deleted', batch_size=2)
+
+        self.assertEqual(count, 3)
+        deleted = models.BaseComment.objects.filter(state='deleted')
+        self.assertCountEqual(deleted, comments)
+
+    def test_set_state_overtaken(self):
+        """Comments another moderator moved first aren't counted, or signalled."""
+        comment, overtaken = factories.TextCommentFactory.create_batch(2)
+        handler = mock.Mock()
+        signals.comment_state_changed.connect(handler)
+        self.addCleanup(signals.comment_state_changed.disconnect, handler)
+        select_for_update = QuerySet.select_for_update
+
+        def overtake(queryset, *args, **kwargs):
+            models.BaseComment.objects.filter(pk=overtaken.pk).update(state='deleted')
+            return select_for_update(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'select_for_update', overtake):
+            count = models.BaseComment.objects.all().set_state('hidden')
+
+        self.assertEqual(count, 1)
+        handler.assert_called_once_with(
+            signal=signals.comment_state_changed,
+            sender=models.BaseComment,
+            comment_ids=[comment.pk],
+            discussion_ids=[comment.discussion_id],
+            state='hidden',
+        )
+        overtaken.refresh_from_db()
+        self.assertTrue(overtaken.is_deleted())
+
+    def test_set_state_all_overtaken(self):
+        comment = factories.TextCommentFactory.create()
+        handler = mock.Mock()
+        signals.comment_state_changed.connect(handler)
+        self.addCleanup(signals.comment_state_changed.disconnect, handler)
+        select_for_update = QuerySet.select_for_update
+
+        def overtake(queryset, *args, **kwargs):
+            models.BaseComment.objects.filter(pk=comment.pk).update(state='deleted')
+            return select_for_update(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'select_for_update', overtake):
+            self.assertEqual(models.BaseComment.objects.all().set_state('hidden'), 0)
+        self.assertFalse(handler.called)
+
+    def test_set_state_unchanged(self):
+        """Comments already in the state aren't counted, and don't send the signal."""
+        comment = factories.TextCommentFactory.create()
+        handler = mock.Mock()
+        signals.comment_state_changed.connect(handler)
+        self.addCleanup(signals.comment_state_changed.disconnect, handler)
+
+        with self.assertNumQueries(1):
+            count = models.BaseComment.objects.all().set_state('ok')
+
+        self.assertEqual(count, 0)
+        self.assertFalse(handler.called)
+        comment.refresh_from_db()
+        self.assertEqual(comment.state, 'ok')
+
+    def test_set_state_transitions(self):
+        """Comments that can't move into the state, such as deleted ones, are skipped."""
+        comment, deleted = factories.TextCommentFactory.create_batch(2)
+        deleted.delete_state()
+
+        count = models.BaseComment.objects.all().set_state('hidden')
+
+        self.assertEqual(count, 1)
+        deleted.refresh_from_db()
+        self.assertTrue(deleted.is_deleted())
+
+    def test_signal(self):
+        comment, other = factories.TextCommentFactory.create_batch(2)
+        factories.TextCommentFactory.create(discussion=comment.discussion)
+        handler = mock.Mock()
+        signals.comment_state_changed.connect(handler)
+        self.addCleanup(signals.comment_state_changed.disconnect, handler)
+
+        models.BaseComment.objects.all().set_state('hidden')
+
+        handler.assert_called_once_with(
+            signal=signals.comment_state_changed,
+            sender=models.BaseComment,
+            comment_ids=mock.ANY,
+            discussion_ids=sorted([comment.discussion_id, other.discussion_id]),
+            state='hidden',
+        )
+        comment_ids = handler.call_args[1]['comment_ids']
+        self.assertCountEqual(comment_ids, models.BaseComment.objects.values_list(
+            'pk',
+            flat=True,
+        ))
+
+
+class TestArchive(Python2AssertMixin, TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.old = self.now - datetime.timedelta(days=100)
+
+    def test_archivable_old(self):
+        old = factories.TextCommentFactory.create(date_created=self.old)
+        factories.TextCommentFactory.create()
+
+        before = self.now - datetime.timedelta(days=1)
+        results = models.BaseComment.objects.archivable(created_before=before)
+        self.assertCountEqual(results, [old])
+
+    def test_archivable_deleted(self):
+        deleted = factories.TextCommentFactory.create()
+        deleted.delete_state()
+        factories.TextCommentFactory.create()  # Not deleted.
+
+        after = self.now + datetime.timedelta(days=1)
+        results = models.BaseComment.objects.archivable(deleted_before=after)
+        self.assertCountEqual(results, [deleted])
+
+        results = models.BaseComment.objects.archivable(deleted_before=self.old)
+        self.assertCountEqual(results, [])
+
+    def test_archivable_nothing(self):
+        factories.TextCommentFactory.create(date_created=self.old)
+        self.assertFalse(models.BaseComment.objects.archivable().exists())
+
+    def test_archivable_attachments(self):
+        """Comments with attachments stay where they are."""
+        comment = factories.TextCommentFactory.create(date_created=self.old)
+        factories.AttachedFileFactory.create(attached_to=comment)
+
+        results = models.BaseComment.objects.archivable(created_before=self.now)
+        self.assertCountEqual(results, [])
+
+    def test_archive(self):
+        text_comment = factories.TextCommentFactory.create(date_created=self.old)
+        base_comment = factories.BaseCommentFactory.create(date_created=self.old)
+        base_comment.delete_state()
+        recent = factories.TextCommentFactory.create()
+
+        archivable = models.BaseComment.objects.archivable(
+            created_before=self.now - datetime.timedelta(days=1),
+        )
+        self.assertEqual(archivable.archive(batch_size=1), 2)
+
+        self.assertSequenceEqual(models.BaseComment.objects.all(), [recent])
+        self.assertFalse(models.TextComment.objects.exclude(pk=recent.pk).exists())
+
+        archived_text, archived_base = models.ArchivedComment.objects.order_by('pk')
+        self.assertEqual(archived_text.pk, text_comment.pk)
+        self.assertEqual(archived_text.discussion, text_comment.discussion)
+        self.assertEqual(archived_text.user, text_comment.user)
+        self.assertEqual(archived_text.date_created, text_comment.date_created)
+        self.assertEqual(archived_text.body, text_comment.body)
+        self.assertEqual(archived_base.pk, base_comment.pk)
+        self.assertEqual(archived_base.body, '')
+        self.assertTrue(archived_base.is_deleted())
+
+    def test_archivable_related(self):
+        """Comments with history, reactions or mentions aren't archived, or lost."""
+        edited, reacted, mentioned = factories.TextCommentFactory.create_batch(
+            3,
+            date_created=self.old,
+        )
+        revisions.edit(edited, 'Edited', edited.user)
+        factories.ReactionFactory.create(comment=edited)
+        factories.ReactionFactory.create(comment=reacted)
+        factories.MentionFactory.create(comment=mentioned)
+
+        archivable = models.BaseComment.objects.archivable(created_before=self.now)
+        self.assertEqual(archivable.archive(), 0)
+
+        self.assertEqual(models.BaseComment.objects.count(), 3)
+        self.assertEqual(edited.revisions.count(), 2)
+        self.assertEqual(models.Reaction.objects.count(), 2)
+        self.assertEqual(models.Mention.objects.count(), 1)
+        self.assertFalse(models.ArchivedComment.objects.exists())
+
+
+class TestBulkCreateComments(Python2AssertMixin, TestCase):
+    features_path = 'django.db.backends.base.features.BaseDatabaseFeatures'
+
+    def build_comments(self, count, **kwargs):
+        discussion = factories.DiscussionFactory.create()
+        return factories.TextCommentFactory.build_batch(
+            count,
+            discussion=discussion,
+            user=discussion.creator,
+            **kwargs
+        )
+
+    def test_bulk_create_comments(self):
+        comments = self.build_comments(3)
+
+        created = models.BaseComment.objects.bulk_create_comments(comments)
+        self.assertEqual(created, comments)
+
+        # The comments come back out of the database as their proper subclass.
+        results = models.BaseComment.objects.order_by('pk')
+        self.assertSequenceEqual(results, comments)
+        self.assertEqual(
+            [comment.body for comment in results],
+            [comment.body for comment in comments],
+        )
+        self.assertTrue(all(isinstance(c, models.TextComment) for c in results))
+
+    def test_saved_state(self):
+        """The created instances behave like saved ones."""
+        comment = self.build_comments(1)[0]
+        models.BaseComment.objects.bulk_create_comments([comment])
+
+        self.assertFalse(comment._state.adding)
+        comment.delete_state()
+        self.assertTrue(models.TextComment.objects.get().is_deleted())
+
+    def test_mixed_types(self):
+        text_comment = self.build_comments(1)[0]
+        base_comment = factories.BaseCommentFactory.build(
+            discussion=text_comment.discussion,
+            user=text_comment.user,
+        )
+
+        models.BaseComment.objects.bulk_create_comments([base_comment, text_comment])
+        results = models.BaseComment.objects.order_by('pk')
+        self.assertEqual(
+            [type(comment) for comment in results],
+            [models.BaseComment, models.TextComment],
+        )
+
+    def test_batch_size(self):
+        """Child rows are inserted with one query per batch."""
+        comments = self.build_comments(4)
+        original = QuerySet._insert
+        with mock.patch.object(
+            QuerySet,
+            '_insert',
+            autospec=True,
+            side_effect=original,
+        ) as insert:
+            models.BaseComment.objects.bulk_create_comments(comments, batch_size=2)
+
+        child_inserts = [
+            call[0][1] for call in insert.call_args_list
+            if call[0][0].model == models.TextComment
+        ]
+        self.assertEqual(child_inserts, [comments[:2], comments[2:]])
+
+    def test_ids_returned_one_at_a_time(self):
+        """Backends that can't return ids from a bulk insert still get them set."""
+        comments = self.build_comments(2)
+        feature = self.features_path + '.can_return_ids_from_bulk_insert'
+        with mock.patch(feature, False, create=True):
+            models.BaseComment.objects.bulk_create_comments(comments)
+
+        self.assertCountEqual(models.TextComment.objects.all(), comments)
+
+    def test_ids_returned_in_bulk_mocked(self):
+        """Backends that can return ids from a bulk insert get them in one INSERT."""
+        comments = self.build_comments(2)
+        fields = models.BaseComment._meta.local_concrete_fields
+        manager = models.BaseComment._base_manager
+        feature = self.features_path + '.can_return_ids_from_bulk_insert'
+        with mock.patch(feature, True, create=True):
+            with mock.patch.object(manager, '_insert', return_value=[7, 8]) as insert:
+                pks = models.BaseComment.objects._insert_returning_ids(
+                    models.BaseComment,
+                    comments,
+                    fields,
+                    'default',
+                )
+
+        self.assertEqual(pks, [7, 8])
+        insert.assert_called_once_with(
+            comments,
+            fields=fields,
+            return_id=True,
+            using='default',
+        )
+
+    @skipUnless(
+        getattr(connection.features, 'can_return_ids_from_bulk_insert', False),
+        'The database cannot return ids from a bulk insert.',
+    )
+    def test_ids_returned_in_bulk(self):
+        comments = self.build_comments(2)
+        models.BaseComment.objects.bulk_create_comments(comments)
+
+        self.assertCountEqual(models.TextComment.objects.all(), comments)
+
+    def test_replies(self):
+        """Replies to saved comments are given their paths."""
+        parent = factories.TextCommentFactory.create()
+        comment = self.build_comments(1, parent=parent)[0]
+
+        models.BaseComment.objects.bulk_create_comments([comment])
+
+        comment = models.BaseComment.objects.get(pk=comment.pk)
+        self.assertEqual(comment.path, '{}/'.format(parent.pk))
+        self.assertEqual(comment.depth, 1)
+
+    def test_attachments(self):
+        comments = self.build_comments(2)
+        attachments = [
+            (comment, factories.AttachedFileFactory.build(user=comment.user))
+            for comment in comments
+        ]
+
+        models.BaseComment.objects.bulk_create_comments(comments, attachments)
+        for comment in comments:
+            self.assertEqual(comment.attachments.count(), 1)
 
 
 class TestWithinDaysQuerySetMixin(Python2AssertMixin, TestCase):
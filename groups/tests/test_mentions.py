@@ -0,0 +1,72 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.apps import apps
+from django.test import TestCase
+
+from . import factories
+from .. import mentions, models
+
+
+class TestParse(TestCase):
+    def test_parse(self):
+        text = '@alice, have you seen this?  Ask @bob.smith or @carol_1.'
+        self.assertEqual(mentions.parse(text), ['alice', 'bob.smith', 'carol_1'])
+
+    def test_parse_email_address(self):
+        """Email addresses aren't mentions."""
+        self.assertEqual(mentions.parse('Write to dave@example.com, @@eve'), [])
+
+    def test_parse_repeats(self):
+        self.assertEqual(mentions.parse('@alice @bob @alice'), ['alice', 'bob'])
+
+    def test_parse_limit(self):
+        config = apps.get_app_config('groups')
+        with mock.patch.object(config, 'max_mentions_per_comment', 2):
+            usernames = mentions.parse('@alice @bob @carol')
+        self.assertEqual(usernames, ['alice', 'bob'])
+
+
+class TestRecord(TestCase):
+    def test_record(self):
+        """Every mentioned user is looked up at once, and their mentions saved at once."""
+        alice, bob = factories.UserFactory.create_batch(2)
+        comment = factories.TextCommentFactory.create(
+            body='@{} @{} @nobody'.format(alice.username, bob.username),
+        )
+
+        # The users, the mentions already recorded, and the new mentions.
+        with self.assertNumQueries(3):
+            users = mentions.record(comment)
+
+        self.assertCountEqual(users, [alice, bob])
+        recorded = models.Mention.objects.filter(comment=comment)
+        self.assertCountEqual([mention.user for mention in recorded], [alice, bob])
+
+    def test_record_author(self):
+        """Authors who mention themselves aren't recorded."""
+        comment = factories.TextCommentFactory.create()
+        comment.body = '@{}'.format(comment.user.username)
+
+        self.assertEqual(mentions.record(comment), [])
+        self.assertFalse(models.Mention.objects.exists())
+
+    def test_record_again(self):
+        """Recording a comment's mentions again doesn't duplicate them."""
+        alice, bob = factories.UserFactory.create_batch(2)
+        comment = factories.TextCommentFactory.create(body='@' + alice.username)
+        mentions.record(comment)
+
+        comment.body = '@{} @{}'.format(alice.username, bob.username)
+        mentions.record(comment)
+
+        recorded = models.Mention.objects.filter(comment=comment)
+        self.assertCountEqual([mention.user for mention in recorded], [alice, bob])
+
+    def test_record_no_body(self):
+        """Comments without text mention nobody, and cost no queries."""
+        comment = factories.BaseCommentFactory.create()
+        with self.assertNumQueries(0):
+            self.assertEqual(mentions.record(comment), [])
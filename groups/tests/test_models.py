@@ -1,11 +1,19 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 import datetime
 
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
 from django.core import signing
 from django.test import TestCase
 from incuna_test_utils.compat import Python2AssertMixin
 
 from . import factories
-from .. import models
+from .. import models, signals
 
 
 class TestGroup(Python2AssertMixin, TestCase):
@@ -33,6 +41,36 @@ class TestGroup(Python2AssertMixin, TestCase):
         group = factories.GroupFactory.create()
         self.assertEqual(str(group), group.name)
 
+    def test_filter_readers_public(self):
+        """Everyone can read a public group."""
+        group = factories.GroupFactory.create()
+        users = factories.UserFactory.create_batch(2)
+
+        readers = group.filter_readers(get_user_model().objects.all())
+        self.assertCountEqual(readers, users)
+
+    def test_filter_readers_private(self):
+        """Only members, moderators and staff can read a private group."""
+        group = factories.GroupFactory.create(is_private=True)
+        member, moderator = factories.UserFactory.create_batch(2)
+        admin = factories.AdminFactory.create()
+        factories.UserFactory.create()  # An outsider.
+        group.members_if_private.add(member)
+        group.moderators.add(moderator)
+
+        readers = group.filter_readers(get_user_model().objects.all())
+        self.assertCountEqual(readers, [member, moderator, admin])
+
+    def test_may_moderate(self):
+        group = factories.GroupFactory.create()
+        moderator, user = factories.UserFactory.create_batch(2)
+        group.moderators.add(moderator)
+
+        self.assertTrue(group.may_moderate(moderator))
+        self.assertTrue(group.may_moderate(factories.AdminFactory.create()))
+        self.assertFalse(group.may_moderate(user))
+        self.assertFalse(group.may_moderate(AnonymousUser()))
+
     def test_get_all_comments(self):
         """Assert this method returns all comments on the group and no more."""
         group = factories.GroupFactory.create()
@@ -83,6 +121,12 @@ class TestDiscussion(Python2AssertMixin, TestCase):
 
             # From BaseComment
             'comments',
+
+            # From ArchivedComment
+            'archived_comments',
+
+            # From ReadMarker
+            'read_markers',
         ]
         self.assertCountEqual(fields, expected)
 
@@ -134,7 +178,15 @@ class TestBaseComment(Python2AssertMixin, TestCase):
             'user',
             'date_created',
             'state',
+            'date_deleted',
             'attachments',
+            'mentions',
+            'reactions',
+            'reaction_counts',
+            'parent',
+            'path',
+            'depth',
+            'replies',
 
             'polymorphic_ctype',
             'textcomment',
@@ -156,10 +208,51 @@ class TestBaseComment(Python2AssertMixin, TestCase):
         expected = '/groups/discussions/{}/#c{}'.format(comment.discussion.pk, comment.pk)
         self.assertEqual(comment.get_absolute_url(), expected)
 
+    def test_reply(self):
+        """A reply's path and depth are set from its parent's when it's saved."""
+        comment = factories.TextCommentFactory.create()
+        reply = factories.TextCommentFactory.create(
+            discussion=comment.discussion,
+            parent=comment,
+        )
+        self.assertEqual(reply.path, '{}/'.format(comment.pk))
+        self.assertEqual(reply.depth, 1)
+        self.assertEqual(list(comment.replies.all()), [reply])
+
+    def test_reply_max_depth(self):
+        """Replies to the deepest comments are made replies to their parent."""
+        comment = factories.TextCommentFactory.create()
+        reply = factories.TextCommentFactory.create(parent=comment)
+        config = apps.get_app_config('groups')
+
+        with mock.patch.object(config, 'max_reply_depth', 1):
+            deeper = factories.TextCommentFactory.create(parent=reply)
+
+        self.assertEqual(deeper.parent, comment)
+        self.assertEqual(deeper.path, reply.path)
+        self.assertEqual(deeper.depth, 1)
+
+    def test_get_absolute_url_deep(self):
+        """Replies too deep for the discussion's page link to the page they're on."""
+        comment = factories.TextCommentFactory.create()
+        reply = factories.TextCommentFactory.create(parent=comment)
+        config = apps.get_app_config('groups')
+
+        with mock.patch.object(config, 'thread_page_depth', 1):
+            url = reply.get_absolute_url()
+
+        expected = '/groups/comments/{}/replies/#c{}'.format(comment.pk, reply.pk)
+        self.assertEqual(url, expected)
+
     def test_may_be_deleted_comment_user(self):
         comment = factories.TextCommentFactory.create()
         self.assertTrue(comment.may_be_deleted(comment.user))
 
+    def test_may_be_edited(self):
+        """Comments without text have nothing to edit."""
+        comment = factories.BaseCommentFactory.create()
+        self.assertFalse(comment.may_be_edited(comment.user))
+
     def test_may_be_deleted_admin(self):
         comment = factories.TextCommentFactory.create()
         admin = factories.AdminFactory.create()
@@ -180,6 +273,7 @@ class TestBaseComment(Python2AssertMixin, TestCase):
         self.assertEqual(comment.state, comment.STATE_OK)
         comment.delete_state()
         self.assertEqual(comment.state, comment.STATE_DELETED)
+        self.assertIsNotNone(comment.date_deleted)
 
     def test_is_deleted(self):
         comment = factories.TextCommentFactory.create()
@@ -187,6 +281,86 @@ class TestBaseComment(Python2AssertMixin, TestCase):
         comment.delete_state()
         self.assertTrue(comment.is_deleted())
 
+    def test_delete_state_query(self):
+        """Deleting is a single UPDATE, which leaves the body alone."""
+        comment = factories.TextCommentFactory.create(body='Before')
+        models.TextComment.objects.filter(pk=comment.pk).update(body='After')
+
+        with self.assertNumQueries(1):
+            self.assertTrue(comment.delete_state())
+
+        comment = models.TextComment.objects.get(pk=comment.pk)
+        self.assertTrue(comment.is_deleted())
+        self.assertEqual(comment.body, 'After')
+
+    def test_transition(self):
+        comment = factories.TextCommentFactory.create()
+        handler = mock.Mock()
+        signals.comment_state_changed.connect(handler)
+        self.addCleanup(signals.comment_state_changed.disconnect, handler)
+
+        self.assertTrue(comment.transition(comment.STATE_HIDDEN))
+
+        self.assertTrue(comment.is_hidden())
+        self.assertIsNone(comment.date_deleted)
+        comment.refresh_from_db()
+        self.assertTrue(comment.is_hidden())
+        handler.assert_called_once_with(
+            signal=signals.comment_state_changed,
+            sender=models.BaseComment,
+            comment_ids=[comment.pk],
+            discussion_ids=[comment.discussion_id],
+            state=comment.STATE_HIDDEN,
+        )
+
+    def test_transition_race(self):
+        """A moderator acting on an out-of-date copy of a comment changes nothing."""
+        comment = factories.TextCommentFactory.create()
+        stale = models.BaseComment.objects.get(pk=comment.pk)
+        comment.transition(comment.STATE_HIDDEN)
+        handler = mock.Mock()
+        signals.comment_state_changed.connect(handler)
+        self.addCleanup(signals.comment_state_changed.disconnect, handler)
+
+        self.assertFalse(stale.transition(comment.STATE_DELETED))
+
+        self.assertEqual(stale.state, comment.STATE_OK)
+        comment.refresh_from_db()
+        self.assertTrue(comment.is_hidden())
+        self.assertFalse(handler.called)
+
+    def test_transition_not_allowed(self):
+        comment = factories.TextCommentFactory.create()
+        comment.delete_state()
+
+        with self.assertRaises(ValueError):
+            comment.transition(comment.STATE_HIDDEN)
+
+    def test_transition_pending(self):
+        comment = factories.TextCommentFactory.create(state='pending')
+        self.assertTrue(comment.is_pending())
+
+        self.assertTrue(comment.transition(comment.STATE_OK))
+        self.assertFalse(comment.is_pending())
+
+    def test_render_pending(self):
+        comment = factories.TextCommentFactory.create(state='pending', body='Unseen')
+        rendered = comment.render(request=None)
+        self.assertIn('(Post awaiting moderation)', rendered)
+        self.assertNotIn('Unseen', rendered)
+
+    def test_is_hidden(self):
+        comment = factories.TextCommentFactory.create()
+        self.assertFalse(comment.is_hidden())
+        comment.state = comment.STATE_HIDDEN
+        self.assertTrue(comment.is_hidden())
+
+    def test_render_hidden(self):
+        comment = factories.TextCommentFactory.create(state='hidden', body='Spam')
+        rendered = comment.render(request=None)
+        self.assertIn('(Post hidden by a moderator)', rendered)
+        self.assertNotIn('Spam', rendered)
+
     def test_str(self):
         comment = factories.TextCommentFactory.create()
         self.assertEqual(
@@ -204,17 +378,79 @@ class TestTextComment(Python2AssertMixin, TestCase):
         expected = [
             'id',
             'body',
+            'version',
+            'date_edited',
+            'revisions',
             'discussion',
             'user',
             'date_created',
             'state',
+            'date_deleted',
             'attachments',
+            'mentions',
+            'reactions',
+            'reaction_counts',
+            'parent',
+            'path',
+            'depth',
+            'replies',
 
             'polymorphic_ctype',
             'basecomment_ptr',
         ]
         self.assertCountEqual(fields, expected)
 
+    def test_may_be_edited(self):
+        """Only the author may edit a comment, and only while it's shown."""
+        comment = factories.TextCommentFactory.create()
+        self.assertTrue(comment.may_be_edited(comment.user))
+        self.assertFalse(comment.may_be_edited(factories.AdminFactory.create()))
+
+        comment.state = comment.STATE_HIDDEN
+        self.assertFalse(comment.may_be_edited(comment.user))
+
+
+class TestArchivedComment(Python2AssertMixin, TestCase):
+    def test_fields(self):
+        fields = [f.name for f in models.ArchivedComment._meta.get_fields()]
+        expected = [
+            'id',
+            'discussion',
+            'user',
+            'date_created',
+            'state',
+            'body',
+            'date_archived',
+        ]
+        self.assertCountEqual(fields, expected)
+
+    def test_get_pagejump_anchor(self):
+        """Archived comments keep the anchor of the comment they were archived from."""
+        comment = factories.ArchivedCommentFactory.create(id=42)
+        self.assertEqual(comment.get_pagejump_anchor(), 'c42')
+
+    def test_get_absolute_url(self):
+        comment = factories.ArchivedCommentFactory.create()
+        expected = '/groups/discussions/{}/?archived=1#c{}'.format(
+            comment.discussion.pk,
+            comment.pk,
+        )
+        self.assertEqual(comment.get_absolute_url(), expected)
+
+    def test_render(self):
+        comment = factories.ArchivedCommentFactory.create()
+        self.assertIn(comment.body, comment.render(request=None))
+
+    def test_render_deleted(self):
+        comment = factories.ArchivedCommentFactory.create(state='deleted')
+        self.assertTrue(comment.is_deleted())
+        self.assertNotIn(comment.body, comment.render(request=None))
+
+    def test_str(self):
+        comment = factories.ArchivedCommentFactory.create()
+        expected = 'Archived comment on Discussion #{}'.format(comment.discussion_id)
+        self.assertEqual(str(comment), expected)
+
 
 class TestAttachedFile(Python2AssertMixin, TestCase):
     def test_fields(self):
@@ -225,10 +461,83 @@ class TestAttachedFile(Python2AssertMixin, TestCase):
             'user',
             'date_created',
             'attached_to',
+            'size',
+            'mime_type',
+            'width',
+            'height',
+            'thumbnail',
+            'preview',
+            'date_processed',
+            'upload_session',
         ]
         self.assertCountEqual(fields, expected)
 
+    def test_is_image(self):
+        self.assertTrue(models.AttachedFile(mime_type='image/png').is_image())
+        self.assertFalse(models.AttachedFile(mime_type='text/plain').is_image())
+        self.assertFalse(models.AttachedFile().is_image())
+
     def test_short_filename(self):
         filename = '/groups/file_comments/test_attached_file_comment.txt'
         comment = factories.AttachedFileFactory.create(file__filename=filename)
         self.assertEqual(comment.short_filename(), 'test_attached_file_comment.txt')
+
+
+class TestUploadSession(TestCase):
+    def test_str(self):
+        session = factories.UploadSessionFactory.create(filename='notes.txt')
+        self.assertEqual(str(session), 'Upload of notes.txt')
+
+    def test_is_complete(self):
+        session = factories.UploadSessionFactory.create()
+        self.assertFalse(session.is_complete())
+        session.attachment = factories.AttachedFileFactory.create()
+        self.assertTrue(session.is_complete())
+
+
+class TestReadMarker(TestCase):
+    def test_str(self):
+        marker = factories.ReadMarkerFactory.create(user__username='reader')
+        expected = 'Read marker for reader on Discussion #{}'.format(
+            marker.discussion_id,
+        )
+        self.assertEqual(str(marker), expected)
+
+
+class TestMention(TestCase):
+    def test_str(self):
+        mention = factories.MentionFactory.create(user__username='alice')
+        expected = 'Mention of alice in Comment #{}'.format(mention.comment_id)
+        self.assertEqual(str(mention), expected)
+
+
+class TestCommentRevision(TestCase):
+    def test_str(self):
+        comment = factories.TextCommentFactory.create()
+        revision = models.CommentRevision.objects.create(
+            comment=comment,
+            number=2,
+            user=comment.user,
+            data=b'',
+        )
+        expected = 'Revision 2 of Comment #{}'.format(comment.pk)
+        self.assertEqual(str(revision), expected)
+
+
+class TestReaction(TestCase):
+    def test_str(self):
+        reaction = factories.ReactionFactory.create(user__username='alice')
+        expected = 'like from alice on Comment #{}'.format(reaction.comment_id)
+        self.assertEqual(str(reaction), expected)
+
+
+class TestReactionCount(TestCase):
+    def test_str(self):
+        count = factories.ReactionCountFactory.create(count=3)
+        self.assertEqual(str(count), '3 like on Comment #{}'.format(count.comment_id))
+
+
+class TestOutboxMessage(TestCase):
+    def test_str(self):
+        message = factories.OutboxMessageFactory.create(object_id=42)
+        self.assertEqual(str(message), 'New comment #42')
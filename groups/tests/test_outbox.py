@@ -0,0 +1,457 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import datetime
+
+from django.core import mail
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+from incuna_test_utils.compat import Python2AssertMixin
+
+from . import factories
+from .utils import RequestTestCase
+from .. import models, outbox, routers
+
+
+def run_immediately(func, using=None):
+    """Stand in for `transaction.on_commit`, which never fires inside a TestCase."""
+    func()
+
+
+class TestGetReplyAddress(Python2AssertMixin, TestCase):
+    def test_get_reply_address(self):
+        """
+        Assert that the method returns `reply-{uuid}@{domain}`.
+
+        Look for dollar signs ($) instead of colons in the UUID, because we've done some
+        replace work to ensure the email address is legal.
+        """
+        discussion = factories.DiscussionFactory.create()
+        site = outbox.EmailSite('example.com')
+
+        uuid_regex = r'[\d\w\-_$]*'  # A string of alphanumerics, `-`, `_`, and/or `$`
+        self.assertRegex(
+            outbox.get_reply_address(discussion, discussion.creator, site),
+            r'reply-{uuid}@example\.com'.format(uuid=uuid_regex)
+        )
+
+
+class TestRecipients(TestCase):
+    def test_comment_recipients(self):
+        """
+        Test that comment_recipients picks the right users.
+
+        * All subscribers to the discussion,
+        * plus all subscribers to the discussion's parent group,
+        * minus everyone who ignored the discussion,
+        * minus the user who posted the comment.
+        """
+        (
+            group_subscriber,  # Will be notified.
+            discussion_subscriber,  # Will also be notified.
+            discussion_ignorer,  # A group subscriber, but ignores the discussion = no.
+            comment_poster,  # The poster isn't notified regardless of subscriptions.
+            unrelated_user,  # Not subscribed at all = no notifications.
+        ) = factories.UserFactory.create_batch(5)
+
+        group = factories.GroupFactory.create()
+        discussion = factories.DiscussionFactory.create(group=group)
+        comment = factories.BaseCommentFactory.create(
+            user=comment_poster,
+            discussion=discussion,
+        )
+
+        # Set up the various subscription preferences as described above.
+        group.watchers = [group_subscriber, discussion_ignorer, comment_poster]
+        discussion.subscribers = [discussion_subscriber, comment_poster]
+        discussion.ignorers = [discussion_ignorer]
+
+        users = outbox.comment_recipients(comment)
+        self.assertEqual(set(users), {group_subscriber, discussion_subscriber})
+
+    def test_comment_recipients_private(self):
+        """Subscribers who can no longer read a private group aren't notified."""
+        member, former_member = factories.UserFactory.create_batch(2)
+        group = factories.GroupFactory.create(is_private=True)
+        group.members_if_private.add(member)
+        group.watchers = [member, former_member]
+        comment = factories.BaseCommentFactory.create(discussion__group=group)
+
+        users = outbox.comment_recipients(comment)
+        self.assertEqual(set(users), {member})
+
+    def test_comment_recipients_mentioned(self):
+        """
+        Users mentioned in the comment are notified whether or not they're subscribed,
+        and only once if they are.
+        """
+        subscriber, mentioned, ignorer = factories.UserFactory.create_batch(3)
+        comment = factories.TextCommentFactory.create()
+        comment.discussion.subscribers = [subscriber]
+        comment.discussion.ignorers = [ignorer]
+        for user in [subscriber, mentioned, ignorer]:
+            factories.MentionFactory.create(comment=comment, user=user)
+
+        users = outbox.comment_recipients(comment)
+        self.assertCountEqual(users, [subscriber, mentioned, ignorer])
+
+    def test_comment_recipients_mentioned_private(self):
+        """Users mentioned in a private group they can't read aren't notified."""
+        mentioned = factories.UserFactory.create()
+        comment = factories.TextCommentFactory.create(discussion__group__is_private=True)
+        factories.MentionFactory.create(comment=comment, user=mentioned)
+
+        self.assertFalse(outbox.comment_recipients(comment).exists())
+
+    def test_comment_recipients_watching_groups(self):
+        """A mentioned user who watches several groups is only notified once."""
+        mentioned = factories.UserFactory.create()
+        comment = factories.TextCommentFactory.create()
+        comment.discussion.group.watchers.add(mentioned)
+        factories.GroupFactory.create().watchers.add(mentioned)
+        factories.MentionFactory.create(comment=comment, user=mentioned)
+
+        self.assertEqual(list(outbox.comment_recipients(comment)), [mentioned])
+
+    def test_discussion_recipients(self):
+        """Group subscribers are notified, apart from the discussion's creator."""
+        subscriber, creator = factories.UserFactory.create_batch(2)
+        group = factories.GroupFactory.create()
+        group.watchers = [subscriber, creator]
+        discussion = factories.DiscussionFactory.create(creator=creator, group=group)
+
+        users = outbox.discussion_recipients(discussion)
+        self.assertEqual(set(users), {subscriber})
+
+    def test_discussion_recipients_mentioned(self):
+        """Users mentioned in the discussion's first comment are notified too."""
+        subscriber, mentioned = factories.UserFactory.create_batch(2)
+        discussion = factories.DiscussionFactory.create()
+        discussion.group.watchers = [subscriber]
+        first_comment = factories.TextCommentFactory.create(discussion=discussion)
+        factories.MentionFactory.create(comment=first_comment, user=mentioned)
+
+        users = outbox.discussion_recipients(discussion, first_comment)
+        self.assertCountEqual(users, [subscriber, mentioned])
+
+    def test_discussion_recipients_watching_groups(self):
+        """A mentioned user who watches several groups is only notified once."""
+        mentioned = factories.UserFactory.create()
+        discussion = factories.DiscussionFactory.create()
+        discussion.group.watchers.add(mentioned)
+        factories.GroupFactory.create().watchers.add(mentioned)
+        first_comment = factories.TextCommentFactory.create(discussion=discussion)
+        factories.MentionFactory.create(comment=first_comment, user=mentioned)
+
+        users = outbox.discussion_recipients(discussion, first_comment)
+        self.assertEqual(list(users), [mentioned])
+
+
+class TestSendEmails(TestCase):
+    site = outbox.EmailSite('testserver')
+    reply_address = 'leeroy@jenkins.com'
+    address_path = 'groups.outbox.get_reply_address'
+
+    def test_send_comment_emails(self):
+        """
+        Test notification emails for a new comment.
+
+        The recipient logic is tested above, so we can mock it here.  Same with
+        get_reply_address, which is awkward to assert otherwise.
+        """
+        subscriber = factories.UserFactory.create()
+        discussion = factories.DiscussionFactory.create()
+        comment = factories.TextCommentFactory.create(discussion=discussion)
+
+        recipients_path = 'groups.outbox.comment_recipients'
+        with mock.patch(recipients_path, return_value=[subscriber]):
+            with mock.patch(self.address_path, return_value=self.reply_address):
+                outbox.send_comment_emails(comment, self.site, 'http')
+
+        self.assertEqual(len(mail.outbox), 1)
+        email = mail.outbox[0]
+        self.assertEqual(email.subject, 'New comment on {}'.format(discussion.name))
+        self.assertEqual(email.to, [subscriber.email])
+        self.assertEqual(email.reply_to, [self.reply_address])
+        self.assertIn('A new comment has been posted', email.body)
+        self.assertIn(subscriber.get_full_name(), email.body)
+        self.assertIn(comment.body, email.body)
+        self.assertIn('http://testserver', email.body)
+
+    def test_send_discussion_emails(self):
+        """Test notification emails for a new discussion."""
+        group = factories.GroupFactory.create()
+        subscriber = factories.UserFactory.create()
+        discussion = factories.DiscussionFactory.create(group=group)
+        first_comment = factories.TextCommentFactory.create(discussion=discussion)
+
+        recipients_path = 'groups.outbox.discussion_recipients'
+        with mock.patch(recipients_path, return_value=[subscriber]):
+            with mock.patch(self.address_path, return_value=self.reply_address):
+                outbox.send_discussion_emails(discussion, self.site, 'https')
+
+        self.assertEqual(len(mail.outbox), 1)
+        email = mail.outbox[0]
+        self.assertEqual(email.subject, 'New discussion in {}'.format(group.name))
+        self.assertEqual(email.to, [subscriber.email])
+        self.assertEqual(email.reply_to, [self.reply_address])
+        self.assertIn('A new discussion on "{}"'.format(discussion.name), email.body)
+        self.assertIn(subscriber.get_full_name(), email.body)
+        self.assertIn(first_comment.body, email.body)
+        self.assertIn('https://testserver', email.body)
+
+    def test_send_comment_emails_mentions(self):
+        """Mentions are recorded, and mentioned users emailed, once per comment."""
+        subscriber, mentioned = factories.UserFactory.create_batch(2)
+        comment = factories.TextCommentFactory.create(
+            body='@{} and @{}, look.'.format(subscriber.username, mentioned.username),
+        )
+        comment.discussion.subscribers = [subscriber]
+
+        outbox.send_comment_emails(comment, self.site, 'http')
+
+        self.assertCountEqual([email.to[0] for email in mail.outbox], [
+            subscriber.email,
+            mentioned.email,
+        ])
+        mentions = models.Mention.objects.filter(comment=comment)
+        self.assertCountEqual([m.user for m in mentions], [subscriber, mentioned])
+
+    def test_send_discussion_emails_mentions(self):
+        mentioned = factories.UserFactory.create()
+        discussion = factories.DiscussionFactory.create()
+        factories.TextCommentFactory.create(
+            discussion=discussion,
+            body='Over to you, @{}.'.format(mentioned.username),
+        )
+
+        outbox.send_discussion_emails(discussion, self.site, 'http')
+
+        self.assertEqual([email.to for email in mail.outbox], [[mentioned.email]])
+
+    def build_emails(self, count):
+        return [
+            outbox.build_email(
+                'groups/emails/new_comment.txt',
+                to='{}@example.com'.format(i),
+                subject='Subject',
+                reply_to=self.reply_address,
+                context={},
+            )
+            for i in range(count)
+        ]
+
+    def test_send_emails(self):
+        """Emails are shared between at most `concurrency` connections."""
+        emails = self.build_emails(5)
+        get_connection = mock.Mock(wraps=mail.get_connection)
+        with mock.patch.object(outbox.mail, 'get_connection', get_connection):
+            sent = outbox.send_emails(emails, concurrency=3)
+
+        self.assertEqual(sent, 5)
+        self.assertEqual(get_connection.call_count, 3)
+        self.assertCountEqual([email.to for email in mail.outbox], [e.to for e in emails])
+
+    def test_send_emails_single_connection(self):
+        emails = self.build_emails(2)
+        with mock.patch('multiprocessing.pool.ThreadPool') as pool:
+            sent = outbox.send_emails(emails, concurrency=1)
+
+        self.assertEqual(sent, 2)
+        self.assertFalse(pool.called)
+
+    def test_send_emails_none(self):
+        self.assertEqual(outbox.send_emails([]), 0)
+
+
+class TestEnqueue(RequestTestCase):
+    kind = models.OutboxMessage.KIND_COMMENT
+    on_commit_path = 'groups.outbox.transaction.on_commit'
+
+    def setUp(self):
+        self.subscriber = factories.UserFactory.create()
+        self.comment = factories.TextCommentFactory.create()
+        self.comment.discussion.subscribers.add(self.subscriber)
+
+    def test_enqueue(self):
+        """The message is only sent once the transaction commits."""
+        request = self.create_request(secure=True)
+        with mock.patch(self.on_commit_path) as on_commit:
+            message = outbox.enqueue(self.kind, self.comment, request)
+
+        self.assertEqual(message.object_id, self.comment.pk)
+        self.assertEqual(message.protocol, 'https')
+        self.assertEqual(len(mail.outbox), 0)
+
+        callback = on_commit.call_args[0][0]
+        callback()
+        self.assertEqual(mail.outbox[0].to, [self.subscriber.email])
+        message.refresh_from_db()
+        self.assertIsNotNone(message.date_sent)
+
+    def test_enqueue_for_worker(self):
+        """With `deliver_notifications_on_commit` off, sending is left to workers."""
+        request = self.create_request()
+        config_path = 'groups.apps.GroupsConfig.deliver_notifications_on_commit'
+        with mock.patch(config_path, new=False):
+            with mock.patch(self.on_commit_path, side_effect=run_immediately):
+                message = outbox.enqueue(self.kind, self.comment, request)
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(models.OutboxMessage.objects.pending().get(), message)
+
+    def test_enqueue_already_claimed(self):
+        """A worker that claims the message first is left to send it."""
+        request = self.create_request()
+        with mock.patch(self.on_commit_path) as on_commit:
+            outbox.enqueue(self.kind, self.comment, request)
+
+        claimed = models.OutboxMessage.objects.claim(10)
+        on_commit.call_args[0][0]()
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_on_commit_fallback(self):
+        """Before Django 1.9 there's no `on_commit`, so the message is sent at once."""
+        callback = mock.Mock()
+        with mock.patch.object(outbox, 'transaction', spec=['atomic']):
+            outbox.on_commit(callback)
+        callback.assert_called_once_with()
+
+    def test_on_commit(self):
+        callback = mock.Mock()
+        with mock.patch.object(transaction, 'on_commit') as on_commit:
+            outbox.on_commit(callback, using='default')
+        on_commit.assert_called_once_with(callback, using='default')
+        self.assertFalse(callback.called)
+
+
+class TestDeliver(TestCase):
+    multi_db = True
+
+    def test_deliver(self):
+        subscriber = factories.UserFactory.create()
+        message = factories.OutboxMessageFactory.create()
+        comment = models.BaseComment.objects.get(pk=message.object_id)
+        comment.discussion.subscribers.add(subscriber)
+
+        sent = outbox.deliver(models.OutboxMessage.objects.claim(10))
+
+        self.assertEqual(sent, 1)
+        self.assertEqual(mail.outbox[0].to, [subscriber.email])
+        message.refresh_from_db()
+        self.assertIsNotNone(message.date_sent)
+        self.assertIsNone(message.locked_until)
+        self.assertEqual(message.attempts, 1)
+
+    def test_deliver_discussion(self):
+        subscriber = factories.UserFactory.create()
+        discussion = factories.DiscussionFactory.create()
+        discussion.group.watchers.add(subscriber)
+        factories.OutboxMessageFactory.create(
+            kind=models.OutboxMessage.KIND_DISCUSSION,
+            object_id=discussion.pk,
+        )
+
+        outbox.deliver(models.OutboxMessage.objects.claim(10))
+        self.assertEqual(mail.outbox[0].to, [subscriber.email])
+
+    def test_deliver_deleted(self):
+        """A message about something that's gone is marked as sent without emailing."""
+        message = factories.OutboxMessageFactory.create(object_id=0)
+
+        sent = outbox.deliver(models.OutboxMessage.objects.claim(10))
+
+        self.assertEqual(sent, 1)
+        self.assertEqual(len(mail.outbox), 0)
+        message.refresh_from_db()
+        self.assertIsNotNone(message.date_sent)
+
+    @mock.patch('groups.apps.GroupsConfig.replica_databases', ('replica',))
+    def test_deliver_with_replica(self):
+        """
+        Messages are sent from the primary database, which has the new comment and
+        its mentions before any replica does.
+        """
+        mentioned = factories.UserFactory.create(username='someone')
+        factories.OutboxMessageFactory.create(
+            object_id=factories.TextCommentFactory.create(body='Hi @someone').pk,
+        )
+        routers.set_pinned_to_primary(False)
+        self.addCleanup(routers.set_pinned_to_primary, True)
+
+        self.assertEqual(outbox.deliver(models.OutboxMessage.objects.claim(10)), 1)
+
+        self.assertEqual(mail.outbox[0].to, [mentioned.email])
+        self.assertFalse(routers.is_pinned_to_primary())
+
+    def test_deliver_failure(self):
+        """A failed message keeps its lease, so it isn't retried straight away."""
+        message = factories.OutboxMessageFactory.create()
+
+        send_path = 'groups.outbox.send_message'
+        with mock.patch(send_path, side_effect=ValueError('Nope')):
+            with mock.patch('groups.outbox.logger') as logger:
+                sent = outbox.deliver(models.OutboxMessage.objects.claim(10))
+
+        self.assertEqual(sent, 0)
+        self.assertTrue(logger.exception.called)
+        message.refresh_from_db()
+        self.assertIsNone(message.date_sent)
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('Nope', message.last_error)
+        self.assertFalse(models.OutboxMessage.objects.pending().exists())
+
+    def test_deliver_pending(self):
+        factories.OutboxMessageFactory.create_batch(3)
+
+        self.assertEqual(outbox.deliver_pending(batch_size=2), 3)
+        self.assertFalse(models.OutboxMessage.objects.pending().exists())
+
+
+class TestOutboxQuerySet(TestCase):
+    def test_pending(self):
+        now = timezone.now()
+        pending = factories.OutboxMessageFactory.create()
+        lease_expired = factories.OutboxMessageFactory.create(
+            locked_until=now - datetime.timedelta(seconds=1),
+        )
+        factories.OutboxMessageFactory.create(date_sent=now)
+        factories.OutboxMessageFactory.create(
+            locked_until=now + datetime.timedelta(seconds=60),
+        )
+        factories.OutboxMessageFactory.create(attempts=5)
+
+        self.assertCountEqual(
+            models.OutboxMessage.objects.pending(),
+            [pending, lease_expired],
+        )
+
+    def test_claim(self):
+        """Claimed messages are leased, so they aren't claimed again."""
+        first, second, third = factories.OutboxMessageFactory.create_batch(3)
+
+        claimed = models.OutboxMessage.objects.claim(2, lease_seconds=60)
+
+        self.assertEqual(claimed, [first, second])
+        self.assertGreater(claimed[0].locked_until, timezone.now())
+        self.assertEqual(models.OutboxMessage.objects.claim(2), [third])
+        self.assertEqual(models.OutboxMessage.objects.claim(2), [])
+
+    def test_claim_skip_locked(self):
+        """Where the database can skip locked rows, workers don't wait for each other."""
+        factories.OutboxMessageFactory.create()
+        features_path = (
+            'django.db.backends.sqlite3.features.DatabaseFeatures.'
+            'has_select_for_update_skip_locked'
+        )
+        select_path = 'django.db.models.query.QuerySet.select_for_update'
+        with mock.patch(features_path, new=True):
+            with mock.patch(select_path, autospec=True) as select_for_update:
+                select_for_update.side_effect = lambda queryset, **kwargs: queryset
+                models.OutboxMessage.objects.claim(1)
+
+        self.assertEqual(select_for_update.call_args[1], {'skip_locked': True})
@@ -0,0 +1,116 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.apps import apps
+from django.core.cache import cache
+from django.test import TestCase
+
+from . import factories
+from .utils import EmptyCacheMixin
+from .. import models, ratelimits, signals
+
+
+class TestTokenBucket(EmptyCacheMixin, TestCase):
+    def setUp(self):
+        super(TestTokenBucket, self).setUp()
+        self.bucket = ratelimits.TokenBucket(cache, 'bucket', capacity=4, seconds=60)
+
+    def test_get_tokens_new(self):
+        """A bucket that hasn't been used is full."""
+        self.assertEqual(self.bucket.get_tokens(1000), 4)
+
+    def test_get_tokens_refill(self):
+        """Tokens come back at `capacity` per `seconds`, up to `capacity`."""
+        self.bucket.set_tokens(0.5, 1000)
+
+        self.assertEqual(self.bucket.get_tokens(1015), 1.5)
+        self.assertEqual(self.bucket.get_tokens(2000), 4)
+
+    def test_get_wait(self):
+        self.assertEqual(self.bucket.get_wait(0.5), 8)
+        self.assertEqual(self.bucket.get_wait(0.9), 2)
+
+
+class TestCheckComment(EmptyCacheMixin, TestCase):
+    limits = {'user': (2, 60), 'discussion': (3, 60), 'reply_token': (1, 60)}
+
+    def setUp(self):
+        super(TestCheckComment, self).setUp()
+        self.user = factories.UserFactory.create()
+        self.discussion = factories.DiscussionFactory.create()
+        config = apps.get_app_config('groups')
+        patcher = mock.patch.object(config, 'comment_rate_limits', self.limits)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_user(self):
+        """A user can post `capacity` comments at once, and then has to wait."""
+        ratelimits.check_comment(self.user, self.discussion)
+        ratelimits.check_comment(self.user, self.discussion)
+
+        with self.assertRaises(ratelimits.RateLimited) as cm:
+            ratelimits.check_comment(self.user, self.discussion)
+        self.assertEqual(cm.exception.scope, 'user')
+        self.assertEqual(cm.exception.retry_after, 30)
+
+    def test_user_refill(self):
+        with mock.patch('groups.ratelimits.time.time', return_value=1000):
+            ratelimits.check_comment(self.user, self.discussion)
+            ratelimits.check_comment(self.user, self.discussion)
+        with mock.patch('groups.ratelimits.time.time', return_value=1030):
+            ratelimits.check_comment(self.user, self.discussion)
+
+    def test_discussion(self):
+        """Different users share each discussion's bucket."""
+        for user in factories.UserFactory.create_batch(3):
+            ratelimits.check_comment(user, self.discussion)
+
+        with self.assertRaises(ratelimits.RateLimited) as cm:
+            ratelimits.check_comment(self.user, self.discussion)
+        self.assertEqual(cm.exception.scope, 'discussion')
+
+    def test_rejected_takes_nothing(self):
+        """A refused comment doesn't use up the limits it was within."""
+        ratelimits.check_comment(self.user, self.discussion, reply_token='token')
+        with self.assertRaises(ratelimits.RateLimited):
+            ratelimits.check_comment(self.user, self.discussion, reply_token='token')
+
+        # The user has one comment left, and the discussion two.
+        ratelimits.check_comment(self.user, self.discussion)
+        ratelimits.check_comment(factories.UserFactory.create(), self.discussion)
+
+    def test_reply_token(self):
+        ratelimits.check_comment(self.user, self.discussion, reply_token='token')
+
+        with self.assertRaises(ratelimits.RateLimited) as cm:
+            ratelimits.check_comment(self.user, self.discussion, reply_token='token')
+        self.assertEqual(cm.exception.scope, 'reply_token')
+        ratelimits.check_comment(self.user, self.discussion, reply_token='another')
+
+    def test_unlimited(self):
+        """A scope whose limit is None isn't limited."""
+        limits = dict(self.limits, user=None)
+        with mock.patch.dict(self.limits, limits):
+            for _ in range(3):
+                ratelimits.check_comment(self.user, self.discussion)
+
+    def test_signal(self):
+        """Rejections are reported, for metrics."""
+        ratelimits.check_comment(self.user, self.discussion, reply_token='token')
+        receiver = mock.Mock()
+        signals.comment_rate_limited.connect(receiver)
+        self.addCleanup(signals.comment_rate_limited.disconnect, receiver)
+
+        with self.assertRaises(ratelimits.RateLimited):
+            ratelimits.check_comment(self.user, self.discussion, reply_token='token')
+
+        receiver.assert_called_once_with(
+            signal=signals.comment_rate_limited,
+            sender=models.BaseComment,
+            scope='reply_token',
+            user=self.user,
+            discussion=self.discussion,
+            retry_after=60,
+        )
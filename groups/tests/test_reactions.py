@@ -0,0 +1,154 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.db import DatabaseError
+from django.db.models.query import QuerySet
+from django.test import TestCase
+
+from . import factories
+from .utils import WriteBehindBufferMixin
+from .. import models, reactions
+
+
+class TestReactionBuffer(WriteBehindBufferMixin, TestCase):
+    def setUp(self):
+        super(TestReactionBuffer, self).setUp()
+        self.buffer = reactions.buffer
+
+    def test_add(self):
+        """Changes to the same count are added together."""
+        self.buffer.add((1, 'like'), 1)
+        self.buffer.add((1, 'like'), 1)
+        self.buffer.add((1, 'love'), -1)
+
+        self.assertEqual(self.buffer.pending, {(1, 'like'): 2, (1, 'love'): -1})
+        self.assertFalse(models.ReactionCount.objects.exists())
+
+    def test_get_pending(self):
+        self.buffer.add((1, 'like'), 1)
+        self.buffer.add((2, 'like'), 1)
+        self.assertEqual(self.buffer.get_pending({2, 3}), {(2, 'like'): 1})
+
+    def test_flush(self):
+        count = factories.ReactionCountFactory.create(count=1)
+        self.buffer.add((count.comment_id, count.kind), 2)
+
+        self.buffer.flush()
+
+        count.refresh_from_db()
+        self.assertEqual(count.count, 3)
+
+    def test_flush_failure(self):
+        """A batch that can't be saved is rolled back, and saved once with the next."""
+        count = factories.ReactionCountFactory.create(count=1)
+        comment = factories.TextCommentFactory.create()
+        self.buffer.add((count.comment_id, count.kind), 2)
+        self.buffer.add((comment.pk, 'like'), 1)
+
+        with mock.patch.object(QuerySet, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.buffer.flush()
+        count.refresh_from_db()
+        self.assertEqual(count.count, 1)
+
+        self.buffer.add((comment.pk, 'like'), 1)
+        self.buffer.flush()
+
+        count.refresh_from_db()
+        self.assertEqual(count.count, 3)
+        self.assertEqual(models.ReactionCount.objects.get(comment=comment).count, 2)
+
+
+class TestReactions(WriteBehindBufferMixin, TestCase):
+    def setUp(self):
+        super(TestReactions, self).setUp()
+        self.comment = factories.TextCommentFactory.create()
+        self.user = factories.UserFactory.create()
+
+    def test_react(self):
+        self.assertTrue(reactions.react(self.user, self.comment, 'like'))
+
+        reaction = models.Reaction.objects.get()
+        self.assertEqual(reaction.user, self.user)
+        self.assertEqual(reaction.comment, self.comment)
+        self.assertEqual(reactions.buffer.pending, {(self.comment.pk, 'like'): 1})
+
+    def test_react_twice(self):
+        """A user can only give each reaction once, and isn't counted twice."""
+        reactions.react(self.user, self.comment, 'like')
+        self.assertFalse(reactions.react(self.user, self.comment, 'like'))
+
+        self.assertEqual(models.Reaction.objects.count(), 1)
+        self.assertEqual(reactions.buffer.pending, {(self.comment.pk, 'like'): 1})
+
+    def test_react_unknown(self):
+        with self.assertRaises(ValueError):
+            reactions.react(self.user, self.comment, 'shrug')
+
+    def test_unreact(self):
+        reactions.react(self.user, self.comment, 'like')
+
+        self.assertTrue(reactions.unreact(self.user, self.comment, 'like'))
+
+        self.assertFalse(models.Reaction.objects.exists())
+        self.assertEqual(reactions.buffer.pending, {(self.comment.pk, 'like'): 0})
+        self.assertFalse(reactions.unreact(self.user, self.comment, 'like'))
+
+    def test_flush(self):
+        reactions.react(self.user, self.comment, 'like')
+        reactions.flush()
+        self.assertEqual(models.ReactionCount.objects.get().count, 1)
+
+    def test_get_counts(self):
+        """Saved counts are read in one query, with this process's unsaved changes."""
+        factories.ReactionCountFactory.create(comment=self.comment, count=3)
+        other = factories.TextCommentFactory.create()
+        reactions.react(self.user, self.comment, 'like')
+        reactions.react(self.user, other, 'love')
+
+        with self.assertNumQueries(1):
+            counts = reactions.get_counts([self.comment.pk, other.pk])
+
+        self.assertEqual(counts, {
+            self.comment.pk: {'like': 4},
+            other.pk: {'love': 1},
+        })
+
+    def test_load_counts(self):
+        factories.ReactionCountFactory.create(comment=self.comment, count=2)
+        factories.ReactionCountFactory.create(
+            comment=self.comment,
+            kind='laugh',
+            count=-1,
+        )
+        archived = factories.ArchivedCommentFactory.create()
+
+        reactions.load_counts([self.comment, archived])
+
+        expected = [('like', 2), ('love', 0), ('laugh', 0), ('thanks', 0)]
+        self.assertEqual(self.comment.reaction_totals, expected)
+        self.assertFalse(hasattr(archived, 'reaction_totals'))
+
+    def test_recount(self):
+        """Counts that have drifted are set from the reactions."""
+        factories.ReactionCountFactory.create(comment=self.comment, count=5)
+        factories.ReactionFactory.create_batch(2, comment=self.comment)
+        other = factories.ReactionCountFactory.create(count=7)
+
+        reactions.recount([self.comment.pk])
+
+        counts = models.ReactionCount.objects.filter(comment=self.comment)
+        self.assertEqual(list(counts.values_list('kind', 'count')), [('like', 2)])
+        other.refresh_from_db()
+        self.assertEqual(other.count, 7)
+
+    def test_recount_all(self):
+        factories.ReactionCountFactory.create(count=5)
+        factories.ReactionFactory.create(comment=self.comment, kind='love')
+
+        reactions.recount()
+
+        counts = models.ReactionCount.objects.values_list('comment', 'kind', 'count')
+        self.assertEqual(list(counts), [(self.comment.pk, 'love', 1)])
@@ -0,0 +1,129 @@
+from django.contrib.auth.models import AnonymousUser
+from django.test import TestCase
+from django.utils import timezone
+
+from . import factories
+from .utils import WriteBehindBufferMixin
+from .. import models, read_markers
+
+
+class TestReadMarkerBuffer(WriteBehindBufferMixin, TestCase):
+    def setUp(self):
+        super(TestReadMarkerBuffer, self).setUp()
+        self.buffer = read_markers.buffer
+
+    def test_add(self):
+        """Only the latest comment read in each discussion is kept."""
+        self.buffer.add((1, 2), 5)
+        self.buffer.add((1, 2), 3)
+        self.buffer.add((1, 4), 3)
+
+        self.assertEqual(self.buffer.pending, {(1, 2): 5, (1, 4): 3})
+        self.assertFalse(models.ReadMarker.objects.exists())
+
+    def test_flush(self):
+        marker = factories.ReadMarkerFactory.create()
+        self.buffer.add((marker.user_id, marker.discussion_id), 8)
+
+        self.buffer.flush()
+
+        marker.refresh_from_db()
+        self.assertEqual(marker.last_read_comment_id, 8)
+
+
+class TestMarkRead(WriteBehindBufferMixin, TestCase):
+    def setUp(self):
+        super(TestMarkRead, self).setUp()
+        self.buffer = read_markers.buffer
+
+    def test_mark_read(self):
+        marker = factories.ReadMarkerFactory.build()
+
+        read_markers.mark_read(marker.user, marker.discussion, 3)
+
+        key = (marker.user.pk, marker.discussion.pk)
+        self.assertEqual(self.buffer.pending, {key: 3})
+        self.assertLessEqual(self.buffer.started, timezone.now())
+
+    def test_mark_read_anonymous(self):
+        discussion = factories.DiscussionFactory.create()
+        read_markers.mark_read(AnonymousUser(), discussion, 3)
+        self.assertEqual(self.buffer.pending, {})
+
+    def test_mark_read_no_comments(self):
+        discussion = factories.DiscussionFactory.create()
+        read_markers.mark_read(factories.UserFactory.create(), discussion, 0)
+        self.assertEqual(self.buffer.pending, {})
+
+    def test_flush(self):
+        marker = factories.ReadMarkerFactory.create()
+        read_markers.mark_read(marker.user, marker.discussion, 3)
+
+        read_markers.flush()
+
+        marker.refresh_from_db()
+        self.assertEqual(marker.last_read_comment_id, 3)
+
+    def test_get_last_read(self):
+        marker = factories.ReadMarkerFactory.create(last_read_comment_id=5)
+        user, discussion = marker.user, marker.discussion
+        self.assertEqual(read_markers.get_last_read(user, discussion), 5)
+
+        read_markers.mark_read(user, discussion, 7)
+        self.assertEqual(read_markers.get_last_read(user, discussion), 7)
+
+        other = factories.DiscussionFactory.create()
+        self.assertEqual(read_markers.get_last_read(user, other), 0)
+
+
+class TestMarkPageRead(WriteBehindBufferMixin, TestCase):
+    def setUp(self):
+        super(TestMarkPageRead, self).setUp()
+        self.user = factories.UserFactory.create()
+        self.discussion = factories.DiscussionFactory.create()
+        self.first, self.hidden, self.last = factories.TextCommentFactory.create_batch(
+            3,
+            discussion=self.discussion,
+        )
+        self.key = (self.user.pk, self.discussion.pk)
+
+    def mark(self, not_shown_ids):
+        comments = self.discussion.comments.all()
+        shown_ids = [pk for pk in comments.values_list('pk', flat=True)
+                     if pk not in not_shown_ids]
+        not_shown = comments.filter(pk__in=not_shown_ids)
+        read_markers.mark_page_read(self.user, self.discussion, shown_ids, not_shown)
+
+    def test_all_shown(self):
+        self.mark([])
+        self.assertEqual(read_markers.buffer.pending, {self.key: self.last.pk})
+
+    def test_not_shown(self):
+        """The marker stops before an older comment that wasn't shown."""
+        self.mark([self.hidden.pk])
+        self.assertEqual(read_markers.buffer.pending, {self.key: self.hidden.pk - 1})
+
+    def test_not_shown_already_read(self):
+        factories.ReadMarkerFactory.create(
+            user=self.user,
+            discussion=self.discussion,
+            last_read_comment_id=self.hidden.pk,
+        )
+        self.mark([self.hidden.pk])
+        self.assertEqual(read_markers.buffer.pending, {self.key: self.last.pk})
+
+    def test_not_shown_own(self):
+        """The viewer's own comments never count as unread."""
+        self.hidden.user = self.user
+        self.hidden.save()
+        self.mark([self.hidden.pk])
+        self.assertEqual(read_markers.buffer.pending, {self.key: self.last.pk})
+
+    def test_anonymous(self):
+        read_markers.mark_page_read(
+            AnonymousUser(),
+            self.discussion,
+            [self.last.pk],
+            self.discussion.comments.none(),
+        )
+        self.assertEqual(read_markers.buffer.pending, {})
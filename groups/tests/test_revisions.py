@@ -0,0 +1,111 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.apps import apps
+from django.test import TestCase
+
+from . import factories
+from .. import models, revisions, signals
+
+
+class TestDiff(TestCase):
+    def test_round_trip(self):
+        old = 'The quick brown fox\njumps over the lazy dog.'
+        new = 'The quick red fox\njumps over the dog.  Twice!'
+
+        diff = revisions.make_diff(old, new)
+
+        self.assertEqual(revisions.apply_diff(old, diff), new)
+
+    def test_unchanged_words_not_stored(self):
+        """Only the new words are kept; the rest are slices of the old text."""
+        old = ' '.join(['word{}'.format(n) for n in range(100)])
+        new = old.replace('word50', 'changed')
+
+        diff = revisions.make_diff(old, new)
+
+        self.assertEqual(diff, [[0, 100], 'changed', [101, 199]])
+        self.assertLess(len(revisions.encode(diff)), len(revisions.encode(new)) / 4)
+
+
+class TestEdit(TestCase):
+    def setUp(self):
+        self.comment = factories.TextCommentFactory.create(body='First version')
+        self.editor = self.comment.user
+
+    def test_edit(self):
+        """The first edit keeps the original body as revision 1."""
+        self.assertTrue(revisions.edit(self.comment, 'Second version', self.editor))
+
+        comment = models.TextComment.objects.get(pk=self.comment.pk)
+        self.assertEqual(comment.body, 'Second version')
+        self.assertEqual(comment.version, 2)
+        self.assertIsNotNone(comment.date_edited)
+        self.assertTrue(comment.is_edited())
+        history = revisions.get_history(comment)
+        self.assertEqual([r.number for r in history], [1, 2])
+        self.assertEqual([r.is_snapshot for r in history], [True, False])
+        self.assertEqual(history[0].date_created, self.comment.date_created)
+
+    def test_edit_unchanged(self):
+        self.assertFalse(revisions.edit(self.comment, 'First version', self.editor))
+        self.assertFalse(self.comment.revisions.exists())
+        self.assertEqual(models.TextComment.objects.get().version, 1)
+
+    def test_edit_signal(self):
+        receiver = mock.Mock()
+        signals.comment_edited.connect(receiver)
+        self.addCleanup(signals.comment_edited.disconnect, receiver)
+
+        revisions.edit(self.comment, 'Second version', self.editor)
+
+        receiver.assert_called_once_with(
+            signal=signals.comment_edited,
+            sender=models.BaseComment,
+            comment=self.comment,
+            version=2,
+        )
+
+    def test_snapshots(self):
+        """Every `revision_snapshot_interval`th revision holds the whole body."""
+        config = apps.get_app_config('groups')
+        with mock.patch.object(config, 'revision_snapshot_interval', 3):
+            for n in range(2, 8):
+                revisions.edit(self.comment, 'Version {}'.format(n), self.editor)
+
+        snapshots = self.comment.revisions.filter(is_snapshot=True)
+        self.assertEqual([r.number for r in snapshots], [1, 4, 7])
+
+
+class TestGetBody(TestCase):
+    def setUp(self):
+        self.comment = factories.TextCommentFactory.create(body='Version 1')
+        config = apps.get_app_config('groups')
+        with mock.patch.object(config, 'revision_snapshot_interval', 3):
+            for n in range(2, 8):
+                body = 'Version {} of a comment'.format(n)
+                revisions.edit(self.comment, body, self.comment.user)
+
+    def test_get_body(self):
+        self.assertEqual(revisions.get_body(self.comment, 1), 'Version 1')
+        for n in range(2, 8):
+            body = revisions.get_body(self.comment, n)
+            self.assertEqual(body, 'Version {} of a comment'.format(n))
+
+    def test_current(self):
+        with self.assertNumQueries(0):
+            revisions.get_body(self.comment, 7)
+
+    def test_reads_from_snapshot(self):
+        """Only the revisions since the snapshot at or before the version are read."""
+        with mock.patch('groups.revisions.decode', wraps=revisions.decode) as decode:
+            with self.assertNumQueries(2):
+                revisions.get_body(self.comment, 6)
+        self.assertEqual(decode.call_count, 3)
+
+    def test_missing(self):
+        for number in (0, 8):
+            with self.assertRaises(models.CommentRevision.DoesNotExist):
+                revisions.get_body(self.comment, number)
@@ -0,0 +1,221 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.http import Http404, HttpResponse
+from django.test.utils import CaptureQueriesContext
+
+from . import factories
+from .utils import RequestTestCase
+from .. import models, routers
+from ..views import comments, discussions, subscriptions
+
+
+REPLICAS_PATH = 'groups.apps.GroupsConfig.replica_databases'
+
+
+class PinningTestCase(RequestTestCase):
+    def tearDown(self):
+        routers.set_pinned_to_primary(True)
+
+
+class ReplicaTestCase(PinningTestCase):
+    """Read as a request that `ReplicaPinningMiddleware` let use the replicas would."""
+    def setUp(self):
+        super(ReplicaTestCase, self).setUp()
+        routers.set_pinned_to_primary(False)
+
+
+@mock.patch(REPLICAS_PATH, ('replica',))
+class TestReplicaRouter(ReplicaTestCase):
+    router = routers.ReplicaRouter()
+
+    def test_db_for_read(self):
+        self.assertEqual(self.router.db_for_read(models.Discussion), 'replica')
+
+    def test_db_for_read_pinned(self):
+        routers.set_pinned_to_primary(True)
+        self.assertEqual(self.router.db_for_read(models.Discussion), 'default')
+
+    def test_db_for_read_outside_request(self):
+        """Commands and workers, which no middleware has seen, read from the primary."""
+        del routers._local.pinned
+        self.assertEqual(self.router.db_for_read(models.Discussion), 'default')
+
+    def test_db_for_read_no_replicas(self):
+        with mock.patch(REPLICAS_PATH, ()):
+            self.assertEqual(self.router.db_for_read(models.Discussion), 'default')
+
+    def test_db_for_read_other_app(self):
+        self.assertIsNone(self.router.db_for_read(get_user_model()))
+
+    def test_db_for_write(self):
+        self.assertEqual(self.router.db_for_write(models.Discussion), 'default')
+        self.assertIsNone(self.router.db_for_write(get_user_model()))
+
+    def test_allow_relation(self):
+        discussion = models.Discussion()
+        discussion._state.db = 'replica'
+        user = get_user_model()()
+        user._state.db = 'default'
+        self.assertTrue(self.router.allow_relation(discussion, user))
+
+        user._state.db = 'elsewhere'
+        self.assertIsNone(self.router.allow_relation(discussion, user))
+
+
+@mock.patch(REPLICAS_PATH, ('replica',))
+class TestReplicaDatabase(ReplicaTestCase):
+    """
+    Reads against the test project's `replica` database.
+
+    Nothing is copied to it, so anything read from there is missing, as if the replica
+    hadn't caught up yet.
+    """
+    multi_db = True
+
+    def setUp(self):
+        super(TestReplicaDatabase, self).setUp()
+        self.discussion = factories.DiscussionFactory.create()
+
+    def run_query(self, query):
+        """Run `query`, and return its result and the database it ran on."""
+        contexts = {
+            alias: CaptureQueriesContext(connections[alias])
+            for alias in ('default', 'replica')
+        }
+        for context in contexts.values():
+            context.__enter__()
+        try:
+            result = query()
+        finally:
+            for context in contexts.values():
+                context.__exit__(None, None, None)
+        used = [alias for alias, context in contexts.items() if len(context)]
+        self.assertEqual(len(used), 1)
+        return result, used[0]
+
+    def read(self):
+        discussions = models.Discussion.objects.filter(pk=self.discussion.pk)
+        return self.run_query(discussions.exists)
+
+    def test_read(self):
+        self.assertEqual(self.read(), (False, 'replica'))
+
+    def test_write(self):
+        discussions = models.Discussion.objects.filter(pk=self.discussion.pk)
+        result = self.run_query(lambda: discussions.update(name='Changed'))
+        self.assertEqual(result, (1, 'default'))
+
+    def test_pinned_after_write(self):
+        """After a change, the user's next requests read from the primary."""
+        middleware = routers.ReplicaPinningMiddleware()
+        request = self.create_request(add_session=True)
+        routers.pin_to_primary(request)
+        self.assertEqual(self.read(), (True, 'default'))
+
+        next_request = self.create_request()
+        next_request.session = request.session
+        middleware.process_request(next_request)
+        self.assertEqual(self.read(), (True, 'default'))
+
+        middleware.process_response(next_request, HttpResponse())
+        self.assertEqual(self.read(), (True, 'default'))
+
+        middleware.process_request(self.create_request(add_session=True))
+        self.assertEqual(self.read(), (False, 'replica'))
+
+    def test_archive(self):
+        """Archiving reads its batches from the primary, not a replica that's behind."""
+        comment = factories.TextCommentFactory.create(discussion=self.discussion)
+        comments = models.BaseComment.objects.filter(pk=comment.pk)
+
+        self.assertEqual(comments.archive(), 1)
+
+        routers.set_pinned_to_primary(True)
+        self.assertFalse(comments.exists())
+        self.assertTrue(models.ArchivedComment.objects.filter(pk=comment.pk).exists())
+
+    def test_view(self):
+        view = discussions.DiscussionThread.as_view()
+        with self.assertRaises(Http404):
+            view(self.create_request(), pk=self.discussion.pk)
+
+        routers.set_pinned_to_primary(True)
+        response = view(self.create_request(), pk=self.discussion.pk)
+        self.assertEqual(response.status_code, 200)
+
+
+class TestPinToPrimary(PinningTestCase):
+    def test_pin_to_primary(self):
+        request = self.create_request(add_session=True)
+        routers.pin_to_primary(request)
+
+        self.assertTrue(routers.is_pinned_to_primary())
+        self.assertGreater(request.session[routers.PIN_SESSION_KEY], time.time())
+
+    def test_no_session(self):
+        routers.pin_to_primary(self.create_request())
+        self.assertTrue(routers.is_pinned_to_primary())
+
+    def test_reading_from_primary(self):
+        routers.set_pinned_to_primary(False)
+        with routers.reading_from_primary():
+            self.assertTrue(routers.is_pinned_to_primary())
+        self.assertFalse(routers.is_pinned_to_primary())
+
+        routers.set_pinned_to_primary(True)
+        with routers.reading_from_primary():
+            pass
+        self.assertTrue(routers.is_pinned_to_primary())
+
+
+class TestReplicaPinningMiddleware(PinningTestCase):
+    middleware = routers.ReplicaPinningMiddleware()
+
+    def test_pinned(self):
+        """Requests are pinned until the time saved in the session."""
+        request = self.create_request(add_session=True)
+        request.session[routers.PIN_SESSION_KEY] = time.time() + 10
+
+        self.middleware.process_request(request)
+        self.assertTrue(routers.is_pinned_to_primary())
+
+        response = HttpResponse()
+        self.assertEqual(self.middleware.process_response(request, response), response)
+        self.assertTrue(routers.is_pinned_to_primary())
+
+    def test_expired(self):
+        request = self.create_request(add_session=True)
+        request.session[routers.PIN_SESSION_KEY] = time.time() - 1
+        routers.set_pinned_to_primary(True)
+
+        self.middleware.process_request(request)
+        self.assertFalse(routers.is_pinned_to_primary())
+
+    def test_no_session(self):
+        self.middleware.process_request(self.create_request())
+        self.assertFalse(routers.is_pinned_to_primary())
+
+
+class TestViewsPinToPrimary(PinningTestCase):
+    """Views that change something pin the user to the primary database."""
+    def test_comment_delete(self):
+        comment = factories.TextCommentFactory.create()
+        request = self.create_request('post', user=comment.user, add_session=True)
+
+        comments.CommentDelete.as_view()(request, pk=comment.pk)
+        self.assertIn(routers.PIN_SESSION_KEY, request.session)
+
+    def test_subscribe(self):
+        discussion = factories.DiscussionFactory.create()
+        data = {'subscribe': True}
+        request = self.create_request('post', data=data, add_session=True)
+
+        subscriptions.DiscussionSubscribe.as_view()(request, pk=discussion.pk)
+        self.assertIn(routers.PIN_SESSION_KEY, request.session)
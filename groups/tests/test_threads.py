@@ -0,0 +1,100 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.apps import apps
+from django.test import TestCase
+
+from . import factories
+from .. import threads
+
+
+def create_chain(length, **kwargs):
+    """Create `length` comments, each a reply to the one before."""
+    if 'discussion' not in kwargs:
+        kwargs['discussion'] = factories.DiscussionFactory.create()
+    comments = []
+    parent = None
+    for _ in range(length):
+        parent = factories.TextCommentFactory.create(parent=parent, **kwargs)
+        comments.append(parent)
+    return comments
+
+
+class TestPaths(TestCase):
+    def test_get_reply_path(self):
+        root, reply = create_chain(2)
+        self.assertEqual(threads.get_reply_path(root), '{}/'.format(root.pk))
+        self.assertEqual(reply.path, '{}/'.format(root.pk))
+        self.assertEqual(
+            threads.get_reply_path(reply),
+            '{}/{}/'.format(root.pk, reply.pk),
+        )
+
+    def test_get_ancestor_ids(self):
+        comments = create_chain(3)
+        self.assertEqual(threads.get_ancestor_ids(comments[0]), [])
+        self.assertEqual(
+            threads.get_ancestor_ids(comments[2]),
+            [comments[0].pk, comments[1].pk],
+        )
+
+
+class TestOrder(TestCase):
+    def test_order(self):
+        """Replies follow the comment they reply to, and siblings keep their order."""
+        discussion = factories.DiscussionFactory.create()
+        first, second = factories.TextCommentFactory.create_batch(
+            2,
+            discussion=discussion,
+        )
+        reply = factories.TextCommentFactory.create(parent=first, discussion=discussion)
+        nested = factories.TextCommentFactory.create(parent=reply, discussion=discussion)
+        later = factories.TextCommentFactory.create(parent=first, discussion=discussion)
+
+        ordered = threads.order([first, second, reply, nested, later])
+
+        self.assertEqual(ordered, [first, reply, nested, later, second])
+        depths = [comment.thread_depth for comment in ordered]
+        self.assertEqual(depths, [0, 1, 2, 1, 0])
+
+    def test_order_missing_parent(self):
+        """A reply whose parent isn't shown starts its own thread."""
+        parent, reply = create_chain(2)
+        ordered = threads.order([reply])
+        self.assertEqual(ordered, [reply])
+        self.assertEqual(reply.thread_depth, 0)
+
+
+class TestPages(TestCase):
+    def setUp(self):
+        config = apps.get_app_config('groups')
+        patcher = mock.patch.object(config, 'thread_page_depth', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_page_root_id(self):
+        """Each replies page shows a comment and `thread_page_depth` levels below it."""
+        comments = create_chain(6)
+        roots = [threads.get_page_root_id(comment) for comment in comments]
+        expected = [None, None] + [comments[1].pk] * 2 + [comments[3].pk] * 2
+        self.assertEqual(roots, expected)
+
+    def test_get_page_root_id_unlimited(self):
+        comment = create_chain(3)[-1]
+        with mock.patch.object(apps.get_app_config('groups'), 'thread_page_depth', None):
+            self.assertIsNone(threads.get_page_root_id(comment))
+
+    def test_mark_collapsed(self):
+        """Only comments on the last level shown have hidden replies."""
+        comments = create_chain(3)
+        for comment in comments:
+            comment.reply_count = 1
+        comments[2].reply_count = 0
+
+        threads.mark_collapsed(comments[:2], last_depth=1)
+        threads.mark_collapsed(comments[2:], last_depth=2)
+
+        hidden = [comment.has_hidden_replies for comment in comments]
+        self.assertEqual(hidden, [False, True, False])
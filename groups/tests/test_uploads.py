@@ -0,0 +1,313 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import datetime
+import os
+
+from django.apps import apps
+from django.db.models.query import QuerySet
+from django.test import TestCase
+from django.utils import six, timezone
+
+from . import factories
+from .utils import UploadStagingMixin
+from .. import models, uploads
+
+
+class BrokenStream(object):
+    """A request body whose client goes away after sending `data`."""
+    def __init__(self, data):
+        self.stream = six.BytesIO(data)
+
+    def read(self, size):
+        piece = self.stream.read(size)
+        if not piece:
+            raise IOError('Client disconnected.')
+        return piece
+
+
+class TestUploads(UploadStagingMixin, TestCase):
+    def test_staging_path(self):
+        session = factories.UploadSessionFactory.create()
+        expected = os.path.join(self.staging_directory, str(session.pk))
+        self.assertEqual(uploads.staging_path(session), expected)
+
+    def test_staging_path_default(self):
+        session = factories.UploadSessionFactory.create()
+        config = apps.get_app_config('groups')
+        with mock.patch.object(config, 'upload_staging_directory', None):
+            path = uploads.staging_path(session)
+        self.assertEqual(os.path.basename(os.path.dirname(path)), 'groups-uploads')
+
+    def test_staging_directory_created(self):
+        session = factories.UploadSessionFactory.create(size=1)
+        directory = os.path.join(self.staging_directory, 'uploads')
+        config = apps.get_app_config('groups')
+        with mock.patch.object(config, 'upload_staging_directory', directory):
+            uploads.receive(session, 0, 1, six.BytesIO(b'0'))
+        self.assertTrue(os.path.exists(os.path.join(directory, str(session.pk))))
+
+    def test_start(self):
+        user = factories.UserFactory.create()
+        session = uploads.start(user, '../../etc/notes.txt', 10)
+        self.assertEqual(session.user, user)
+        self.assertEqual(session.filename, 'notes.txt')
+        self.assertEqual(session.size, 10)
+        self.assertEqual(session.offset, 0)
+        self.assertFalse(session.is_complete())
+
+    def test_start_invalid(self):
+        user = factories.UserFactory.create()
+        config = apps.get_app_config('groups')
+        with mock.patch.object(config, 'upload_max_bytes', 100):
+            with self.assertRaises(uploads.UploadError):
+                uploads.start(user, 'big.txt', 101)
+        with self.assertRaises(uploads.UploadError):
+            uploads.start(user, 'empty.txt', 0)
+
+    def test_receive_and_finish(self):
+        session = factories.UploadSessionFactory.create(size=10)
+
+        self.assertEqual(uploads.receive(session, 0, 4, six.BytesIO(b'0123')), 4)
+        self.assertEqual(uploads.receive(session, 4, 6, six.BytesIO(b'456789')), 10)
+        attachment = uploads.finish(session)
+
+        session.refresh_from_db()
+        self.assertEqual(session.attachment, attachment)
+        self.assertEqual(attachment.user, session.user)
+        self.assertIsNone(attachment.attached_to)
+        self.assertTrue(attachment.short_filename().startswith('upload'))
+        attachment.file.open()
+        self.assertEqual(attachment.file.read(), b'0123456789')
+
+        # Finishing again changes nothing.
+        self.assertEqual(uploads.finish(session), attachment)
+        self.assertEqual(models.AttachedFile.objects.count(), 1)
+
+    def test_receive_in_pieces(self):
+        """Chunks are copied to disk a piece at a time."""
+        session = factories.UploadSessionFactory.create(size=10)
+        stream = mock.Mock(wraps=six.BytesIO(b'0123456789'))
+        with mock.patch.object(uploads, 'PIECE_SIZE', 4):
+            uploads.receive(session, 0, 10, stream)
+        self.assertEqual(stream.read.call_args_list, [
+            mock.call(4), mock.call(4), mock.call(2),
+        ])
+        with open(uploads.staging_path(session), 'rb') as staged:
+            self.assertEqual(staged.read(), b'0123456789')
+
+    def test_receive_interrupted(self):
+        """Bytes that arrived before the connection dropped are kept."""
+        session = factories.UploadSessionFactory.create(size=10)
+
+        self.assertEqual(uploads.receive(session, 0, 10, BrokenStream(b'0123')), 4)
+        self.assertEqual(uploads.receive(session, 4, 6, six.BytesIO(b'45678')), 9)
+        self.assertEqual(uploads.receive(session, 9, 1, six.BytesIO(b'9')), 10)
+
+        attachment = uploads.finish(session)
+        attachment.file.open()
+        self.assertEqual(attachment.file.read(), b'0123456789')
+
+    def test_receive_discards_unsaved(self):
+        """Bytes written past the saved offset, e.g. by a crashed request, are dropped."""
+        session = factories.UploadSessionFactory.create(size=4, offset=2)
+        with open(uploads.staging_path(session), 'wb') as staged:
+            staged.write(b'01xx')
+
+        uploads.receive(session, 2, 2, six.BytesIO(b'23'))
+        with open(uploads.staging_path(session), 'rb') as staged:
+            self.assertEqual(staged.read(), b'0123')
+
+    def test_receive_lost_staged(self):
+        """A missing staging file sends the client back to the start."""
+        session = factories.UploadSessionFactory.create(size=4, offset=2)
+
+        with self.assertRaises(uploads.OffsetMismatch) as cm:
+            uploads.receive(session, 2, 2, six.BytesIO(b'23'))
+
+        self.assertEqual(cm.exception.offset, 0)
+        session.refresh_from_db()
+        self.assertEqual(session.offset, 0)
+        self.assertFalse(os.path.exists(uploads.staging_path(session)))
+
+    def test_receive_short_staged(self):
+        """A staging file missing some bytes resumes from the end of what's there."""
+        session = factories.UploadSessionFactory.create(size=4, offset=3)
+        with open(uploads.staging_path(session), 'wb') as staged:
+            staged.write(b'0')
+
+        with self.assertRaises(uploads.OffsetMismatch) as cm:
+            uploads.receive(session, 3, 1, six.BytesIO(b'3'))
+
+        self.assertEqual(cm.exception.offset, 1)
+        session.refresh_from_db()
+        self.assertEqual(session.offset, 1)
+        self.assertEqual(uploads.receive(session, 1, 3, six.BytesIO(b'123')), 4)
+        attachment = uploads.finish(session)
+        attachment.file.open()
+        self.assertEqual(attachment.file.read(), b'0123')
+
+    def test_receive_wrong_offset(self):
+        session = factories.UploadSessionFactory.create(size=10, offset=4)
+        with self.assertRaises(uploads.OffsetMismatch) as cm:
+            uploads.receive(session, 6, 2, six.BytesIO(b'67'))
+        self.assertEqual(cm.exception.offset, 4)
+
+    def test_receive_too_long(self):
+        session = factories.UploadSessionFactory.create(size=10)
+        with self.assertRaises(uploads.UploadError):
+            uploads.receive(session, 0, 11, six.BytesIO(b'0' * 11))
+
+    def test_receive_too_large_chunk(self):
+        session = factories.UploadSessionFactory.create(size=10)
+        config = apps.get_app_config('groups')
+        with mock.patch.object(config, 'upload_max_chunk_bytes', 4):
+            with self.assertRaises(uploads.UploadError):
+                uploads.receive(session, 0, 5, six.BytesIO(b'01234'))
+            self.assertEqual(uploads.receive(session, 0, 4, six.BytesIO(b'0123')), 4)
+
+    def test_receive_reads_before_locking(self):
+        """The session is only locked once the whole chunk has arrived."""
+        session = factories.UploadSessionFactory.create(size=8)
+        events = []
+        stream = six.BytesIO(b'01234567')
+
+        def read(size):
+            events.append('read')
+            return stream.read(size)
+
+        select_for_update = QuerySet.select_for_update
+
+        def locking(queryset, *args, **kwargs):
+            events.append('lock')
+            return select_for_update(queryset, *args, **kwargs)
+
+        with mock.patch.object(uploads, 'PIECE_SIZE', 4):
+            with mock.patch.object(QuerySet, 'select_for_update', locking):
+                uploads.receive(session, 0, 8, mock.Mock(read=read))
+
+        self.assertEqual(events, ['read', 'read', 'lock'])
+        self.assertEqual(os.listdir(self.staging_directory), [str(session.pk)])
+
+    def test_receive_overtaken(self):
+        """A chunk that another request sent while this one arrived is refused."""
+        session = factories.UploadSessionFactory.create(size=4)
+        other = models.UploadSession.objects.get(pk=session.pk)
+
+        def read(size):
+            uploads.receive(other, 0, 2, six.BytesIO(b'01'))
+            return b'xx'
+
+        with self.assertRaises(uploads.OffsetMismatch) as cm:
+            uploads.receive(session, 0, 2, mock.Mock(read=read))
+
+        self.assertEqual(cm.exception.offset, 2)
+        with open(uploads.staging_path(session), 'rb') as staged:
+            self.assertEqual(staged.read(), b'01')
+        self.assertEqual(os.listdir(self.staging_directory), [str(session.pk)])
+
+    def test_receive_complete(self):
+        session = factories.UploadSessionFactory.create(
+            attachment=factories.AttachedFileFactory.create(),
+        )
+        with self.assertRaises(uploads.UploadError):
+            uploads.receive(session, 0, 1, six.BytesIO(b'0'))
+
+    def test_finish_overtaken(self):
+        """If another request finishes the upload first, its attachment is kept."""
+        session = factories.UploadSessionFactory.create(size=1)
+        uploads.receive(session, 0, 1, six.BytesIO(b'0'))
+        other = factories.AttachedFileFactory.create()
+        delete = mock.Mock()
+
+        def save(self, name, content, save=True):
+            self.name = 'stored'
+            models.UploadSession.objects.filter(pk=session.pk).update(attachment=other)
+            self.delete = delete
+
+        with mock.patch('django.db.models.fields.files.FieldFile.save', save):
+            self.assertEqual(uploads.finish(session), other)
+
+        delete.assert_called_once_with(save=False)
+        self.assertEqual(models.AttachedFile.objects.get(), other)
+
+    def test_finish_lost_staged(self):
+        """A complete upload whose staging file has gone isn't stored."""
+        session = factories.UploadSessionFactory.create(size=2)
+        uploads.receive(session, 0, 2, six.BytesIO(b'01'))
+        with open(uploads.staging_path(session), 'wb') as staged:
+            staged.write(b'0')
+
+        with self.assertRaises(uploads.OffsetMismatch) as cm:
+            uploads.finish(session)
+
+        self.assertEqual(cm.exception.offset, 1)
+        session.refresh_from_db()
+        self.assertEqual(session.offset, 1)
+        self.assertFalse(models.AttachedFile.objects.exists())
+
+    def test_finish_incomplete(self):
+        session = factories.UploadSessionFactory.create(size=10, offset=9)
+        with self.assertRaises(uploads.UploadError):
+            uploads.finish(session)
+
+    def test_finish_removes_staged(self):
+        session = factories.UploadSessionFactory.create(size=1)
+        uploads.receive(session, 0, 1, six.BytesIO(b'0'))
+        path = uploads.staging_path(session)
+
+        with mock.patch('groups.outbox.transaction.on_commit') as on_commit:
+            uploads.finish(session)
+        self.assertTrue(os.path.exists(path))
+        on_commit.call_args[0][0]()
+        self.assertFalse(os.path.exists(path))
+
+    def test_attach(self):
+        attachment = factories.AttachedFileFactory.create()
+        session = factories.UploadSessionFactory.create(
+            user=attachment.user,
+            attachment=attachment,
+        )
+        comment = factories.TextCommentFactory.create(user=attachment.user)
+
+        uploads.attach(session.pk, comment)
+
+        attachment.refresh_from_db()
+        self.assertEqual(attachment.attached_to, comment)
+
+        # It can't be attached to another comment.
+        other = factories.TextCommentFactory.create(user=attachment.user)
+        with self.assertRaises(uploads.UploadError):
+            uploads.attach(session.pk, other)
+
+    def test_attach_invalid(self):
+        unfinished = factories.UploadSessionFactory.create()
+        someone_elses = factories.UploadSessionFactory.create(
+            attachment=factories.AttachedFileFactory.create(),
+        )
+        comment = factories.TextCommentFactory.create(user=unfinished.user)
+        for session_id in (unfinished.pk, someone_elses.pk, 'nonsense'):
+            with self.assertRaises(uploads.UploadError):
+                uploads.attach(session_id, comment)
+
+    def test_delete_abandoned(self):
+        day_ago = timezone.now() - datetime.timedelta(hours=24, minutes=1)
+        abandoned = factories.UploadSessionFactory.create(size=1, date_created=day_ago)
+        uploads.receive(abandoned, 0, 1, six.BytesIO(b'0'))
+        recent = factories.UploadSessionFactory.create()
+        finished = factories.UploadSessionFactory.create(
+            date_created=day_ago,
+            attachment=factories.AttachedFileFactory.create(),
+        )
+        unstarted = factories.UploadSessionFactory.create(date_created=day_ago)
+
+        self.assertEqual(uploads.delete_abandoned(dry_run=True), 2)
+        self.assertEqual(models.UploadSession.objects.count(), 4)
+
+        self.assertEqual(uploads.delete_abandoned(), 2)
+        remaining = models.UploadSession.objects.order_by('date_created')
+        self.assertEqual(set(remaining), {recent, finished})
+        self.assertFalse(os.path.exists(uploads.staging_path(abandoned)))
+        self.assertFalse(os.path.exists(uploads.staging_path(unstarted)))
@@ -1,6 +1,6 @@
 from incuna_test_utils.testcases.urls import URLTestCase
 
-from ..views import comments, discussions, groups, subscriptions
+from ..views import api, comments, discussions, groups, moderation, subscriptions
 
 
 class TestGroupUrls(URLTestCase):
@@ -29,6 +29,14 @@ class TestGroupUrls(URLTestCase):
             url_kwargs={'pk': self.pk}
         )
 
+    def test_group_moderation(self):
+        self.assert_url_matches_view(
+            moderation.ModerationQueue,
+            '/groups/{}/moderation/'.format(self.pk),
+            'group-moderation',
+            url_kwargs={'pk': self.pk}
+        )
+
     def test_discussion_create(self):
         self.assert_url_matches_view(
             discussions.DiscussionCreate,
@@ -45,6 +53,14 @@ class TestGroupUrls(URLTestCase):
             url_kwargs={'pk': self.pk}
         )
 
+    def test_discussion_events(self):
+        self.assert_url_matches_view(
+            discussions.DiscussionEvents,
+            '/groups/discussions/{}/events/'.format(self.pk),
+            'discussion-events',
+            url_kwargs={'pk': self.pk}
+        )
+
     def test_discussion_subscribe(self):
         self.assert_url_matches_view(
             subscriptions.DiscussionSubscribe,
@@ -68,3 +84,102 @@ class TestGroupUrls(URLTestCase):
             'comment-delete',
             url_kwargs={'pk': self.pk}
         )
+
+    def test_comment_permalink(self):
+        self.assert_url_matches_view(
+            comments.CommentPermalink,
+            '/groups/comments/{}/'.format(self.pk),
+            'comment-permalink',
+            url_kwargs={'pk': self.pk}
+        )
+
+
+class TestApiUrls(URLTestCase):
+    pk = 42
+
+    def test_group_list(self):
+        self.assert_url_matches_view(
+            api.GroupList,
+            '/groups/api/groups/',
+            'api-group-list',
+        )
+
+    def test_group_detail(self):
+        self.assert_url_matches_view(
+            api.GroupDetail,
+            '/groups/api/groups/{}/'.format(self.pk),
+            'api-group-detail',
+            url_kwargs={'pk': self.pk}
+        )
+
+    def test_comment_moderation(self):
+        self.assert_url_matches_view(
+            api.CommentModeration,
+            '/groups/api/groups/{}/moderation/'.format(self.pk),
+            'api-comment-moderation',
+            url_kwargs={'pk': self.pk}
+        )
+
+    def test_discussion_list(self):
+        self.assert_url_matches_view(
+            api.DiscussionList,
+            '/groups/api/groups/{}/discussions/'.format(self.pk),
+            'api-discussion-list',
+            url_kwargs={'pk': self.pk}
+        )
+
+    def test_group_subscription(self):
+        self.assert_url_matches_view(
+            api.GroupSubscription,
+            '/groups/api/groups/{}/subscription/'.format(self.pk),
+            'api-group-subscription',
+            url_kwargs={'pk': self.pk}
+        )
+
+    def test_discussion_detail(self):
+        self.assert_url_matches_view(
+            api.DiscussionDetail,
+            '/groups/api/discussions/{}/'.format(self.pk),
+            'api-discussion-detail',
+            url_kwargs={'pk': self.pk}
+        )
+
+    def test_comment_list(self):
+        self.assert_url_matches_view(
+            api.CommentList,
+            '/groups/api/discussions/{}/comments/'.format(self.pk),
+            'api-comment-list',
+            url_kwargs={'pk': self.pk}
+        )
+
+    def test_discussion_subscription(self):
+        self.assert_url_matches_view(
+            api.DiscussionSubscription,
+            '/groups/api/discussions/{}/subscription/'.format(self.pk),
+            'api-discussion-subscription',
+            url_kwargs={'pk': self.pk}
+        )
+
+    def test_comment_detail(self):
+        self.assert_url_matches_view(
+            api.CommentDetail,
+            '/groups/api/comments/{}/'.format(self.pk),
+            'api-comment-detail',
+            url_kwargs={'pk': self.pk}
+        )
+
+    def test_upload_list(self):
+        self.assert_url_matches_view(
+            api.UploadList,
+            '/groups/api/uploads/',
+            'api-upload-list',
+        )
+
+    def test_upload_detail(self):
+        pk = '6f0f1d2e-3b4a-4c5d-8e9f-0a1b2c3d4e5f'
+        self.assert_url_matches_view(
+            api.UploadDetail,
+            '/groups/api/uploads/{}/'.format(pk),
+            'api-upload-detail',
+            url_kwargs={'pk': pk}
+        )
@@ -0,0 +1,708 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import datetime
+import json
+import os
+
+from django.apps import apps
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import Q
+from incuna_test_utils.compat import Python2AssertMixin
+
+from . import factories
+from .utils import RequestTestCase, UploadStagingMixin
+from .. import attachments, models, reactions, uploads
+from ..views import api
+
+
+class ApiTestCase(Python2AssertMixin, RequestTestCase):
+    def call(self, method='get', user=None, url='/', pk=None, **kwargs):
+        request = self.create_request(method, url=url, user=user, **kwargs)
+        view_kwargs = {} if pk is None else {'pk': pk}
+        return self.view_class.as_view()(request, **view_kwargs)
+
+    def get_json(self, response, status=200):
+        self.assertEqual(response.status_code, status)
+        return json.loads(response.content.decode())
+
+    def post_json(self, data, **kwargs):
+        return self.call(
+            'post',
+            data=json.dumps(data),
+            content_type='application/json',
+            **kwargs
+        )
+
+
+class TestHelpers(Python2AssertMixin, RequestTestCase):
+    def test_cursor(self):
+        """Cursors keep datetimes to the microsecond."""
+        values = [datetime.datetime(2017, 1, 2, 3, 4, 5, 678901), 42]
+        cursor = api.encode_cursor(values)
+
+        decoded = api.decode_cursor(cursor, 2)
+        self.assertEqual(decoded, ['2017-01-02T03:04:05.678901', 42])
+
+    def test_decode_cursor_invalid(self):
+        for cursor in ['nonsense!', api.encode_cursor([1]), 'bm9wZQ']:
+            with self.assertRaises(api.ApiError):
+                api.decode_cursor(cursor, 2)
+
+    def test_keyset_filter(self):
+        query = api.keyset_filter(('-date_created', 'id'), ['2017-01-01', 5])
+        earlier = Q(date_created__lt='2017-01-01')
+        same_time = Q(date_created='2017-01-01', id__gt=5)
+        self.assertEqual(str(query), str(earlier | same_time))
+
+    def test_etag_matches(self):
+        request = self.create_request(HTTP_IF_NONE_MATCH='"abc", W/"def"')
+        self.assertTrue(api.etag_matches(request, 'abc'))
+        self.assertTrue(api.etag_matches(request, 'def'))
+        self.assertFalse(api.etag_matches(request, 'ghi'))
+
+        request = self.create_request(HTTP_IF_NONE_MATCH='*')
+        self.assertTrue(api.etag_matches(request, 'ghi'))
+
+
+class TestGroupList(ApiTestCase):
+    view_class = api.GroupList
+
+    def test_get(self):
+        group = factories.GroupFactory.create()
+        factories.GroupFactory.create(is_private=True)
+
+        data = self.get_json(self.call())
+
+        expected = {'id': group.pk, 'name': group.name, 'is_private': False}
+        self.assertEqual(data, {'results': [expected], 'next': None})
+
+    def test_pagination(self):
+        groups = factories.GroupFactory.create_batch(3)
+
+        data = self.get_json(self.call(url='/?limit=2'))
+        self.assertEqual([g['id'] for g in data['results']], [g.pk for g in groups[:2]])
+
+        data = self.get_json(self.call(url='/?limit=2&after=' + data['next']))
+        self.assertEqual([g['id'] for g in data['results']], [groups[2].pk])
+        self.assertIsNone(data['next'])
+
+    def test_invalid_parameters(self):
+        for url in ['/?limit=many', '/?after=nonsense', '/?fields=id,secret']:
+            data = self.get_json(self.call(url=url), status=400)
+            self.assertIn('error', data)
+
+    def test_sparse_fields(self):
+        group = factories.GroupFactory.create()
+        user = factories.UserFactory.create()
+        with self.assertNumQueries(1):
+            data = self.get_json(self.call(user=user, url='/?fields=name'))
+        self.assertEqual(data['results'], [{'name': group.name}])
+
+    def test_etag(self):
+        """A client with the current content is told it hasn't changed."""
+        factories.GroupFactory.create()
+        response = self.call()
+        etag = response['ETag']
+
+        response = self.call(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        factories.GroupFactory.create()
+        self.assertEqual(self.call(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class TestGroupDetail(ApiTestCase):
+    view_class = api.GroupDetail
+
+    def test_get(self):
+        group = factories.GroupFactory.create()
+        data = self.get_json(self.call(pk=group.pk))
+        self.assertEqual(data['name'], group.name)
+
+    def test_get_private(self):
+        group = factories.GroupFactory.create(is_private=True)
+        data = self.get_json(self.call(pk=group.pk), status=404)
+        self.assertEqual(data, {'error': 'Not found.'})
+
+
+class TestDiscussionList(ApiTestCase):
+    view_class = api.DiscussionList
+
+    def setUp(self):
+        self.group = factories.GroupFactory.create()
+
+    def test_get(self):
+        """Discussions are listed newest first."""
+        older = factories.DiscussionFactory.create(
+            group=self.group,
+            date_created=datetime.datetime(2017, 1, 1),
+        )
+        newer = factories.DiscussionFactory.create(
+            group=self.group,
+            date_created=datetime.datetime(2017, 1, 2),
+        )
+        factories.DiscussionFactory.create()
+
+        data = self.get_json(self.call(pk=self.group.pk, url='/?limit=1'))
+        self.assertEqual(data['results'][0]['id'], newer.pk)
+        self.assertEqual(data['results'][0]['group'], self.group.pk)
+
+        url = '/?limit=1&after=' + data['next']
+        data = self.get_json(self.call(pk=self.group.pk, url=url))
+        self.assertEqual(data['results'][0]['id'], older.pk)
+
+    def test_get_private(self):
+        group = factories.GroupFactory.create(is_private=True)
+        self.get_json(self.call(pk=group.pk), status=404)
+
+    def test_post(self):
+        user = factories.UserFactory.create()
+        data = {'name': 'New', 'comment': 'First!'}
+
+        with mock.patch('groups.outbox.enqueue') as enqueue:
+            response = self.post_json(data, user=user, pk=self.group.pk)
+
+        result = self.get_json(response, status=201)
+        discussion = models.Discussion.objects.get()
+        self.assertEqual(result['id'], discussion.pk)
+        self.assertEqual(discussion.comments.get().body, 'First!')
+        enqueue.assert_called_once_with(
+            models.OutboxMessage.KIND_DISCUSSION,
+            discussion,
+            mock.ANY,
+        )
+
+    def test_post_form_data(self):
+        data = {'name': 'New', 'comment': 'First!'}
+        self.get_json(self.call('post', data=data, pk=self.group.pk), status=201)
+        self.assertEqual(models.Discussion.objects.get().name, 'New')
+
+    def test_post_invalid(self):
+        response = self.post_json({'name': 'New'}, pk=self.group.pk)
+        data = self.get_json(response, status=400)
+        self.assertEqual(list(data['errors']), ['comment'])
+
+    def test_post_not_json_object(self):
+        for body in ['[]', '{']:
+            response = self.call(
+                'post',
+                data=body,
+                content_type='application/json',
+                pk=self.group.pk,
+            )
+            self.get_json(response, status=400)
+
+    def test_post_anonymous(self):
+        response = self.post_json({}, auth=False, pk=self.group.pk)
+        self.get_json(response, status=403)
+
+
+class TestDiscussionDetail(ApiTestCase):
+    view_class = api.DiscussionDetail
+
+    def test_get(self):
+        discussion = factories.DiscussionFactory.create()
+        data = self.get_json(self.call(pk=discussion.pk, url='/?fields=id,creator'))
+        self.assertEqual(data, {'id': discussion.pk, 'creator': discussion.creator.pk})
+
+
+class TestCommentList(ApiTestCase):
+    view_class = api.CommentList
+
+    def setUp(self):
+        super(TestCommentList, self).setUp()
+        self.discussion = factories.DiscussionFactory.create()
+
+    def test_get(self):
+        """Comments are listed oldest first, with deleted comments' text hidden."""
+        when = datetime.datetime(2017, 1, 1)
+        comment, deleted = factories.TextCommentFactory.create_batch(
+            2,
+            discussion=self.discussion,
+            date_created=when,
+        )
+        deleted.delete_state()
+        user = factories.UserFactory.create()
+
+        with self.assertNumQueries(2):  # The discussion, then the comments.
+            data = self.get_json(self.call(user=user, pk=self.discussion.pk))
+
+        first, second = data['results']
+        self.assertEqual(first['id'], comment.pk)
+        self.assertEqual(first['type'], 'textcomment')
+        self.assertEqual(first['body'], comment.body)
+        self.assertEqual(second['id'], deleted.pk)
+        self.assertEqual(second['state'], 'deleted')
+        self.assertIsNone(second['body'])
+
+    def test_get_ties(self):
+        """Comments created at the same moment are split across pages by id."""
+        comments = factories.TextCommentFactory.create_batch(
+            3,
+            discussion=self.discussion,
+            date_created=datetime.datetime(2017, 1, 1, 0, 0, 0, 1),
+        )
+        url = '/?fields=id&limit=2'
+        data = self.get_json(self.call(pk=self.discussion.pk, url=url))
+        data = self.get_json(
+            self.call(pk=self.discussion.pk, url=url + '&after=' + data['next']),
+        )
+        self.assertEqual(data['results'], [{'id': comments[2].pk}])
+
+    def test_get_attachments(self):
+        comment = factories.TextCommentFactory.create(discussion=self.discussion)
+        attachment = factories.AttachedFileFactory.create(attached_to=comment)
+
+        user = factories.UserFactory.create()
+        url = '/?fields=id,attachments'
+        with self.assertNumQueries(3):
+            data = self.get_json(self.call(user=user, pk=self.discussion.pk, url=url))
+
+        attachments = data['results'][0]['attachments']
+        expected = {
+            'id': attachment.pk,
+            'url': attachment.file.url,
+            'size': None,
+            'mime_type': None,
+            'width': None,
+            'height': None,
+            'thumbnail': None,
+        }
+        self.assertEqual(attachments, [expected])
+
+    def test_get_reactions(self):
+        comment = factories.TextCommentFactory.create(discussion=self.discussion)
+        factories.ReactionCountFactory.create(comment=comment, kind='love', count=3)
+
+        user = factories.UserFactory.create()
+        url = '/?fields=id,reactions'
+        with self.assertNumQueries(3):
+            data = self.get_json(self.call(user=user, pk=self.discussion.pk, url=url))
+
+        expected = {'like': 0, 'love': 3, 'laugh': 0, 'thanks': 0}
+        self.assertEqual(data['results'][0]['reactions'], expected)
+
+    def test_get_attachments_processed(self):
+        comment = factories.TextCommentFactory.create(discussion=self.discussion)
+        attachment = factories.AttachedFileFactory.create(attached_to=comment)
+        attachments.process_pending()
+        attachment.refresh_from_db()
+
+        user = factories.UserFactory.create()
+        url = '/?fields=id,attachments'
+        data = self.get_json(self.call(user=user, pk=self.discussion.pk, url=url))
+
+        result = data['results'][0]['attachments'][0]
+        self.assertEqual(result['size'], attachment.size)
+        self.assertEqual(result['mime_type'], 'image/png')
+        self.assertEqual(result['width'], attachment.width)
+        self.assertEqual(result['height'], attachment.height)
+        self.assertEqual(result['thumbnail'], attachment.thumbnail.url)
+
+    def test_post(self):
+        user = factories.UserFactory.create()
+
+        email_path = 'groups.views.api.CommentList.email_subscribers'
+        with mock.patch(email_path) as email_subscribers:
+            with mock.patch('groups.events.publish_comment') as publish_comment:
+                response = self.post_json(
+                    {'body': 'Hello'},
+                    user=user,
+                    pk=self.discussion.pk,
+                )
+
+        data = self.get_json(response, status=201)
+        comment = models.TextComment.objects.get()
+        self.assertEqual(data['body'], 'Hello')
+        self.assertEqual(data['user'], user.pk)
+        email_subscribers.assert_called_once_with(comment)
+        publish_comment.assert_called_once_with(comment)
+
+    def test_post_attachment(self):
+        upload = SimpleUploadedFile('notes.txt', b'Notes')
+        response = self.call(
+            'post',
+            data={'body': 'See attached', 'file': upload},
+            pk=self.discussion.pk,
+        )
+
+        self.get_json(response, status=201)
+        attachment = models.AttachedFile.objects.get()
+        self.assertEqual(attachment.attached_to, models.BaseComment.objects.get())
+
+    def test_post_invalid(self):
+        data = self.get_json(self.post_json({}, pk=self.discussion.pk), status=400)
+        self.assertEqual(list(data['errors']), ['body'])
+
+    def test_post_reply(self):
+        comment = factories.TextCommentFactory.create(discussion=self.discussion)
+        data = {'body': 'Hello', 'parent': comment.pk}
+
+        response = self.post_json(data, pk=self.discussion.pk)
+
+        data = self.get_json(response, status=201)
+        self.assertEqual(data['parent'], comment.pk)
+        self.assertEqual(models.TextComment.objects.get(pk=data['id']).depth, 1)
+
+    def test_post_reply_other_discussion(self):
+        comment = factories.TextCommentFactory.create()
+        data = {'body': 'Hello', 'parent': comment.pk}
+
+        response = self.post_json(data, pk=self.discussion.pk)
+
+        data = self.get_json(response, status=400)
+        self.assertEqual(list(data['errors']), ['parent'])
+
+    def test_post_upload(self):
+        """A finished resumable upload can be attached to the new comment."""
+        user = factories.UserFactory.create()
+        session = factories.UploadSessionFactory.create(
+            user=user,
+            attachment=factories.AttachedFileFactory.create(user=user),
+        )
+        data = {'body': 'See attached', 'upload': str(session.pk)}
+        response = self.post_json(data, user=user, pk=self.discussion.pk)
+
+        self.get_json(response, status=201)
+        session.attachment.refresh_from_db()
+        self.assertEqual(session.attachment.attached_to, models.BaseComment.objects.get())
+
+    def test_post_upload_invalid(self):
+        """The comment isn't posted if its upload can't be attached."""
+        user = factories.UserFactory.create()
+        session = factories.UploadSessionFactory.create()
+        data = {'body': 'See attached', 'upload': str(session.pk)}
+        response = self.post_json(data, user=user, pk=self.discussion.pk)
+
+        data = self.get_json(response, status=400)
+        self.assertEqual(list(data['errors']), ['upload'])
+        self.assertFalse(models.BaseComment.objects.exists())
+
+    def test_post_rate_limited(self):
+        user = factories.UserFactory.create()
+        config = apps.get_app_config('groups')
+        limits = {'user': (1, 60)}
+
+        with mock.patch.object(config, 'comment_rate_limits', limits):
+            self.get_json(
+                self.post_json({'body': 'One'}, user=user, pk=self.discussion.pk),
+                status=201,
+            )
+            response = self.post_json({'body': 'Two'}, user=user, pk=self.discussion.pk)
+
+        data = self.get_json(response, status=429)
+        self.assertEqual(data['retry_after'], 60)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(models.BaseComment.objects.get().body, 'One')
+
+
+class TestCommentDetail(ApiTestCase):
+    view_class = api.CommentDetail
+
+    def test_get(self):
+        comment = factories.TextCommentFactory.create()
+        data = self.get_json(self.call(pk=comment.pk))
+        self.assertEqual(data['body'], comment.body)
+
+    def test_get_private(self):
+        comment = factories.TextCommentFactory.create(discussion__group__is_private=True)
+        self.get_json(self.call(pk=comment.pk), status=404)
+
+    def test_get_hidden(self):
+        comment = factories.TextCommentFactory.create(state='hidden')
+        data = self.get_json(self.call(pk=comment.pk))
+        self.assertIsNone(data['body'])
+
+    def test_delete(self):
+        comment = factories.TextCommentFactory.create()
+
+        response = self.call('delete', user=comment.user, pk=comment.pk)
+
+        self.assertEqual(response.status_code, 204)
+        comment.refresh_from_db()
+        self.assertTrue(comment.is_deleted())
+
+    def test_delete_other_user(self):
+        comment = factories.TextCommentFactory.create()
+        self.get_json(self.call('delete', pk=comment.pk), status=403)
+        comment.refresh_from_db()
+        self.assertFalse(comment.is_deleted())
+
+    def patch_json(self, data, **kwargs):
+        return self.call(
+            'patch',
+            data=json.dumps(data),
+            content_type='application/json',
+            **kwargs
+        )
+
+    def test_patch(self):
+        comment = factories.TextCommentFactory.create(body='Before')
+
+        response = self.patch_json({'body': 'After'}, user=comment.user, pk=comment.pk)
+
+        data = self.get_json(response)
+        self.assertEqual(data['body'], 'After')
+        self.assertEqual(data['version'], 2)
+        self.assertEqual(comment.revisions.count(), 2)
+
+    def test_patch_other_user(self):
+        comment = factories.TextCommentFactory.create(body='Before')
+        self.get_json(self.patch_json({'body': 'After'}, pk=comment.pk), status=403)
+        self.assertEqual(models.TextComment.objects.get().body, 'Before')
+
+    def test_patch_invalid(self):
+        comment = factories.TextCommentFactory.create()
+        response = self.patch_json({'body': ''}, user=comment.user, pk=comment.pk)
+        data = self.get_json(response, status=400)
+        self.assertEqual(list(data['errors']), ['body'])
+
+
+class TestCommentReaction(ApiTestCase):
+    view_class = api.CommentReaction
+
+    def setUp(self):
+        super(TestCommentReaction, self).setUp()
+        self.comment = factories.TextCommentFactory.create()
+        self.user = factories.UserFactory.create()
+
+    def call_kind(self, method='get', kind='like', **kwargs):
+        request = self.create_request(method, **kwargs)
+        view = self.view_class.as_view()
+        return view(request, pk=self.comment.pk, kind=kind)
+
+    def test_get(self):
+        factories.ReactionCountFactory.create(comment=self.comment, count=2)
+        data = self.get_json(self.call_kind(user=self.user))
+        self.assertEqual(data, {'kind': 'like', 'reacted': False, 'count': 2})
+
+    def test_put(self):
+        data = self.get_json(self.call_kind('put', user=self.user))
+        self.assertEqual(data, {'kind': 'like', 'reacted': True, 'count': 1})
+
+        # Giving the same reaction twice only counts it once.
+        data = self.get_json(self.call_kind('put', user=self.user))
+        self.assertEqual(data['count'], 1)
+
+    def test_delete(self):
+        reactions.react(self.user, self.comment, 'like')
+        data = self.get_json(self.call_kind('delete', user=self.user))
+        self.assertEqual(data, {'kind': 'like', 'reacted': False, 'count': 0})
+
+    def test_unknown_kind(self):
+        self.get_json(self.call_kind('put', kind='shrug', user=self.user), status=404)
+
+    def test_anonymous(self):
+        self.get_json(self.call_kind('put', auth=False), status=403)
+        self.assertFalse(models.Reaction.objects.exists())
+
+
+class TestMentionList(ApiTestCase):
+    view_class = api.MentionList
+
+    def test_get(self):
+        """The user's mentions are listed newest first, if they can still read them."""
+        user = factories.UserFactory.create()
+        older, newer = [
+            factories.MentionFactory.create(
+                user=user,
+                comment__date_created=datetime.datetime(2017, 1, day),
+            ).comment
+            for day in (1, 2)
+        ]
+        factories.MentionFactory.create(
+            user=user,
+            comment__discussion__group__is_private=True,
+        )
+        factories.MentionFactory.create()
+
+        data = self.get_json(self.call(user=user, url='/?fields=id'))
+        self.assertEqual(data['results'], [{'id': newer.pk}, {'id': older.pk}])
+
+    def test_get_anonymous(self):
+        self.get_json(self.call(auth=False), status=403)
+
+
+class TestCommentModeration(ApiTestCase):
+    view_class = api.CommentModeration
+
+    def setUp(self):
+        super(TestCommentModeration, self).setUp()
+        self.group = factories.GroupFactory.create()
+        self.moderator = factories.UserFactory.create()
+        self.group.moderators.add(self.moderator)
+
+    def test_post(self):
+        comments = factories.TextCommentFactory.create_batch(
+            2,
+            discussion__group=self.group,
+        )
+        other = factories.TextCommentFactory.create()
+        data = {'action': 'hidden', 'comments': [comment.pk for comment in comments]}
+
+        response = self.post_json(data, user=self.moderator, pk=self.group.pk)
+
+        self.assertEqual(self.get_json(response), {'action': 'hidden', 'changed': 2})
+        hidden = models.BaseComment.objects.filter(state='hidden')
+        self.assertCountEqual(hidden, comments)
+        other.refresh_from_db()
+        self.assertEqual(other.state, 'ok')
+
+    def test_post_other_group(self):
+        other = factories.TextCommentFactory.create()
+        data = {'action': 'deleted', 'comments': [other.pk]}
+
+        response = self.post_json(data, user=self.moderator, pk=self.group.pk)
+
+        data = self.get_json(response, status=400)
+        self.assertEqual(list(data['errors']), ['comments'])
+
+    def test_post_not_moderator(self):
+        response = self.post_json({}, pk=self.group.pk)
+        self.get_json(response, status=403)
+
+
+class TestSubscriptions(ApiTestCase):
+    view_class = api.GroupSubscription
+
+    def test_group_subscription(self):
+        group = factories.GroupFactory.create()
+        user = factories.UserFactory.create()
+
+        data = self.get_json(self.call(user=user, pk=group.pk))
+        self.assertEqual(data, {'subscribed': False})
+
+        data = self.get_json(self.call('put', user=user, pk=group.pk))
+        self.assertEqual(data, {'subscribed': True})
+        self.assertTrue(group.is_subscribed(user))
+
+        data = self.get_json(self.call('delete', user=user, pk=group.pk))
+        self.assertEqual(data, {'subscribed': False})
+
+    def test_discussion_subscription(self):
+        discussion = factories.DiscussionFactory.create()
+        user = factories.UserFactory.create()
+        request = self.create_request('put', user=user)
+
+        response = api.DiscussionSubscription.as_view()(request, pk=discussion.pk)
+
+        self.assertEqual(self.get_json(response), {'subscribed': True})
+        self.assertTrue(discussion.is_subscribed(user))
+
+    def test_anonymous(self):
+        group = factories.GroupFactory.create()
+        self.get_json(self.call(auth=False, pk=group.pk), status=403)
+
+
+class TestUploadList(ApiTestCase):
+    view_class = api.UploadList
+
+    def test_post(self):
+        user = factories.UserFactory.create()
+        data = {'filename': 'video.mp4', 'size': 1000}
+        result = self.get_json(self.post_json(data, user=user), status=201)
+
+        session = models.UploadSession.objects.get()
+        self.assertEqual(session.user, user)
+        self.assertEqual(result, {
+            'id': str(session.pk),
+            'filename': 'video.mp4',
+            'size': 1000,
+            'offset': 0,
+            'attachment': None,
+        })
+
+    def test_post_invalid(self):
+        user = factories.UserFactory.create()
+        data = self.get_json(self.post_json({'size': 0}, user=user), status=400)
+        self.assertCountEqual(data['errors'], ['filename', 'size'])
+
+    def test_post_too_large(self):
+        user = factories.UserFactory.create()
+        data = {'filename': 'video.mp4', 'size': 2 * 1024 ** 3}
+        self.get_json(self.post_json(data, user=user), status=400)
+        self.assertFalse(models.UploadSession.objects.exists())
+
+    def test_post_anonymous(self):
+        data = {'filename': 'video.mp4', 'size': 1000}
+        self.get_json(self.post_json(data, auth=False), status=403)
+
+
+class TestUploadDetail(UploadStagingMixin, ApiTestCase):
+    view_class = api.UploadDetail
+
+    def setUp(self):
+        super(TestUploadDetail, self).setUp()
+        self.session = factories.UploadSessionFactory.create(size=10)
+        self.user = self.session.user
+
+    def put(self, data, content_range, user=None):
+        return self.call(
+            'put',
+            user=user or self.user,
+            pk=self.session.pk,
+            data=data,
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=content_range,
+        )
+
+    def test_get(self):
+        data = self.get_json(self.call(user=self.user, pk=self.session.pk))
+        self.assertEqual(data['offset'], 0)
+
+    def test_get_other_user(self):
+        """Only the uploader can see or add to an upload."""
+        user = factories.UserFactory.create()
+        self.get_json(self.call(user=user, pk=self.session.pk), status=404)
+        self.get_json(self.call(auth=False, pk=self.session.pk), status=403)
+
+    def test_upload(self):
+        self.assertEqual(self.get_json(self.put(b'0123', 'bytes 0-3/10'))['offset'], 4)
+        self.assertEqual(self.get_json(self.put(b'456789', 'bytes 4-9/10'))['offset'], 10)
+
+        data = self.get_json(self.call('post', user=self.user, pk=self.session.pk))
+        attachment = models.AttachedFile.objects.get()
+        self.assertEqual(data['attachment'], attachment.pk)
+        attachment.file.open()
+        self.assertEqual(attachment.file.read(), b'0123456789')
+
+    def test_put_wrong_offset(self):
+        """A chunk in the wrong place gets a 409, with the offset to resume from."""
+        self.put(b'0123', 'bytes 0-3/10')
+        data = self.get_json(self.put(b'6789', 'bytes 6-9/10'), status=409)
+        self.assertEqual(data['offset'], 4)
+
+    def test_post_lost_staged(self):
+        """Finishing an upload whose staged bytes were lost gets a 409."""
+        self.put(b'0123456789', 'bytes 0-9/10')
+        os.remove(uploads.staging_path(self.session))
+
+        data = self.get_json(
+            self.call('post', user=self.user, pk=self.session.pk),
+            status=409,
+        )
+        self.assertEqual(data['offset'], 0)
+
+    def test_put_incomplete(self):
+        data = self.get_json(self.put(b'0123', 'bytes 0-9/10'), status=400)
+        self.assertEqual(data['offset'], 4)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.offset, 4)
+
+    def test_put_invalid_range(self):
+        for content_range in ('', 'bytes 0-3/11', 'bytes 3-0/10', 'bytes */10'):
+            self.get_json(self.put(b'0123', content_range), status=400)
+
+    def test_put_too_long(self):
+        self.session.offset = 8
+        self.session.save()
+        self.get_json(self.put(b'0123', 'bytes 8-11/10'), status=400)
+
+    def test_post_incomplete(self):
+        self.put(b'0123', 'bytes 0-3/10')
+        self.get_json(self.call('post', user=self.user, pk=self.session.pk), status=400)
+        self.assertFalse(models.AttachedFile.objects.exists())
@@ -6,14 +6,16 @@ except ImportError:
 import datetime
 
 import pytz
+from django.apps import apps
 from django.contrib.sites.shortcuts import get_current_site
 from django.core import signing
 from django.http import Http404
+from django.utils import timezone
 from incuna_test_utils.compat import Python2AssertMixin
 
 from . import factories
 from .utils import RequestTestCase
-from .. import models
+from .. import models, ratelimits, reactions, read_markers, revisions
 from ..views import comments
 
 
@@ -120,6 +122,218 @@ class TestCommentDelete(RequestTestCase):
         self.assertEqual(view_obj.get_success_url(), expected)
 
 
+class TestCommentEdit(RequestTestCase):
+    view_class = comments.CommentEdit
+
+    def setUp(self):
+        super(TestCommentEdit, self).setUp()
+        self.comment = factories.TextCommentFactory.create(body='Before')
+
+    def test_get(self):
+        request = self.create_request(user=self.comment.user)
+        response = self.view_class.as_view()(request, pk=self.comment.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context_data['comment'], self.comment)
+        self.assertEqual(response.context_data['form'].initial['body'], 'Before')
+
+    def test_get_forbidden(self):
+        """Only the comment's author may edit it."""
+        request = self.create_request()
+        response = self.view_class.as_view()(request, pk=self.comment.pk)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['location'], self.comment.discussion.get_absolute_url())
+        self.assertEqual(
+            'You do not have permission to edit this comment.',
+            request._messages.store[0]
+        )
+
+    def test_post(self):
+        data = {'body': 'After'}
+        request = self.create_request('post', user=self.comment.user, data=data)
+
+        response = self.view_class.as_view()(request, pk=self.comment.pk)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['location'], self.comment.get_absolute_url())
+        comment = models.TextComment.objects.get()
+        self.assertEqual(comment.body, 'After')
+        self.assertEqual(comment.version, 2)
+
+
+class TestCommentReact(RequestTestCase):
+    view_class = comments.CommentReact
+
+    def setUp(self):
+        super(TestCommentReact, self).setUp()
+        self.comment = factories.TextCommentFactory.create()
+        self.user = factories.UserFactory.create()
+
+    def react(self, kind='like'):
+        request = self.create_request('post', user=self.user, data={'kind': kind})
+        return self.view_class.as_view()(request, pk=self.comment.pk)
+
+    def test_post(self):
+        """Posting a reaction gives it, and posting it again takes it back."""
+        response = self.react()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['location'], self.comment.get_absolute_url())
+        reaction = models.Reaction.objects.get()
+        self.assertEqual((reaction.user, reaction.kind), (self.user, 'like'))
+        self.assertEqual(reactions.buffer.pending, {(self.comment.pk, 'like'): 1})
+
+        self.react()
+        self.assertFalse(models.Reaction.objects.exists())
+        self.assertEqual(reactions.buffer.pending, {(self.comment.pk, 'like'): 0})
+
+    def test_post_unknown(self):
+        response = self.react('shrug')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.Reaction.objects.exists())
+
+    def test_post_private(self):
+        self.comment.discussion.group.is_private = True
+        self.comment.discussion.group.save()
+        with self.assertRaises(Http404):
+            self.react()
+
+
+class TestCommentHistory(RequestTestCase):
+    view_class = comments.CommentHistory
+
+    def setUp(self):
+        super(TestCommentHistory, self).setUp()
+        self.comment = factories.TextCommentFactory.create(body='Before')
+        revisions.edit(self.comment, 'After', self.comment.user)
+
+    def test_get(self):
+        """The current version is shown by default."""
+        response = self.view_class.as_view()(self.create_request(), pk=self.comment.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context_data['version'], 2)
+        self.assertEqual(response.context_data['body'], 'After')
+        content = response.render().content.decode()
+        self.assertIn('?version=1', content)
+
+    def test_get_version(self):
+        request = self.create_request(url='/?version=1')
+        response = self.view_class.as_view()(request, pk=self.comment.pk)
+        self.assertEqual(response.context_data['body'], 'Before')
+
+    def test_get_missing_version(self):
+        view = self.view_class.as_view()
+        for version in ('3', 'latest'):
+            request = self.create_request(url='/?version={}'.format(version))
+            with self.assertRaises(Http404):
+                view(request, pk=self.comment.pk).render()
+
+    def test_get_hidden(self):
+        """A hidden comment's old versions are hidden too."""
+        self.comment.transition(self.comment.STATE_HIDDEN)
+        with self.assertRaises(Http404):
+            self.view_class.as_view()(self.create_request(), pk=self.comment.pk)
+
+
+class TestCommentPermalink(RequestTestCase):
+    view_class = comments.CommentPermalink
+
+    def test_get(self):
+        comment = factories.TextCommentFactory.create()
+        response = self.view_class.as_view()(self.create_request(), pk=comment.pk)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['location'], comment.get_absolute_url())
+
+    def test_get_archived(self):
+        """Links to comments that have been archived still work."""
+        comment = factories.ArchivedCommentFactory.create()
+        response = self.view_class.as_view()(self.create_request(), pk=comment.pk)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['location'], comment.get_absolute_url())
+
+    def test_get_missing(self):
+        with self.assertRaises(Http404):
+            self.view_class.as_view()(self.create_request(), pk=42)
+
+    def test_get_private(self):
+        comment = factories.TextCommentFactory.create(discussion__group__is_private=True)
+        with self.assertRaises(Http404):
+            self.view_class.as_view()(self.create_request(), pk=comment.pk)
+
+
+class TestCommentReplies(RequestTestCase):
+    view_class = comments.CommentReplies
+
+    def setUp(self):
+        super(TestCommentReplies, self).setUp()
+        config = apps.get_app_config('groups')
+        patcher = mock.patch.object(config, 'thread_page_depth', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.comment = factories.TextCommentFactory.create()
+        self.chain = [self.comment]
+        for _ in range(3):
+            self.chain.append(factories.TextCommentFactory.create(
+                discussion=self.comment.discussion,
+                parent=self.chain[-1],
+            ))
+
+    def test_get(self):
+        """The comment is shown with `thread_page_depth` levels of its replies."""
+        sibling = factories.TextCommentFactory.create(
+            discussion=self.comment.discussion,
+            parent=self.chain[1],
+        )
+        request = self.create_request()
+
+        response = self.view_class.as_view()(request, pk=self.comment.pk)
+
+        self.assertEqual(response.status_code, 200)
+        context = response.context_data
+        self.assertEqual(context['comment'], self.comment)
+        self.assertEqual(context['discussion'], self.comment.discussion)
+        self.assertEqual(context['comments'], self.chain[:3] + [sibling])
+        self.assertTrue(context['comments'][2].has_hidden_replies)
+        self.assertFalse(context['comments'][3].has_hidden_replies)
+        url = '/groups/comments/{}/replies/'.format(self.chain[2].pk)
+        self.assertIn(url, response.render().content.decode())
+
+    def test_get_marks_read(self):
+        """Showing the deep replies moves the read marker past them."""
+        request = self.create_request()
+        key = (request.user.pk, self.comment.discussion_id)
+        view = self.view_class.as_view()
+
+        # The comment above them hasn't been read, so still counts as unread.
+        view(request, pk=self.chain[1].pk)
+        self.assertEqual(read_markers.buffer.pending, {})
+
+        read_markers.mark_read(request.user, self.comment.discussion, self.comment.pk)
+        view(request, pk=self.chain[1].pk)
+        self.assertEqual(read_markers.buffer.pending, {key: self.chain[-1].pk})
+
+    def test_get_archived_ancestors(self):
+        """Archiving old comments leaves the ones above a deep reply to show it on."""
+        old = timezone.now() - datetime.timedelta(days=100)
+        ancestors = models.BaseComment.objects.filter(
+            pk__in=[comment.pk for comment in self.chain[:3]],
+        )
+        ancestors.update(date_created=old)
+
+        before = timezone.now() - datetime.timedelta(days=1)
+        archivable = models.BaseComment.objects.archivable(created_before=before)
+        self.assertEqual(archivable.archive(), 0)
+
+        response = self.view_class.as_view()(self.create_request(), pk=self.chain[1].pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context_data['comments'], self.chain[1:])
+
+    def test_get_private(self):
+        self.comment.discussion.group.is_private = True
+        self.comment.discussion.group.save()
+        with self.assertRaises(Http404):
+            self.view_class.as_view()(self.create_request(), pk=self.comment.pk)
+
+
 class TestCommentPostByEmail(RequestTestCase):
     view_class = comments.CommentPostByEmail
 
@@ -236,3 +450,28 @@ class TestCommentPostByEmail(RequestTestCase):
         extract_uuid.assert_called_once_with(request_data['recipient'], request)
         create_file_attachments.assert_called_once_with(request, user, comment)
         email_subscribers.assert_called_once_with(comment)
+
+    def test_post_rate_limited(self):
+        """
+        A mail loop is cut off before it creates comments or sends notifications, and
+        refused with a 406 so that Mailgun doesn't retry the mail later.
+        """
+        discussion = factories.DiscussionFactory.create()
+        user = discussion.creator
+        uuid = self.generate_uuid(discussion.pk, user.pk)
+        request = self.create_request(method='post')
+        request.POST = {'stripped-text': 'Re: Re: Re:', 'recipient': 'mocked out'}
+        error = ratelimits.RateLimited('reply_token', 60)
+
+        with mock.patch(self.extract_path, return_value=uuid):
+            with mock.patch(self.email_path) as email_subscribers:
+                with mock.patch(
+                    'groups.ratelimits.check_comment',
+                    side_effect=error,
+                ) as check_comment:
+                    response = self.view_class.as_view()(request, uuid='mocked out')
+
+        self.assertEqual(response.status_code, 406)
+        check_comment.assert_called_once_with(user, discussion, reply_token=uuid)
+        self.assertFalse(models.TextComment.objects.exists())
+        self.assertFalse(email_subscribers.called)
@@ -4,15 +4,30 @@ except ImportError:
     import mock
 
 import datetime
+import json
+import time
 
 import pytz
-from django.core import mail
+from crispy_forms.helper import FormHelper
+from django.apps import apps
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.http import Http404
+from django.utils.http import http_date
 from incuna_test_utils.compat import Python2AssertMixin
 
 from . import factories
 from .utils import RequestTestCase
-from .. import models
+from .. import (
+    attachments,
+    events,
+    forms,
+    models,
+    ratelimits,
+    reactions,
+    read_markers,
+    revisions,
+)
 from ..views import discussions
 
 
@@ -34,6 +49,250 @@ class TestDiscussionThread(Python2AssertMixin, RequestTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertCountEqual(response.context_data['comments'], [comment])
         self.assertEqual(response.context_data['discussion'], discussion)
+        self.assertEqual(response.context_data['last_comment_id'], comment.pk)
+
+    def test_get_marks_read(self):
+        """Reading a thread notes the latest comment, to be saved with others later."""
+        comment = factories.TextCommentFactory.create()
+        request = self.create_request()
+
+        self.view_class.as_view()(request, pk=comment.discussion_id)
+
+        key = (request.user.pk, comment.discussion_id)
+        self.assertEqual(read_markers.buffer.pending, {key: comment.pk})
+
+    def test_get_marks_read_shown(self):
+        """Replies too deep to show on the page aren't marked read."""
+        config = apps.get_app_config('groups')
+        comment = factories.TextCommentFactory.create()
+        reply = factories.TextCommentFactory.create(
+            discussion=comment.discussion,
+            parent=comment,
+        )
+        factories.TextCommentFactory.create(discussion=comment.discussion)
+        request = self.create_request()
+
+        with mock.patch.object(config, 'thread_page_depth', 1):
+            self.view_class.as_view()(request, pk=comment.discussion_id)
+
+        key = (request.user.pk, comment.discussion_id)
+        self.assertEqual(read_markers.buffer.pending, {key: reply.pk - 1})
+
+    def test_get_marks_read_unlimited(self):
+        config = apps.get_app_config('groups')
+        comment = factories.TextCommentFactory.create()
+        reply = factories.TextCommentFactory.create(
+            discussion=comment.discussion,
+            parent=comment,
+        )
+        request = self.create_request()
+
+        with mock.patch.object(config, 'thread_page_depth', None):
+            self.view_class.as_view()(request, pk=comment.discussion_id)
+
+        key = (request.user.pk, comment.discussion_id)
+        self.assertEqual(read_markers.buffer.pending, {key: reply.pk})
+
+    def test_get_archived(self):
+        """Archived comments are only shown when asked for."""
+        discussion = factories.DiscussionFactory.create()
+        comment = factories.TextCommentFactory.create(
+            discussion=discussion,
+            date_created=datetime.datetime(2017, 1, 2),
+        )
+        archived = factories.ArchivedCommentFactory.create(
+            discussion=discussion,
+            date_created=datetime.datetime(2017, 1, 1),
+        )
+        view = self.view_class.as_view()
+
+        response = view(self.create_request(), pk=discussion.pk)
+        self.assertEqual(response.context_data['comments'], [comment])
+        self.assertTrue(response.context_data['has_archived_comments'])
+        self.assertIn('?archived=1', response.render().content.decode())
+
+        response = view(self.create_request(url='/?archived=1'), pk=discussion.pk)
+        self.assertEqual(response.context_data['comments'], [archived, comment])
+        self.assertIn(archived.body, response.render().content.decode())
+
+    def test_not_modified(self):
+        """A client with the current page gets a 304 without anything being rendered."""
+        discussion = factories.DiscussionFactory.create()
+        comment = factories.TextCommentFactory.create(discussion=discussion)
+        user = factories.UserFactory.create()
+        view = self.view_class.as_view()
+
+        response = view(self.create_request(user=user), pk=discussion.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        etag = response['ETag']
+
+        request = self.create_request(user=user, HTTP_IF_NONE_MATCH=etag)
+        with mock.patch.object(self.view_class, 'get_queryset') as get_queryset:
+            response = view(request, pk=discussion.pk)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(get_queryset.called)
+
+        # The page changes for other users, and when a comment is deleted.
+        request = self.create_request(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(view(request, pk=discussion.pk).status_code, 200)
+
+        comment.delete_state()
+        request = self.create_request(user=user, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(view(request, pk=discussion.pk).status_code, 200)
+
+    def test_no_last_modified(self):
+        """
+        Hiding a comment changes the page without moving any date, so clients can only
+        revalidate with the ETag.
+        """
+        comment = factories.TextCommentFactory.create()
+        view = self.view_class.as_view()
+
+        response = view(self.create_request(), pk=comment.discussion_id)
+        self.assertNotIn('Last-Modified', response)
+
+        comment.transition(models.BaseComment.STATE_HIDDEN)
+        request = self.create_request(
+            HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 3600),
+        )
+        self.assertEqual(view(request, pk=comment.discussion_id).status_code, 200)
+
+    def test_not_modified_edited(self):
+        """Editing a comment changes the page's ETag."""
+        comment = factories.TextCommentFactory.create()
+        user = factories.UserFactory.create()
+        view = self.view_class.as_view()
+        request = self.create_request(user=user)
+        etag = view(request, pk=comment.discussion_id)['ETag']
+
+        revisions.edit(comment, 'Changed', comment.user)
+
+        request = self.create_request(user=user, HTTP_IF_NONE_MATCH=etag)
+        response = view(request, pk=comment.discussion_id)
+        self.assertEqual(response.status_code, 200)
+        content = response.render().content.decode()
+        self.assertIn('Changed', content)
+        self.assertIn('/groups/comments/{}/history/'.format(comment.pk), content)
+
+    def test_not_modified_reacted(self):
+        """Reacting to a comment changes the page for the user who reacted."""
+        comment = factories.TextCommentFactory.create()
+        user = factories.UserFactory.create()
+        view = self.view_class.as_view()
+        etag = view(self.create_request(user=user), pk=comment.discussion_id)['ETag']
+
+        reactions.react(user, comment, 'thanks')
+
+        request = self.create_request(user=user, HTTP_IF_NONE_MATCH=etag)
+        response = view(request, pk=comment.discussion_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context_data['comments'][0].reaction_totals, [
+            ('like', 0), ('love', 0), ('laugh', 0), ('thanks', 1),
+        ])
+        content = response.render().content.decode()
+        self.assertIn('/groups/comments/{}/react/'.format(comment.pk), content)
+
+    def test_not_modified_queries(self):
+        """A 304 costs one query for the discussion and one for its ETag."""
+        comment = factories.TextCommentFactory.create()
+        factories.AttachedFileFactory.create(attached_to=comment)
+        factories.ReactionCountFactory.create(comment=comment)
+        reaction = factories.ReactionFactory.create(comment=comment)
+        view = self.view_class.as_view()
+        request = self.create_request(user=reaction.user)
+        etag = view(request, pk=comment.discussion_id)['ETag']
+
+        request = self.create_request(user=reaction.user, HTTP_IF_NONE_MATCH=etag)
+        with self.assertNumQueries(2):
+            response = view(request, pk=comment.discussion_id)
+        self.assertEqual(response.status_code, 304)
+
+    def test_not_modified_subscription(self):
+        discussion = factories.DiscussionFactory.create()
+        user = factories.UserFactory.create()
+        view = self.view_class.as_view()
+        etag = view(self.create_request(user=user), pk=discussion.pk)['ETag']
+
+        discussion.subscribe(user)
+        request = self.create_request(user=user, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(view(request, pk=discussion.pk).status_code, 200)
+
+    def test_not_modified_hidden(self):
+        """Hiding a comment, and restoring it, both change the page."""
+        comment = factories.TextCommentFactory.create()
+        comments = models.BaseComment.objects.filter(pk=comment.pk)
+        user = factories.UserFactory.create()
+        view = self.view_class.as_view()
+        etag = view(self.create_request(user=user), pk=comment.discussion_id)['ETag']
+
+        comments.set_state(models.BaseComment.STATE_HIDDEN)
+        response = view(self.create_request(user=user), pk=comment.discussion_id)
+        self.assertNotEqual(response['ETag'], etag)
+
+        comments.set_state(models.BaseComment.STATE_OK)
+        response = view(self.create_request(user=user), pk=comment.discussion_id)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_not_modified_attachment_processed(self):
+        """Processing an attachment adds its thumbnail to the page."""
+        attachment = factories.AttachedFileFactory.create(
+            attached_to=factories.TextCommentFactory.create(),
+        )
+        discussion_id = attachment.attached_to.discussion_id
+        user = factories.UserFactory.create()
+        view = self.view_class.as_view()
+        etag = view(self.create_request(user=user), pk=discussion_id)['ETag']
+
+        attachments.process_pending()
+        request = self.create_request(user=user, HTTP_IF_NONE_MATCH=etag)
+        response = view(request, pk=discussion_id)
+        self.assertEqual(response.status_code, 200)
+
+        attachment.refresh_from_db()
+        content = response.render().content.decode()
+        self.assertIn(attachment.thumbnail.name, content)
+        self.assertIn(attachment.preview.name, content)
+
+    def test_subscribe_button_cost(self):
+        """
+        The subscribe button's share of each page view, once its HTML is cached.
+
+        Showing a cached button builds no form helper and doesn't run crispy, which
+        is nearly all the cost of rendering it from scratch.
+        """
+        discussion = factories.DiscussionFactory.create()
+        user = factories.UserFactory.create()
+        iterations = 20
+
+        def render_buttons(clear_cache):
+            helper = mock.Mock(wraps=FormHelper)
+            crispy = mock.Mock(wraps=forms.render_crispy_form)
+            with mock.patch.object(forms, 'FormHelper', helper):
+                with mock.patch.object(forms, 'render_crispy_form', crispy):
+                    for _ in range(iterations):
+                        if clear_cache:
+                            cache.clear()
+                        form = forms.SubscribeForm(
+                            user=user,
+                            instance=discussion,
+                            url_name='discussion-subscribe',
+                        )
+                        form.render_button('token')
+            return helper.call_count, crispy.call_count
+
+        self.assertEqual(render_buttons(clear_cache=True), (iterations, iterations))
+        self.assertEqual(render_buttons(clear_cache=False), (0, 0))
+
+    def test_get_private(self):
+        """A discussion on a private group can't be read by outsiders."""
+        discussion = factories.DiscussionFactory.create(group__is_private=True)
+
+        request = self.create_request()
+        view = self.view_class.as_view()
+
+        with self.assertRaises(Http404):
+            view(request, pk=discussion.pk)
 
     def test_sorting(self):
         discussion = factories.DiscussionFactory.create()
@@ -71,6 +330,87 @@ class TestDiscussionThread(Python2AssertMixin, RequestTestCase):
         self.assertEqual(created_comment.discussion, discussion)
         self.assertEqual(created_comment.user, user)
 
+    def test_post_publishes(self):
+        """The new comment is sent to the discussion's live readers."""
+        discussion = factories.DiscussionFactory.create()
+        request = self.create_request('post', data={'body': 'I am a comment!'})
+
+        with mock.patch('groups.events.publish_comment') as publish_comment:
+            self.view_class.as_view()(request, pk=discussion.pk)
+
+        publish_comment.assert_called_once_with(models.TextComment.objects.get())
+
+    def test_post_rate_limited(self):
+        """A comment over the rate limit is refused before it's saved."""
+        discussion = factories.DiscussionFactory.create()
+        request = self.create_request('post', data={'body': 'I am a comment!'})
+        error = ratelimits.RateLimited('user', 30)
+
+        with mock.patch('groups.ratelimits.check_comment', side_effect=error):
+            response = self.view_class.as_view()(request, pk=discussion.pk)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        form = response.context_data['form']
+        self.assertEqual(form.non_field_errors(), [str(error)])
+        self.assertFalse(models.TextComment.objects.exists())
+
+    def test_get_threaded(self):
+        """Replies follow the comments they reply to, until they get too deep."""
+        discussion = factories.DiscussionFactory.create()
+        first, second = factories.TextCommentFactory.create_batch(
+            2,
+            discussion=discussion,
+        )
+        reply = factories.TextCommentFactory.create(discussion=discussion, parent=first)
+        factories.TextCommentFactory.create(discussion=discussion, parent=reply)
+        config = apps.get_app_config('groups')
+
+        with mock.patch.object(config, 'thread_page_depth', 2):
+            response = self.view_class.as_view()(self.create_request(), pk=discussion.pk)
+            content = response.render().content.decode()
+
+        comments = response.context_data['comments']
+        self.assertEqual(comments, [first, reply, second])
+        self.assertEqual([c.thread_depth for c in comments], [0, 1, 0])
+        self.assertTrue(comments[1].has_hidden_replies)
+        self.assertIn('/groups/comments/{}/replies/'.format(reply.pk), content)
+        self.assertIn('?reply_to={}#reply'.format(second.pk), content)
+
+    def test_get_reply_to(self):
+        comment = factories.TextCommentFactory.create()
+        request = self.create_request(url='/?reply_to={}'.format(comment.pk))
+
+        response = self.view_class.as_view()(request, pk=comment.discussion_id)
+
+        self.assertEqual(response.context_data['form']['parent'].value(), str(comment.pk))
+        self.assertIn('Replying to', response.render().content.decode())
+
+    def test_post_reply(self):
+        comment = factories.TextCommentFactory.create()
+        data = {'body': 'I am a reply!', 'parent': comment.pk}
+        request = self.create_request('post', data=data)
+
+        response = self.view_class.as_view()(request, pk=comment.discussion_id)
+
+        reply = models.TextComment.objects.get(body=data['body'])
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(reply.parent, comment)
+        self.assertEqual(reply.depth, 1)
+
+    def test_post_reply_other_discussion(self):
+        """Only comments on the same discussion can be replied to."""
+        comment = factories.TextCommentFactory.create()
+        discussion = factories.DiscussionFactory.create()
+        data = {'body': 'I am a reply!', 'parent': comment.pk}
+        request = self.create_request('post', data=data)
+
+        response = self.view_class.as_view()(request, pk=discussion.pk)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('parent', response.context_data['form'].errors)
+        self.assertFalse(models.TextComment.objects.filter(body=data['body']).exists())
+
 
 class TestDiscussionCreate(RequestTestCase):
     view_class = discussions.DiscussionCreate
@@ -116,35 +456,96 @@ class TestDiscussionCreate(RequestTestCase):
         self.assertEqual(email_subscribers.call_count, 1)
 
     def test_email_subscribers(self):
-        """
-        Test notification emails for a new discussion.
-
-        Assert that subscribers to a group are emailed correctly when a new discussion
-        is posted there, apart from the discussion's creator.
-        """
-        group = factories.GroupFactory.create()
-        subscriber = factories.UserFactory.create()
-        creator = factories.UserFactory.create()
-        group.subscribe(subscriber)
-        group.subscribe(creator)
-
-        new_discussion = factories.DiscussionFactory.create(creator=creator, group=group)
-        first_comment = factories.TextCommentFactory.create(discussion=new_discussion)
-
+        """A notification about the new discussion is queued in the outbox."""
+        discussion = factories.DiscussionFactory.create()
         view = self.view_class()
-        view.request = self.create_request(user=creator)
-
-        reply_address = 'leeroy@jenkins.com'
-        address_path = 'groups.views.discussions.get_reply_address'  # imports are weird
-        with mock.patch(address_path, return_value=reply_address):
-            view.email_subscribers(new_discussion)
-
-        self.assertEqual(len(mail.outbox), 1)
-        email = mail.outbox[0]
-        self.assertEqual(email.subject, 'New discussion in {}'.format(group.name))
-        self.assertEqual(email.to, [subscriber.email])
-        self.assertEqual(email.reply_to, [reply_address])
-        self.assertIn('A new discussion on "{}"'.format(new_discussion.name), email.body)
-        self.assertIn(subscriber.get_full_name(), email.body)
-        self.assertIn(first_comment.body, email.body)
-        self.assertIn('http://testserver', email.body)
+        view.request = self.create_request(user=discussion.creator)
+
+        view.email_subscribers(discussion)
+
+        message = models.OutboxMessage.objects.get()
+        self.assertEqual(message.kind, message.KIND_DISCUSSION)
+        self.assertEqual(message.object_id, discussion.pk)
+
+
+class TestDiscussionEvents(RequestTestCase):
+    view_class = discussions.DiscussionEvents
+    stream_seconds_path = 'groups.apps.GroupsConfig.event_stream_seconds'
+
+    def setUp(self):
+        self.discussion = factories.DiscussionFactory.create()
+        self.comment = factories.TextCommentFactory.create(discussion=self.discussion)
+
+    def get_stream(self, **kwargs):
+        request = self.create_request(**kwargs)
+        response = self.view_class.as_view()(request, pk=self.discussion.pk)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.addCleanup(response.close)
+        return iter(response.streaming_content)
+
+    def test_new_comments(self):
+        """Comments published after connecting are streamed."""
+        stream = self.get_stream()
+        self.assertEqual(next(stream), b'retry: 3000\n\n')
+
+        message = json.dumps({'id': self.comment.pk + 1, 'html': 'Hello'})
+        channel = events.discussion_channel(self.discussion.pk)
+        events.get_broker().publish(channel, message)
+
+        event = next(stream).decode()
+        self.assertIn('id: {}\n'.format(self.comment.pk + 1), event)
+        self.assertIn('Hello', event)
+
+    def test_missed_comments(self):
+        """Comments after the last one the browser has are sent first."""
+        stream = self.get_stream(url='/?after=0')
+        next(stream)
+
+        event = next(stream).decode()
+        self.assertIn('id: {}\n'.format(self.comment.pk), event)
+        self.assertIn(self.comment.body, event)
+
+        # The same comment arriving from the broker isn't sent twice.
+        channel = events.discussion_channel(self.discussion.pk)
+        events.get_broker().publish(channel, json.dumps({'id': self.comment.pk}))
+        with mock.patch.object(self.view_class, 'keepalive_seconds', 0):
+            self.assertEqual(next(stream), b': keepalive\n\n')
+
+    def test_last_event_id(self):
+        """Reconnecting browsers are caught up from their `Last-Event-ID`."""
+        newer = factories.TextCommentFactory.create(discussion=self.discussion)
+        stream = self.get_stream(HTTP_LAST_EVENT_ID=str(self.comment.pk))
+        next(stream)
+
+        self.assertIn('id: {}\n'.format(newer.pk), next(stream).decode())
+
+    def test_stream_ends(self):
+        """The stream closes after `event_stream_seconds`, and unsubscribes."""
+        with mock.patch(self.stream_seconds_path, new=0):
+            content = list(self.get_stream(url='/?after=nonsense'))
+
+        self.assertEqual(content, [b'retry: 3000\n\n'])
+        self.assertEqual(events.get_broker().subscriptions, {})
+
+    def test_close_connections(self):
+        """The database connections are closed before waiting for new comments."""
+        connection = mock.Mock(in_atomic_block=False)
+        in_transaction = mock.Mock(in_atomic_block=True)
+        all_path = 'groups.views.discussions.connections.all'
+        with mock.patch(all_path, return_value=[connection, in_transaction]):
+            stream = self.get_stream(url='/?after=0')
+            next(stream)
+            self.assertFalse(connection.close.called)
+
+            self.assertIn('id: {}\n'.format(self.comment.pk), next(stream).decode())
+
+        connection.close.assert_called_once_with()
+        self.assertFalse(in_transaction.close.called)
+
+    def test_private(self):
+        discussion = factories.DiscussionFactory.create(group__is_private=True)
+        request = self.create_request()
+
+        with self.assertRaises(Http404):
+            self.view_class.as_view()(request, pk=discussion.pk)
@@ -1,5 +1,12 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 import datetime
 
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404
 from incuna_test_utils.compat import Python2AssertMixin
 
 from . import factories
@@ -22,6 +29,17 @@ class TestGroupList(Python2AssertMixin, RequestTestCase):
         object_list = response.context_data['object_list']
         self.assertCountEqual(object_list, [group_first, group_last])
 
+    def test_get_private(self):
+        """Private groups are hidden from users who haven't joined them."""
+        public = factories.GroupFactory.create()
+        factories.GroupFactory.create(is_private=True)
+
+        request = self.create_request()
+        view = self.view_class.as_view()
+
+        response = view(request)
+        self.assertCountEqual(response.context_data['object_list'], [public])
+
 
 class TestGroupDetail(RequestTestCase):
     view_class = groups.GroupDetail
@@ -62,3 +80,79 @@ class TestGroupDetail(RequestTestCase):
         discussions = response.context_data['object_list']
         expected = [discussion_newest, discussion_middle, discussion_oldest]
         self.assertSequenceEqual(discussions, expected)
+
+    def test_get_private(self):
+        """A private group can't be viewed by a user who hasn't joined it."""
+        group = factories.GroupFactory.create(is_private=True)
+
+        request = self.create_request()
+        view = self.view_class.as_view()
+
+        with self.assertRaises(Http404):
+            view(request, pk=group.pk)
+
+    def test_not_modified(self):
+        """A client with the current page gets a 304, until a discussion is started."""
+        group = factories.GroupFactory.create()
+        user = factories.UserFactory.create()
+        view = self.view_class.as_view()
+
+        response = view(self.create_request(user=user), pk=group.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Vary'], 'Cookie')
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+
+        request = self.create_request(user=user, HTTP_IF_NONE_MATCH=etag)
+        with mock.patch.object(self.view_class, 'get_queryset') as get_queryset:
+            response = view(request, pk=group.pk)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(get_queryset.called)
+
+        factories.DiscussionFactory.create(group=group)
+        request = self.create_request(user=user, HTTP_IF_NONE_MATCH=etag)
+        response = view(request, pk=group.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+
+    def test_not_modified_read(self):
+        """Reading a discussion changes its unread count, so the page changes too."""
+        comment = factories.TextCommentFactory.create()
+        group = comment.discussion.group
+        user = factories.UserFactory.create()
+        view = self.view_class.as_view()
+        etag = view(self.create_request(user=user), pk=group.pk)['ETag']
+
+        factories.ReadMarkerFactory.create(
+            user=user,
+            discussion=comment.discussion,
+            last_read_comment_id=comment.pk,
+        )
+        request = self.create_request(user=user, HTTP_IF_NONE_MATCH=etag)
+        response = view(request, pk=group.pk)
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_anonymous(self):
+        """Anonymous users have no read markers, so nothing is counted as unread."""
+        comment = factories.TextCommentFactory.create()
+        request = self.create_request(user=AnonymousUser())
+
+        response = self.view_class.as_view()(request, pk=comment.discussion.group_id)
+        discussion, = response.context_data['object_list']
+        self.assertFalse(hasattr(discussion, 'unread_count'))
+
+    def test_unread_count(self):
+        comment = factories.TextCommentFactory.create()
+        factories.TextCommentFactory.create(discussion=comment.discussion)
+        user = factories.UserFactory.create()
+        factories.ReadMarkerFactory.create(
+            user=user,
+            discussion=comment.discussion,
+            last_read_comment_id=comment.pk,
+        )
+        view = self.view_class.as_view()
+
+        response = view(self.create_request(user=user), pk=comment.discussion.group_id)
+        discussion, = response.context_data['object_list']
+        self.assertEqual(discussion.unread_count, 1)
+        self.assertIn('1 Unread', response.render().content.decode())
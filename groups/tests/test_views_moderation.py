@@ -0,0 +1,92 @@
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from incuna_test_utils.compat import Python2AssertMixin
+
+from . import factories
+from .utils import RequestTestCase
+from .. import models
+from ..views import moderation
+
+
+class TestModerationQueue(Python2AssertMixin, RequestTestCase):
+    view_class = moderation.ModerationQueue
+
+    def setUp(self):
+        super(TestModerationQueue, self).setUp()
+        self.group = factories.GroupFactory.create()
+        self.moderator = factories.UserFactory.create()
+        self.group.moderators.add(self.moderator)
+
+    def call(self, method='get', user=None, **kwargs):
+        request = self.create_request(method, user=user or self.moderator, **kwargs)
+        return request, self.view_class.as_view()(request, pk=self.group.pk)
+
+    def test_get(self):
+        old, new = factories.TextCommentFactory.create_batch(
+            2,
+            discussion__group=self.group,
+        )
+        factories.TextCommentFactory.create()
+
+        request, response = self.call()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context_data['object_list']), [new, old])
+        self.assertEqual(response.context_data['group'], self.group)
+        self.assertIn(new.body, response.render().content.decode())
+
+    def test_get_state(self):
+        comment, hidden = factories.TextCommentFactory.create_batch(
+            2,
+            discussion__group=self.group,
+        )
+        models.BaseComment.objects.filter(pk=hidden.pk).set_state('hidden')
+
+        request, response = self.call(url='/?state=hidden')
+        self.assertEqual(list(response.context_data['object_list']), [hidden])
+        self.assertEqual(response.context_data['state'], 'hidden')
+
+        request, response = self.call(url='/?state=nonsense')
+        self.assertCountEqual(response.context_data['object_list'], [comment, hidden])
+        self.assertIsNone(response.context_data['state'])
+
+    def test_not_moderator(self):
+        with self.assertRaises(PermissionDenied):
+            self.call(user=factories.UserFactory.create())
+
+    def test_staff(self):
+        request, response = self.call(user=factories.AdminFactory.create())
+        self.assertEqual(response.status_code, 200)
+
+    def test_private_group(self):
+        self.group.is_private = True
+        self.group.save()
+
+        with self.assertRaises(Http404):
+            self.call(user=factories.UserFactory.create())
+
+    def test_post(self):
+        comments = factories.TextCommentFactory.create_batch(
+            2,
+            discussion__group=self.group,
+        )
+        data = {'action': 'deleted', 'comments': [comment.pk for comment in comments]}
+
+        request, response = self.call('post', data=data, url='/?state=ok')
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['location'], '/?state=ok')
+        self.assertEqual(request._messages.store[0], '2 comments changed.')
+        deleted = models.BaseComment.objects.filter(state='deleted')
+        self.assertCountEqual(deleted, comments)
+
+    def test_post_invalid(self):
+        other = factories.TextCommentFactory.create()
+        data = {'action': 'deleted', 'comments': [other.pk]}
+
+        request, response = self.call('post', data=data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('comments', response.context_data['form'].errors)
+        other.refresh_from_db()
+        self.assertFalse(other.is_deleted())
@@ -1,12 +1,76 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import shutil
+import tempfile
+
+from django.apps import apps
+from django.core.cache import caches
 from incuna_test_utils.testcases.integration import BaseIntegrationTestCase
 from incuna_test_utils.testcases.request import BaseRequestTestCase
 
 from .factories import UserFactory
+from .. import reactions, read_markers
+
+
+class WriteBehindBufferMixin(object):
+    """
+    Give each test its own read marker and reaction buffers (see `groups.buffers`).
+
+    Otherwise changes noted by one test could be flushed by a later one, after the
+    rows they refer to have been rolled back.
+    """
+    def setUp(self):
+        super(WriteBehindBufferMixin, self).setUp()
+        for module in (read_markers, reactions):
+            buffer = type(module.buffer)()
+            patcher = mock.patch.object(module, 'buffer', buffer)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+            self.addCleanup(buffer.cancel)
+
+
+class EmptyCacheMixin(object):
+    """
+    Start each test with an empty cache.
+
+    Otherwise the rate limits counted by one test could refuse comments in a later
+    one, which may reuse the same user and discussion ids.
+    """
+    def setUp(self):
+        super(EmptyCacheMixin, self).setUp()
+        caches[apps.get_app_config('groups').rate_limit_cache].clear()
+
+
+class UploadStagingMixin(object):
+    """Stage each test's resumable uploads in a temporary directory of its own."""
+    def setUp(self):
+        super(UploadStagingMixin, self).setUp()
+        self.staging_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.staging_directory)
+        config = apps.get_app_config('groups')
+        patcher = mock.patch.object(
+            config,
+            'upload_staging_directory',
+            self.staging_directory,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
 
-class RequestTestCase(BaseRequestTestCase):
+class RequestTestCase(
+    EmptyCacheMixin,
+    WriteBehindBufferMixin,
+    BaseRequestTestCase,
+):
     user_factory = UserFactory
 
 
-class RenderedContentTestCase(BaseIntegrationTestCase):
+class RenderedContentTestCase(
+    EmptyCacheMixin,
+    WriteBehindBufferMixin,
+    BaseIntegrationTestCase,
+):
     user_factory = UserFactory
@@ -0,0 +1,78 @@
+"""
+Nest replies under the comments they reply to.
+
+Each comment keeps a pointer to its `parent`, and a materialised path: the pks of
+its ancestors, root first, as `'12/34/'`.  Both are known before the comment is
+saved, so posting a reply costs no extra query.  The replies to a comment, their
+replies and so on are the comments whose path starts with the comment's own path
+plus its pk, which is a single indexed `LIKE 'prefix%'` query (see
+`CommentManagerMixin.subtree()`).  `depth` is the number of ancestors.
+
+A whole thread is loaded in one query, like a flat one was, and `order()` puts it
+in thread order in memory.  Pages only show `thread_page_depth` levels of replies.
+Comments at the last level that have replies link to `CommentReplies`, which loads
+the branch below them on its own page, `thread_page_depth` levels at a time.
+"""
+from collections import defaultdict
+
+from django.apps import apps
+
+
+def get_config():
+    return apps.get_app_config('groups')
+
+
+def get_reply_path(comment):
+    """Return the path of a reply to `comment`."""
+    return '{}{}/'.format(comment.path, comment.pk)
+
+
+def get_ancestor_ids(comment):
+    """Return the pks of `comment`'s ancestors, root first."""
+    return [int(pk) for pk in comment.path.split('/') if pk]
+
+
+def order(comments):
+    """
+    Return `comments` in thread order: each one followed by its replies.
+
+    Siblings keep the order they were given in.  Comments whose parent isn't among
+    `comments` are treated as top-level ones.  Each comment is given a
+    `thread_depth`, its depth within `comments`, for indenting it.
+    """
+    ids = {comment.pk for comment in comments}
+    replies = defaultdict(list)
+    for comment in comments:
+        parent_id = comment.parent_id if comment.parent_id in ids else None
+        replies[parent_id].append(comment)
+
+    ordered = []
+    stack = [(comment, 0) for comment in reversed(replies[None])]
+    while stack:
+        comment, depth = stack.pop()
+        comment.thread_depth = depth
+        ordered.append(comment)
+        stack.extend((reply, depth + 1) for reply in reversed(replies[comment.pk]))
+    return ordered
+
+
+def get_page_root_id(comment):
+    """
+    Return the pk of the comment whose replies page shows `comment`.
+
+    That's None for comments shown on the discussion's own page.
+    """
+    per_page = get_config().thread_page_depth
+    if per_page is None or comment.depth < per_page:
+        return None
+    root_depth = per_page - 1 + per_page * ((comment.depth - per_page) // per_page)
+    return get_ancestor_ids(comment)[root_depth]
+
+
+def mark_collapsed(comments, last_depth):
+    """Flag the comments at `last_depth` whose replies aren't shown, and return them."""
+    for comment in comments:
+        comment.has_hidden_replies = bool(
+            comment.depth == last_depth and getattr(comment, 'reply_count', 0)
+        )
+    return comments
@@ -0,0 +1,259 @@
+"""
+Receive large attachments in resumable chunks.
+
+A client starts an `UploadSession` with the file's name and size, sends the file's
+bytes in one or more chunks, each starting at the session's current `offset`, and
+then finishes the session, which turns it into an `AttachedFile`.  That attachment
+can then be attached to a new comment.  If a connection drops, the bytes that did
+arrive are kept: the client asks for the session's `offset` and carries on from
+there.
+
+Each chunk is read from the request into a part file on local disk, in
+`upload_staging_directory`, a piece at a time, before the session is locked.  Only
+then is the session's row locked, briefly, to check the chunk still starts at its
+offset, append the part to the session's staging file and move the offset on, so a
+slow client never holds a lock or a transaction open.  The finished file is
+streamed from the staging file into storage.  The file is never held in memory.
+Each process that receives chunks for a session must see the same staging
+directory.  If the staging file turns out to be shorter than the session's offset
+(because the directory was cleaned, or the process can't see it), the offset is
+moved back to the bytes it does hold, and the client is told to resume from there.
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import uuid
+
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import router, transaction
+from django.utils import timezone
+
+from . import models
+from .outbox import on_commit
+
+
+PIECE_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """An upload request that can't be carried out."""
+
+
+class OffsetMismatch(UploadError):
+    """A chunk that doesn't start where the upload has got to."""
+    def __init__(self, message, offset):
+        super(OffsetMismatch, self).__init__(message)
+        self.offset = offset
+
+
+def get_config():
+    return apps.get_app_config('groups')
+
+
+def staging_path(session):
+    directory = get_config().upload_staging_directory
+    if directory is None:
+        directory = os.path.join(tempfile.gettempdir(), 'groups-uploads')
+    return os.path.join(directory, str(session.pk))
+
+
+def remove_staged(session):
+    try:
+        os.remove(staging_path(session))
+    except OSError:
+        pass
+
+
+def staged_size(path):
+    """Return how many bytes of an upload are in the staging file at `path`."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def lost(offset):
+    message = 'Part of the upload was lost; resend it from the offset.'
+    return OffsetMismatch(message, offset)
+
+
+def get_current(session):
+    """Return `session` as it is now, from the primary database."""
+    sessions = models.UploadSession.objects.using(
+        router.db_for_write(models.UploadSession),
+    )
+    return sessions.get(pk=session.pk)
+
+
+def check_chunk(session, offset, length):
+    """Raise `UploadError` if `session` can't take `length` bytes at `offset`."""
+    if session.is_complete():
+        raise UploadError('The upload is already complete.')
+    if offset != session.offset:
+        message = 'Expected a chunk at the current offset.'
+        raise OffsetMismatch(message, session.offset)
+    if offset + length > session.size:
+        raise UploadError('The chunk runs past the end of the file.')
+
+
+def read_part(path, length, stream):
+    """Copy up to `length` bytes from `stream` to a new file, and return how many."""
+    remaining = length
+    with open(path, 'wb') as part:
+        while remaining:
+            try:
+                piece = stream.read(min(remaining, PIECE_SIZE))
+            except IOError:  # The client went away.
+                break
+            if not piece:
+                break
+            part.write(piece)
+            remaining -= len(piece)
+    return length - remaining
+
+
+def start(user, filename, size):
+    """Start an upload of `size` bytes, to be called `filename`."""
+    max_size = get_config().upload_max_bytes
+    if size < 1:
+        raise UploadError('The file is empty.')
+    if size > max_size:
+        raise UploadError('The file is larger than {} bytes.'.format(max_size))
+    return models.UploadSession.objects.create(
+        user=user,
+        filename=os.path.basename(filename),
+        size=size,
+    )
+
+
+def receive(session, offset, length, stream):
+    """
+    Append `length` bytes, read from `stream`, to the upload at `offset`.
+
+    Whatever arrives is kept, even if the stream ends early, and the session's new
+    offset is returned.  Chunks longer than `upload_max_chunk_bytes`, that don't
+    start at the current offset, or that run past the end of the file, raise
+    `UploadError`.  If the staging file has lost bytes before `offset`, the session's
+    offset is moved back to the end of what's left and `OffsetMismatch` is raised.
+    """
+    max_chunk = get_config().upload_max_chunk_bytes
+    if length > max_chunk:
+        raise UploadError('The chunk is larger than {} bytes.'.format(max_chunk))
+    check_chunk(get_current(session), offset, length)
+
+    path = staging_path(session)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    part_path = '{}.{}.part'.format(path, uuid.uuid4().hex)
+    try:
+        received = read_part(part_path, length, stream)
+
+        with transaction.atomic():
+            # Lock the session, so that only one request at a time writes to its file,
+            # and check nobody else has sent this chunk while it was arriving.
+            locked = models.UploadSession.objects.select_for_update().get(pk=session.pk)
+            check_chunk(locked, offset, length)
+            staged_bytes = staged_size(path)
+            if staged_bytes < offset:
+                locked.offset = staged_bytes
+            else:
+                with open(path, 'r+b' if staged_bytes else 'wb') as staged:
+                    # Drop anything written after the saved offset by a failed request.
+                    staged.seek(offset)
+                    staged.truncate()
+                    with open(part_path, 'rb') as part:
+                        shutil.copyfileobj(part, staged, PIECE_SIZE)
+                locked.offset = offset + received
+            locked.save(update_fields=['offset'])
+    finally:
+        os.remove(part_path)
+    if locked.offset < offset:
+        raise lost(locked.offset)
+    return locked.offset
+
+
+def finish(session):
+    """
+    Store the complete file as an unattached `AttachedFile`, and return it.
+
+    The file is copied into storage before the session is locked.  Finishing a
+    session again returns the same attachment.  If the staging file has lost bytes,
+    the session's offset is moved back to the end of what's left, and
+    `OffsetMismatch` is raised.
+    """
+    current = get_current(session)
+    if current.is_complete():
+        return current.attachment
+    if current.offset != current.size:
+        raise UploadError('The upload is incomplete.')
+    staged_bytes = staged_size(staging_path(current))
+    if staged_bytes < current.size:
+        sessions = models.UploadSession.objects.filter(pk=current.pk, offset=current.size)
+        sessions.update(offset=staged_bytes)
+        raise lost(staged_bytes)
+
+    attachment = models.AttachedFile(user=current.user)
+    with open(staging_path(current), 'rb') as staged:
+        attachment.file.save(current.filename, File(staged), save=False)
+
+    with transaction.atomic():
+        locked = models.UploadSession.objects.select_for_update().get(pk=session.pk)
+        if locked.is_complete():
+            # Another request finished it while the file was being stored.
+            attachment.file.delete(save=False)
+            return locked.attachment
+        attachment.save()
+        locked.attachment = attachment
+        locked.save(update_fields=['attachment'])
+        on_commit(lambda: remove_staged(locked))
+    return attachment
+
+
+def attach(session_id, comment):
+    """
+    Attach the file from the finished upload `session_id` to `comment`.
+
+    The upload must be by the comment's author, and its file mustn't be on another
+    comment already.
+    """
+    sessions = models.UploadSession.objects.filter(
+        user=comment.user,
+        attachment__isnull=False,
+    )
+    try:
+        attachment_id = sessions.values_list('attachment', flat=True).get(pk=session_id)
+    except (models.UploadSession.DoesNotExist, ValidationError):
+        attachment_id = None
+    attachments = models.AttachedFile.objects.filter(
+        pk=attachment_id,
+        attached_to__isnull=True,
+    )
+    if not attachment_id or not attachments.update(attached_to=comment):
+        raise UploadError('No finished upload with that id.')
+
+
+def delete_abandoned(hours=None, dry_run=False):
+    """
+    Delete unfinished uploads started more than `hours` ago, and their staged files.
+
+    `hours` defaults to `GroupsConfig.orphaned_attachment_hours`.  Return how many
+    uploads were (or, with `dry_run`, would have been) deleted.
+    """
+    if hours is None:
+        hours = get_config().orphaned_attachment_hours
+    cutoff = timezone.now() - datetime.timedelta(hours=hours)
+    sessions = models.UploadSession.objects.filter(
+        attachment__isnull=True,
+        date_created__lt=cutoff,
+    )
+    if dry_run:
+        return sessions.count()
+    count = 0
+    for session in sessions.only('pk').iterator():
+        remove_staged(session)
+        count += 1
+    sessions.delete()
+    return count
@@ -1,6 +1,6 @@
 from django.conf.urls import include, url
 
-from .views import comments, discussions, groups, subscriptions
+from .views import api, comments, discussions, groups, moderation, subscriptions
 
 
 urlpatterns = [
@@ -21,6 +21,11 @@ urlpatterns = [
             subscriptions.GroupSubscribe.as_view(),
             name='group-subscribe',
         ),
+        url(
+            r'^moderation/$',
+            moderation.ModerationQueue.as_view(),
+            name='group-moderation',
+        ),
     ])),
     url(r'^discussions/(?P<pk>\d+)/', include([
         url(
@@ -28,6 +33,11 @@ urlpatterns = [
             discussions.DiscussionThread.as_view(),
             name='discussion-thread',
         ),
+        url(
+            r'^events/$',
+            discussions.DiscussionEvents.as_view(),
+            name='discussion-events',
+        ),
         url(
             r'^post-with-attachment/$',
             comments.CommentPostWithAttachment.as_view(),
@@ -40,11 +50,83 @@ urlpatterns = [
         ),
     ])),
     url(r'^comments/(?P<pk>\d+)/', include([
+        url(
+            r'^$',
+            comments.CommentPermalink.as_view(),
+            name='comment-permalink',
+        ),
         url(
             r'^delete/$',
             comments.CommentDelete.as_view(),
             name='comment-delete',
         ),
+        url(
+            r'^edit/$',
+            comments.CommentEdit.as_view(),
+            name='comment-edit',
+        ),
+        url(
+            r'^react/$',
+            comments.CommentReact.as_view(),
+            name='comment-react',
+        ),
+        url(
+            r'^history/$',
+            comments.CommentHistory.as_view(),
+            name='comment-history',
+        ),
+        url(
+            r'^replies/$',
+            comments.CommentReplies.as_view(),
+            name='comment-replies',
+        ),
+    ])),
+    url(r'^api/', include([
+        url(r'^groups/$', api.GroupList.as_view(), name='api-group-list'),
+        url(r'^groups/(?P<pk>\d+)/', include([
+            url(r'^$', api.GroupDetail.as_view(), name='api-group-detail'),
+            url(
+                r'^discussions/$',
+                api.DiscussionList.as_view(),
+                name='api-discussion-list',
+            ),
+            url(
+                r'^subscription/$',
+                api.GroupSubscription.as_view(),
+                name='api-group-subscription',
+            ),
+            url(
+                r'^moderation/$',
+                api.CommentModeration.as_view(),
+                name='api-comment-moderation',
+            ),
+        ])),
+        url(r'^discussions/(?P<pk>\d+)/', include([
+            url(r'^$', api.DiscussionDetail.as_view(), name='api-discussion-detail'),
+            url(r'^comments/$', api.CommentList.as_view(), name='api-comment-list'),
+            url(
+                r'^subscription/$',
+                api.DiscussionSubscription.as_view(),
+                name='api-discussion-subscription',
+            ),
+        ])),
+        url(
+            r'^comments/(?P<pk>\d+)/$',
+            api.CommentDetail.as_view(),
+            name='api-comment-detail',
+        ),
+        url(
+            r'^comments/(?P<pk>\d+)/reactions/(?P<kind>[\w-]+)/$',
+            api.CommentReaction.as_view(),
+            name='api-comment-reaction',
+        ),
+        url(r'^mentions/$', api.MentionList.as_view(), name='api-mention-list'),
+        url(r'^uploads/$', api.UploadList.as_view(), name='api-upload-list'),
+        url(
+            r'^uploads/(?P<pk>[0-9a-f-]+)/$',
+            api.UploadDetail.as_view(),
+            name='api-upload-detail',
+        ),
     ])),
     url(
         r'^reply/',
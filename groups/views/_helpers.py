@@ -1,65 +1,62 @@
-from django.apps import apps
-from django.contrib.sites.shortcuts import get_current_site
+import hashlib
+
+from django.db import transaction
 from django.http import HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.utils import six
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
 from django.views.generic import CreateView
-from incuna_mail import send
-
-from .. import models
 
-NEW_COMMENT_SUBJECT = apps.get_app_config('groups').new_comment_subject
+from .. import events, forms, models, outbox, ratelimits, routers
 
 
-def get_reply_address(discussion, user, request):
-    """
-    Wrap a discussion reply UUID in an email address suitable for use as a reply-to.
+def latest(*dates):
+    """Return the latest of `dates`, ignoring Nones, or None if there aren't any."""
+    dates = [date for date in dates if date is not None]
+    return max(dates) if dates else None
 
-    reply-{uuid}@{domain}
 
-    The UUID contains colons, which aren't allowed in email addresses, so swap those
-    out for dollar signs ($) as a placeholder using a string `replace`.  The rest of
-    the UUID is base64-encoded, so there will be neither colons nor dollar signs in it
-    (it's only alphanumerics, hyphens, and underscores).
+class ConditionalGetMixin(object):
     """
-    uuid = discussion.generate_reply_uuid(user).replace(':', '$')
-    site = get_current_site(request)
-    return 'reply-{}@{}'.format(uuid, site)
+    Answer GET requests with 304 Not Modified when the page hasn't changed.
+
+    Subclasses implement `get_validators()`, which returns a list of values that
+    between them change whenever the page would, and the time the page last changed,
+    or None if no date covers every change (then no `Last-Modified` is sent).
+    It should be cheap: it runs before anything else is fetched for the page, and
+    when the client's copy is current nothing else is.  The viewer and the full
+    URL are always part of the ETag.
+    """
+    def get_validators(self):
+        raise NotImplementedError
+
+    def get_etag(self, parts):
+        user = self.request.user
+        viewer = [user.pk, user.is_staff, user.is_superuser, self.request.get_full_path()]
+        data = '|'.join(six.text_type(part) for part in viewer + list(parts))
+        return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        parts, last_modified = self.get_validators()
+        etag = self.get_etag(parts)
+        get = condition(
+            etag_func=lambda request, *args, **kwargs: etag,
+            last_modified_func=lambda request, *args, **kwargs: last_modified,
+        )(super(ConditionalGetMixin, self).get)
+        response = get(request, *args, **kwargs)
+
+        # The page differs from user to user, and must be revalidated on every visit.
+        patch_vary_headers(response, ['Cookie'])
+        patch_cache_control(response, private=True, max_age=0)
+        return response
 
 
 class CommentEmailMixin:
     """A mixin for CreateViews and similar that build comments."""
-    @staticmethod
-    def users_to_notify(comment):
-        """
-        Return subscribers to the comment's discussion or its parent group.
-
-        Exclude anyone who's explicitly ignored this discussion, and the person who
-        posted the comment.
-        """
-        discussion = comment.discussion
-        discussion_subscribers = discussion.subscribers.all()
-        group_subscribers = discussion.group.watchers.exclude(
-            ignored_discussions=discussion
-        )
-
-        all_subscribers = discussion_subscribers | group_subscribers
-        return all_subscribers.exclude(pk=comment.user.pk)
-
     def email_subscribers(self, comment):
-        """Notify all subscribers to the discussion or its group, except the poster."""
-        users = self.users_to_notify(comment)
-        for user in users:
-            send(
-                to=user.email,
-                subject=NEW_COMMENT_SUBJECT.format(discussion=comment.discussion.name),
-                template_name='groups/emails/new_comment.txt',
-                reply_to=get_reply_address(comment.discussion, user, self.request),
-                context={
-                    'comment': comment,
-                    'user': user,
-                    'site': get_current_site(self.request),
-                    'protocol': 'https' if self.request.is_secure() else 'http',
-                },
-            )
+        """Queue an email to all subscribers to the discussion or its group."""
+        outbox.enqueue(models.OutboxMessage.KIND_COMMENT, comment, self.request)
 
 
 class CommentPostView(CommentEmailMixin, CreateView):
@@ -72,8 +69,11 @@ class CommentPostView(CommentEmailMixin, CreateView):
     model = models.BaseComment
 
     def dispatch(self, request, *args, **kwargs):
-        pk = self.kwargs['pk']
-        self.discussion = models.Discussion.objects.select_related('group').get(pk=pk)
+        discussions = models.Discussion.objects.visible_to(request.user)
+        self.discussion = get_object_or_404(
+            discussions.select_related('group'),
+            pk=self.kwargs['pk'],
+        )
         return super(CommentPostView, self).dispatch(request, *args, **kwargs)
 
     def get_context_data(self, *args, **kwargs):
@@ -82,9 +82,34 @@ class CommentPostView(CommentEmailMixin, CreateView):
         context['discussion'] = self.discussion
         return context
 
+    def get_form(self, form_class=None):
+        form = super(CommentPostView, self).get_form(form_class)
+        forms.limit_parents(form, self.discussion)
+        return form
+
+    def save_comment(self, form):
+        """Save the new comment, and anything that belongs with it."""
+        return form.save()
+
+    def rate_limited(self, form, error):
+        """Show the form again, with a 429 status, when the comment is refused."""
+        form.add_error(None, str(error))
+        response = self.form_invalid(form)
+        response.status_code = 429
+        response['Retry-After'] = str(error.retry_after)
+        return response
+
     def form_valid(self, form):
+        try:
+            ratelimits.check_comment(self.request.user, self.discussion)
+        except ratelimits.RateLimited as e:
+            return self.rate_limited(form, e)
+
         form.instance.user = self.request.user
         form.instance.discussion = self.discussion
-        self.object = form.save()
-        self.email_subscribers(self.object)
+        with transaction.atomic():
+            self.object = self.save_comment(form)
+            self.email_subscribers(self.object)
+            events.publish_comment(self.object)
+        routers.pin_to_primary(self.request)
         return HttpResponseRedirect(self.get_success_url())
@@ -0,0 +1,679 @@
+"""
+A JSON API for groups, discussions, comments, attachments and subscriptions.
+
+List endpoints take:
+* `fields` - a comma-separated list of the fields to include in each result.
+* `limit` - how many results to return, up to `max_page_size`.
+* `after` - the `next` cursor from the previous page.
+
+Pages are fetched by keyset rather than offset, so deep pages cost the same as the
+first one.  Results are read with `values()`, so comments are never instantiated as
+polymorphic models.  Every GET response has an `ETag`, and a request whose
+`If-None-Match` matches it gets an empty 304 response.
+"""
+import base64
+import binascii
+import functools
+import hashlib
+import json
+import operator
+import re
+from collections import OrderedDict
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.shortcuts import get_object_or_404
+from django.views.generic import View
+
+from ._helpers import CommentEmailMixin
+from .. import (
+    events, forms, models, outbox, ratelimits, reactions, revisions, routers, uploads,
+)
+
+
+class ApiError(Exception):
+    """An error to report to the client as a JSON response with the given status."""
+    def __init__(self, message, status=400, **extra):
+        super(ApiError, self).__init__(message)
+        self.status = status
+        self.data = dict(extra, error=message)
+
+
+def etag_matches(request, etag):
+    """Return True if the request's `If-None-Match` header includes `etag`."""
+    header = request.META.get('HTTP_IF_NONE_MATCH', '')
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or any(tag.lstrip('W/').strip('"') == etag for tag in tags)
+
+
+def json_response(request, data, status=200):
+    """
+    Return `data` as JSON, with an ETag derived from the content.
+
+    GET requests that already have the same content get a 304 response instead.
+    """
+    content = json.dumps(data, cls=DjangoJSONEncoder)
+    etag = hashlib.md5(content.encode('utf-8')).hexdigest()
+    if request.method == 'GET' and status == 200 and etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, status=status, content_type='application/json')
+    response['ETag'] = '"{}"'.format(etag)
+    return response
+
+
+def encode_cursor(values):
+    """
+    Encode the ordering values of the last result on a page as an opaque string.
+
+    Datetimes keep their microseconds, which `DjangoJSONEncoder` would round away.
+    """
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value
+              for value in values]
+    data = json.dumps(values).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode())
+    except (TypeError, ValueError, binascii.Error):
+        values = None
+    if not isinstance(values, list) or len(values) != length:
+        raise ApiError('Invalid cursor.')
+    return values
+
+
+def keyset_filter(ordering, values):
+    """
+    Return a Q that matches rows after `values` in `ordering`.
+
+    For an ordering of `('date_created', 'id')` that's rows created later, or created
+    at the same time with a greater id.
+    """
+    conditions = []
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = '{}__{}'.format(name, 'lt' if field.startswith('-') else 'gt')
+        conditions.append(Q(**dict(equal, **{lookup: value})))
+        equal[name] = value
+    return functools.reduce(operator.or_, conditions)
+
+
+class ApiView(View):
+    """
+    The base class for API endpoints.
+
+    Subclasses describe the resource they return with:
+    * `fields` - an OrderedDict of {field name: `values()` lookup}.  A lookup of None
+      means the field is filled in by `serialise()`.
+    * `field_dependencies` - a dict of {field name: lookups `serialise()` needs to
+      fill it in}.
+    * `default_fields` - the fields returned when the request doesn't say.
+    * `ordering` - the unique ordering used for keyset pagination.
+    """
+    fields = OrderedDict()
+    field_dependencies = {}
+    default_fields = None
+    ordering = ('id',)
+    page_size = 20
+    max_page_size = 100
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            self.load_objects(request, **kwargs)
+            return super(ApiView, self).dispatch(request, *args, **kwargs)
+        except Http404:
+            return json_response(request, {'error': 'Not found.'}, status=404)
+        except ApiError as e:
+            response = json_response(request, e.data, status=e.status)
+            if 'retry_after' in e.data:
+                response['Retry-After'] = str(e.data['retry_after'])
+            return response
+
+    def load_objects(self, request, **kwargs):
+        """A hook for fetching the objects named in the URL, before the handler runs."""
+
+    def require_user(self):
+        if self.request.user.pk is None:
+            raise ApiError('Authentication required.', status=403)
+        return self.request.user
+
+    def get_data(self):
+        """Return the request's JSON object, or its form data."""
+        if not self.request.META.get('CONTENT_TYPE', '').startswith('application/json'):
+            return self.request.POST
+        try:
+            data = json.loads(self.request.body.decode('utf-8'))
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            raise ApiError('Expected a JSON object.')
+        return data
+
+    def get_fields(self):
+        requested = self.request.GET.get('fields')
+        if not requested:
+            return list(self.default_fields or self.fields)
+        fields = [field for field in requested.split(',') if field]
+        unknown = [field for field in fields if field not in self.fields]
+        if unknown:
+            raise ApiError('Unknown fields.', fields=unknown)
+        return fields
+
+    def get_lookups(self, fields):
+        """Return the `values()` lookups needed for `fields` and for pagination."""
+        lookups = [field.lstrip('-') for field in self.ordering]
+        for field in fields:
+            needed = [self.fields[field]] + list(self.field_dependencies.get(field, ()))
+            lookups.extend(lookup for lookup in needed if lookup is not None)
+        return list(OrderedDict.fromkeys(lookups))
+
+    def serialise(self, rows, fields):
+        """Turn `values()` rows into the requested fields."""
+        return [
+            OrderedDict((field, row.get(self.fields[field])) for field in fields)
+            for row in rows
+        ]
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.GET.get('limit', self.page_size))
+        except ValueError:
+            raise ApiError('Invalid limit.')
+        return max(1, min(limit, self.max_page_size))
+
+    def list_response(self, queryset):
+        """Return one page of `queryset`, and a cursor for the next, as JSON."""
+        fields = self.get_fields()
+        limit = self.get_limit()
+        cursor = self.request.GET.get('after')
+        if cursor:
+            values = decode_cursor(cursor, len(self.ordering))
+            queryset = queryset.filter(keyset_filter(self.ordering, values))
+
+        queryset = queryset.order_by(*self.ordering).values(*self.get_lookups(fields))
+        rows = list(queryset[:limit + 1])
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor([last[f.lstrip('-')] for f in self.ordering])
+
+        return json_response(self.request, {
+            'results': self.serialise(rows, fields),
+            'next': next_cursor,
+        })
+
+    def detail_response(self, queryset, status=200):
+        """Return the only object in `queryset` as JSON."""
+        fields = self.get_fields()
+        rows = list(queryset.values(*self.get_lookups(fields)))
+        if not rows:
+            raise Http404
+        return json_response(self.request, self.serialise(rows, fields)[0], status)
+
+    @staticmethod
+    def form_errors(form):
+        errors = dict((field, list(messages)) for field, messages in form.errors.items())
+        return ApiError('Invalid data.', errors=errors)
+
+
+class GroupApiMixin(object):
+    fields = OrderedDict([
+        ('id', 'id'),
+        ('name', 'name'),
+        ('is_private', 'is_private'),
+    ])
+    ordering = ('id',)
+
+    def get_groups(self):
+        return models.Group.objects.visible_to(self.request.user)
+
+
+class DiscussionApiMixin(object):
+    fields = OrderedDict([
+        ('id', 'id'),
+        ('name', 'name'),
+        ('group', 'group'),
+        ('creator', 'creator'),
+        ('date_created', 'date_created'),
+    ])
+    ordering = ('-date_created', '-id')
+
+    def get_discussions(self):
+        return models.Discussion.objects.visible_to(self.request.user)
+
+
+class CommentApiMixin(object):
+    """
+    Describes comments.
+
+    `type` is the name of the comment's model, and `body` is its text (None for
+    comments with no text, and for deleted or hidden ones).  `parent` is the id of
+    the comment it replies to, if any.  `version` counts the body's edits, starting at
+    1 (None for comments with no text).  `attachments` and `reactions` (the count of
+    each kind) cost one more query per page each, so they're only included when
+    asked for.
+    """
+    fields = OrderedDict([
+        ('id', 'id'),
+        ('discussion', 'discussion'),
+        ('user', 'user'),
+        ('date_created', 'date_created'),
+        ('state', 'state'),
+        ('type', 'polymorphic_ctype'),
+        ('body', 'textcomment__body'),
+        ('version', 'textcomment__version'),
+        ('date_edited', 'textcomment__date_edited'),
+        ('parent', 'parent'),
+        ('depth', 'depth'),
+        ('attachments', None),
+        ('reactions', None),
+    ])
+    field_dependencies = {'body': ('state',)}
+    default_fields = (
+        'id', 'discussion', 'user', 'date_created', 'state', 'type', 'body', 'parent',
+        'version',
+    )
+    ordering = ('date_created', 'id')
+
+    def get_comments(self):
+        comments = models.BaseComment.objects.visible_to(self.request.user)
+        return comments.non_polymorphic()
+
+    def serialise(self, rows, fields):
+        results = super(CommentApiMixin, self).serialise(rows, fields)
+        if 'type' in fields:
+            for result in results:
+                ctype = ContentType.objects.get_for_id(result['type'])
+                result['type'] = ctype.model
+        if 'body' in fields:
+            for row, result in zip(rows, results):
+                if row['state'] != models.BaseComment.STATE_OK:
+                    result['body'] = None
+        if 'attachments' in fields:
+            attachments = self.get_attachments([row['id'] for row in rows])
+            for row, result in zip(rows, results):
+                result['attachments'] = attachments.get(row['id'], [])
+        if 'reactions' in fields:
+            counts = reactions.get_counts(row['id'] for row in rows)
+            kinds = reactions.get_kinds()
+            for row, result in zip(rows, results):
+                comment_counts = counts.get(row['id'], {})
+                result['reactions'] = OrderedDict(
+                    (kind, max(0, comment_counts.get(kind, 0))) for kind in kinds
+                )
+        return results
+
+    @staticmethod
+    def get_attachments(comment_ids):
+        """Return {comment id: [attachment data]} for the given comments."""
+        files = models.AttachedFile.objects.filter(attached_to__in=comment_ids)
+        attachments = {}
+        values = files.order_by('pk').values(
+            'id', 'attached_to', 'file', 'size', 'mime_type', 'width', 'height',
+            'thumbnail',
+        )
+        for data in values:
+            thumbnail = data['thumbnail']
+            attachments.setdefault(data['attached_to'], []).append({
+                'id': data['id'],
+                'url': default_storage.url(data['file']),
+                'size': data['size'],
+                'mime_type': data['mime_type'] or None,
+                'width': data['width'],
+                'height': data['height'],
+                'thumbnail': default_storage.url(thumbnail) if thumbnail else None,
+            })
+        return attachments
+
+
+class GroupList(GroupApiMixin, ApiView):
+    http_method_names = ['get', 'head']
+
+    def get(self, request, *args, **kwargs):
+        return self.list_response(self.get_groups())
+
+
+class GroupDetail(GroupApiMixin, ApiView):
+    http_method_names = ['get', 'head']
+
+    def get(self, request, *args, **kwargs):
+        return self.detail_response(self.get_groups().filter(pk=kwargs['pk']))
+
+
+class DiscussionList(DiscussionApiMixin, ApiView):
+    """List the discussions in a group, newest first, or start a new one."""
+    http_method_names = ['get', 'head', 'post']
+
+    def load_objects(self, request, **kwargs):
+        groups = models.Group.objects.visible_to(request.user)
+        self.group = get_object_or_404(groups, pk=kwargs['pk'])
+
+    def get(self, request, *args, **kwargs):
+        return self.list_response(self.get_discussions().filter(group=self.group))
+
+    def post(self, request, *args, **kwargs):
+        user = self.require_user()
+        form = forms.DiscussionCreate(data=self.get_data())
+        if not form.is_valid():
+            raise self.form_errors(form)
+
+        with transaction.atomic():
+            discussion = models.Discussion.objects.start(
+                group=self.group,
+                creator=user,
+                name=form.cleaned_data['name'],
+                comment=form.cleaned_data['comment'],
+            )
+            kind = models.OutboxMessage.KIND_DISCUSSION
+            outbox.enqueue(kind, discussion, request)
+        routers.pin_to_primary(request)
+        discussions = models.Discussion.objects.filter(pk=discussion.pk)
+        return self.detail_response(discussions, status=201)
+
+
+class DiscussionDetail(DiscussionApiMixin, ApiView):
+    http_method_names = ['get', 'head']
+
+    def get(self, request, *args, **kwargs):
+        return self.detail_response(self.get_discussions().filter(pk=kwargs['pk']))
+
+
+class CommentList(CommentApiMixin, CommentEmailMixin, ApiView):
+    """
+    List the comments on a discussion, oldest first, or post a new one.
+
+    Send a `file` in a multipart request to attach it to the new comment, or the id
+    of a finished resumable upload (see `UploadDetail`) as `upload`.
+    """
+    http_method_names = ['get', 'head', 'post']
+
+    def load_objects(self, request, **kwargs):
+        discussions = models.Discussion.objects.visible_to(request.user)
+        self.discussion = get_object_or_404(discussions, pk=kwargs['pk'])
+
+    def get(self, request, *args, **kwargs):
+        return self.list_response(self.get_comments().filter(discussion=self.discussion))
+
+    def post(self, request, *args, **kwargs):
+        user = self.require_user()
+        data = self.get_data()
+        form_class = forms.AddTextComment
+        if 'file' in request.FILES:
+            form_class = forms.AddTextCommentWithAttachment
+        form = form_class(data=data, files=request.FILES)
+        forms.limit_parents(form, self.discussion)
+        if not form.is_valid():
+            raise self.form_errors(form)
+        try:
+            ratelimits.check_comment(user, self.discussion)
+        except ratelimits.RateLimited as e:
+            raise ApiError(str(e), status=429, retry_after=e.retry_after)
+
+        form.instance.user = user
+        form.instance.discussion = self.discussion
+        with transaction.atomic():
+            comment = form.save()
+            if 'file' in form.cleaned_data:
+                models.AttachedFile.objects.create(
+                    file=form.cleaned_data['file'],
+                    user=user,
+                    attached_to=comment,
+                )
+            if data.get('upload'):
+                try:
+                    uploads.attach(data['upload'], comment)
+                except uploads.UploadError as e:
+                    raise ApiError('Invalid data.', errors={'upload': [str(e)]})
+            self.email_subscribers(comment)
+            events.publish_comment(comment)
+        routers.pin_to_primary(request)
+        comments = models.BaseComment.objects.non_polymorphic().filter(pk=comment.pk)
+        return self.detail_response(comments, status=201)
+
+
+class CommentDetail(CommentApiMixin, ApiView):
+    """
+    Show a comment, edit it, or delete it (leaving a placeholder, as the site does).
+
+    PATCH a new `body` to edit a text comment.  Its old versions are kept (see
+    `groups.revisions`).
+    """
+    http_method_names = ['get', 'head', 'patch', 'delete']
+
+    def get(self, request, *args, **kwargs):
+        return self.detail_response(self.get_comments().filter(pk=kwargs['pk']))
+
+    def patch(self, request, *args, **kwargs):
+        user = self.require_user()
+        comment = get_object_or_404(
+            models.TextComment.objects.visible_to(user),
+            pk=kwargs['pk'],
+        )
+        if not comment.may_be_edited(user):
+            raise ApiError('You may not edit this comment.', status=403)
+        form = forms.EditTextComment(data=self.get_data(), instance=comment)
+        if not form.is_valid():
+            raise self.form_errors(form)
+        revisions.edit(comment, form.cleaned_data['body'], user)
+        routers.pin_to_primary(request)
+        return self.get(request, *args, **kwargs)
+
+    def delete(self, request, *args, **kwargs):
+        user = self.require_user()
+        comment = get_object_or_404(
+            models.BaseComment.objects.visible_to(user),
+            pk=kwargs['pk'],
+        )
+        if not comment.may_be_deleted(user):
+            raise ApiError('You may not delete this comment.', status=403)
+        comment.delete_state()
+        routers.pin_to_primary(request)
+        return HttpResponse(status=204)
+
+
+class MentionList(CommentApiMixin, ApiView):
+    """List the comments that `@mention` the user, newest first."""
+    http_method_names = ['get', 'head']
+    ordering = ('-date_created', '-id')
+
+    def get(self, request, *args, **kwargs):
+        user = self.require_user()
+        return self.list_response(self.get_comments().filter(mentions__user=user))
+
+
+class CommentReaction(ApiView):
+    """
+    Check (GET), give (PUT) or take back (DELETE) the user's reaction to a comment.
+
+    The response says whether the user has given the reaction, and how many of it
+    the comment has.  Counts are saved in batches, so another process's answer may
+    lag behind for a few seconds (see `groups.reactions`).
+    """
+    http_method_names = ['get', 'head', 'put', 'delete']
+
+    def load_objects(self, request, **kwargs):
+        comments = models.BaseComment.objects.visible_to(request.user)
+        self.comment = get_object_or_404(comments, pk=kwargs['pk'])
+        self.kind = kwargs['kind']
+        if self.kind not in reactions.get_kinds():
+            raise Http404
+
+    def reaction_response(self):
+        user = self.request.user
+        reacted = self.comment.reactions.filter(user=user, kind=self.kind).exists()
+        count = reactions.get_counts([self.comment.pk])[self.comment.pk].get(self.kind, 0)
+        return json_response(self.request, {
+            'kind': self.kind,
+            'reacted': reacted,
+            'count': max(0, count),
+        })
+
+    def get(self, request, *args, **kwargs):
+        self.require_user()
+        return self.reaction_response()
+
+    def put(self, request, *args, **kwargs):
+        reactions.react(self.require_user(), self.comment, self.kind)
+        routers.pin_to_primary(request)
+        return self.reaction_response()
+
+    def delete(self, request, *args, **kwargs):
+        reactions.unreact(self.require_user(), self.comment, self.kind)
+        routers.pin_to_primary(request)
+        return self.reaction_response()
+
+
+class CommentModeration(ApiView):
+    """
+    Hide, delete or restore many of a group's comments at once.
+
+    POST `action` (a comment state: `hidden`, `deleted` or `ok`) and `comments` (a
+    list of ids).  Only the group's moderators may do this.
+    """
+    http_method_names = ['post']
+
+    def load_objects(self, request, **kwargs):
+        groups = models.Group.objects.visible_to(request.user)
+        self.group = get_object_or_404(groups, pk=kwargs['pk'])
+
+    def post(self, request, *args, **kwargs):
+        user = self.require_user()
+        if not self.group.may_moderate(user):
+            raise ApiError('You may not moderate this group.', status=403)
+
+        comments = models.BaseComment.objects.for_group(self.group).non_polymorphic()
+        form = forms.ModerationForm(comments=comments, data=self.get_data())
+        if not form.is_valid():
+            raise self.form_errors(form)
+
+        count = form.save()
+        routers.pin_to_primary(request)
+        return json_response(request, {
+            'action': form.cleaned_data['action'],
+            'changed': count,
+        })
+
+
+class SubscriptionBase(ApiView):
+    """Check (GET), start (PUT) or stop (DELETE) the user's subscription to an object."""
+    http_method_names = ['get', 'head', 'put', 'delete']
+
+    def load_objects(self, request, **kwargs):
+        queryset = self.model.objects.visible_to(request.user)
+        self.object = get_object_or_404(queryset, pk=kwargs['pk'])
+
+    def subscription_response(self):
+        subscribed = self.object.is_subscribed(self.request.user)
+        return json_response(self.request, {'subscribed': subscribed})
+
+    def get(self, request, *args, **kwargs):
+        self.require_user()
+        return self.subscription_response()
+
+    def put(self, request, *args, **kwargs):
+        self.object.subscribe(self.require_user())
+        routers.pin_to_primary(request)
+        return self.subscription_response()
+
+    def delete(self, request, *args, **kwargs):
+        self.object.unsubscribe(self.require_user())
+        routers.pin_to_primary(request)
+        return self.subscription_response()
+
+
+class GroupSubscription(SubscriptionBase):
+    model = models.Group
+
+
+class DiscussionSubscription(SubscriptionBase):
+    model = models.Discussion
+
+
+class UploadApiMixin(object):
+    """Describes resumable uploads.  `attachment` is set once the upload is finished."""
+    fields = OrderedDict([
+        ('id', 'id'),
+        ('filename', 'filename'),
+        ('size', 'size'),
+        ('offset', 'offset'),
+        ('attachment', 'attachment'),
+    ])
+
+    def get_uploads(self):
+        return models.UploadSession.objects.filter(user=self.require_user())
+
+
+class UploadList(UploadApiMixin, ApiView):
+    """Start a resumable upload: POST the file's `filename` and `size` in bytes."""
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        user = self.require_user()
+        form = forms.UploadStart(data=self.get_data())
+        if not form.is_valid():
+            raise self.form_errors(form)
+        try:
+            session = uploads.start(user, **form.cleaned_data)
+        except uploads.UploadError as e:
+            raise ApiError(str(e))
+        return self.detail_response(self.get_uploads().filter(pk=session.pk), status=201)
+
+
+class UploadDetail(UploadApiMixin, ApiView):
+    """
+    Check on (GET), add a chunk to (PUT) or finish (POST) a resumable upload.
+
+    A PUT's body is the chunk's bytes, and its `Content-Range` header (e.g.
+    `bytes 0-1048575/5000000`) says where they belong.  Each chunk must start at the
+    upload's current `offset`; one that doesn't gets a 409 response with the offset
+    to carry on from.  POSTing once every byte has arrived turns the upload into an
+    attachment, which can be added to a comment (see `CommentList`).
+    """
+    http_method_names = ['get', 'head', 'put', 'post']
+    content_range = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+    def load_objects(self, request, **kwargs):
+        self.session = get_object_or_404(self.get_uploads(), pk=kwargs['pk'])
+
+    def get(self, request, *args, **kwargs):
+        return self.detail_response(self.get_uploads().filter(pk=self.session.pk))
+
+    def get_range(self):
+        """Return the offset and length of the chunk being PUT."""
+        match = self.content_range.match(self.request.META.get('HTTP_CONTENT_RANGE', ''))
+        if not match:
+            raise ApiError('Expected a Content-Range header.')
+        first, last, size = (int(value) for value in match.groups())
+        if last < first or size != self.session.size:
+            raise ApiError('Invalid Content-Range header.')
+        return first, last - first + 1
+
+    def put(self, request, *args, **kwargs):
+        offset, length = self.get_range()
+        try:
+            received = uploads.receive(self.session, offset, length, request)
+        except uploads.OffsetMismatch as e:
+            raise ApiError(str(e), status=409, offset=e.offset)
+        except uploads.UploadError as e:
+            raise ApiError(str(e))
+        if received != offset + length:
+            raise ApiError('The chunk was incomplete.', offset=received)
+        return self.get(request, *args, **kwargs)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            uploads.finish(self.session)
+        except uploads.OffsetMismatch as e:
+            raise ApiError(str(e), status=409, offset=e.offset)
+        except uploads.UploadError as e:
+            raise ApiError(str(e))
+        return self.get(request, *args, **kwargs)
@@ -5,17 +5,19 @@ from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.sites.shortcuts import get_current_site
 from django.core import signing
+from django.db import transaction
 from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
-from django.views.generic import View
+from django.views.generic import FormView, TemplateView, View
 
 from django.views.generic.edit import DeleteView
 
 from ._helpers import CommentEmailMixin, CommentPostView
-from .. import forms, models
-
-NEW_COMMENT_SUBJECT = apps.get_app_config('groups').new_comment_subject
+from .. import (
+    events, forms, models, ratelimits, reactions, read_markers, revisions, routers,
+    threads,
+)
 
 
 class CommentPostWithAttachment(CommentPostView):
@@ -24,14 +26,14 @@ class CommentPostWithAttachment(CommentPostView):
     template_name = 'groups/comment_post_with_attachment.html'
     attachment_model = models.AttachedFile
 
-    def form_valid(self, form):
-        response = super(CommentPostWithAttachment, self).form_valid(form)
+    def save_comment(self, form):
+        comment = super(CommentPostWithAttachment, self).save_comment(form)
         self.attachment_model.objects.create(
             file=form.cleaned_data['file'],
-            user=self.object.user,
-            attached_to=self.object,
+            user=comment.user,
+            attached_to=comment,
         )
-        return response
+        return comment
 
 
 class CommentDelete(DeleteView):
@@ -61,12 +63,172 @@ class CommentDelete(DeleteView):
 
     def delete(self, request, *args, **kwargs):
         self.comment.delete_state()
+        routers.pin_to_primary(request)
         return HttpResponseRedirect(self.get_success_url())
 
     def get_success_url(self):
         return self.comment.get_absolute_url()
 
 
+class CommentEdit(FormView):
+    """
+    Edit a text comment, keeping the version it replaces (see `groups.revisions`).
+
+    Only the comment's author may edit it, and only while it's shown.  Anyone else is
+    sent back to the discussion with a Django message, as `CommentDelete` does.
+    """
+    form_class = forms.EditTextComment
+    template_name = 'groups/comment_edit.html'
+
+    def dispatch(self, request, *args, **kwargs):
+        comments = models.TextComment.objects.visible_to(request.user)
+        self.comment = get_object_or_404(comments, pk=self.kwargs['pk'])
+        if not self.comment.may_be_edited(request.user):
+            messages.error(request, 'You do not have permission to edit this comment.')
+            return HttpResponseRedirect(self.comment.discussion.get_absolute_url())
+
+        return super(CommentEdit, self).dispatch(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super(CommentEdit, self).get_form_kwargs()
+        kwargs['instance'] = self.comment
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super(CommentEdit, self).get_context_data(**kwargs)
+        context['comment'] = self.comment
+        context['discussion'] = self.comment.discussion
+        return context
+
+    def form_valid(self, form):
+        revisions.edit(self.comment, form.cleaned_data['body'], self.request.user)
+        routers.pin_to_primary(self.request)
+        return HttpResponseRedirect(self.comment.get_absolute_url())
+
+
+class CommentReact(View):
+    """
+    Add the user's reaction to a comment, or take it back if they'd already given it.
+
+    POST a `kind` from `GroupsConfig.reaction_kinds`.  See `groups.reactions`.
+    """
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        comments = models.BaseComment.objects.visible_to(request.user)
+        comment = get_object_or_404(comments, pk=self.kwargs['pk'])
+        form = forms.ReactionForm(data=request.POST)
+        if not form.is_valid():
+            return HttpResponse('Unknown reaction.', status=400)
+
+        kind = form.cleaned_data['kind']
+        if not reactions.react(request.user, comment, kind):
+            reactions.unreact(request.user, comment, kind)
+        routers.pin_to_primary(request)
+        return HttpResponseRedirect(comment.get_absolute_url())
+
+
+class CommentHistory(TemplateView):
+    """
+    List a text comment's versions, and show one of them.
+
+    The version to show is given by the `version` query parameter, and defaults to
+    the current one.  Only that version is rebuilt, from the revisions since the
+    snapshot before it.
+    """
+    template_name = 'groups/comment_history.html'
+
+    def dispatch(self, request, *args, **kwargs):
+        comments = models.TextComment.objects.visible_to(request.user).filter(
+            state=models.TextComment.STATE_OK,
+        )
+        self.comment = get_object_or_404(comments, pk=self.kwargs['pk'])
+        return super(CommentHistory, self).dispatch(request, *args, **kwargs)
+
+    def get_version(self):
+        try:
+            return int(self.request.GET.get('version', self.comment.version))
+        except ValueError:
+            raise Http404
+
+    def get_context_data(self, **kwargs):
+        context = super(CommentHistory, self).get_context_data(**kwargs)
+        version = self.get_version()
+        try:
+            context['body'] = revisions.get_body(self.comment, version)
+        except models.CommentRevision.DoesNotExist:
+            raise Http404
+        context['version'] = version
+        context['revisions'] = revisions.get_history(self.comment)
+        context['comment'] = self.comment
+        context['discussion'] = self.comment.discussion
+        return context
+
+
+class CommentPermalink(View):
+    """
+    Redirect to a comment in its discussion thread, wherever the comment is stored.
+
+    Comments that have been moved into the archive are only displayed on request, so
+    this looks in the live comments first and then falls back to the archive.
+    """
+    def get(self, request, *args, **kwargs):
+        pk = self.kwargs['pk']
+        discussions = models.Discussion.objects.visible_to(request.user)
+        comment = models.BaseComment.objects.filter(
+            pk=pk,
+            discussion__in=discussions,
+        ).first()
+        if comment is None:
+            comment = get_object_or_404(
+                models.ArchivedComment,
+                pk=pk,
+                discussion__in=discussions,
+            )
+        return HttpResponseRedirect(comment.get_absolute_url())
+
+
+class CommentReplies(TemplateView):
+    """
+    Show a comment and the replies below it, `thread_page_depth` levels deep.
+
+    Discussion pages link here from comments whose replies are too deep to show on
+    them, so a long branch is only loaded when someone asks for it.  Showing them
+    moves the viewer's read marker on, as the discussion page does.
+    """
+    template_name = 'groups/comment_replies.html'
+
+    def dispatch(self, request, *args, **kwargs):
+        comments = models.BaseComment.objects.visible_to(request.user)
+        self.comment = get_object_or_404(
+            comments.select_related('discussion__group'),
+            pk=self.kwargs['pk'],
+        )
+        return super(CommentReplies, self).dispatch(request, *args, **kwargs)
+
+    def get_comments(self):
+        """Return the comment and its replies in thread order, like `DiscussionThread`."""
+        depth = apps.get_app_config('groups').thread_page_depth
+        comments = models.BaseComment.objects.subtree(self.comment, depth)
+        comments = comments.with_reply_counts().with_user_may_delete(self.request.user)
+        last_depth = None if depth is None else self.comment.depth + depth
+        comments = threads.mark_collapsed(threads.order(comments), last_depth)
+        reactions.load_counts(comments)
+        return comments
+
+    def get_context_data(self, **kwargs):
+        context = super(CommentReplies, self).get_context_data(**kwargs)
+        context['comment'] = self.comment
+        context['comments'] = comments = self.get_comments()
+        shown_ids = [comment.pk for comment in comments]
+        discussion = self.comment.discussion
+        not_shown = discussion.comments.exclude(pk__in=shown_ids)
+        read_markers.mark_page_read(self.request.user, discussion, shown_ids, not_shown)
+        context['discussion'] = self.comment.discussion
+        context['group'] = self.comment.discussion.group
+        return context
+
+
 class CommentPostByEmail(CommentEmailMixin, View):
     """
     Receive comments posted by email and create them in the database.
@@ -133,12 +295,20 @@ class CommentPostByEmail(CommentEmailMixin, View):
         discussion = target['discussion']
         content = message['stripped-text']
 
-        comment = models.TextComment.objects.create(
-            body=content,
-            user=user,
-            discussion=discussion,
-        )
+        try:
+            ratelimits.check_comment(user, discussion, reply_token=uuid)
+        except ratelimits.RateLimited as e:
+            # Mailgun retries any other failure, which would post the mail once the
+            # bucket refills.  A 406 tells it to drop the message instead.
+            return HttpResponse(str(e), status=406)
 
-        self.create_file_attachments(request, user, comment)
-        self.email_subscribers(comment)
+        with transaction.atomic():
+            comment = models.TextComment.objects.create(
+                body=content,
+                user=user,
+                discussion=discussion,
+            )
+            self.create_file_attachments(request, user, comment)
+            self.email_subscribers(comment)
+            events.publish_comment(comment)
         return HttpResponse(status=200)
@@ -1,15 +1,18 @@
+import json
+import time
+
 from django.apps import apps
-from django.contrib.sites.shortcuts import get_current_site
 from django.core.urlresolvers import reverse
+from django.db import connections, transaction
+from django.db.models import Case, Count, IntegerField, Max, Sum, When
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.views.generic import FormView
-from incuna_mail import send
-
-from ._helpers import CommentPostView, get_reply_address
-from .. import forms, models
-
+from django.views.generic import FormView, View
 
-NEW_DISCUSSION_SUBJECT = apps.get_app_config('groups').new_discussion_subject
+from ._helpers import CommentPostView, ConditionalGetMixin
+from .. import (
+    comment_types, events, forms, models, outbox, reactions, read_markers, threads,
+)
 
 
 class DiscussionCreate(FormView):
@@ -18,7 +21,8 @@ class DiscussionCreate(FormView):
     template_name = 'groups/discussion_form.html'
 
     def get_group(self):
-        return get_object_or_404(models.Group, pk=self.kwargs['pk'])
+        groups = models.Group.objects.visible_to(self.request.user)
+        return get_object_or_404(groups, pk=self.kwargs['pk'])
 
     def get_context_data(self, *args, **kwargs):
         context = super(DiscussionCreate, self).get_context_data(*args, **kwargs)
@@ -30,40 +34,23 @@ class DiscussionCreate(FormView):
 
     def form_valid(self, form):
         user = self.request.user
-        discussion = models.Discussion.objects.create(
-            creator=user,
-            group=self.get_group(),
-            name=form.cleaned_data['name'],
-        )
-        discussion.subscribers.add(user)
-        models.TextComment.objects.create(
-            body=form.cleaned_data['comment'],
-            discussion=discussion,
-            user=user,
-        )
+        with transaction.atomic():
+            discussion = models.Discussion.objects.start(
+                group=self.get_group(),
+                creator=user,
+                name=form.cleaned_data['name'],
+                comment=form.cleaned_data['comment'],
+            )
+            self.email_subscribers(discussion)
         self.pk = discussion.pk
-        self.email_subscribers(discussion)
         return super(DiscussionCreate, self).form_valid(form)
 
     def email_subscribers(self, discussion):
-        """Notify all subscribers to the discussion's parent group, except its creator."""
-        users = discussion.group.watchers.exclude(pk=self.request.user.pk)
-        for user in users:
-            send(
-                to=user.email,
-                subject=NEW_DISCUSSION_SUBJECT.format(group=discussion.group.name),
-                template_name='groups/emails/new_discussion.txt',
-                reply_to=get_reply_address(discussion, user, self.request),
-                context={
-                    'discussion': discussion,
-                    'user': user,
-                    'site': get_current_site(self.request),
-                    'protocol': 'https' if self.request.is_secure() else 'http',
-                },
-            )
+        """Queue an email to all subscribers to the discussion's parent group."""
+        outbox.enqueue(models.OutboxMessage.KIND_DISCUSSION, discussion, self.request)
 
 
-class DiscussionThread(CommentPostView):
+class DiscussionThread(ConditionalGetMixin, CommentPostView):
     """Allow a user to read and comment on a Discussion."""
     form_class = forms.AddTextComment
     subscribe_form_class = forms.SubscribeForm
@@ -71,16 +58,120 @@ class DiscussionThread(CommentPostView):
 
     def get_queryset(self):
         """
-        Display the comments attached to a given discussion, newest at the bottom.
+        Display the comments attached to a given discussion, in thread order.
 
         Use the CommentManager's with_user_may_delete method to annotate each comment
         with a value denoting if it can be deleted by the current user. This allows us
         to conditionally display the delete link in the template.
+
+        Only the first `thread_page_depth` levels of replies are loaded.  Comments on
+        the last level that have replies of their own link to those replies.  Their
+        reaction counts are read in one more query (see `groups.reactions`).
+        """
+        depth = apps.get_app_config('groups').thread_page_depth
+        comments = self.discussion.comments.with_reply_counts()
+        if depth is not None:
+            comments = comments.filter(depth__lt=depth)
+        comments = threads.order(comments.with_user_may_delete(self.request.user))
+        comments = threads.mark_collapsed(comments, None if depth is None else depth - 1)
+        reactions.load_counts(comments)
+        return comments
+
+    def get_initial(self):
+        """Reply to the comment in the `reply_to` query parameter, if there is one."""
+        initial = super(DiscussionThread, self).get_initial()
+        if 'reply_to' in self.request.GET:
+            initial['parent'] = self.request.GET['reply_to']
+        return initial
+
+    def get_validators(self):
         """
-        return self.discussion.comments.with_user_may_delete(self.request.user)
+        Describe the thread's state with aggregates over its comments and attachments.
+
+        Posting a comment changes the count and the latest creation date, deleting
+        one changes the deleted count and the latest deletion date, editing one
+        changes the latest edit date, hiding or restoring one changes the count in that
+        state, and archiving comments changes the count.  Processing an attachment adds
+        its thumbnail, so the latest processing date is included too.  Saving reaction
+        counts moves their latest update date, but that can wait for a flush (see
+        `groups.reactions`), so the viewer's own reactions are described as well.
+
+        It's all read in one query: the comments are aggregated, and everything else
+        comes from `with_thread_activity()`'s subqueries.
+
+        There's no last modified time, as hiding, restoring and subscribing aren't
+        dated, so only the ETag can tell a client its copy is current.
+        """
+        states = [
+            name for name, _ in models.BaseComment.STATE_CHOICES
+            if name != models.BaseComment.STATE_OK
+        ]
+        in_state = {
+            '{}_count'.format(name): Sum(Case(
+                When(comments__state=name, then=1),
+                default=0,
+                output_field=IntegerField(),
+            ))
+            for name in states
+        }
+        discussions = models.Discussion.objects.filter(pk=self.discussion.pk)
+        state = discussions.annotate(
+            comment_count=Count('comments'),
+            last_created=Max('comments__date_created'),
+            last_deleted=Max('comments__date_deleted'),
+            last_edited=Max('comments__textcomment__date_edited'),
+            **in_state
+        ).with_thread_activity(self.request.user).get()
+        parts = [
+            self.discussion.name,
+            state.comment_count,
+            state.last_created,
+            state.last_deleted,
+            state.last_edited,
+            bool(state.subscribed),
+            state.last_processed,
+            state.last_reacted,
+            state.own_reaction_count,
+            state.last_own_reaction,
+        ]
+        parts.extend(getattr(state, '{}_count'.format(name)) for name in states)
+        return parts, None
+
+    def show_archived_comments(self):
+        return 'archived' in self.request.GET
+
+    def get_comments(self):
+        """
+        Return the comments to display, including archived ones if they were asked for.
+
+        Archived comments are only read when the `archived` query parameter is present,
+        which is where their permalinks point.
+        """
+        comments = self.get_queryset()
+        if not self.show_archived_comments():
+            return comments
+
+        # Archived comments aren't threaded, so they go first, oldest first.
+        comment_type = comment_types.registry.get(models.ArchivedComment)
+        archived = list(comment_type.apply(self.discussion.archived_comments.all()))
+        for comment in archived:
+            comment.thread_depth = 0
+        return archived + comments
+
+    def get_not_shown(self):
+        """Return the discussion's comments that are too deep to show on this page."""
+        depth = apps.get_app_config('groups').thread_page_depth
+        if depth is None:
+            return self.discussion.comments.none()
+        return self.discussion.comments.filter(depth__gte=depth)
 
     def get_context_data(self, *args, **kwargs):
-        """Attach the discussion and its existing comments to the context."""
+        """
+        Attach the discussion and its existing comments to the context.
+
+        The viewer has now read every comment here, so move their read marker up, but
+        not past deeper replies that aren't shown (see `read_markers.mark_page_read`).
+        """
         context = super(DiscussionThread, self).get_context_data(*args, **kwargs)
         discussion = self.discussion
         form = self.subscribe_form_class(
@@ -88,7 +179,104 @@ class DiscussionThread(CommentPostView):
             instance=discussion,
             url_name='discussion-subscribe',
         )
-        context['comments'] = self.get_queryset()
+        context['comments'] = comments = self.get_comments()
+        shown_ids = [comment.pk for comment in comments]
+        context['last_comment_id'] = max(shown_ids or [0])
+        read_markers.mark_page_read(
+            self.request.user,
+            discussion,
+            shown_ids,
+            self.get_not_shown(),
+        )
+        context['showing_archived_comments'] = self.show_archived_comments()
+        context['has_archived_comments'] = discussion.archived_comments.exists()
         context['group'] = discussion.group
         context['discussion-subscribe-form'] = form
         return context
+
+
+class DiscussionEvents(View):
+    """
+    Stream new comments on a discussion to the browser as server-sent events.
+
+    Each event's id is the comment's pk.  Comments newer than the `Last-Event-ID`
+    header (which browsers send when they reconnect) or the `after` query parameter
+    are sent first, so nothing posted while the browser wasn't connected is missed.
+    The stream ends after `GroupsConfig.event_stream_seconds`, when browsers reconnect,
+    so that a server's workers aren't held forever.  See `groups.events`.
+
+    Each open stream holds a worker for that long, so serve this view with threaded or
+    async workers (e.g. gunicorn's `gthread` or `gevent`), not a small pool of sync
+    ones.  The database connections are closed once the missed comments are sent, so
+    waiting streams don't count against the database's connection limit.
+    """
+    keepalive_seconds = 15
+    retry_milliseconds = 3000
+
+    def dispatch(self, request, *args, **kwargs):
+        discussions = models.Discussion.objects.visible_to(request.user)
+        self.discussion = get_object_or_404(discussions, pk=self.kwargs['pk'])
+        return super(DiscussionEvents, self).dispatch(request, *args, **kwargs)
+
+    def get_last_event_id(self):
+        """Return the pk of the last comment the browser has, or None if it didn't say."""
+        last_id = self.request.META.get('HTTP_LAST_EVENT_ID')
+        if last_id is None:
+            last_id = self.request.GET.get('after')
+        try:
+            return int(last_id)
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, request, *args, **kwargs):
+        stream = self.stream(self.get_last_event_id())
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Stop nginx holding the events back.
+        return response
+
+    @staticmethod
+    def close_connections():
+        """
+        Close this thread's database connections, which waiting for comments doesn't use.
+
+        Connections inside a transaction are left open, as closing them would break it.
+        """
+        for connection in connections.all():
+            if not connection.in_atomic_block:
+                connection.close()
+
+    def stream(self, last_id):
+        """
+        Yield the missed comments, then new ones as they're published.
+
+        Subscribe before looking for missed comments, so that none fall in between.
+        Anything published that was already sent as a missed comment is skipped.
+        """
+        channel = events.discussion_channel(self.discussion.pk)
+        subscription = events.get_broker().subscribe(channel)
+        try:
+            yield 'retry: {}\n\n'.format(self.retry_milliseconds)
+
+            comments = self.discussion.comments.all()
+            if last_id is None:
+                last_id = comments.aggregate(last_id=Max('pk'))['last_id'] or 0
+            missed = list(comments.filter(pk__gt=last_id).order_by('pk'))
+            self.close_connections()
+            for comment in missed:
+                last_id = comment.pk
+                yield events.format_event(comment.pk, events.serialise_comment(comment))
+
+            stream_seconds = apps.get_app_config('groups').event_stream_seconds
+            deadline = time.time() + stream_seconds
+            while time.time() < deadline:
+                message = subscription.get(timeout=self.keepalive_seconds)
+                if message is None:
+                    yield ': keepalive\n\n'
+                else:
+                    comment_id = json.loads(message)['id']
+                    if comment_id > last_id:
+                        last_id = comment_id
+                        yield events.format_event(comment_id, message)
+        finally:
+            subscription.close()
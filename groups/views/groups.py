@@ -1,6 +1,8 @@
+from django.db.models import Count, Max
 from django.shortcuts import get_object_or_404
 from django.views.generic import ListView
 
+from ._helpers import ConditionalGetMixin, latest
 from .. import forms, models
 
 
@@ -10,8 +12,13 @@ class GroupList(ListView):
     template_name = 'groups/group_list.html'
     ordering = 'name'
 
+    def get_queryset(self):
+        """Hide private groups from users who aren't allowed to read them."""
+        groups = super(GroupList, self).get_queryset()
+        return groups.visible_to(self.request.user)
+
 
-class GroupDetail(ListView):
+class GroupDetail(ConditionalGetMixin, ListView):
     """Show the discussions belonging to a group."""
     model = models.Discussion
     paginate_by = 10
@@ -21,13 +28,52 @@ class GroupDetail(ListView):
 
     def dispatch(self, request, *args, **kwargs):
         """Get the group object we're accessing according to the pk in the URL."""
-        self.group = get_object_or_404(models.Group, pk=self.kwargs['pk'])
+        groups = models.Group.objects.visible_to(request.user)
+        self.group = get_object_or_404(groups, pk=self.kwargs['pk'])
         return super(GroupDetail, self).dispatch(request, *args, **kwargs)
 
+    def get_validators(self):
+        """
+        Describe the group's discussions with a single aggregate.
+
+        Starting a discussion or posting to one changes the counts and the latest
+        dates that `with_last_updated()` orders the page by.  The viewer's latest read
+        marker is included too, since it changes the unread counts.
+        """
+        state = self.group.discussions.aggregate(
+            discussions=Count('pk', distinct=True),
+            comments=Count('comments'),
+            last_started=Max('date_created'),
+            last_updated=Max('comments__date_created'),
+        )
+        parts = [
+            self.group.name,
+            state['discussions'],
+            state['comments'],
+            state['last_started'],
+            state['last_updated'],
+            self.group.is_subscribed(self.request.user),
+            self.get_last_read(),
+        ]
+        return parts, latest(state['last_started'], state['last_updated'])
+
+    def get_last_read(self):
+        """Return when the viewer's read markers in this group last moved, if ever."""
+        user = self.request.user
+        if not user.is_authenticated():
+            return None
+        markers = user.read_markers.filter(discussion__group=self.group)
+        return markers.aggregate(last_read=Max('date_updated'))['last_read']
+
     def get_queryset(self):
-        """Return all discussions on the particular group we're using."""
+        """
+        Return all discussions on the particular group we're using.
+
+        Each one is annotated with the viewer's `unread_count`.
+        """
         discussions = super(GroupDetail, self).get_queryset()
-        return discussions.for_group(self.group).with_last_updated()
+        discussions = discussions.for_group(self.group).with_last_updated()
+        return discussions.with_unread_count(self.request.user)
 
     def get_context_data(self, *args, **kwargs):
         """Sort the object list and allow the group to be displayed properly."""
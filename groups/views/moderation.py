@@ -0,0 +1,63 @@
+from django.contrib import messages
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.views.generic import ListView
+
+from .. import forms, models, routers
+
+
+class ModerationQueue(ListView):
+    """
+    Let a group's moderators hide, delete or restore many comments at once.
+
+    The group's comments are listed newest first, optionally only those in the state
+    given by the `state` query parameter.  The chosen comments are changed together
+    by `set_state()`, however many there are.
+    """
+    paginate_by = 50
+    template_name = 'groups/moderation_queue.html'
+    form_class = forms.ModerationForm
+
+    def dispatch(self, request, *args, **kwargs):
+        groups = models.Group.objects.visible_to(request.user)
+        self.group = get_object_or_404(groups, pk=self.kwargs['pk'])
+        if not self.group.may_moderate(request.user):
+            raise PermissionDenied
+        return super(ModerationQueue, self).dispatch(request, *args, **kwargs)
+
+    def get_state(self):
+        state = self.request.GET.get('state')
+        return state if state in dict(models.BaseComment.STATE_CHOICES) else None
+
+    def get_queryset(self):
+        comments = models.BaseComment.objects.for_group(self.group)
+        comments = comments.select_related('user', 'discussion').order_by('-date_created')
+        state = self.get_state()
+        if state:
+            comments = comments.filter(state=state)
+        return comments
+
+    def get_form(self, data=None):
+        """Offer any of the group's comments, read without their subclass tables."""
+        comments = models.BaseComment.objects.for_group(self.group).non_polymorphic()
+        return self.form_class(comments=comments, data=data)
+
+    def get_context_data(self, *args, **kwargs):
+        kwargs.setdefault('form', self.get_form())
+        context = super(ModerationQueue, self).get_context_data(*args, **kwargs)
+        context['group'] = self.group
+        context['state'] = self.get_state()
+        context['state_choices'] = models.BaseComment.STATE_CHOICES
+        return context
+
+    def post(self, request, *args, **kwargs):
+        form = self.get_form(data=request.POST)
+        if not form.is_valid():
+            self.object_list = self.get_queryset()
+            return self.render_to_response(self.get_context_data(form=form))
+
+        count = form.save()
+        routers.pin_to_primary(request)
+        messages.success(request, '{} comments changed.'.format(count))
+        return HttpResponseRedirect(request.get_full_path())
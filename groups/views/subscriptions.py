@@ -1,7 +1,7 @@
 from django.views.generic import FormView
 from django.views.generic.detail import SingleObjectMixin
 
-from .. import forms, models
+from .. import forms, models, routers
 
 
 class SubscribeBase(SingleObjectMixin, FormView):
@@ -29,6 +29,7 @@ class SubscribeBase(SingleObjectMixin, FormView):
             self.object.subscribe(user)
         else:
             self.object.unsubscribe(user)
+        routers.pin_to_primary(self.request)
 
         return super(SubscribeBase, self).form_valid(form)
 
@@ -11,6 +11,9 @@ setup(
         'django-polymorphic>=1.2,<1.3',
         'incuna-pagination>=0.1.3,<1',
     ],
+    extras_require={
+        'images': ['Pillow'],
+    },
     description='Generic group/forum framework.',
     author='Incuna Ltd',
     author_email='admin@incuna.com',
@@ -16,6 +16,13 @@ PASSWORD_HASHERS = ('django.contrib.auth.hashers.MD5PasswordHasher',)
 DATABASES = {
     'default': dj_database_url.config(default='postgres://localhost/groups')
 }
+# A second database standing in for a read replica.  Nothing copies data into it, so
+# tests that route reads there can see exactly which queries reached it.
+DATABASES['replica'] = dict(
+    DATABASES['default'],
+    NAME='{}_replica'.format(DATABASES['default']['NAME']),
+)
+DATABASE_ROUTERS = ['groups.routers.ReplicaRouter']
 DEFAULT_FILE_STORAGE = 'inmemorystorage.InMemoryStorage'
 
 INSTALLED_APPS = (
@@ -37,6 +44,7 @@ INSTALLED_APPS = (
 MIDDLEWARE_CLASSES = (
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'groups.routers.ReplicaPinningMiddleware',
 )
 
 TEMPLATES = [